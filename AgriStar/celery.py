@@ -0,0 +1,13 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AgriStar.settings')
+
+app = Celery('AgriStar')
+
+# All CELERY_* settings in settings.py configure the app
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Picks up <app>/tasks.py from every installed app
+app.autodiscover_tasks()
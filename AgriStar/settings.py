@@ -1,5 +1,7 @@
 import os
 from pathlib import Path
+import django
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,6 +38,7 @@ INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'administration.apps.AdministrationConfig',
     'mpesa.apps.MpesaConfig',
+    'ledger.apps.LedgerConfig',
     'community.apps.CommunityConfig',
 ]
 
@@ -63,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'marketplace.context_processors.notifications',
             ],
         },
     },
@@ -86,8 +90,15 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {'timeout': 20},
+            # On disk (not :memory:) so threaded tests share one database
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
+    if django.VERSION >= (5, 1):
+        # Take the write lock at BEGIN so concurrent requests queue up
+        # instead of failing with "database is locked" halfway through.
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -134,20 +145,118 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
-# Channels
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [(os.getenv('REDIS_HOST', '127.0.0.1'), 6379)],
+# Cache
+# 'default' is shared between processes (Redis when REDIS_HOST is set);
+# 'local' is a small per-process tier read before it (see marketplace.cache).
+if os.getenv('REDIS_HOST'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': f"redis://{os.getenv('REDIS_HOST')}:6379/1",
         },
-    },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'agristar-default',
+        },
+    }
+CACHES['local'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'agristar-local',
+    'OPTIONS': {'MAX_ENTRIES': 2000},
 }
 
+# Channels (in-process layer without Redis: fine for runserver and tests)
+if os.getenv('REDIS_HOST'):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [(os.getenv('REDIS_HOST'), 6379)],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    }
+
 # Celery
-CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', f"redis://{os.getenv('REDIS_HOST', 'localhost')}:6379/0")
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', f"redis://{os.getenv('REDIS_HOST', 'localhost')}:6379/0")
+# Run tasks inline (no worker needed) for local dev and tests. Defaults to on
+# when no broker is configured, so uploads don't stall waiting for Redis.
+_HAS_BROKER = bool(os.getenv('CELERY_BROKER_URL') or os.getenv('REDIS_HOST'))
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False' if _HAS_BROKER else 'True') == 'True'
+CELERY_TIMEZONE = TIME_ZONE
+# STK pushes get their own queue, so the payments worker's pool size caps the
+# calls in flight to Safaricom (see docker-compose)
+CELERY_TASK_ROUTES = {
+    'mpesa.tasks.process_payment_events': {'queue': 'celery'},
+    'mpesa.tasks.reconcile_payments': {'queue': 'celery'},
+    'mpesa.tasks.*': {'queue': 'payments'},
+}
+
+# Periodic jobs, run by `celery -A AgriStar beat`
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-cart-holds': {
+        'task': 'marketplace.tasks.release_expired_holds',
+        'schedule': 60.0,
+    },
+    'propose-rider-dispatch': {
+        'task': 'marketplace.tasks.propose_dispatch',
+        'schedule': 120.0,
+    },
+    'reconcile-notification-counters': {
+        'task': 'marketplace.tasks.reconcile_notification_counters',
+        'schedule': 3600.0,
+    },
+    'refresh-analytics': {
+        'task': 'administration.tasks.refresh_analytics',
+        'schedule': 900.0,
+    },
+    'rebuild-analytics': {
+        'task': 'administration.tasks.rebuild_analytics',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'process-payment-events': {
+        'task': 'mpesa.tasks.process_payment_events',
+        'schedule': 60.0,
+    },
+    'reconcile-payments': {
+        'task': 'mpesa.tasks.reconcile_payments',
+        'schedule': 300.0,
+    },
+    'retry-payouts': {
+        'task': 'mpesa.tasks.retry_payouts',
+        'schedule': 300.0,
+    },
+    'snapshot-ledger-balances': {
+        'task': 'ledger.tasks.snapshot_balances',
+        'schedule': 3600.0,
+    },
+    'check-ledger': {
+        'task': 'ledger.tasks.check_ledger',
+        'schedule': 3600.0,
+    },
+}
+
+# How long items in a cart hold their stock (marketplace.reservations)
+CART_HOLD_MINUTES = int(os.getenv('CART_HOLD_MINUTES', 15))
+
+# Default search radius of the rider jobs feed (marketplace.jobs)
+RIDER_JOB_RADIUS_KM = float(os.getenv('RIDER_JOB_RADIUS_KM', 50))
+
+# Encode order QR codes in the background when an order is accepted (marketplace.qr)
+ORDER_QR_PREGENERATE = os.getenv('ORDER_QR_PREGENERATE', 'False') == 'True'
 
 # Authentication Redirects
 LOGIN_URL = 'login'
@@ -159,6 +268,18 @@ MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY')
 MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET')
 MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE')
 MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
+MPESA_BASE_URL = os.getenv('MPESA_BASE_URL')  # e.g. a local stub (mpesa/stub.py); else by MPESA_ENV
+# Payment pipeline (mpesa.payments): retries with backoff, then a circuit breaker
+MPESA_MAX_ATTEMPTS = int(os.getenv('MPESA_MAX_ATTEMPTS', 5))
+MPESA_RETRY_BASE_DELAY = float(os.getenv('MPESA_RETRY_BASE_DELAY', 2))
+MPESA_BREAKER_THRESHOLD = int(os.getenv('MPESA_BREAKER_THRESHOLD', 5))
+MPESA_BREAKER_COOLDOWN = int(os.getenv('MPESA_BREAKER_COOLDOWN', 30))
+# Reconciliation (mpesa.reconcile): STK pushes with no callback after this long are queried
+MPESA_RECONCILE_AFTER_MINUTES = int(os.getenv('MPESA_RECONCILE_AFTER_MINUTES', 10))
+MPESA_RECONCILE_CONCURRENCY = int(os.getenv('MPESA_RECONCILE_CONCURRENCY', 4))
+# Payout retries (mpesa.payouts): a failed B2C payout is sent again after this long, up to this many payouts
+MPESA_PAYOUT_RETRY_MINUTES = int(os.getenv('MPESA_PAYOUT_RETRY_MINUTES', 15))
+MPESA_PAYOUT_MAX_ATTEMPTS = int(os.getenv('MPESA_PAYOUT_MAX_ATTEMPTS', 3))
 
 # AI Assistant Settings (Groq API)
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AnalyticsBucket
+
+
+@admin.register(AnalyticsBucket)
+class AnalyticsBucketAdmin(admin.ModelAdmin):
+    list_display = ('period', 'start', 'metric', 'dimension', 'value')
+    list_filter = ('period', 'metric')
+    date_hierarchy = 'start'
@@ -0,0 +1,315 @@
+"""
+Analytics rollups for the custom admin dashboard.
+
+Every figure on the dashboard is a sum over ``AnalyticsBucket`` rows, kept
+per hour and per day:
+- signups, split by role,
+- orders (count) and order_value (total_price), split by status,
+- gmv (accepted-or-later order value), split by the seller's county and
+  the product's category,
+- products, split by approval status.
+
+Rows are bucketed by when the user, order or product was created, so a
+window can be recounted exactly from the source tables. Signal handlers
+(administration.signals) apply deltas as things change, and the
+``refresh_analytics`` task recounts the last day every 15 minutes to catch
+whatever they missed (role changes, queryset updates). Misses on older rows
+are caught by ``rebuild``, which recounts everything: nightly from the
+``rebuild_analytics`` task and on demand via ``manage.py rebuild_analytics``.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+
+from marketplace.models import Order, Product
+from marketplace.stats import GROSS_STATUSES
+from users.models import User
+from .models import AnalyticsBucket
+
+PERIODS = {
+    AnalyticsBucket.HOUR: TruncHour,
+    AnalyticsBucket.DAY: TruncDay,
+}
+REFRESH_WINDOW = datetime.timedelta(days=1)
+DASHBOARD_CACHE_TIMEOUT = 60  # seconds
+SERIES_RANGES = {
+    # name: (period, how many buckets back)
+    '30d': (AnalyticsBucket.DAY, 30),
+    '48h': (AnalyticsBucket.HOUR, 48),
+}
+UNKNOWN = 'Unknown'
+
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def bucket_start(moment, period):
+    moment = timezone.localtime(moment)
+    if period == AnalyticsBucket.DAY:
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record(moment, deltas):
+    """
+    Add ``{(metric, dimension): delta}`` to the hour and day buckets holding
+    ``moment``: one INSERT for missing rows and one UPDATE for all of them.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    keys = [
+        (period, bucket_start(moment, period), metric, dimension)
+        for period in PERIODS for metric, dimension in deltas
+    ]
+    match = Q(pk__in=[])
+    whens = []
+    for period, start, metric, dimension in keys:
+        condition = Q(period=period, start=start, metric=metric, dimension=dimension)
+        match |= condition
+        whens.append(When(condition, then=F('value') + Value(Decimal(deltas[metric, dimension]))))
+    with transaction.atomic():
+        AnalyticsBucket.objects.bulk_create(
+            [AnalyticsBucket(period=p, start=s, metric=m, dimension=d) for p, s, m, d in keys],
+            ignore_conflicts=True,
+        )
+        AnalyticsBucket.objects.filter(match).update(value=Case(*whens, default=F('value'), output_field=MONEY))
+
+
+def order_facts(status, total_price, category, county):
+    """What one order adds to the rollups."""
+    if status is None:
+        return {}
+    price = Decimal(total_price or 0)
+    facts = {
+        ('orders', f'status:{status}'): 1,
+        ('order_value', f'status:{status}'): price,
+    }
+    if status in GROSS_STATUSES:
+        facts[('gmv', f'category:{category or UNKNOWN}')] = price
+        facts[('gmv', f'county:{county or UNKNOWN}')] = price
+    return facts
+
+
+def difference(new, old):
+    keys = new.keys() | old.keys()
+    return {key: new.get(key, 0) - old.get(key, 0) for key in keys}
+
+
+def _product_details(product_ids):
+    """``{product_id: (category, seller county)}``"""
+    rows = Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'category', 'seller__profile__county__name',
+    )
+    return {pk: (category, county) for pk, category, county in rows}
+
+
+def order_changed(order, created=False, deleted=False):
+    """Move the rollups for a saved or deleted order; False if its previous state is unknown."""
+    if created or deleted:
+        old_status = old_price = None
+    else:
+        known_status, old_status = order.previous_value('status')
+        known_price, old_price = order.previous_value('total_price')
+        if not (known_status and known_price):
+            return False
+        if (old_status, old_price) == (order.status, order.total_price):
+            return True
+    category, county = _product_details([order.product_id]).get(order.product_id, (None, None))
+    new = order_facts(order.status, order.total_price, category, county)
+    old = order_facts(old_status, old_price, category, county)
+    if deleted:
+        new, old = {}, new
+    record(order.created_at or timezone.now(), difference(new, old))
+    return True
+
+
+def orders_placed(orders):
+    """Count bulk-created orders (no post_save for those)."""
+    details = _product_details({order.product_id for order in orders})
+    by_hour = defaultdict(lambda: defaultdict(Decimal))
+    for order in orders:
+        category, county = details.get(order.product_id, (None, None))
+        moment = bucket_start(order.created_at or timezone.now(), AnalyticsBucket.HOUR)
+        for key, delta in order_facts(order.status, order.total_price, category, county).items():
+            by_hour[moment][key] += delta
+    for moment, deltas in by_hour.items():
+        record(moment, deltas)
+
+
+def product_changed(product, created=False, deleted=False):
+    if created or deleted:
+        old = None
+    else:
+        known, old = product.previous_value('approval_status')
+        if not known:
+            return False
+    new = product.approval_status
+    if deleted:
+        new, old = None, new
+    if new != old:
+        deltas = {}
+        if new:
+            deltas[('products', f'approval:{new}')] = 1
+        if old:
+            deltas[('products', f'approval:{old}')] = -1
+        record(product.created_at or timezone.now(), deltas)
+    return True
+
+
+def products_added(products):
+    """Count bulk-created products (no post_save for those)."""
+    deltas = defaultdict(int)
+    for product in products:
+        deltas[('products', f'approval:{product.approval_status}')] += 1
+    record(timezone.now(), deltas)
+
+
+def user_signed_up(user, delta=1):
+    record(user.date_joined or timezone.now(), {('signups', f'role:{user.role}'): delta})
+
+
+def _recount(since, period):
+    """
+    Fresh bucket values for everything created from ``since`` (None: ever),
+    as {(start, metric, dimension): value}.
+    """
+    trunc = PERIODS[period]
+    values = defaultdict(Decimal)
+
+    def created_since(queryset, field):
+        if since is not None:
+            queryset = queryset.filter(**{f'{field}__gte': since})
+        return queryset.annotate(bucket=trunc(field))
+
+    users = created_since(User.objects.all(), 'date_joined')
+    for start, role, n in users.values('bucket', 'role').annotate(n=Count('id')).values_list('bucket', 'role', 'n'):
+        values[start, 'signups', f'role:{role}'] += n
+
+    products = created_since(Product.objects.all(), 'created_at')
+    for start, approval, n in (
+        products.values('bucket', 'approval_status').annotate(n=Count('id'))
+        .values_list('bucket', 'approval_status', 'n')
+    ):
+        values[start, 'products', f'approval:{approval}'] += n
+
+    orders = created_since(Order.objects.all(), 'created_at')
+    total = Coalesce(Sum('total_price'), Value(Decimal('0')), output_field=MONEY)
+    for start, status, n, value in (
+        orders.values('bucket', 'status').annotate(n=Count('id'), value=total)
+        .values_list('bucket', 'status', 'n', 'value')
+    ):
+        values[start, 'orders', f'status:{status}'] += n
+        values[start, 'order_value', f'status:{status}'] += value
+
+    gross = orders.filter(status__in=GROSS_STATUSES)
+    for prefix, field in [('category', 'product__category'), ('county', 'seller__profile__county__name')]:
+        for start, name, value in gross.values('bucket', field).annotate(value=total).values_list('bucket', field, 'value'):
+            values[start, 'gmv', f'{prefix}:{name or UNKNOWN}'] += value
+    return values
+
+
+def refresh(since=None):
+    """
+    Recount every bucket from the one holding ``since`` (default: one
+    REFRESH_WINDOW ago; None recounts everything). Returns the number of
+    rows written.
+    """
+    # Whole days, so the day buckets are recounted completely
+    start = bucket_start(since, AnalyticsBucket.DAY) if since else None
+    written = 0
+    with transaction.atomic():
+        for period in PERIODS:
+            stale = AnalyticsBucket.objects.filter(period=period)
+            if start:
+                stale = stale.filter(start__gte=start)
+            stale.delete()
+            rows = [
+                AnalyticsBucket(period=period, start=bucket, metric=metric, dimension=dimension, value=value)
+                for (bucket, metric, dimension), value in _recount(start, period).items() if value
+            ]
+            AnalyticsBucket.objects.bulk_create(rows, batch_size=1000)
+            written += len(rows)
+    return written
+
+
+def refresh_recent():
+    """The scheduled job: recount the last day, or everything on first run."""
+    if not AnalyticsBucket.objects.exists():
+        return refresh(None)
+    return refresh(timezone.now() - REFRESH_WINDOW)
+
+
+def rebuild():
+    return refresh(None)
+
+
+def _totals():
+    rows = (
+        AnalyticsBucket.objects.filter(period=AnalyticsBucket.DAY)
+        .values('metric', 'dimension').annotate(total=Sum('value'))
+        .values_list('metric', 'dimension', 'total')
+    )
+    totals = defaultdict(dict)
+    for metric, dimension, total in rows:
+        totals[metric][dimension] = total
+    return totals
+
+
+def _series(range_name):
+    period, count = SERIES_RANGES[range_name]
+    step = datetime.timedelta(days=1) if period == AnalyticsBucket.DAY else datetime.timedelta(hours=1)
+    last = bucket_start(timezone.now(), period)
+    starts = [last - step * i for i in reversed(range(count))]
+    rows = (
+        AnalyticsBucket.objects.filter(period=period, metric__in=['signups', 'orders'], start__gte=starts[0])
+        .values('start', 'metric').annotate(total=Sum('value')).values_list('start', 'metric', 'total')
+    )
+    found = {(start, metric): total for start, metric, total in rows}
+    label = '%b %d' if period == AnalyticsBucket.DAY else '%H:%M'
+    return {
+        'labels': [timezone.localtime(start).strftime(label) for start in starts],
+        'signups': [int(found.get((start, 'signups'), 0)) for start in starts],
+        'orders': [int(found.get((start, 'orders'), 0)) for start in starts],
+    }
+
+
+def _split(values, prefix, limit=None):
+    pairs = sorted(
+        ((dimension[len(prefix) + 1:], value) for dimension, value in values.items() if dimension.startswith(prefix + ':')),
+        key=lambda pair: pair[1], reverse=True,
+    )
+    pairs = [(name, value) for name, value in pairs if value][:limit]
+    return {'labels': [name for name, _ in pairs], 'values': [float(value) for _, value in pairs]}
+
+
+def dashboard(range_name='30d'):
+    """Everything the admin dashboard shows, cached for DASHBOARD_CACHE_TIMEOUT seconds."""
+    if range_name not in SERIES_RANGES:
+        range_name = '30d'
+    key = f'admin-analytics:{range_name}'
+    data = cache.get(key)
+    if data is None:
+        totals = _totals()
+        signups, orders, products = totals['signups'], totals['orders'], totals['products']
+        data = {
+            'total_users': int(sum(signups.values())),
+            'total_farmers': int(signups.get(f'role:{User.Role.FARMER}', 0)),
+            'total_products': int(sum(products.values())),
+            'pending_products': int(products.get('approval:PENDING', 0)),
+            'total_orders': int(sum(orders.values())),
+            'total_revenue': totals['order_value'].get('status:COMPLETED', Decimal('0')),
+            'charts': {
+                'growth': _series(range_name),
+                'orders_by_status': _split(orders, 'status'),
+                'gmv_by_county': _split(totals['gmv'], 'county', limit=10),
+                'gmv_by_category': _split(totals['gmv'], 'category'),
+            },
+        }
+        cache.set(key, data, DASHBOARD_CACHE_TIMEOUT)
+    return data
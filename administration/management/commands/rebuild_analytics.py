@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from administration import analytics
+
+
+class Command(BaseCommand):
+    help = 'Recounts the admin analytics rollups from users, products and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only the last N days (default: everything)')
+
+    def handle(self, *args, **options):
+        if options['days']:
+            written = analytics.refresh(timezone.now() - timedelta(days=options['days']))
+        else:
+            written = analytics.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} analytics bucket(s)."))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('metric', models.CharField(max_length=20)),
+                ('dimension', models.CharField(blank=True, max_length=120)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'metric', 'start'], name='analytics_series_idx')],
+                'unique_together': {('period', 'start', 'metric', 'dimension')},
+            },
+        ),
+    ]
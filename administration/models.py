@@ -1,3 +1,30 @@
 from django.db import models
 
-# Create your models here.
+
+class AnalyticsBucket(models.Model):
+    """
+    One metric for one hour or day, optionally split by a dimension such as
+    ``status:PAID_OUT`` or ``county:Nakuru`` (empty for an unsplit total).
+    Maintained by administration.analytics.
+    """
+    HOUR = 'HOUR'
+    DAY = 'DAY'
+    PERIOD_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    metric = models.CharField(max_length=20)
+    dimension = models.CharField(max_length=120, blank=True)
+    value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('period', 'start', 'metric', 'dimension')
+        indexes = [
+            models.Index(fields=['period', 'metric', 'start'], name='analytics_series_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.start:%Y-%m-%d %H:%M} {self.metric} {self.dimension}: {self.value}"
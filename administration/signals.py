@@ -0,0 +1,56 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from marketplace.models import Order, Product
+from marketplace.signals import orders_placed, products_added
+from users.models import User
+from . import analytics
+
+# Deltas for the admin analytics rollups. Anything these can't see (a
+# role change, a queryset update) is picked up by the scheduled refresh
+# (recent rows) or the nightly rebuild (older ones).
+
+
+@receiver(post_save, sender=User)
+def count_signup(sender, instance, created, **kwargs):
+    if created:
+        analytics.user_signed_up(instance)
+
+
+@receiver(post_delete, sender=User)
+def uncount_signup(sender, instance, **kwargs):
+    analytics.user_signed_up(instance, delta=-1)
+
+
+@receiver(post_save, sender=Product)
+def count_product(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and 'approval_status' not in update_fields:
+        return
+    analytics.product_changed(instance, created=created)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_product(sender, instance, **kwargs):
+    analytics.product_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Order)
+def count_order(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and not {'status', 'total_price'}.intersection(update_fields):
+        return
+    analytics.order_changed(instance, created=created)
+
+
+@receiver(post_delete, sender=Order)
+def uncount_order(sender, instance, **kwargs):
+    analytics.order_changed(instance, deleted=True)
+
+
+@receiver(orders_placed)
+def count_placed_orders(sender, orders, **kwargs):
+    analytics.orders_placed(orders)
+
+
+@receiver(products_added)
+def count_added_products(sender, products, **kwargs):
+    analytics.products_added(products)
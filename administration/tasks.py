@@ -0,0 +1,15 @@
+from celery import shared_task
+
+from . import analytics
+
+
+@shared_task
+def refresh_analytics():
+    """Recount the last day of admin analytics. Scheduled every 15 minutes."""
+    return analytics.refresh_recent()
+
+
+@shared_task
+def rebuild_analytics():
+    """Recount all admin analytics, so drift on rows older than a day is repaired. Scheduled nightly."""
+    return analytics.rebuild()
@@ -1,3 +1,83 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Sum
 from django.test import TestCase
+from django.utils import timezone
+
+from marketplace import services as checkout_service
+from marketplace.models import CartItem, Order, Product
+from users.models import County, User
+from . import analytics, tasks
+from .models import AnalyticsBucket
+
+
+class AnalyticsRollupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.farmer.profile.county = County.objects.create(name='Nakuru', code=32)
+        self.farmer.profile.save()
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                           price=50, quantity=100, category='VEGETABLES', location='Nakuru')
+
+    def totals(self, metric):
+        rows = (
+            AnalyticsBucket.objects.filter(period=AnalyticsBucket.DAY, metric=metric)
+            .values('dimension').annotate(total=Sum('value')).values_list('dimension', 'total')
+        )
+        return {dimension: total for dimension, total in rows if total}
+
+    def snapshot(self):
+        return sorted(
+            (b.period, b.start, b.metric, b.dimension, b.value)
+            for b in AnalyticsBucket.objects.all() if b.value
+        )
+
+    def test_signals_keep_the_rollups_matching_a_recount(self):
+        CartItem.objects.create(buyer=self.buyer, product=self.kale, quantity=2)
+        order, = checkout_service.checkout_cart(self.buyer).orders
+        self.assertEqual(self.totals('orders'), {'status:PENDING': 1})
+
+        order = Order.objects.get(pk=order.pk)
+        order.status = 'COMPLETED'
+        order.save()
+        self.kale.approval_status = 'APPROVED'
+        self.kale.save()
+
+        self.assertEqual(self.totals('orders'), {'status:COMPLETED': 1})
+        self.assertEqual(self.totals('gmv'), {'category:VEGETABLES': Decimal('100'), 'county:Nakuru': Decimal('100')})
+        self.assertEqual(self.totals('signups'), {'role:FARMER': 1, 'role:BUYER': 1})
+        self.assertEqual(self.totals('products'), {'approval:APPROVED': 1})
+
+        incremental = self.snapshot()
+        analytics.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_refresh_repairs_recent_buckets_and_nightly_rebuild_the_rest(self):
+        old = Order.objects.create(buyer=self.buyer, product=self.kale, quantity=1, total_price=50)
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        analytics.rebuild()
+        # A change the signals can't see
+        Order.objects.filter(pk=old.pk).update(status='CANCELLED')
+        Order.objects.create(buyer=self.buyer, product=self.kale, quantity=1, total_price=50)
+        AnalyticsBucket.objects.filter(start__gte=timezone.now() - timedelta(days=1)).delete()
+
+        analytics.refresh_recent()
+        self.assertEqual(self.totals('orders'), {'status:PENDING': 2})
+        # The nightly rebuild picks up the old order's change
+        tasks.rebuild_analytics.apply()
+        self.assertEqual(self.totals('orders'), {'status:PENDING': 1, 'status:CANCELLED': 1})
 
-# Create your tests here.
+    def test_dashboard_is_cached(self):
+        Order.objects.create(buyer=self.buyer, product=self.kale, quantity=2, total_price=100, status='COMPLETED')
+        with self.assertNumQueries(2):
+            data = analytics.dashboard()
+        self.assertEqual((data['total_users'], data['total_farmers'], data['total_orders']), (2, 1, 1))
+        self.assertEqual(data['total_revenue'], Decimal('100'))
+        self.assertEqual(data['charts']['growth']['orders'][-1], 1)
+        self.assertEqual(data['charts']['gmv_by_county'], {'labels': ['Nakuru'], 'values': [100.0]})
+        with self.assertNumQueries(0):
+            analytics.dashboard()
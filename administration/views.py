@@ -5,6 +5,7 @@ from django.db.models import Count, Sum
 from django.utils import timezone
 from users.models import User, Profile
 from marketplace.models import Product, Order
+from . import analytics
 
 def is_admin(user):
     return user.is_authenticated and user.role == User.Role.ADMIN
@@ -12,30 +13,16 @@ def is_admin(user):
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    # Analytics
-    total_users = User.objects.count()
-    total_farmers = User.objects.filter(role=User.Role.FARMER).count()
-    total_products = Product.objects.count()
-    total_orders = Order.objects.count()
-    total_revenue = Order.objects.filter(status='COMPLETED').aggregate(Sum('total_price'))['total_price__sum'] or 0
+    # Totals and charts come from the cached rollups (administration.analytics)
+    range_name = request.GET.get('range', '30d')
+    context = dict(analytics.dashboard(range_name))
     
     # Recent Activity
-    recent_users = User.objects.order_by('-date_joined')[:5]
-    recent_orders = Order.objects.order_by('-created_at')[:5]
-    
-    # Pending Approvals
-    pending_products = Product.objects.filter(approval_status='PENDING').count()
-    
-    context = {
-        'total_users': total_users,
-        'total_farmers': total_farmers,
-        'total_products': total_products,
-        'total_orders': total_orders,
-        'total_revenue': total_revenue,
-        'recent_users': recent_users,
-        'recent_orders': recent_orders,
-        'pending_products': pending_products,
-    }
+    context.update({
+        'recent_users': User.objects.select_related('profile').order_by('-date_joined')[:5],
+        'recent_orders': Order.objects.order_by('-created_at')[:5],
+        'series_range': range_name if range_name in analytics.SERIES_RANGES else '30d',
+    })
     return render(request, 'administration/dashboard.html', context)
 
 @login_required
@@ -75,7 +62,7 @@ def product_approval(request):
 def approve_product(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     product.approval_status = 'APPROVED'
-    product.save()
+    product.save(update_fields=['approval_status', 'last_updated'])
     messages.success(request, f'Product {product.name} approved.')
     return redirect('admin_product_approval')
 
@@ -84,6 +71,6 @@ def approve_product(request, product_id):
 def reject_product(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     product.approval_status = 'REJECTED'
-    product.save()
+    product.save(update_fields=['approval_status', 'last_updated'])
     messages.warning(request, f'Product {product.name} rejected.')
     return redirect('admin_product_approval')
@@ -40,6 +40,7 @@ class Post(models.Model):
     ai_diagnosis = models.TextField(blank=True, null=True)
     video = models.FileField(upload_to='community_videos/', blank=True, null=True)
     image = models.ImageField(upload_to='community_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     class Meta:
         ordering = ['-created_at']
@@ -71,6 +72,7 @@ class PostImage(models.Model):
         upload_to='community_posts/%Y/%m/',
         validators=[FileExtensionValidator(['jpg', 'jpeg', 'png', 'gif', 'webp'])]
     )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -101,6 +103,7 @@ class Comment(models.Model):
     )
     content = models.TextField()
     image = models.ImageField(upload_to='comment_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_edited = models.BooleanField(default=False)
@@ -0,0 +1,87 @@
+"""
+Read-side helpers for the DRF viewsets.
+
+``FastReadMixin`` gives a viewset:
+- ``?fields=a,b`` sparse fieldsets, for lists and single objects;
+- ``select_related`` for whichever requested fields read through a relation;
+- a fast list path: when every requested field can be read from database
+  columns (see core.serializers.values_column), the page is fetched with
+  ``.values()`` and turned into dicts directly, skipping model instances and
+  the ModelSerializer machinery. The output is the same either way.
+
+The viewset's serializer must use core.serializers.SparseFieldsMixin.
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .serializers import related_path, values_column
+
+FIELDS_PARAM = 'fields'
+
+
+def requested_fields(request, allowed):
+    """The ``?fields=`` subset of ``allowed`` (all of it when absent), in ``allowed`` order."""
+    param = request.query_params.get(FIELDS_PARAM)
+    if not param:
+        return list(allowed)
+    names = {name.strip() for name in param.split(',') if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: f"Unknown field(s): {', '.join(sorted(unknown))}"})
+    return [name for name in allowed if name in names]
+
+
+class FastReadMixin:
+    fast_reads = True
+
+    def get_fields(self):
+        if not hasattr(self, '_fields'):
+            allowed = self.get_serializer_class().Meta.fields
+            if self.request.method in SAFE_METHODS:
+                self._fields = requested_fields(self.request, allowed)
+            else:
+                # Writes validate and echo the whole serializer
+                self._fields = None
+        return self._fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_fields()
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.get_fields() is None:
+            return queryset
+        fields = self.get_serializer().fields
+        related = {related_path(field) for field in fields.values()} - {None}
+        return queryset.select_related(*sorted(related)) if related else queryset
+
+    def get_columns(self):
+        """{field: Column} for the requested fields, or None if any needs a model instance."""
+        if not self.fast_reads:
+            return None
+        columns = {}
+        for name, field in self.get_serializer().fields.items():
+            column = values_column(field)
+            if column is None:
+                return None
+            columns[name] = column
+        return columns
+
+    def list(self, request, *args, **kwargs):
+        columns = self.get_columns()
+        if columns is None:
+            return super().list(request, *args, **kwargs)
+
+        paths = {path for column in columns.values() for path in column.paths}
+        if hasattr(self.paginator, 'get_key_fields'):
+            # Keyset cursors are built from the ordering columns
+            paths.update(self.paginator.get_key_fields(request, self))
+        rows = self.filter_queryset(self.get_queryset()).values(*sorted(paths))
+        page = self.paginate_queryset(rows)
+        data = [{name: column.read(row) for name, column in columns.items()} for row in (rows if page is None else page)]
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
@@ -26,7 +26,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         pass
 
     async def send_notification(self, event):
-        message = event['message']
+        # Pushed by marketplace.notifications after the row is committed
         await self.send(text_data=json.dumps({
-            'message': message
+            'id': event.get('id'),
+            'notification_type': event.get('notification_type'),
+            'message': event['message'],
+            'order_id': event.get('order_id'),
+            'created_at': event.get('created_at'),
+            'unread_count': event.get('unread_count'),
         }))
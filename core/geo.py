@@ -0,0 +1,196 @@
+"""
+Geohash helpers and great-circle distances for spatial lookups.
+
+A geohash interleaves latitude/longitude bits into a base32 string, so nearby
+points share a prefix and every prefix is a rectangular cell. Storing the
+hash in an indexed column turns "who is near here?" into a handful of index
+range scans (one per covering cell) instead of a full table scan.
+
+The distance functions take whole columns of coordinates at once (NumPy float
+arrays, or any sequence of floats/Decimals/None) so ranking hundreds of
+riders or orders is one vectorised call. Missing coordinates come back as NaN
+and never match a radius or top-k query.
+"""
+import math
+
+import numpy as np
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {c: i for i, c in enumerate(BASE32)}
+
+GEOHASH_PRECISION = 9  # ~4.8m x 4.8m, plenty for rider positions
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+
+# Upper bound on the cells a lookup may expand into (each is one index range)
+MAX_COVER_CELLS = 32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_lo = mid
+            else:
+                value *= 2
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_lo = mid
+            else:
+                value *= 2
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def decode_bbox(geohash):
+    """Return ``(lat_min, lat_max, lon_min, lon_max)`` of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+
+def cell_size(precision):
+    """Return ``(lat_degrees, lon_degrees)`` spanned by a cell of ``precision`` chars."""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return ``(lat_min, lat_max, lon_min, lon_max)`` enclosing the circle."""
+    latitude, longitude = float(latitude), float(longitude)
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+    return (
+        max(latitude - dlat, -90.0), min(latitude + dlat, 90.0),
+        longitude - dlon, longitude + dlon,
+    )
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=MAX_COVER_CELLS):
+    """
+    Geohash prefixes whose cells together cover the circle's bounding box,
+    using the finest precision that needs at most ``max_cells`` cells.
+    """
+    lat_min, lat_max, lon_min, lon_max = bounding_box(latitude, longitude, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = cell_size(precision)
+        rows = math.floor((lat_max + 90) / lat_step) - math.floor((lat_min + 90) / lat_step) + 1
+        cols = math.floor((lon_max + 180) / lon_step) - math.floor((lon_min + 180) / lon_step) + 1
+        if rows * cols <= max_cells or precision == 1:
+            break
+
+    cells = set()
+    first_row = math.floor((lat_min + 90) / lat_step)
+    first_col = math.floor((lon_min + 180) / lon_step)
+    for row in range(rows):
+        lat = min(-90 + (first_row + row + 0.5) * lat_step, 90.0)
+        for col in range(cols):
+            # Wrap around the antimeridian
+            lon = (-180 + (first_col + col + 0.5) * lon_step + 180) % 360 - 180
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """
+    ``(low, high)`` such that every hash starting with ``prefix`` satisfies
+    ``low <= hash < high``. ``high`` is None for the last prefix of its length.
+    Ranges use the index where ``LIKE 'abc%'`` often cannot.
+    """
+    chars = list(prefix)
+    while chars:
+        pos = _DECODE[chars[-1]]
+        if pos + 1 < len(BASE32):
+            chars[-1] = BASE32[pos + 1]
+            return prefix, ''.join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two points in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def as_degrees(values):
+    """Float array of coordinates; None/'' become NaN. Accepts Decimals."""
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        return values
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        # Some coordinates are missing
+        return np.array([np.nan if v is None or v == '' else float(v) for v in values], dtype=float)
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    # Inputs in radians, broadcastable
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_km(latitude, longitude, lats, lons):
+    """Distance from one point to each of ``lats``/``lons`` (many-to-one)."""
+    lat, lon = math.radians(float(latitude)), math.radians(float(longitude))
+    return _haversine(lat, lon, np.radians(as_degrees(lats)), np.radians(as_degrees(lons)))
+
+
+def pairwise_km(lats1, lons1, lats2, lons2):
+    """``len(lats1) x len(lats2)`` matrix of distances (many-to-many)."""
+    lat1 = np.radians(as_degrees(lats1))[:, None]
+    lon1 = np.radians(as_degrees(lons1))[:, None]
+    lat2 = np.radians(as_degrees(lats2))[None, :]
+    lon2 = np.radians(as_degrees(lons2))[None, :]
+    return _haversine(lat1, lon1, lat2, lon2)
+
+
+def nearest(latitude, longitude, lats, lons, k):
+    """
+    Indices and distances of the ``k`` points closest to the given one,
+    nearest first.
+    """
+    dist = distances_km(latitude, longitude, lats, lons)
+    valid = np.flatnonzero(~np.isnan(dist))
+    if k < len(valid):
+        valid = valid[np.argpartition(dist[valid], k)[:k]]
+    order = valid[np.argsort(dist[valid], kind='stable')]
+    return order, dist[order]
+
+
+def within_radius(latitude, longitude, lats, lons, radius_km):
+    """Indices and distances of the points within ``radius_km``, nearest first."""
+    dist = distances_km(latitude, longitude, lats, lons)
+    hits = np.flatnonzero(dist <= radius_km)
+    order = hits[np.argsort(dist[hits], kind='stable')]
+    return order, dist[order]
@@ -0,0 +1,180 @@
+"""
+Responsive image derivatives.
+
+Uploads are kept as they came in, but pages serve resized copies: a few
+widths, each as WebP plus a JPEG fallback, re-encoded without EXIF (so no GPS
+tags from farmers' phones leak out). A Celery task builds them after the
+upload is saved and records what exists in the model's ``<field>_variants``
+JSON column, e.g. ``{"source": "products/kale.jpg", "widths": [320, 640]}``.
+Until then the original is served.
+
+Templates use ``{% responsive_image %}`` (core.templatetags.images); the API
+uses ``core.serializers.ImageVariantsField``.
+"""
+import io
+import logging
+import posixpath
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640, 1024)
+VARIANT_FORMATS = {
+    # name: (Pillow format, extension, save options)
+    'webp': ('WEBP', 'webp', {'quality': 78, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+VARIANT_ROOT = 'variants'
+
+# model label -> image fields that get derivatives (stored in <field>_variants)
+IMAGE_FIELDS = {
+    'marketplace.Product': ['image'],
+    'users.Profile': ['avatar'],
+    'community.Post': ['image'],
+    'community.PostImage': ['image'],
+    'community.Comment': ['image'],
+}
+
+
+def variants_field(field):
+    return f'{field}_variants'
+
+
+def variant_name(source, width, fmt):
+    """Storage path of ``source``'s derivative at ``width`` in ``fmt``."""
+    stem, _ = posixpath.splitext(source)
+    return f'{VARIANT_ROOT}/{stem}-{width}w.{VARIANT_FORMATS[fmt][1]}'
+
+
+def needs_variants(instance, field):
+    """True if ``instance.<field>`` holds an upload the recorded variants weren't built from."""
+    name = getattr(instance, field).name
+    if not name or name == instance._meta.get_field(field).default:
+        # Nothing uploaded (the default avatar is a static placeholder)
+        return False
+    return (getattr(instance, variants_field(field)) or {}).get('source') != name
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; WebP keeps it
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return image, background
+    image = image.convert('RGB')
+    return image, image
+
+
+def build_variants(source, storage=default_storage):
+    """
+    Write every derivative of the stored file ``source`` and return its
+    manifest. Widths wider than the original are skipped (the original width
+    is used instead when it is narrower than all of them). Existing files are
+    reused: upload names are unique, so a derivative never goes stale.
+    """
+    with storage.open(source, 'rb') as handle:
+        image = Image.open(handle)
+        # Let the JPEG decoder downscale while reading; far cheaper for phone photos
+        image.draft('RGB', (max(VARIANT_WIDTHS), max(VARIANT_WIDTHS)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    widths = [w for w in VARIANT_WIDTHS if w < image.width] or [image.width]
+    if image.width <= max(VARIANT_WIDTHS) and image.width not in widths:
+        widths.append(image.width)
+    with_alpha, flat = _flatten(image)
+
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        for fmt, (pil_format, _, options) in VARIANT_FORMATS.items():
+            name = variant_name(source, width, fmt)
+            if storage.exists(name):
+                continue
+            frame = with_alpha if fmt == 'webp' else flat
+            if frame.width != width:
+                frame = frame.resize((width, height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            # No exif= argument: the derivative carries no metadata
+            frame.save(buffer, format=pil_format, **options)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    return {'source': source, 'widths': widths}
+
+
+def delete_variants(manifest, storage=default_storage):
+    for width in (manifest or {}).get('widths', []):
+        for fmt in VARIANT_FORMATS:
+            storage.delete(variant_name(manifest['source'], width, fmt))
+
+
+def process(label, pk, field):
+    """
+    Build derivatives for ``<label>.<field>`` of row ``pk`` and record them.
+    Returns the manifest, or None if there was nothing to do.
+    """
+    model = apps.get_model(label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_variants(instance, field):
+        return None
+    source = getattr(instance, field).name
+    try:
+        manifest = build_variants(source)
+    except (OSError, Image.DecompressionBombError, SyntaxError, ValueError) as exc:
+        # Missing or unreadable upload: keep serving the original
+        logger.warning("Could not build image variants for %s %s.%s (%s): %s", label, pk, field, source, exc)
+        return None
+
+    old = getattr(instance, variants_field(field)) or {}
+    setattr(instance, variants_field(field), manifest)
+    # save() rather than update() so the usual signals (e.g. catalog cache) run
+    instance.save(update_fields=[variants_field(field)])
+    if old.get('source') and old['source'] != source and not in_use(old['source']):
+        delete_variants(old)
+    return manifest
+
+
+def in_use(source):
+    """True if any row still points at the upload ``source``."""
+    for label, fields in IMAGE_FIELDS.items():
+        model = apps.get_model(label)
+        for field in fields:
+            if model.objects.filter(**{field: source}).exists():
+                return True
+    return False
+
+
+def manifest_for(instance, field):
+    """Recorded variants of ``instance.<field>``, or None if they are missing or stale."""
+    file = getattr(instance, field)
+    return current_manifest(file.name if file else None, getattr(instance, variants_field(field), None))
+
+
+def current_manifest(name, manifest):
+    """``manifest`` if it was built from the upload ``name``, else None."""
+    manifest = manifest or {}
+    if not name or manifest.get('source') != name:
+        return None
+    return manifest
+
+
+def variant_urls(manifest, fmt):
+    """``[(url, width), ...]`` of a manifest's derivatives in ``fmt``."""
+    return [
+        (default_storage.url(variant_name(manifest['source'], width, fmt)), width)
+        for width in manifest['widths']
+    ]
+
+
+def srcset(manifest, fmt, absolute=str):
+    """``srcset`` value for a manifest's derivatives in ``fmt``."""
+    return ', '.join(f'{absolute(url)} {width}w' for url, width in variant_urls(manifest, fmt))
+
+
+def fallback_url(manifest, fmt='jpeg', width=640):
+    """The widest derivative up to ``width``, for clients that ignore srcset."""
+    fitting = [w for w in manifest['widths'] if w <= width] or manifest['widths'][:1]
+    return default_storage.url(variant_name(manifest['source'], fitting[-1], fmt))
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.tasks import build_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Builds missing responsive image variants (backfill, or catch-up after a worker outage)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Send the work to Celery instead of doing it here')
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        for label, fields in images.IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            for field in fields:
+                rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                default = model._meta.get_field(field).default
+                if isinstance(default, str):
+                    rows = rows.exclude(**{field: default})
+                rows = rows.values_list('pk', field, images.variants_field(field))
+                for pk, name, manifest in rows.iterator():
+                    if (manifest or {}).get('source') == name:
+                        continue
+                    if options['queue']:
+                        build_image_variants.delay(label, pk, field)
+                        built += 1
+                    elif images.process(label, pk, field):
+                        built += 1
+                    else:
+                        failed += 1
+        verb = 'Queued' if options['queue'] else 'Built'
+        self.stdout.write(self.style.SUCCESS(f"{verb} variants for {built} image(s); {failed} could not be read."))
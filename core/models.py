@@ -1,6 +1,52 @@
 from django.db import models
 from django.conf import settings
 
+
+class LoadedValuesMixin:
+    """
+    Keeps ``_loaded_values``, the row as last read from or written to the
+    database, so post_save handlers can tell what a save changed. Instances
+    built by hand (never loaded) have none until their first save.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Refreshed only after post_save, so every handler sees the old values
+        update_fields = kwargs.get('update_fields')
+        fields = (
+            self._meta.concrete_fields if update_fields is None
+            else [self._meta.get_field(name) for name in update_fields]
+        )
+        loaded = getattr(self, '_loaded_values', None) or {}
+        loaded.update((f.attname, getattr(self, f.attname)) for f in fields)
+        self._loaded_values = loaded
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # The row as it is now, e.g. after a save was rolled back
+        deferred = self.get_deferred_fields()
+        names = fields or [f.attname for f in self._meta.concrete_fields if f.attname not in deferred]
+        attnames = [self._meta.get_field(name).attname for name in names]
+        loaded = getattr(self, '_loaded_values', None) or {}
+        loaded.update((attname, getattr(self, attname)) for attname in attnames)
+        self._loaded_values = loaded
+
+    def previous_value(self, attname, created=False):
+        """``(known, value)`` of ``attname`` before the save being handled (None when just created)."""
+        if created:
+            return True, None
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or attname not in loaded:
+            return False, None
+        return True, loaded[attname]
+
+
 class FarmerSchedule(models.Model):
     EVENT_TYPES = [
         ('PLANTING', 'Planting'),
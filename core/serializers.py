@@ -0,0 +1,96 @@
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+from core import images
+
+
+def _absolute(request, url):
+    return request.build_absolute_uri(url) if request else url
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Read-only ``{"webp": srcset, "jpeg": srcset, "src": url}`` for an image
+    field's derivatives (see core.images); null until they are built.
+
+        image_variants = ImageVariantsField(field='image')
+    """
+
+    def __init__(self, field='image', **kwargs):
+        self.image_field = field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return self.represent(images.manifest_for(instance, self.image_field))
+
+    # Fast read path (core.api.FastReadMixin): the same output from .values() columns
+    @property
+    def values_sources(self):
+        return (self.image_field, images.variants_field(self.image_field))
+
+    def from_values(self, name, manifest):
+        return self.represent(images.current_manifest(name, manifest))
+
+    def represent(self, manifest):
+        if manifest is None:
+            return None
+        request = self.context.get('request')
+        data = {'src': _absolute(request, images.fallback_url(manifest))}
+        for fmt in images.VARIANT_FORMATS:
+            data[fmt] = images.srcset(manifest, fmt, lambda url: _absolute(request, url))
+        return data
+
+
+class SparseFieldsMixin:
+    """
+    Drops every field not listed in ``context['fields']`` (set by
+    core.api.FastReadMixin from ``?fields=``). Without it, all fields are kept.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = self.context.get('fields')
+        if wanted is not None:
+            for name in set(self.fields) - set(wanted):
+                self.fields.pop(name)
+
+
+class Column:
+    """How to read one serializer field from a ``.values()`` row."""
+
+    def __init__(self, paths, represent):
+        self.paths = paths
+        self.represent = represent
+
+    def read(self, row):
+        return self.represent(*[row[path] for path in self.paths])
+
+
+def values_column(field):
+    """
+    A Column giving the same output as ``field`` (a bound serializer field)
+    from ``.values()`` rows, or None if the field needs the model instance.
+    """
+    if hasattr(field, 'values_sources'):
+        return Column(field.values_sources, field.from_values)
+    if field.source == '*' or isinstance(field, (serializers.SerializerMethodField, serializers.ManyRelatedField)):
+        return None
+    model = field.parent.Meta.model
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and len(field.source_attrs) == 1:
+        return Column((model._meta.get_field(field.source).attname,), lambda pk: pk)
+    if isinstance(field, serializers.RelatedField):
+        return None
+    path = '__'.join(field.source_attrs)
+    if isinstance(field, serializers.FileField):
+        request = field.context.get('request')
+        return Column((path,), lambda name: _absolute(request, default_storage.url(name)) if name else None)
+    return Column((path,), lambda value: None if value is None else field.to_representation(value))
+
+
+def related_path(field):
+    """``select_related`` path the field reads through, if any."""
+    if field.source == '*' or len(field.source_attrs) < 2:
+        return None
+    return '__'.join(field.source_attrs[:-1])
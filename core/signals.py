@@ -0,0 +1,50 @@
+import logging
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import images
+
+logger = logging.getLogger(__name__)
+
+
+def queue_image_variants(sender, instance, update_fields=None, **kwargs):
+    """Build derivatives in the background once a new upload is committed"""
+    from .tasks import build_image_variants
+
+    label = sender._meta.label
+    for field in images.IMAGE_FIELDS[label]:
+        if update_fields and field not in update_fields:
+            continue
+        if not images.needs_variants(instance, field):
+            continue
+
+        def enqueue(pk=instance.pk, field=field):
+            try:
+                build_image_variants.delay(label, pk, field)
+            except Exception:
+                # Broker down: the original is served meanwhile, and
+                # `manage.py build_image_variants` catches up later
+                logger.exception("Could not queue image variants for %s %s.%s", label, pk, field)
+
+        transaction.on_commit(enqueue)
+
+
+def remove_image_variants(sender, instance, **kwargs):
+    for field in images.IMAGE_FIELDS[sender._meta.label]:
+        manifest = images.manifest_for(instance, field)
+        if manifest:
+            transaction.on_commit(lambda manifest=manifest: _delete_unused(manifest))
+
+
+def _delete_unused(manifest):
+    if not images.in_use(manifest['source']):
+        images.delete_variants(manifest)
+
+
+def connect():
+    for label in images.IMAGE_FIELDS:
+        model = apps.get_model(label)
+        post_save.connect(queue_image_variants, sender=model, dispatch_uid=f'image_variants_save_{label}')
+        post_delete.connect(remove_image_variants, sender=model, dispatch_uid=f'image_variants_delete_{label}')
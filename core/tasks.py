@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from . import images
+
+
+@shared_task
+def build_image_variants(label, pk, field):
+    """Resize a fresh upload into its responsive variants."""
+    return images.process(label, pk, field)
@@ -0,0 +1,48 @@
+from django import template
+from django.utils.html import format_html
+
+from core import images
+
+register = template.Library()
+
+DEFAULT_SIZES = '(max-width: 576px) 100vw, 50vw'
+
+
+@register.simple_tag
+def responsive_image(instance, field='image', alt='', css_class='', sizes=DEFAULT_SIZES):
+    """
+    ``<picture>`` for ``instance.<field>``: WebP and JPEG derivatives in
+    ``srcset``, or the original upload until they have been built.
+
+        {% load images %}
+        {% responsive_image product 'image' alt=product.name css_class='card-img-top' %}
+    """
+    file = getattr(instance, field)
+    if not file:
+        return ''
+    manifest = images.manifest_for(instance, field)
+    if manifest is None:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', file.url, alt, css_class)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        images.srcset(manifest, 'webp'), sizes,
+        images.fallback_url(manifest), images.srcset(manifest, 'jpeg'), sizes, alt, css_class,
+    )
+
+
+@register.simple_tag
+def image_url(instance, field='image', width=640):
+    """URL of the derivative closest to ``width`` (or the original), for plain ``<img>`` tags."""
+    manifest = images.manifest_for(instance, field)
+    if manifest is None:
+        file = getattr(instance, field)
+        return file.url if file else ''
+    return images.fallback_url(manifest, width=width)
+
+
+@register.simple_tag
+def image_srcset(instance, field='image', fmt='jpeg'):
+    """Bare ``srcset`` value, for markup that needs its own ``<img>``."""
+    manifest = images.manifest_for(instance, field)
+    return images.srcset(manifest, fmt) if manifest else ''
@@ -0,0 +1,165 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from marketplace.models import Product
+
+from . import geo, images
+
+
+class GeohashTest(SimpleTestCase):
+    def test_encode_known_point(self):
+        # Nairobi CBD
+        self.assertEqual(geo.encode(-1.286389, 36.817223, precision=6), 'kzf0tv')
+
+    def test_decode_bbox_contains_point(self):
+        lat_min, lat_max, lon_min, lon_max = geo.decode_bbox(geo.encode(-0.0917, 34.7680))
+        self.assertTrue(lat_min <= -0.0917 <= lat_max)
+        self.assertTrue(lon_min <= 34.7680 <= lon_max)
+
+    def test_covering_cells_cover_the_circle(self):
+        lat, lon, radius = -1.2864, 36.8172, 50
+        cells = geo.covering_cells(lat, lon, radius)
+        self.assertLessEqual(len(cells), geo.MAX_COVER_CELLS)
+        lat_min, lat_max, lon_min, lon_max = geo.bounding_box(lat, lon, radius)
+        for point in [(lat_min, lon_min), (lat_max, lon_max), (lat, lon_max), (lat_min, lon)]:
+            self.assertTrue(any(geo.encode(*point).startswith(c) for c in cells), point)
+
+    def test_prefix_range(self):
+        self.assertEqual(geo.prefix_range('kz'), ('kz', 'm'))
+        self.assertEqual(geo.prefix_range('k9'), ('k9', 'kb'))
+        self.assertEqual(geo.prefix_range('zz'), ('zz', None))
+
+    def test_haversine(self):
+        # Nairobi -> Mombasa is roughly 440 km as the crow flies
+        self.assertAlmostEqual(geo.haversine_km(-1.2864, 36.8172, -4.0435, 39.6682), 440, delta=5)
+
+
+class DistanceArrayTest(SimpleTestCase):
+    # Nairobi, Thika, Nakuru, Mombasa, unknown
+    LATS = [-1.2864, -1.0333, -0.3031, -4.0435, None]
+    LONS = [36.8172, 37.0693, 36.0800, 39.6682, None]
+
+    def test_many_to_one_matches_scalar(self):
+        dist = geo.distances_km(-1.2864, 36.8172, self.LATS, self.LONS)
+        for i in range(4):
+            expected = geo.haversine_km(-1.2864, 36.8172, self.LATS[i], self.LONS[i])
+            self.assertAlmostEqual(dist[i], expected, places=6)
+        self.assertTrue(np.isnan(dist[4]))
+
+    def test_many_to_many(self):
+        matrix = geo.pairwise_km(self.LATS[:2], self.LONS[:2], self.LATS[:4], self.LONS[:4])
+        self.assertEqual(matrix.shape, (2, 4))
+        self.assertAlmostEqual(matrix[1, 0], matrix[0, 1])
+        self.assertEqual(matrix[0, 0], 0)
+
+    def test_nearest_and_radius(self):
+        indices, dist = geo.nearest(-1.2864, 36.8172, self.LATS, self.LONS, k=2)
+        self.assertEqual(list(indices), [0, 1])
+        indices, dist = geo.within_radius(-1.2864, 36.8172, self.LATS, self.LONS, radius_km=200)
+        self.assertEqual(list(indices), [0, 1, 2])
+        self.assertTrue((np.diff(dist) >= 0).all())
+
+
+
+def photo(width=2400, height=1600, fmt='JPEG'):
+    """An in-memory upload with an EXIF orientation tag, like a phone photo."""
+    image = Image.new('RGB', (width, height), (40, 160, 60))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees
+    exif[0x010F] = 'PhoneMaker'
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, exif=exif)
+    return SimpleUploadedFile('kale.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageVariantTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.farmer = get_user_model().objects.create_user(username='farmer', password='x', role='FARMER')
+
+    def upload_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                             category='VEGETABLES', location='Thika', image=photo())
+        product.refresh_from_db()
+        return product
+
+    def test_upload_builds_stripped_webp_and_jpeg_variants(self):
+        product = self.upload_product()
+        manifest = product.image_variants
+        self.assertEqual(manifest['source'], product.image.name)
+        self.assertEqual(manifest['widths'], list(images.VARIANT_WIDTHS))
+        original_size = default_storage.size(product.image.name)
+        for fmt in images.VARIANT_FORMATS:
+            name = images.variant_name(product.image.name, 320, fmt)
+            with default_storage.open(name) as handle:
+                variant = Image.open(handle)
+                variant.load()
+            # Orientation applied (portrait now), metadata gone
+            self.assertEqual(variant.size, (320, 480))
+            self.assertFalse(variant.getexif())
+            self.assertLess(default_storage.size(name), original_size)
+
+    def test_template_tag_and_serializer_emit_srcset(self):
+        product = self.upload_product()
+        html = Template("{% load images %}{% responsive_image product 'image' alt='Kale' %}").render(
+            Context({'product': product}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-1024w.webp 1024w', html)
+        self.assertIn('-640w.jpg', html)
+
+        from marketplace.serializers import ProductSerializer
+        data = ProductSerializer(product).data['image_variants']
+        self.assertTrue(data['src'].endswith('-640w.jpg'))
+        self.assertEqual(data['webp'].count('w.webp'), 3)
+
+        # The API's .values() read path builds the same thing
+        from marketplace.views import ProductViewSet
+        fast = self.client.get('/marketplace/api/products/').json()
+        with mock.patch.object(ProductViewSet, 'fast_reads', False):
+            self.assertEqual(self.client.get('/marketplace/api/products/').json(), fast)
+        self.assertEqual(fast['results'][0]['image_variants']['webp'].count('w.webp'), 3)
+
+    def test_original_is_served_until_variants_exist(self):
+        product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                         category='VEGETABLES', location='Thika', image=photo())
+        html = Template("{% load images %}{% responsive_image product 'image' %}").render(Context({'product': product}))
+        self.assertIn(product.image.url, html)
+        self.assertNotIn('srcset', html)
+
+        self.assertEqual(Product.objects.get().image_variants, {})
+        call_command('build_image_variants', stdout=io.StringIO())
+        self.assertEqual(Product.objects.get().image_variants['source'], product.image.name)
+
+    def test_small_images_are_not_upscaled_and_replaced_variants_are_removed(self):
+        product = self.upload_product()
+        old = product.image_variants
+        product.image = photo(300, 500)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        # Turned on its side by the EXIF tag: 500 wide
+        self.assertEqual(product.image_variants['widths'], [320, 500])
+        self.assertFalse(default_storage.exists(images.variant_name(old['source'], 1024, 'webp')))
+
+    def test_unreadable_upload_keeps_the_original(self):
+        broken = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        with self.assertLogs('core.images', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                             category='VEGETABLES', location='Thika', image=broken)
+        self.assertEqual(Product.objects.get(pk=product.pk).image_variants, {})
@@ -5,6 +5,7 @@ from django.views.decorators.http import require_POST
 from django.utils import timezone
 from .models import FarmerSchedule, JournalEntry
 from marketplace.models import Notification
+from marketplace.notifications import notify
 import json
 from datetime import timedelta
 
@@ -175,7 +176,7 @@ def check_upcoming_events(user):
             ).exists()
             
             if not exists:
-                Notification.objects.create(
+                notify(
                     user=user,
                     notification_type='ORDER_ACCEPTED', # Reusing type or add 'REMINDER' if possible
                     message=message
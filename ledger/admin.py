@@ -0,0 +1,46 @@
+from django.contrib import admin
+
+from .models import Account, BalanceSnapshot, Entry, Posting
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    # Money only moves through ledger.books
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class PostingInline(admin.TabularInline):
+    model = Posting
+    fields = ('account', 'amount')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Account)
+class AccountAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'kind', 'user', 'balance', 'updated_at')
+    list_filter = ('kind',)
+    search_fields = ('user__username',)
+
+
+@admin.register(Entry)
+class EntryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'kind', 'amount', 'order', 'reference', 'created_at')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('order__id', 'reference', 'memo')
+    inlines = [PostingInline]
+
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'account', 'balance', 'posting_id', 'taken_at')
@@ -0,0 +1,123 @@
+"""
+Balance snapshots and ledger checks.
+
+``take_snapshots`` (Celery beat, see ledger.tasks) counts each account that
+has new postings up from its last snapshot, and stores the result. It holds
+the account's row lock while counting; ledger.books only adds postings
+while holding that same lock, so once a snapshot covers a posting id, no
+earlier posting of that account can still be on its way. A count that
+disagrees with the stored balance is logged.
+
+``check`` looks for anything that breaks the books:
+
+- an entry whose postings don't sum to zero
+- an account whose balance isn't its last snapshot plus the postings since
+- balances that don't add up to zero across the ledger
+- a rider's wallet below zero
+- an order that took more out of escrow than it put in
+
+Each is one query. Only postings since the last snapshots are looked at,
+unless ``full`` is set.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+
+from .models import Account, BalanceSnapshot, Posting
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0')
+TOLERANCE = Decimal('0.005')  # SQLite adds decimals as floats
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _latest_snapshot():
+    return BalanceSnapshot.objects.filter(account=OuterRef('pk')).order_by('-posting_id')
+
+
+def _with_snapshot(accounts):
+    latest = _latest_snapshot()
+    return accounts.annotate(
+        snapshot_balance=Coalesce(Subquery(latest.values('balance')[:1]), Value(ZERO), output_field=MONEY),
+        snapshot_posting=Coalesce(Subquery(latest.values('posting_id')[:1]), Value(0)),
+    )
+
+
+def snapshot(account_id):
+    """Count ``account_id`` up from its last snapshot and store it. None if nothing was posted since."""
+    with transaction.atomic():
+        account = Account.objects.select_for_update().get(pk=account_id)
+        last = account.snapshots.order_by('-posting_id').first()
+        start = last.balance if last else ZERO
+        since = account.postings.filter(id__gt=last.posting_id if last else 0).aggregate(
+            total=Sum('amount'), last=Max('id'))
+        if since['last'] is None:
+            return None
+        counted = start + since['total']
+        if abs(counted - account.balance) >= TOLERANCE:
+            logger.error("Ledger account %s: balance is %s but its postings add up to %s",
+                         account.pk, account.balance, counted)
+        # The postings are the record; a wrong balance stays visible to check()
+        return BalanceSnapshot.objects.create(account=account, balance=counted, posting_id=since['last'])
+
+
+def take_snapshots():
+    """Snapshot every account with postings since its last snapshot. Returns how many were taken."""
+    changed = _with_snapshot(Account.objects.all()).filter(
+        Exists(Posting.objects.filter(account=OuterRef('pk'), id__gt=OuterRef('snapshot_posting'))))
+    return sum(1 for account_id in changed.values_list('pk', flat=True) if snapshot(account_id))
+
+
+def balance_at(account, when):
+    """``account``'s balance at ``when``: its last snapshot by then plus the postings after it."""
+    last = account.snapshots.filter(taken_at__lte=when).order_by('-posting_id').first()
+    postings = account.postings.filter(entry__created_at__lte=when, id__gt=last.posting_id if last else 0)
+    return (last.balance if last else ZERO) + (postings.aggregate(total=Sum('amount'))['total'] or ZERO)
+
+
+def check(full=False):
+    """Problems found in the ledger, as messages. Empty when the books balance."""
+    problems = []
+    # Postings older than every account's latest snapshot have been checked already
+    since = 0
+    if not full:
+        posted_to = Account.objects.filter(Exists(Posting.objects.filter(account=OuterRef('pk'))))
+        since = _with_snapshot(posted_to).aggregate(low=Min('snapshot_posting'))['low'] or 0
+    postings = Posting.objects.filter(id__gt=since)
+
+    unbalanced = (Posting.objects.filter(entry__in=postings.values('entry')).order_by().values('entry')
+                  .annotate(total=Sum('amount'), off=Abs(Sum('amount'))).filter(off__gte=TOLERANCE))
+    for row in unbalanced:
+        problems.append(f"Entry #{row['entry']} is off by KES {row['total']:.2f}")
+
+    if full:
+        accounts = Account.objects.annotate(snapshot_balance=Value(ZERO, output_field=MONEY), snapshot_posting=Value(0))
+    else:
+        accounts = _with_snapshot(Account.objects.all())
+    posted = (Posting.objects.filter(account=OuterRef('pk'), id__gt=OuterRef('snapshot_posting')).order_by()
+              .values('account').annotate(total=Sum('amount')).values('total'))
+    miscounted = accounts.annotate(
+        counted=F('snapshot_balance') + Coalesce(Subquery(posted), Value(ZERO), output_field=MONEY),
+    ).annotate(off=Abs(F('balance') - F('counted'))).filter(off__gte=TOLERANCE)
+    for account in miscounted:
+        problems.append(f"Account #{account.pk} ({account.get_kind_display()}) has a balance of "
+                        f"KES {account.balance:.2f}, but its postings add up to KES {account.counted:.2f}")
+
+    total = Account.objects.aggregate(total=Sum('balance'))['total'] or ZERO
+    if abs(total) >= TOLERANCE:
+        problems.append(f"Balances add up to KES {total:.2f}, not zero")
+
+    for account in Account.objects.filter(kind=Account.RIDER, balance__lt=0):
+        problems.append(f"Rider wallet #{account.pk} is overdrawn: KES {account.balance:.2f}")
+
+    escrow = Posting.objects.filter(account__kind=Account.ESCROW, entry__order__isnull=False)
+    if not full:
+        escrow = escrow.filter(entry__order__in=postings.filter(entry__order__isnull=False).values('entry__order'))
+    overdrawn = escrow.order_by().values('entry__order').annotate(held=Sum('amount')).filter(held__lte=-TOLERANCE)
+    for row in overdrawn:
+        problems.append(f"Order #{row['entry__order']} took KES {-row['held']:.2f} more out of escrow than it paid in")
+    return problems
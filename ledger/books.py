@@ -0,0 +1,130 @@
+"""
+Posting money to the ledger.
+
+Every movement is an Entry with two Postings that sum to zero, written in
+one transaction together with the change to both accounts' balances. A
+balance is only ever changed by ``UPDATE ... SET balance = balance + x``
+(never read, changed in Python and saved), and a rider's wallet is only
+debited by a conditional UPDATE (``... WHERE balance >= x``), so racing
+withdrawals can't take it below zero. Accounts are updated in primary key
+order, so two transfers between the same accounts can't deadlock.
+
+Entries tied to an order carry a reference ("order:<id>"), so posting one
+twice (a repeated callback, a retried task) does nothing the second time.
+
+M-Pesa moves whole shillings: STK pushes and B2C payouts send
+``int(amount)``, and the ledger records what was actually sent.
+"""
+from decimal import ROUND_FLOOR, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from marketplace.jobs import DELIVERY_FEE_RATE
+from .models import Account, Entry, Posting
+
+ZERO = Decimal('0')
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal('999999999999.99')  # what the amount columns hold
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, account, amount):
+        self.account = account
+        self.amount = amount
+        super().__init__(f"Insufficient funds for KES {amount}.")
+
+
+def shillings(amount):
+    """``amount`` as M-Pesa sends it: whole shillings, rounded down."""
+    return Decimal(amount).to_integral_value(ROUND_FLOOR)
+
+
+def account(kind, user_id=None):
+    return Account.objects.get_or_create(kind=kind, user_id=user_id)[0]
+
+
+def balance(user_id, kind=Account.RIDER):
+    """A user's balance, read off the account row."""
+    return Account.objects.filter(kind=kind, user_id=user_id).values_list('balance', flat=True).first() or ZERO
+
+
+def transfer(kind, source, target, amount, order=None, reference=None, memo=''):
+    """
+    Move ``amount`` from ``source`` to ``target``. Returns the Entry, or None
+    if an entry of this ``kind`` and ``reference`` is already posted.
+
+    Raises InsufficientFunds if ``source`` is a wallet without ``amount`` in it.
+    """
+    amount = Decimal(amount)
+    if not 0 < amount <= MAX_AMOUNT or amount != amount.quantize(CENT):
+        raise ValueError(f"Transfer amount must be a positive number of cents, got {amount}.")
+    now = timezone.now()
+    with transaction.atomic():
+        if reference is None:
+            entry = Entry.objects.create(kind=kind, amount=amount, order=order, memo=memo)
+        else:
+            try:
+                with transaction.atomic():
+                    entry = Entry.objects.create(kind=kind, amount=amount, order=order, reference=reference, memo=memo)
+            except IntegrityError:
+                return None
+        for side, change in sorted([(source, -amount), (target, amount)], key=lambda pair: pair[0].pk):
+            rows = Account.objects.filter(pk=side.pk)
+            if change < 0 and not side.may_overdraw:
+                rows = rows.filter(balance__gte=-change)
+            if not rows.update(balance=F('balance') + change, updated_at=now):
+                raise InsufficientFunds(side, amount)
+        # Added while both account rows are locked: ledger.audit relies on it
+        Posting.objects.bulk_create([
+            Posting(entry=entry, account=source, amount=-amount),
+            Posting(entry=entry, account=target, amount=amount),
+        ])
+    return entry
+
+
+def rider_fee_for(order):
+    """The rider's cut of ``order``: its ``delivery_fee``, or what the jobs feed quoted them."""
+    if not order.assigned_rider_id:
+        return ZERO
+    fee = order.total_price * DELIVERY_FEE_RATE if order.delivery_fee is None else order.delivery_fee
+    # Never more than the buyer paid
+    return min(shillings(fee), shillings(order.total_price))
+
+
+def payout_for(order):
+    """What the farmer is paid for ``order``: the buyer's payment less the rider's fee."""
+    return shillings(order.total_price) - rider_fee_for(order)
+
+
+def escrow_in(order):
+    """The buyer paid for ``order``: into escrow."""
+    amount = shillings(order.total_price)
+    if not amount:
+        return None
+    return transfer(Entry.ESCROW_IN, account(Account.MPESA), account(Account.ESCROW), amount,
+                    order=order, reference=f'order:{order.pk}')
+
+
+def rider_fee(order):
+    """Delivery confirmed: the rider's fee for ``order`` from escrow to their wallet."""
+    fee = rider_fee_for(order)
+    if not fee:
+        return None
+    return transfer(Entry.RIDER_FEE, account(Account.ESCROW), account(Account.RIDER, order.assigned_rider_id),
+                    fee, order=order, reference=f'order:{order.pk}')
+
+
+def farmer_payout(order, receipt=''):
+    """Safaricom confirmed the B2C payout for ``order``: out of escrow."""
+    payout = payout_for(order)
+    if payout <= 0:
+        return None
+    return transfer(Entry.FARMER_PAYOUT, account(Account.ESCROW), account(Account.MPESA), payout,
+                    order=order, reference=f'order:{order.pk}', memo=receipt)
+
+
+def withdraw(user, amount):
+    """Take ``amount`` out of rider ``user``'s wallet. Raises InsufficientFunds."""
+    return transfer(Entry.WITHDRAWAL, account(Account.RIDER, user.pk), account(Account.MPESA), amount)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from ledger import audit
+
+class Command(BaseCommand):
+    help = 'Checks that the ledger balances: entries, account balances, wallets and escrow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recount every posting, ignoring snapshots')
+        parser.add_argument('--snapshot', action='store_true', help='Snapshot changed balances first')
+
+    def handle(self, *args, **options):
+        if options['snapshot']:
+            self.stdout.write(f"Snapshots taken: {audit.take_snapshots()}")
+        problems = audit.check(full=options['full'])
+        for problem in problems:
+            self.stdout.write(self.style.ERROR(problem))
+        if problems:
+            raise CommandError(f"{len(problems)} problem(s) in the ledger")
+        self.stdout.write(self.style.SUCCESS("The ledger balances."))
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from decimal import ROUND_FLOOR, Decimal
+
+from django.db import migrations
+from django.db.models import Q
+
+MEMO = 'Carried over when the ledger started'
+
+
+def open_books(apps, schema_editor):
+    Account = apps.get_model('ledger', 'Account')
+    Entry = apps.get_model('ledger', 'Entry')
+    Posting = apps.get_model('ledger', 'Posting')
+    RiderProfile = apps.get_model('users', 'RiderProfile')
+    Order = apps.get_model('marketplace', 'Order')
+
+    mpesa = Account.objects.get_or_create(kind='MPESA', user=None)[0]
+    escrow = Account.objects.get_or_create(kind='ESCROW', user=None)[0]
+    # (entry, from, to)
+    moves = []
+    for user_id, wallet_balance in RiderProfile.objects.exclude(wallet_balance=0).values_list('user_id', 'wallet_balance'):
+        wallet = Account.objects.get_or_create(kind='RIDER', user_id=user_id)[0]
+        moves.append((Entry(kind='OPENING', amount=wallet_balance, reference=f'rider:{user_id}', memo=MEMO), mpesa, wallet))
+    # Paid for and not paid out yet (a payout sent before the B2C result callbacks
+    # existed has no payout_conversation_id, and went through)
+    unpaid = Q(payout_receipt_number__isnull=True) | Q(payout_receipt_number='')
+    held = Order.objects.filter(
+        Q(status__in=['ESCROW', 'IN_DELIVERY', 'DELIVERED'])
+        | Q(unpaid, status='DISPUTED')
+        | Q(unpaid, status='PAID_OUT', payout_conversation_id__isnull=False)
+    )
+    for order_id, total_price in held.values_list('id', 'total_price'):
+        amount = Decimal(total_price).to_integral_value(ROUND_FLOOR)
+        if amount > 0:
+            moves.append((Entry(kind='ESCROW_IN', amount=amount, order_id=order_id, reference=f'order:{order_id}',
+                                memo=MEMO), mpesa, escrow))
+    if not moves:
+        return
+
+    entries = Entry.objects.bulk_create([entry for entry, source, target in moves])
+    balances = defaultdict(Decimal)
+    postings = []
+    for entry, (_, source, target) in zip(entries, moves):
+        postings += [Posting(entry=entry, account=source, amount=-entry.amount),
+                     Posting(entry=entry, account=target, amount=entry.amount)]
+        balances[source.pk] -= entry.amount
+        balances[target.pk] += entry.amount
+    Posting.objects.bulk_create(postings)
+    for account_id, balance in balances.items():
+        Account.objects.filter(pk=account_id).update(balance=balance)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0001_ledger'),
+        ('users', '0033_farmerbadge_rating_sum'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_books, migrations.RunPython.noop),
+    ]
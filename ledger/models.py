@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import models
+
+
+class Account(models.Model):
+    """
+    Somewhere money sits. ``balance`` is kept equal to the sum of the
+    account's postings by ledger.books, in the same transaction that adds
+    them, so reading it is a single row.
+
+    ESCROW holds buyers' payments until delivery. MPESA is the other side of
+    the platform's M-Pesa till: money coming in is taken from it, money paid
+    out goes back to it, so it runs negative by what the till holds. Riders
+    each have a RIDER wallet.
+    """
+    ESCROW = 'ESCROW'
+    MPESA = 'MPESA'
+    RIDER = 'RIDER'
+    KIND_CHOICES = [
+        (ESCROW, 'Escrow'),
+        (MPESA, 'M-Pesa till'),
+        (RIDER, 'Rider wallet'),
+    ]
+    SYSTEM = [ESCROW, MPESA]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True,
+                             related_name='ledger_accounts')
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'user'], name='ledger_user_account_uniq'),
+            models.UniqueConstraint(fields=['kind'], condition=models.Q(user__isnull=True),
+                                    name='ledger_system_account_uniq'),
+        ]
+
+    @property
+    def may_overdraw(self):
+        # System accounts record what happened at Safaricom; only wallets have a floor
+        return self.kind in self.SYSTEM
+
+    def __str__(self):
+        owner = f" of {self.user}" if self.user_id else ''
+        return f"{self.get_kind_display()}{owner}: KES {self.balance}"
+
+
+class Entry(models.Model):
+    """
+    One movement of money: postings on two or more accounts that sum to
+    zero. Entries are never changed or deleted; a mistake is put right with
+    another entry.
+    """
+    ESCROW_IN = 'ESCROW_IN'
+    FARMER_PAYOUT = 'FARMER_PAYOUT'
+    RIDER_FEE = 'RIDER_FEE'
+    WITHDRAWAL = 'WITHDRAWAL'
+    OPENING = 'OPENING'
+    KIND_CHOICES = [
+        (ESCROW_IN, 'Buyer payment into escrow'),
+        (FARMER_PAYOUT, 'Payout to farmer'),
+        (RIDER_FEE, 'Delivery fee to rider'),
+        (WITHDRAWAL, 'Rider withdrawal'),
+        (OPENING, 'Opening balance'),
+    ]
+
+    kind = models.CharField(max_length=15, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    order = models.ForeignKey('marketplace.Order', on_delete=models.PROTECT, null=True, blank=True,
+                              related_name='ledger_entries')
+    # Set for entries that must happen once (e.g. "order:42"); a repeat is ignored
+    reference = models.CharField(max_length=100, null=True, blank=True)
+    memo = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'entries'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'reference'], name='ledger_entry_reference_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: KES {self.amount}"
+
+
+class Posting(models.Model):
+    """One side of an Entry: ``amount`` added to (or, when negative, taken from) ``account``."""
+    entry = models.ForeignKey(Entry, on_delete=models.PROTECT, related_name='postings')
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='postings', db_index=False)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # An account's postings after its last snapshot (ledger.audit)
+            models.Index(fields=['account', 'id'], name='ledger_posting_account_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}: {self.amount:+}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    An account's balance counted from its postings, up to and including
+    ``posting_id``. Taken periodically (ledger.audit.take_snapshots), so
+    checking a balance or reading one as of a past time only sums the
+    postings since the last snapshot.
+    """
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='snapshots', db_index=False)
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    posting_id = models.BigIntegerField()
+    taken_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-posting_id'], name='ledger_snapshot_account_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} at posting {self.posting_id}: KES {self.balance}"
@@ -0,0 +1,22 @@
+import logging
+
+from celery import shared_task
+
+from . import audit
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def snapshot_balances():
+    """Snapshot the ledger balances that changed. Scheduled hourly."""
+    return audit.take_snapshots()
+
+
+@shared_task
+def check_ledger():
+    """Log anything that breaks the books. Scheduled hourly."""
+    problems = audit.check()
+    for problem in problems:
+        logger.error("Ledger check: %s", problem)
+    return problems
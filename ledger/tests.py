@@ -0,0 +1,296 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from marketplace.models import Order, Product
+from mpesa.client import MpesaError
+from mpesa.models import PayoutJob
+from users.models import User
+from . import audit, books
+from .models import Account, BalanceSnapshot, Entry, Posting
+
+
+def make_order(buyer, farmer, rider=None, price=100, **fields):
+    product = Product.objects.create(seller=farmer, name='Kale', description='Sukuma', price=price,
+                                     quantity=100, category='VEGETABLES', location='Thika')
+    return Order.objects.create(buyer=buyer, product=product, assigned_rider=rider, delivery_method='DELIVERY', **fields)
+
+
+def balances():
+    return {(kind, user_id): balance for kind, user_id, balance in Account.objects.values_list('kind', 'user_id', 'balance')}
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.farmer.profile.phone_number = '0712345678'
+        self.farmer.profile.save()
+        self.rider = User.objects.create_user(username='rider', password='x', role='RIDER')
+
+    def post_callback(self, name, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(name), json.dumps(payload), content_type='application/json')
+
+    def test_order_from_payment_to_payout(self):
+        order = make_order(self.buyer, self.farmer, self.rider, price=Decimal('250.50'),
+                           status='ACCEPTED', checkout_request_id='ws_CO_1')
+        paid = {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'Processed',
+                'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QK1'}]}}}}
+        self.post_callback('mpesa_callback', paid)
+        self.post_callback('mpesa_callback', paid)  # Safaricom repeats itself
+        self.assertEqual(balances(), {('MPESA', None): Decimal('-250'), ('ESCROW', None): Decimal('250')})
+
+        Order.objects.filter(pk=order.pk).update(status='DELIVERED')
+        self.client.login(username='buyer', password='x')
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', return_value={'ConversationID': 'AG_1'}) as b2c:
+            self.client.post(reverse('confirm_delivery', args=[order.pk]))
+        # 15% of 250.50, in whole shillings, stays back for the rider
+        b2c.assert_called_once_with('254712345678', 213)
+        self.assertEqual(self.rider.rider_profile.wallet_balance, Decimal('37'))
+        self.assertEqual(balances()[('ESCROW', None)], Decimal('213'))
+
+        self.post_callback('b2c_result', {'Result': {'ResultCode': 0, 'ConversationID': 'AG_1', 'TransactionID': 'RB1'}})
+        self.assertEqual(balances(), {('MPESA', None): Decimal('-37'), ('ESCROW', None): Decimal('0'),
+                                      ('RIDER', self.rider.pk): Decimal('37')})
+        self.assertEqual(sorted(Entry.objects.filter(order=order).values_list('kind', flat=True)),
+                         [Entry.ESCROW_IN, Entry.FARMER_PAYOUT, Entry.RIDER_FEE])
+        self.assertEqual(Entry.objects.get(kind=Entry.FARMER_PAYOUT).memo, 'RB1')
+        self.assertEqual(audit.check(), [])
+
+    def test_refused_payout_leaves_the_order_to_confirm_again(self):
+        order = make_order(self.buyer, self.farmer, self.rider, status='DELIVERED')
+        books.escrow_in(order)
+        self.client.login(username='buyer', password='x')
+        refused = {'errorCode': '401.002.01', 'errorMessage': 'Error Occurred - Invalid Access Token'}
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', return_value=refused):
+            self.client.post(reverse('confirm_delivery', args=[order.pk]))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payout_conversation_id), ('DELIVERED', None))
+        self.assertFalse(Entry.objects.filter(kind=Entry.RIDER_FEE).exists())
+        self.assertEqual(order.payout_jobs.get().status, PayoutJob.FAILED)
+
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', return_value={'ConversationID': 'AG_1'}):
+            self.client.post(reverse('confirm_delivery', args=[order.pk]))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payout_conversation_id), ('PAID_OUT', 'AG_1'))
+        self.assertEqual(books.balance(self.rider.pk), Decimal('15'))
+
+    def test_unanswered_payout_keeps_the_order_claimed(self):
+        order = make_order(self.buyer, self.farmer, self.rider, status='DELIVERED')
+        books.escrow_in(order)
+        self.client.login(username='buyer', password='x')
+        timeout = MpesaError("Read timed out. (read timeout=30)")
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', side_effect=timeout) as b2c, \
+                self.assertLogs('mpesa.payouts', 'WARNING'):
+            response = self.client.post(reverse('confirm_delivery', args=[order.pk]))
+            self.assertIn("hasn't confirmed the payout", [str(m) for m in get_messages(response.wsgi_request)][-1])
+            # Safaricom may have paid: confirming again mustn't send a second payout
+            response = self.client.post(reverse('confirm_delivery', args=[order.pk]))
+        b2c.assert_called_once()
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'PAID_OUT')
+        job = order.payout_jobs.get()
+        self.assertEqual((job.status, job.amount), (PayoutJob.UNCONFIRMED, 85))
+        self.assertIn('Read timed out', job.error)
+        self.assertEqual(books.balance(self.rider.pk), Decimal('15'))
+
+    def test_order_under_a_shilling(self):
+        order = make_order(self.buyer, self.farmer, price=Decimal('0.40'))
+        self.assertIsNone(books.escrow_in(order))
+        self.assertIsNone(books.farmer_payout(order))
+        self.assertFalse(Entry.objects.exists())
+
+    def test_rider_withdrawals(self):
+        order = make_order(self.buyer, self.farmer, self.rider, price=500, delivery_fee=Decimal('120.50'))
+        books.escrow_in(order)
+        books.rider_fee(order)
+        self.client.login(username='rider', password='x')
+
+        def withdraw(amount):
+            response = self.client.post(reverse('rider_withdraw'), {'amount': amount})
+            return [str(m) for m in get_messages(response.wsgi_request)][-1]
+
+        for amount in ['abc', '-5', '0', 'NaN', '10.001', '1e30']:
+            self.assertIn('Invalid amount', withdraw(amount))
+        self.assertEqual(withdraw('200'), 'Insufficient funds')
+        self.assertIn('received', withdraw('100.25'))
+        self.assertEqual(withdraw('19.76'), 'Insufficient funds')
+        self.assertIn('received', withdraw('19.75'))
+        self.assertEqual(books.balance(self.rider.pk), Decimal('0'))
+        self.assertEqual(Entry.objects.filter(kind=Entry.WITHDRAWAL).count(), 2)
+        self.assertEqual(audit.check(full=True), [])
+
+    def test_system_accounts_record_what_happened(self):
+        # A payout for an order paid before the ledger existed still gets booked; check() points it out
+        order = make_order(self.buyer, self.farmer, status='PAID_OUT')
+        self.assertIsNotNone(books.farmer_payout(order, 'RB1'))
+        self.assertIsNone(books.farmer_payout(order, 'RB1'))
+        self.assertEqual(audit.check(), [f"Order #{order.pk} took KES 100.00 more out of escrow than it paid in"])
+
+    def test_snapshots(self):
+        orders = [make_order(self.buyer, self.farmer, self.rider) for _ in range(3)]
+        books.escrow_in(orders[0])
+        self.assertEqual(audit.take_snapshots(), 2)
+        self.assertEqual(audit.take_snapshots(), 0)  # nothing new
+        before = timezone.now()
+        for order in orders[1:]:
+            books.escrow_in(order)
+        self.assertEqual(audit.take_snapshots(), 2)
+        escrow = books.account(Account.ESCROW)
+        self.assertEqual(list(escrow.snapshots.order_by('posting_id').values_list('balance', flat=True)),
+                         [Decimal('100'), Decimal('300')])
+        self.assertEqual(audit.balance_at(escrow, before), Decimal('100'))
+        self.assertEqual(audit.balance_at(escrow, timezone.now()), Decimal('300'))
+        self.assertEqual(audit.balance_at(escrow, before - timedelta(days=1)), Decimal('0'))
+
+        # Only postings since the snapshots are rechecked, unless asked
+        Posting.objects.filter(pk=escrow.postings.earliest('id').pk).update(amount=Decimal('90'))
+        self.assertEqual(audit.check(), [])
+        self.assertEqual(len(audit.check(full=True)), 2)  # the entry and the escrow account
+
+    def test_check_finds_a_tampered_balance(self):
+        order = make_order(self.buyer, self.farmer, self.rider)
+        books.escrow_in(order)
+        books.rider_fee(order)
+        audit.take_snapshots()
+        wallet = books.account(Account.RIDER, self.rider.pk)
+        Account.objects.filter(pk=wallet.pk).update(balance=Decimal('1000'))
+        problems = audit.check()
+        self.assertEqual(problems, [
+            f"Account #{wallet.pk} (Rider wallet) has a balance of KES 1000.00, but its postings add up to KES 15.00",
+            "Balances add up to KES 985.00, not zero",
+        ])
+        books.withdraw(self.rider, 5)
+        with self.assertLogs('ledger.audit', 'ERROR'):
+            audit.take_snapshots()
+        # The snapshot keeps the postings' count, so the problem doesn't go away
+        self.assertEqual(wallet.snapshots.latest('posting_id').balance, Decimal('10'))
+        self.assertEqual(len(audit.check()), 2)
+
+
+class ConfirmDeliveryRaceTest(TransactionTestCase):
+    def test_double_confirmation_pays_out_once(self):
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        farmer.profile.phone_number = '0712345678'
+        farmer.profile.save()
+        rider = User.objects.create_user(username='rider', password='x', role='RIDER')
+        order = make_order(buyer, farmer, rider, status='DELIVERED')
+        books.escrow_in(order)
+        start = threading.Barrier(2)
+        outcomes, errors, in_transaction = [], [], []
+
+        def slow_b2c(phone, amount):
+            # Sent with nothing locked, and the claim already committed
+            in_transaction.append(connection.in_atomic_block)
+            time.sleep(0.2)  # the other confirmation arrives while this one is out at Safaricom
+            return {'ConversationID': 'AG_1'}
+
+        def confirm():
+            try:
+                client = Client()
+                client.login(username='buyer', password='x')
+                start.wait()
+                response = client.post(reverse('confirm_delivery', args=[order.pk]))
+                outcomes.append([str(m) for m in get_messages(response.wsgi_request)][-1])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', side_effect=slow_b2c) as b2c:
+            threads = [threading.Thread(target=confirm) for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(errors, [])
+        b2c.assert_called_once_with('254712345678', 85)
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(sorted(outcomes), ['Delivery confirmed! Funds successfully released to farmer.',
+                                            'This delivery has already been confirmed.'])
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'PAID_OUT')
+        self.assertEqual(books.balance(rider.pk), Decimal('15'))
+        self.assertEqual(audit.check(), [])
+
+
+class LedgerStressTest(TransactionTestCase):
+    """Fees, repeated fees, withdrawals and snapshots racing on one wallet must leave the books exact."""
+    ORDERS = 12
+    WITHDRAWALS = 12
+    WITHDRAWAL = Decimal('25.50')
+
+    def test_concurrent_postings_balance(self):
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        rider = User.objects.create_user(username='rider', password='x', role='RIDER')
+        orders = [make_order(buyer, farmer, rider, status='ESCROW') for _ in range(self.ORDERS)]
+        for order in orders:
+            books.escrow_in(order)
+        # Each fee is posted twice at once, as a retried task would
+        work = [(books.rider_fee, order) for order in orders for _ in range(2)]
+        work += [(books.withdraw, rider, self.WITHDRAWAL)] * self.WITHDRAWALS
+        start = threading.Barrier(len(work) + 1)
+        done = threading.Event()
+        errors, outcomes = [], []
+
+        def run(call, *args):
+            try:
+                start.wait()
+                try:
+                    outcomes.append(call(*args))
+                except books.InsufficientFunds:
+                    outcomes.append('refused')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def snapshots():
+            try:
+                start.wait()
+                while not done.is_set():
+                    audit.take_snapshots()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=job) for job in work]
+        snapshotter = threading.Thread(target=snapshots)
+        with self.assertNoLogs('ledger.audit', 'ERROR'):
+            snapshotter.start()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            done.set()
+            snapshotter.join()
+            audit.take_snapshots()
+
+        self.assertEqual(errors, [])
+        fees = Entry.objects.filter(kind=Entry.RIDER_FEE)
+        self.assertEqual(fees.count(), self.ORDERS)  # once per order, however often it was posted
+        self.assertEqual(outcomes.count(None), self.ORDERS)
+        withdrawn = Entry.objects.filter(kind=Entry.WITHDRAWAL).count()
+        self.assertEqual(withdrawn + outcomes.count('refused'), self.WITHDRAWALS)
+        # 12 fees of 15 can pay for at most 7 withdrawals of 25.50
+        self.assertLessEqual(withdrawn, 7)
+        self.assertEqual(books.balance(rider.pk), self.ORDERS * 15 - withdrawn * self.WITHDRAWAL)
+        self.assertEqual(balances()[('ESCROW', None)], self.ORDERS * 85)
+        self.assertEqual(audit.check(), [])
+        self.assertEqual(audit.check(full=True), [])
+        self.assertTrue(BalanceSnapshot.objects.exists())
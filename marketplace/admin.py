@@ -1,18 +1,32 @@
 from django.contrib import admin
-from .models import Product, Order, CartItem, Notification, Favorite
+from .models import Product, Order, CartItem, Notification, Favorite, DispatchProposal
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'seller', 'price', 'category', 'location', 'created_at')
     list_filter = ('category', 'created_at')
     search_fields = ('name', 'description', 'location')
+    readonly_fields = ('reserved_quantity',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # Leaves reserved_quantity to the carts (marketplace.reservations)
+            obj.save(update_fields=[*form.changed_data, 'last_updated'])
+        else:
+            obj.save()
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'buyer', 'status', 'total_price', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('id', 'buyer__username', 'product__name')
+    readonly_fields = ('unit_price', 'total_price')
 
 admin.site.register(CartItem)
 admin.site.register(Notification)
 admin.site.register(Favorite)
+
+@admin.register(DispatchProposal)
+class DispatchProposalAdmin(admin.ModelAdmin):
+    list_display = ('order', 'rider', 'distance_km', 'status', 'created_at')
+    list_filter = ('status', 'created_at')
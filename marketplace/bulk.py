@@ -0,0 +1,309 @@
+"""
+Bulk product import and export for sellers with large inventories.
+
+Imports read a CSV or XLSX file row by row and work through it in chunks of
+CHUNK_SIZE. Each row is checked by ProductForm's fields (the same rules as
+the listing form), then the chunk is written with one ``bulk_create`` (rows
+without an ``id``), one ``bulk_update`` (rows whose ``id`` is one of the
+seller's products) and one ``bulk_create`` of StockHistory for the quantity
+changes. Only a chunk is held in memory at a time, whatever the file size.
+
+bulk_create/bulk_update send no model signals, so the work the signal
+handlers would have done per save is done here instead: the search index is
+refreshed per chunk, and the catalog cache, dashboard stats and badge are
+brought up to date once at the end.
+
+Exports write the same columns, so an exported file can be edited and
+imported back.
+"""
+import codecs
+import csv
+import io
+import zipfile
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .forms import ProductForm
+from .models import Product, StockHistory
+from . import cache as catalog_cache
+from . import search, signals, stats
+
+COLUMNS = ['id', 'name', 'description', 'price', 'quantity', 'unit', 'category', 'location', 'freshness_notes',
+           'available']
+FORM_FIELDS = [name for name in COLUMNS if name in ProductForm.Meta.fields]
+FORM_FIELD_OBJECTS = ProductForm.base_fields
+REQUIRED_COLUMNS = ['name', 'description', 'price', 'quantity', 'category', 'location']
+CHUNK_SIZE = 500
+MAX_ERRORS = 100  # reported; rows past it are still counted
+IMPORT_REASON = 'Bulk import'
+
+CSV = 'csv'
+XLSX = 'xlsx'
+FORMATS = {
+    CSV: 'text/csv',
+    XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+class BulkImportError(Exception):
+    """The upload can't be imported at all (wrong type, no header, missing columns)."""
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # [(line, message)]
+
+    @property
+    def imported(self):
+        return self.created + self.updated
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def file_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in FORMATS:
+        raise BulkImportError("Upload a .csv or .xlsx file.")
+    return extension
+
+
+def _check_utf8(upload, block_size=64 * 1024):
+    """Raise BulkImportError unless the whole upload decodes, so a bad byte can't stop an import halfway."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for block in iter(lambda: upload.read(block_size), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise BulkImportError("The file isn't UTF-8 text. In Excel, save it as \"CSV UTF-8\" and try again.")
+    finally:
+        upload.seek(0)
+
+
+def _csv_rows(upload):
+    _check_utf8(upload)
+    # utf-8-sig: Excel puts a BOM in front of CSVs it saves
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if header is None:
+            return
+        yield header
+        yield from reader
+    finally:
+        text.detach()
+
+
+def _xlsx_rows(upload):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    # read_only streams the sheet instead of loading it whole
+    try:
+        workbook = load_workbook(upload, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise BulkImportError("The file isn't a valid .xlsx workbook.")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def read_rows(upload, fmt):
+    """Yield ``(line, {column: value})`` for each data row of the upload."""
+    upload = getattr(upload, 'file', upload)  # the file under an UploadedFile
+    rows = _csv_rows(upload) if fmt == CSV else _xlsx_rows(upload)
+    header = next(rows, None)
+    if header is None:
+        raise BulkImportError("The file is empty.")
+    header = [name.strip().lower() for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise BulkImportError(f"Missing column(s): {', '.join(missing)}")
+    for line, values in enumerate(rows, start=2):
+        if not any(str(value).strip() for value in values):
+            continue
+        yield line, {name: str(value).strip() for name, value in zip(header, values) if name in COLUMNS}
+
+
+def _parse_id(value):
+    if not value:
+        return None
+    try:
+        return int(float(value))
+    except (ValueError, OverflowError):
+        raise BulkImportError(f"Invalid id {value!r}")
+
+
+def clean_row(row, product=None):
+    """
+    ``(values, errors)`` for one row, validated by ProductForm's fields (one
+    form per row would spend most of an import copying fields). Columns left
+    out, and a blank unit, keep ``product``'s current value.
+    """
+    values, errors = {}, {}
+    for name in FORM_FIELDS:
+        raw = row.get(name, '')
+        if product is not None and (name not in row or (name == 'unit' and not raw)):
+            continue
+        if name == 'unit' and not raw:
+            values[name] = Product._meta.get_field('unit').default
+            continue
+        try:
+            values[name] = FORM_FIELD_OBJECTS[name].clean(raw)
+        except ValidationError as e:
+            errors[name] = e.messages
+    if row.get('available'):
+        values['available'] = row['available'].lower() not in FALSE_VALUES
+    return values, errors
+
+
+def _differs(product, name, value):
+    # Blank text columns export as '' whether the field holds '' or NULL
+    current = getattr(product, name)
+    return current != value and not (current is None and value == '')
+
+
+def _import_chunk(seller, chunk, report, categories, seen_ids):
+    """
+    Validate and write one chunk of ``(line, row)``, adding to ``report`` and
+    ``categories``. ``seen_ids`` holds the ids of rows already taken, so a
+    product listed twice in one file is only updated once.
+    """
+    ids = set()
+    for line, row in chunk:
+        try:
+            ids.add(_parse_id(row.get('id')))
+        except BulkImportError:
+            pass
+    existing = Product.objects.filter(seller=seller, pk__in=ids - {None}).in_bulk()
+
+    new, changed, history = [], [], []
+    changed_fields = set()
+    for line, row in chunk:
+        try:
+            pk = _parse_id(row.get('id'))
+        except BulkImportError as e:
+            report.add_error(line, str(e))
+            continue
+        if pk is not None and pk not in existing:
+            report.add_error(line, f"Product {pk} isn't one of your listings.")
+            continue
+        if pk is not None and pk in seen_ids:
+            report.add_error(line, f"Product {pk} is listed more than once in the file.")
+            continue
+        product = existing.get(pk)
+        old_quantity = product.quantity if product else 0
+        if product:
+            categories.add(product.category)
+        values, errors = clean_row(row, product)
+        if errors:
+            report.add_error(line, '; '.join(f"{name}: {' '.join(messages)}" for name, messages in errors.items()))
+            continue
+        if pk is not None:
+            seen_ids.add(pk)
+        if product is None:
+            product = Product(seller=seller, **values)
+            new.append(product)
+        elif any(_differs(product, name, value) for name, value in values.items()):
+            for name, value in values.items():
+                if _differs(product, name, value):
+                    setattr(product, name, value)
+                    changed_fields.add(name)
+            changed.append(product)
+        else:
+            report.unchanged += 1
+            continue
+        categories.add(product.category)
+        if product.quantity != old_quantity:
+            history.append((product, old_quantity))
+
+    with transaction.atomic():
+        Product.objects.bulk_create(new)
+        now = timezone.now()
+        for product in changed:
+            product.last_updated = now
+        # Only the columns some row changed: each one is a CASE over the whole chunk
+        Product.objects.bulk_update(changed, ['last_updated', *sorted(changed_fields)])
+        StockHistory.objects.bulk_create([
+            StockHistory(product=product, old_quantity=old_quantity, new_quantity=product.quantity,
+                         reason=IMPORT_REASON)
+            for product, old_quantity in history
+        ])
+        search.index_products(new + changed)
+    if changed:
+        catalog_cache.bump_version(*[f'product:{product.pk}' for product in changed])
+    if new:
+        signals.products_added.send(sender=Product, products=new)
+    report.created += len(new)
+    report.updated += len(changed)
+
+
+def import_products(seller, upload, fmt):
+    """
+    Import ``upload`` (a file object) as ``seller``'s listings. Bad rows are
+    skipped and reported; raises BulkImportError if the file itself is unusable.
+    """
+    report = ImportReport()
+    categories, seen_ids = set(), set()
+    rows = read_rows(upload, fmt)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        _import_chunk(seller, chunk, report, categories, seen_ids)
+
+    if report.imported:
+        # What the per-save signal handlers would have done, once
+        catalog_cache.bump_version('all', *[f'category:{category}' for category in categories])
+        stats.rebuild([seller.pk])
+        from users import badges
+        badges.rebuild([seller.pk])
+    return report
+
+
+class Echo:
+    """File-like object whose write() hands back what it was given, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _export_values(seller):
+    products = Product.objects.filter(seller=seller).order_by('pk').values_list(*COLUMNS)
+    return products.iterator(chunk_size=2000)
+
+
+def export_csv(seller):
+    """CSV lines of ``seller``'s listings, produced as the rows are read."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in _export_values(seller):
+        yield writer.writerow(row)
+
+
+def export_xlsx(seller, target):
+    """Write ``seller``'s listings to ``target`` as XLSX, one row at a time."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Products')
+    sheet.append(COLUMNS)
+    for row in _export_values(seller):
+        sheet.append([float(value) if name == 'price' else value for name, value in zip(COLUMNS, row)])
+    workbook.save(target)
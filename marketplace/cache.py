@@ -0,0 +1,131 @@
+"""
+Versioned catalog cache.
+
+Every cached catalog entry is keyed on the current version of one or more
+*scopes* ("all", "category:FRUITS", "product:12"). Product saves (and the
+bulk paths that skip signals) bump the versions, which orphans the old
+entries instead of hunting them down one by one. Versions never expire: a
+counter that lapsed could come back at a value old entries are still
+stored under.
+
+Reads go through a short-lived per-process tier (the ``local`` cache) before
+the shared ``default`` cache (Redis in production).
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+
+LOCAL_TIMEOUT = 30        # seconds an entry may be served from process memory
+SHARED_TIMEOUT = 15 * 60  # seconds an entry lives in the shared cache
+VERSION_LOCAL_TIMEOUT = 2 # how stale another process's version bump may look
+
+STATS_HITS = 'catalog:stats:hits'
+STATS_MISSES = 'catalog:stats:misses'
+
+
+def _local():
+    return caches['local']
+
+
+def _shared():
+    return caches['default']
+
+
+def _version_key(scope):
+    return f'catalog:v:{scope}'
+
+
+def get_version(scope):
+    key = _version_key(scope)
+    version = _local().get(key)
+    if version is None:
+        version = _shared().get(key)
+        if version is None:
+            # Seed from the clock so an evicted counter never restarts at a
+            # value that older entries were stored under.
+            _shared().add(key, int(time.time() * 1000), None)
+            version = _shared().get(key)
+        _local().set(key, version, VERSION_LOCAL_TIMEOUT)
+    return version
+
+
+def bump_version(*scopes):
+    for scope in set(scopes):
+        key = _version_key(scope)
+        try:
+            _shared().incr(key)
+        except ValueError:
+            _shared().add(key, int(time.time() * 1000), None)
+        _local().delete(key)
+
+
+def product_scopes(product, old_category=None):
+    """Scopes whose cached entries may show ``product``."""
+    scopes = ['all', f'category:{product.category}', f'product:{product.pk}']
+    if old_category and old_category != product.category:
+        scopes.append(f'category:{old_category}')
+    return scopes
+
+
+def _incr(key):
+    try:
+        _shared().incr(key)
+    except ValueError:
+        if not _shared().add(key, 1, None):
+            _shared().incr(key)
+
+
+def record_hit():
+    _incr(STATS_HITS)
+
+
+def record_miss():
+    _incr(STATS_MISSES)
+
+
+def stats():
+    hits = _shared().get(STATS_HITS) or 0
+    misses = _shared().get(STATS_MISSES) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats():
+    _shared().delete_many([STATS_HITS, STATS_MISSES])
+
+
+def make_key(kind, scopes, parts):
+    versions = ':'.join(f'{scope}={get_version(scope)}' for scope in scopes)
+    raw = '|'.join(str(p) for p in parts)
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'catalog:{kind}:{versions}:{digest}'
+
+
+_MISSING = object()
+
+
+def get_or_set(kind, scopes, parts, producer, timeout=SHARED_TIMEOUT):
+    """
+    Return the cached value for ``kind`` + ``parts`` under the current
+    ``scopes`` versions, calling ``producer()`` on a miss.
+    """
+    key = make_key(kind, scopes, parts)
+    value = _local().get(key, _MISSING)
+    if value is _MISSING:
+        value = _shared().get(key, _MISSING)
+        if value is not _MISSING:
+            _local().set(key, value, LOCAL_TIMEOUT)
+    if value is not _MISSING:
+        record_hit()
+        return value
+
+    record_miss()
+    value = producer()
+    _shared().set(key, value, timeout)
+    _local().set(key, value, LOCAL_TIMEOUT)
+    return value
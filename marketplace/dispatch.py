@@ -0,0 +1,309 @@
+"""
+Batch dispatch.
+
+Matches every ready, unassigned order to an available, verified rider in one
+pass instead of leaving it to whoever clicks first. The cost of a pairing is
+the pickup distance (rider -> farmer). Pairings a rider's vehicle cannot take
+(too far for it, too big a load) are forbidden.
+
+The matching is an auction over the NumPy distance matrix
+(core.geo.pairwise_km). It is repeated once per extra delivery slot, so a
+pickup with room for four jobs can be given up to four. The result is
+stored as DispatchProposal rows; riders still confirm through accept_delivery.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+
+from core import geo
+from users.models import RiderProfile
+from .models import DispatchProposal, Notification, Order
+from .notifications import notify_many
+
+# Smallest to largest
+VEHICLE_RANK = ['BICYCLE', 'MOTORBIKE', 'TUKTUK', 'PICKUP', 'LORRY']
+
+# Concurrent deliveries and the furthest pickup worth sending each vehicle to
+VEHICLE_LIMITS = {
+    'BICYCLE': {'slots': 1, 'max_km': 5},
+    'MOTORBIKE': {'slots': 2, 'max_km': 30},
+    'TUKTUK': {'slots': 3, 'max_km': 25},
+    'PICKUP': {'slots': 4, 'max_km': 80},
+    'LORRY': {'slots': 6, 'max_km': 150},
+}
+
+# Loads that need at least a given vehicle
+CATEGORY_MIN_VEHICLE = {'LIVESTOCK': 'PICKUP', 'EQUIPMENT': 'PICKUP'}
+BULK_MIN_VEHICLE = [(200, 'PICKUP'), (50, 'TUKTUK')]  # (quantity >=, vehicle)
+
+# Orders a rider is still working on (count against their slots)
+ACTIVE_DELIVERY_STATUSES = ['ACCEPTED', 'ESCROW', 'IN_DELIVERY']
+
+# Auction precision: the matching is within (orders + riders) * epsilon km of optimal
+AUCTION_EPSILON_KM = 0.01
+# Riders each order bids on (its nearest eligible ones)
+DISPATCH_CANDIDATES = 32
+# Orders each rider considers (its nearest bidders)
+COLUMN_CANDIDATES = 64
+
+
+def required_vehicle(category, quantity):
+    """Rank (index into VEHICLE_RANK) of the smallest vehicle that can carry the load."""
+    rank = VEHICLE_RANK.index(CATEGORY_MIN_VEHICLE.get(category, 'BICYCLE'))
+    for threshold, vehicle in BULK_MIN_VEHICLE:
+        if quantity >= threshold:
+            rank = max(rank, VEHICLE_RANK.index(vehicle))
+            break
+    return rank
+
+
+def _bid_rounds(benefit, columns, prices, epsilon):
+    """
+    Jacobi forward auction where every row has to end up with a column.
+    ``prices`` is updated in place. Returns each row's column.
+    """
+    n = len(benefit)
+    assigned = np.full(n, -1)
+    owner = np.full(len(prices), -1)
+    active = np.ones(n, dtype=bool)
+    # Stand-in for the runner-up when a row has a single option
+    spread = float(np.abs(benefit[np.isfinite(benefit)]).max()) + epsilon
+    while active.any():
+        bidders = np.flatnonzero(active)
+        cols = columns[bidders]
+        values = benefit[bidders] - prices[cols]
+        rows = np.arange(len(bidders))
+        best = values.argmax(axis=1)
+        best_value = values[rows, best]
+        values[rows, best] = -np.inf
+        second_value = values.max(axis=1)
+        second_value = np.where(np.isfinite(second_value), second_value, best_value - spread)
+        targets = cols[rows, best]
+        bids = prices[targets] + best_value - second_value + epsilon
+
+        # Highest bid wins each column
+        order = np.lexsort((-bids, targets))
+        ranked = targets[order]
+        first = np.concatenate(([True], ranked[1:] != ranked[:-1]))
+        wins = order[first]
+        won, winners = targets[wins], bidders[wins]
+
+        displaced = owner[won]
+        displaced = displaced[displaced >= 0]
+        assigned[displaced] = -1
+        active[displaced] = True
+
+        owner[won] = winners
+        assigned[winners] = won
+        prices[won] = bids[wins]
+        active[winners] = False
+    return assigned
+
+
+def auction(benefit, columns=None, epsilon=AUCTION_EPSILON_KM, column_limit=COLUMN_CANDIDATES):
+    """
+    Maximum-benefit assignment of rows to columns.
+
+    ``benefit`` is an ``n x k`` array with ``-inf`` for forbidden pairs;
+    ``columns`` (same shape) says which column each entry refers to, so each
+    row can carry just its best candidates. Without it ``benefit`` is the
+    full ``n x m`` matrix. Rows may stay unassigned (worth 0). Returns an
+    array giving each row's column, or -1 if it has none.
+
+    Leaving rows and columns unmatched is modelled with stand-ins so the
+    problem is square: every row may take a private "unserved" slot, and
+    every column has an "idle" row that either takes the column itself or,
+    when a real row took it, that row's unserved slot. Being square lets the
+    auction run in epsilon-scaling phases (coarse prices first), which avoids
+    long price wars, and the result is within ``(n + m) * epsilon`` of the
+    optimum. A column only keeps its ``column_limit`` best rows.
+
+    All unassigned rows bid at once (Jacobi auction), so a round is a handful
+    of NumPy operations over the bidders' rows.
+    """
+    n, k = benefit.shape
+    if columns is None:
+        columns = np.broadcast_to(np.arange(k), (n, k))
+    if n == 0 or k == 0 or not np.isfinite(benefit).any():
+        return np.full(n, -1)
+    benefit = benefit.copy()
+    m = int(columns.max()) + 1
+
+    # Edges, grouped by column, best first; drop each column's tail
+    edge_rows, edge_pos = np.nonzero(np.isfinite(benefit))
+    edge_cols = columns[edge_rows, edge_pos]
+    order = np.lexsort((-benefit[edge_rows, edge_pos], edge_cols))
+    edge_rows, edge_pos, edge_cols = edge_rows[order], edge_pos[order], edge_cols[order]
+    rank = np.arange(len(edge_cols)) - np.searchsorted(edge_cols, edge_cols)
+    cut = rank >= column_limit
+    benefit[edge_rows[cut], edge_pos[cut]] = -np.inf
+    edge_rows, edge_cols, rank = edge_rows[~cut], edge_cols[~cut], rank[~cut]
+
+    # Objects: columns 0..m-1, then row i's unserved slot at m + i.
+    # People: rows 0..n-1, then column j's idle row at n + j.
+    width = max(k, int(rank.max()) + 1 if len(rank) else 0) + 1
+    full_benefit = np.full((n + m, width), -np.inf)
+    full_columns = np.zeros((n + m, width), dtype=np.int64)
+    full_benefit[:n, :k] = benefit
+    full_columns[:n, :k] = columns
+    full_benefit[:n, k] = 0.0
+    full_columns[:n, k] = m + np.arange(n)
+    idle = n + np.arange(m)
+    full_benefit[idle, 0] = 0.0
+    full_columns[idle, 0] = np.arange(m)
+    full_benefit[n + edge_cols, rank + 1] = 0.0
+    full_columns[n + edge_cols, rank + 1] = m + edge_rows
+
+    prices = np.zeros(n + m)
+    step = max(float(benefit[np.isfinite(benefit)].max()) / 4, epsilon)
+    while True:
+        assigned = _bid_rounds(full_benefit, full_columns, prices, step)
+        if step <= epsilon:
+            break
+        step = max(step / 5, epsilon)
+    assigned = assigned[:n]
+    return np.where(assigned < m, assigned, -1)
+
+
+@dataclass
+class Match:
+    order_id: int
+    rider_id: int
+    distance_km: float
+
+
+def load_orders():
+    rows = list(
+        Order.objects.filter(
+            is_ready_for_pickup=True, assigned_rider__isnull=True, status__in=['ACCEPTED', 'ESCROW'],
+            seller__profile__latitude__isnull=False,
+            seller__profile__longitude__isnull=False,
+        ).values(
+            'id', 'quantity', 'product__category',
+            'seller__profile__latitude', 'seller__profile__longitude',
+        )
+    )
+    return {
+        'id': np.array([r['id'] for r in rows], dtype=np.int64),
+        'lat': geo.as_degrees([r['seller__profile__latitude'] for r in rows]),
+        'lon': geo.as_degrees([r['seller__profile__longitude'] for r in rows]),
+        'min_rank': np.array([required_vehicle(r['product__category'], r['quantity']) for r in rows], dtype=np.int64),
+    }
+
+
+def load_riders():
+    rows = list(
+        RiderProfile.objects.filter(is_available=True, verification_status='VERIFIED')
+        .annotate(active=Count('user__assigned_orders',
+                               filter=Q(user__assigned_orders__status__in=ACTIVE_DELIVERY_STATUSES)))
+        .values('user_id', 'vehicle_type', 'active', 'current_latitude', 'current_longitude',
+                'user__profile__latitude', 'user__profile__longitude')
+    )
+    riders = {'id': [], 'lat': [], 'lon': [], 'rank': [], 'max_km': [], 'slots': []}
+    for r in rows:
+        # Last GPS fix, else the rider's home location
+        lat = r['current_latitude'] if r['current_latitude'] is not None else r['user__profile__latitude']
+        lon = r['current_longitude'] if r['current_longitude'] is not None else r['user__profile__longitude']
+        limits = VEHICLE_LIMITS.get(r['vehicle_type'], VEHICLE_LIMITS['MOTORBIKE'])
+        if lat is None or lon is None or r['active'] >= limits['slots']:
+            continue
+        riders['id'].append(r['user_id'])
+        riders['lat'].append(lat)
+        riders['lon'].append(lon)
+        riders['rank'].append(VEHICLE_RANK.index(r['vehicle_type']) if r['vehicle_type'] in VEHICLE_RANK else 1)
+        riders['max_km'].append(limits['max_km'])
+        riders['slots'].append(limits['slots'] - r['active'])
+    return {
+        'id': np.array(riders['id'], dtype=np.int64),
+        'lat': geo.as_degrees(riders['lat']),
+        'lon': geo.as_degrees(riders['lon']),
+        'rank': np.array(riders['rank'], dtype=np.int64),
+        'max_km': np.array(riders['max_km'], dtype=float),
+        'slots': np.array(riders['slots'], dtype=np.int64),
+    }
+
+
+def plan(orders, riders, epsilon=AUCTION_EPSILON_KM):
+    """
+    Match ``orders`` to ``riders`` (the dicts of arrays from load_orders /
+    load_riders). Returns a list of ``Match``.
+    """
+    if not len(orders['id']) or not len(riders['id']):
+        return []
+    distance = geo.pairwise_km(orders['lat'], orders['lon'], riders['lat'], riders['lon'])
+    allowed = (distance <= riders['max_km'][None, :]) & (riders['rank'][None, :] >= orders['min_rank'][:, None])
+    # Constant minus distance: every extra match outweighs any saving in km
+    reward = float(riders['max_km'].max()) + 1.0
+    benefit = np.where(allowed, reward - distance, -np.inf)
+
+    matches = []
+    open_orders = np.ones(len(orders['id']), dtype=bool)
+    slots = riders['slots'].copy()
+    while True:
+        rows = np.flatnonzero(open_orders)
+        cols = np.flatnonzero(slots > 0)
+        if not len(rows) or not len(cols):
+            break
+        sub = benefit[np.ix_(rows, cols)]
+        if sub.shape[1] > DISPATCH_CANDIDATES:
+            # Each order only bids on its nearest eligible riders
+            candidates = np.argpartition(-sub, DISPATCH_CANDIDATES - 1, axis=1)[:, :DISPATCH_CANDIDATES]
+            picked = auction(np.take_along_axis(sub, candidates, axis=1), candidates, epsilon)
+        else:
+            picked = auction(sub, epsilon=epsilon)
+        hit = np.flatnonzero(picked >= 0)
+        if not len(hit):
+            break
+        for r, c in zip(rows[hit], cols[picked[hit]]):
+            matches.append(Match(int(orders['id'][r]), int(riders['id'][c]), float(distance[r, c])))
+        open_orders[rows[hit]] = False
+        slots[cols[picked[hit]]] -= 1
+    return matches
+
+
+def propose(dry_run=False):
+    """
+    Compute a fresh dispatch plan and store it as DispatchProposal rows.
+
+    Proposals that are still part of the plan are kept, others expire, and
+    riders are notified only about proposals that are new to them.
+    Returns the list of ``Match``.
+    """
+    matches = plan(load_orders(), load_riders())
+    if dry_run:
+        return matches
+
+    wanted = {(m.order_id, m.rider_id): m for m in matches}
+    with transaction.atomic():
+        current = DispatchProposal.objects.select_for_update().filter(status='PROPOSED')
+        keep = set()
+        stale = []
+        for proposal_id, order_id, rider_id in current.values_list('id', 'order_id', 'rider_id'):
+            if (order_id, rider_id) in wanted:
+                keep.add((order_id, rider_id))
+            else:
+                stale.append(proposal_id)
+        DispatchProposal.objects.filter(id__in=stale).update(status='EXPIRED')
+
+        new = [m for key, m in wanted.items() if key not in keep]
+        DispatchProposal.objects.bulk_create([
+            DispatchProposal(order_id=m.order_id, rider_id=m.rider_id, distance_km=round(m.distance_km, 2))
+            for m in new
+        ])
+        notify_many([
+            Notification(
+                user_id=m.rider_id, order_id=m.order_id, notification_type='DELIVERY_PROPOSED',
+                message=f"Suggested delivery: Order #{m.order_id} is {m.distance_km:.1f} km from you.",
+            )
+            for m in new
+        ])
+    return matches
+
+
+def close_proposals(order, rider):
+    """Mark ``order``'s proposals settled once ``rider`` has taken it."""
+    open_proposals = DispatchProposal.objects.filter(order=order, status='PROPOSED')
+    open_proposals.filter(rider=rider).update(status='ACCEPTED')
+    open_proposals.exclude(rider=rider).update(status='EXPIRED')
@@ -0,0 +1,113 @@
+"""
+Available-jobs feed for riders.
+
+Open orders (ready for pickup, no rider yet) are filtered to a bounding box
+around the rider in SQL, ordered by an approximate (equirectangular) distance
+that the database can sort on, and paged with LIMIT/OFFSET. Only the rows on
+the page are loaded, and their exact great-circle distance is computed in one
+NumPy call, so a page costs the same few queries however many orders are open.
+"""
+import math
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Cast, Floor
+
+from core import geo
+from .models import Order
+
+JOB_RADIUS_KM = getattr(settings, 'RIDER_JOB_RADIUS_KM', 50)
+MAX_JOB_RADIUS_KM = 200
+JOBS_PAGE_SIZE = 20
+DELIVERY_FEE_RATE = Decimal('0.15')  # of the order value
+
+OPEN_JOB_STATUSES = ['ACCEPTED', 'ESCROW']
+
+SELLER_LAT = 'seller__profile__latitude'
+SELLER_LON = 'seller__profile__longitude'
+
+
+def open_jobs():
+    """Ready, unassigned orders with the rider's fee worked out in SQL."""
+    return Order.objects.filter(
+        is_ready_for_pickup=True, assigned_rider__isnull=True, status__in=OPEN_JOB_STATUSES,
+    ).annotate(
+        estimated_fee=Cast(
+            Floor(ExpressionWrapper(
+                F('total_price') * Value(DELIVERY_FEE_RATE),
+                output_field=DecimalField(max_digits=12, decimal_places=4),
+            )),
+            IntegerField(),
+        ),
+    )
+
+
+def nearby_jobs(latitude, longitude, radius_km=JOB_RADIUS_KM):
+    """
+    Open jobs whose pickup lies within ``radius_km`` of the rider, nearest
+    first, followed by jobs whose seller has no coordinates (unranked).
+    Without a rider position, every open job, newest first.
+    """
+    jobs = open_jobs()
+    if latitude is None or longitude is None:
+        return jobs.order_by('-updated_at', '-id')
+
+    latitude, longitude = float(latitude), float(longitude)
+    lat_min, lat_max, lon_min, lon_max = geo.bounding_box(latitude, longitude, radius_km)
+    # Squared km on a flat map around the rider: good enough to rank within the box
+    lon_scale = geo.KM_PER_DEGREE_LAT * math.cos(math.radians(latitude))
+    dlat = ExpressionWrapper((F(SELLER_LAT) - Value(latitude)) * Value(geo.KM_PER_DEGREE_LAT), output_field=FloatField())
+    dlon = ExpressionWrapper((F(SELLER_LON) - Value(longitude)) * Value(lon_scale), output_field=FloatField())
+    unlocated = Q(**{f'{SELLER_LAT}__isnull': True}) | Q(**{f'{SELLER_LON}__isnull': True})
+    nearby = Q(**{
+        f'{SELLER_LAT}__gte': lat_min, f'{SELLER_LAT}__lte': lat_max,
+        f'{SELLER_LON}__gte': lon_min, f'{SELLER_LON}__lte': lon_max,
+        'approx_distance_sq__lte': radius_km ** 2,
+    })
+    return jobs.annotate(
+        approx_distance_sq=ExpressionWrapper(dlat * dlat + dlon * dlon, output_field=FloatField()),
+        unlocated=Case(When(unlocated, then=Value(1)), default=Value(0), output_field=IntegerField()),
+    ).filter(nearby | unlocated).order_by('unlocated', 'approx_distance_sq', 'id')
+
+
+def page_of(queryset, page, page_size=JOBS_PAGE_SIZE):
+    """
+    Rows of page ``page`` (1-based) and whether another page follows.
+    Fetches one extra row instead of running a COUNT.
+    """
+    start = (page - 1) * page_size
+    rows = list(queryset[start:start + page_size + 1])
+    return rows[:page_size], len(rows) > page_size
+
+
+def add_distances(latitude, longitude, orders):
+    """Set ``distance_km`` (exact, rounded, or "N/A") on orders loaded with their seller's profile."""
+    distances = [float('nan')] * len(orders)
+    if latitude is not None and longitude is not None and orders:
+        distances = geo.distances_km(
+            latitude, longitude,
+            [order.product.seller.profile.latitude for order in orders],
+            [order.product.seller.profile.longitude for order in orders],
+        )
+    for order, dist in zip(orders, distances):
+        order.distance_km = "N/A" if math.isnan(dist) else round(float(dist), 1)
+    return orders
+
+
+def parse_radius(value):
+    """Radius from a query string, clamped to a sane range."""
+    try:
+        radius = float(value)
+    except (TypeError, ValueError):
+        return JOB_RADIUS_KM
+    if not math.isfinite(radius):
+        return JOB_RADIUS_KM
+    return min(max(radius, 1.0), MAX_JOB_RADIUS_KM)
+
+
+def parse_page(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from marketplace import cache as catalog_cache
+
+class Command(BaseCommand):
+    help = 'Shows catalog cache hit/miss counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing')
+
+    def handle(self, *args, **options):
+        stats = catalog_cache.stats()
+        self.stdout.write(f"Hits:     {stats['hits']}")
+        self.stdout.write(f"Misses:   {stats['misses']}")
+        self.stdout.write(self.style.SUCCESS(f"Hit rate: {stats['hit_rate']:.2%}"))
+        if options['reset']:
+            catalog_cache.reset_stats()
+            self.stdout.write("Counters reset.")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace import stats
+
+
+class Command(BaseCommand):
+    help = 'Compares the farmer dashboard rollups with a fresh count of orders and products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('farmer_ids', nargs='*', type=int, help='Only these sellers (default: all)')
+        parser.add_argument('--fix', action='store_true', help='Rebuild the sellers that disagree')
+
+    def handle(self, *args, **options):
+        problems = stats.check(options['farmer_ids'] or None)
+        for farmer_id, day, field, stored, expected in problems:
+            where = f"{farmer_id} {day}" if day else f"{farmer_id}"
+            self.stdout.write(f"{where} {field}: stored {stored}, expected {expected}")
+        if not problems:
+            self.stdout.write(self.style.SUCCESS("Farmer stats are consistent."))
+            return
+        sellers = sorted({farmer_id for farmer_id, *_ in problems})
+        if options['fix']:
+            stats.rebuild(sellers)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {len(sellers)} seller(s)."))
+        else:
+            raise CommandError(f"{len(problems)} mismatch(es) across {len(sellers)} seller(s); rerun with --fix")
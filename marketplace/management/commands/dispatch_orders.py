@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from marketplace import dispatch
+
+class Command(BaseCommand):
+    help = 'Matches ready orders to available riders and stores the proposals (same job as the Celery beat task)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the plan without saving proposals')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        matches = dispatch.propose(dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - start
+        for match in matches:
+            self.stdout.write(f"Order #{match.order_id} -> rider {match.rider_id} ({match.distance_km:.1f} km)")
+        total_km = sum(m.distance_km for m in matches)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(matches)} proposal(s), {total_km:.1f} km total pickup distance, {elapsed:.2f}s"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from marketplace import stats
+
+
+class Command(BaseCommand):
+    help = 'Recounts the farmer dashboard rollups (FarmerStats, FarmerDailyStats) from orders and products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('farmer_ids', nargs='*', type=int, help='Only these sellers (default: all)')
+
+    def handle(self, *args, **options):
+        written = stats.rebuild(options['farmer_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {written} seller(s)."))
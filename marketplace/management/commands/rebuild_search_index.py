@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from marketplace import search
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text product search index'
+
+    def handle(self, *args, **kwargs):
+        backend = search.get_backend()
+        self.stdout.write(f"Rebuilding product index ({type(backend).__name__})...")
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products."))
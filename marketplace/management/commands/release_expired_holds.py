@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from marketplace import reservations
+
+class Command(BaseCommand):
+    help = 'Releases cart stock holds that have expired (same job as the Celery beat task)'
+
+    def handle(self, *args, **options):
+        released = reservations.release_expired()
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired hold(s)."))
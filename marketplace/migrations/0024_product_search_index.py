@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS marketplace_product_fts USING fts5("
+            "name, description, category, location, sw_terms, "
+            "tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS marketplace_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES marketplace_product (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS marketplace_product_search_document_gin "
+            "ON marketplace_product_search USING GIN (document)"
+        )
+    else:
+        return
+
+    # Index whatever is already in the catalog
+    from marketplace import search
+    Product = apps.get_model('marketplace', 'Product')
+    backend = search.BACKENDS[vendor]
+    with schema_editor.connection.cursor() as cursor:
+        for product in Product.objects.all().iterator():
+            backend.index(cursor, product)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS marketplace_product_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS marketplace_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0023_order_delivery_address'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
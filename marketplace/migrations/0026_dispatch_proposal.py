@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0025_stock_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('ORDER_PLACED', 'Order Placed'), ('ORDER_ACCEPTED', 'Order Accepted'), ('ORDER_REJECTED', 'Order Rejected'), ('ORDER_ASSIGNED', 'Order Assigned'), ('DELIVERY_PROPOSED', 'Delivery Proposed')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DispatchProposal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_km', models.DecimalField(decimal_places=2, max_digits=7)),
+                ('status', models.CharField(choices=[('PROPOSED', 'Proposed'), ('ACCEPTED', 'Accepted'), ('EXPIRED', 'Expired')], default='PROPOSED', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_proposals', to='marketplace.order')),
+                ('rider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_proposals', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['rider', 'status'], name='dispatch_rider_status_idx'), models.Index(fields=['order', 'status'], name='dispatch_order_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0026_dispatch_proposal'),
+        ('users', '0031_riderprofile_current_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('assigned_rider__isnull', True)), fields=['status', 'is_ready_for_pickup'], name='order_open_jobs_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def snapshot_unit_prices(apps, schema_editor):
+    Order = apps.get_model('marketplace', 'Order')
+    # What the buyer was charged per unit, not today's product price
+    Order.objects.filter(quantity__gt=0).update(unit_price=F('total_price') / F('quantity'))
+    Order.objects.filter(unit_price__isnull=True).update(unit_price=F('total_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0030_farmer_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True, help_text='Product price when the order was placed'),
+        ),
+        migrations.RunPython(snapshot_unit_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, help_text='Product price when the order was placed', max_digits=10),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0032_order_seller_and_indexes'),
+        ('users', '0033_farmerbadge_rating_sum'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payout_conversation_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payout_receipt_number',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('ORDER_PLACED', 'Order Placed'), ('ORDER_ACCEPTED', 'Order Accepted'), ('ORDER_REJECTED', 'Order Rejected'), ('ORDER_ASSIGNED', 'Order Assigned'), ('DELIVERY_PROPOSED', 'Delivery Proposed'), ('PAYOUT_FAILED', 'Payout Failed')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payout_conversation_id'], name='order_payout_conversation_idx'),
+        ),
+    ]
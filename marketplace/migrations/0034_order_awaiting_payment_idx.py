@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0033_order_payout'),
+        ('users', '0033_farmerbadge_rating_sum'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('checkout_request_id__isnull', False), ('status', 'ACCEPTED')), fields=['id'], name='order_awaiting_payment_idx'),
+        ),
+    ]
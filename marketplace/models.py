@@ -1,7 +1,8 @@
 from django.db import models
 from django.conf import settings
+from core.models import LoadedValuesMixin
 
-class Product(models.Model):
+class Product(LoadedValuesMixin, models.Model):
     CATEGORY_CHOICES = [
         ('VEGETABLES', 'Vegetables'),
         ('FRUITS', 'Fruits'),
@@ -17,6 +18,8 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of image (see core.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     location = models.CharField(max_length=100)
     unit = models.CharField(
         max_length=50, 
@@ -30,10 +33,19 @@ class Product(models.Model):
         default='PENDING'
     )
     quantity = models.PositiveIntegerField(default=1)
+    # Units held by buyers' carts. Only written by the update() calls in
+    # marketplace.reservations: saves of a loaded product pass update_fields
+    # without it, so they can't write back a stale count
+    reserved_quantity = models.PositiveIntegerField(default=0)
     freshness_notes = models.TextField(blank=True, null=True)
     last_updated = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @property
+    def available_quantity(self):
+        """Stock that is not held in anyone's cart."""
+        return max(self.quantity - self.reserved_quantity, 0)
+
     def __str__(self):
         return self.name
 
@@ -53,7 +65,7 @@ class StockHistory(models.Model):
 
 from users.models import DeliveryAddress
 
-class Order(models.Model):
+class Order(LoadedValuesMixin, models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
         ('ACCEPTED', 'Accepted'),
@@ -74,14 +86,21 @@ class Order(models.Model):
 
     buyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='orders')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='orders')
+    # Copy of product.seller, so farmer-side queries don't join through products
+    # (indexed by order_seller_status_idx)
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sales', db_index=False)
     quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Product price when the order was placed")
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     delivery_method = models.CharField(max_length=20, choices=DELIVERY_METHOD_CHOICES, default='PICKUP')
     delivery_address = models.ForeignKey(DeliveryAddress, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders', help_text="Buyer's delivery address for this order")
     mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
     checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
-    assigned_rider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_orders')
+    # B2C payout to the farmer; its result callback finds the order by the ConversationID
+    payout_conversation_id = models.CharField(max_length=100, blank=True, null=True)
+    payout_receipt_number = models.CharField(max_length=50, blank=True, null=True)
+    assigned_rider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_orders', db_index=False)
     delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     estimated_delivery_time = models.CharField(max_length=50, blank=True, null=True, help_text="E.g. 30 mins")
     delivery_distance_km = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
@@ -91,8 +110,33 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Rider jobs feed: ready orders still waiting for a rider
+            models.Index(fields=['status', 'is_ready_for_pickup'], condition=models.Q(assigned_rider__isnull=True),
+                         name='order_open_jobs_idx'),
+            # Farmer dashboard, order API and accept/reject: a seller's orders by status, newest first
+            models.Index(fields=['seller', 'status', '-created_at'], name='order_seller_status_idx'),
+            # Buyer dashboard and order API
+            models.Index(fields=['buyer', '-created_at'], name='order_buyer_created_idx'),
+            # Rider dashboard: a rider's deliveries by status
+            models.Index(fields=['assigned_rider', 'status'], name='order_rider_status_idx'),
+            # M-Pesa callbacks look orders up by their STK request
+            models.Index(fields=['checkout_request_id'], name='order_checkout_request_idx'),
+            models.Index(fields=['payout_conversation_id'], name='order_payout_conversation_idx'),
+            # Payment reconciliation (mpesa.reconcile) walks orders still waiting on an STK push
+            models.Index(fields=['id'], condition=models.Q(status='ACCEPTED', checkout_request_id__isnull=False),
+                         name='order_awaiting_payment_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        self.total_price = self.product.price * self.quantity
+        # Priced once, when placed; later saves (status changes) leave it alone
+        if self._state.adding:
+            if self.seller_id is None:
+                self.seller_id = self.product.seller_id
+            if self.unit_price is None:
+                self.unit_price = self.product.price
+            self.total_price = self.unit_price * self.quantity
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -114,6 +158,8 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='in_carts')
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
+    # Set while ``quantity`` units are held on the product; cleared by the sweeper
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True)
 
     class Meta:
         unique_together = ('buyer', 'product')
@@ -136,6 +182,8 @@ class Notification(models.Model):
         ('ORDER_ACCEPTED', 'Order Accepted'),
         ('ORDER_REJECTED', 'Order Rejected'),
         ('ORDER_ASSIGNED', 'Order Assigned'),
+        ('DELIVERY_PROPOSED', 'Delivery Proposed'),
+        ('PAYOUT_FAILED', 'Payout Failed'),
     ]
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
@@ -147,10 +195,112 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read'], name='notification_user_read_idx'),
+        ]
 
     def mark_as_read(self):
-        self.is_read = True
-        self.save()
+        # Through the service so the user's unread counter follows
+        from .notifications import mark_read
+        mark_read(self)
 
     def __str__(self):
         return f"{self.user.username} - {self.notification_type} - {'Read' if self.is_read else 'Unread'}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Unread notifications per user, kept in step by marketplace.notifications
+    so the navbar badge is a primary-key lookup instead of a COUNT. The
+    reconcile_notification_counters task rebuilds it from Notification.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+
+class DispatchProposal(models.Model):
+    """A rider suggested for a ready order by the dispatch engine (marketplace.dispatch)."""
+    STATUS_CHOICES = [
+        ('PROPOSED', 'Proposed'),
+        ('ACCEPTED', 'Accepted'),
+        ('EXPIRED', 'Expired'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='dispatch_proposals')
+    rider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='dispatch_proposals')
+    distance_km = models.DecimalField(max_digits=7, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PROPOSED')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['rider', 'status'], name='dispatch_rider_status_idx'),
+            models.Index(fields=['order', 'status'], name='dispatch_order_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.order_id} -> {self.rider.username} ({self.status})"
+
+
+class FarmerStats(models.Model):
+    """
+    Per-seller order rollup behind the farmer dashboard, moved by
+    marketplace.stats as orders change status. One ``<status>_count``
+    column per Order status.
+    """
+    farmer = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='farmer_stats')
+    pending_count = models.IntegerField(default=0)
+    accepted_count = models.IntegerField(default=0)
+    escrow_count = models.IntegerField(default=0)
+    in_delivery_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    paid_out_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    disputed_count = models.IntegerField(default=0)
+    refunded_count = models.IntegerField(default=0)
+    active_products = models.IntegerField(default=0)
+    # Value of accepted-or-later orders, and of those paid out to the farmer
+    gross_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_out_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'Farmer stats'
+
+    def count(self, status):
+        return getattr(self, f'{status.lower()}_count')
+
+    @property
+    def orders_count(self):
+        return sum(self.count(status) for status, _ in Order.STATUS_CHOICES)
+
+    @property
+    def in_progress_count(self):
+        from .stats import GROSS_STATUSES
+        return sum(self.count(status) for status in GROSS_STATUSES)
+
+    def __str__(self):
+        return f"Stats for {self.farmer_id}"
+
+
+class FarmerDailyStats(models.Model):
+    """Orders placed on one day for one seller, with their gross and paid-out value so far."""
+    farmer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    orders = models.IntegerField(default=0)
+    gross_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_out_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('farmer', 'day')
+        ordering = ['-day']
+        verbose_name_plural = 'Farmer daily stats'
+
+    def __str__(self):
+        return f"{self.farmer_id} {self.day}: {self.orders} orders"
@@ -0,0 +1,150 @@
+"""
+Notification service.
+
+Every notification goes through ``notify`` (one) or ``notify_many`` (a batch
+written with a single bulk INSERT). Once the surrounding transaction commits,
+each row is pushed to its user's ``user_<id>`` channel-layer group, where
+``core.consumers.NotificationConsumer`` forwards it over the websocket. The
+browser only falls back to polling ``notification_status`` while the socket
+is down.
+
+Unread counts live in ``NotificationCounter``, moved with ``F()`` updates in
+the same transaction as the rows they count, so reading one is a primary-key
+lookup. ``reconcile`` rebuilds them from the table if they ever drift.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Notification, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(user_id):
+    return f"user_{user_id}"
+
+
+def event_for(notification, unread_count=None):
+    """Channel-layer message for one notification (handled by NotificationConsumer.send_notification)."""
+    return {
+        'type': 'send_notification',
+        'id': notification.pk,
+        'notification_type': notification.notification_type,
+        'message': notification.message,
+        'order_id': notification.order_id,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+        'unread_count': unread_count,
+    }
+
+
+async def _send_all(layer, events):
+    await asyncio.gather(*(layer.group_send(group, event) for group, event in events))
+
+
+def push(notifications):
+    """Send already-saved notifications to their users' websocket groups."""
+    layer = get_channel_layer()
+    if layer is None or not notifications:
+        return
+    try:
+        counts = unread_counts({n.user_id for n in notifications})
+        events = [(group_name(n.user_id), event_for(n, counts.get(n.user_id, 0))) for n in notifications]
+        async_to_sync(_send_all)(layer, events)
+    except Exception:
+        # The rows are saved; clients still see them on their next poll
+        logger.exception("Could not push %d notification(s)", len(notifications))
+
+
+def notify_many(notifications):
+    """
+    Save unsaved ``Notification`` instances in one INSERT and push them
+    after commit. Returns the saved rows.
+    """
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create(notifications)
+        _adjust(Counter(n.user_id for n in notifications if not n.is_read))
+    transaction.on_commit(lambda: push(notifications))
+    return notifications
+
+
+def notify(user, notification_type, message, order=None):
+    """Create and push a single notification."""
+    return notify_many([Notification(user=user, notification_type=notification_type, message=message, order=order)])[0]
+
+
+def _adjust(deltas):
+    """Add ``{user_id: delta}`` to the users' unread counters, creating missing ones."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in deltas], ignore_conflicts=True,
+    )
+    # One UPDATE per distinct delta, usually just one
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        by_delta[delta].append(user_id)
+    for delta, user_ids in by_delta.items():
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(
+            unread=Greatest(F('unread') + delta, 0),
+        )
+
+
+def mark_read(notification):
+    """Mark one notification read; the counter only moves if it was unread."""
+    with transaction.atomic():
+        changed = Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True)
+        if changed:
+            _adjust({notification.user_id: -changed})
+    notification.is_read = True
+    return bool(changed)
+
+
+def mark_all_read(user):
+    """Mark all of ``user``'s notifications read. Returns how many changed."""
+    with transaction.atomic():
+        changed = Notification.objects.filter(user=user, is_read=False).update(is_read=True)
+        NotificationCounter.objects.filter(user=user).update(unread=0)
+    return changed
+
+
+def unread_counts(user_ids):
+    """``{user_id: unread}`` from the counters (users without one have none)."""
+    return dict(NotificationCounter.objects.filter(user_id__in=user_ids).values_list('user_id', 'unread'))
+
+
+def unread_count(user):
+    return unread_counts([user.pk]).get(user.pk, 0)
+
+
+def reconcile():
+    """
+    Rebuild counters that disagree with the Notification table (rows deleted
+    with their order, admin edits, a crash between statements...). Returns
+    the number of counters fixed.
+    """
+    actual = dict(
+        Notification.objects.filter(is_read=False).values('user_id')
+        .annotate(n=Count('id')).values_list('user_id', 'n')
+    )
+    stored = dict(NotificationCounter.objects.values_list('user_id', 'unread'))
+    wrong = {
+        user_id: actual.get(user_id, 0)
+        for user_id in actual.keys() | stored.keys()
+        if actual.get(user_id, 0) != stored.get(user_id, 0)
+    }
+    if wrong:
+        # Upsert the correct values; a concurrent bump in between is picked up next run
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id, unread=n) for user_id, n in wrong.items()],
+            update_conflicts=True, unique_fields=['user'], update_fields=['unread'],
+        )
+        logger.info("Reconciled %d notification counter(s)", len(wrong))
+    return len(wrong)
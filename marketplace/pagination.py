@@ -0,0 +1,254 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with ``WHERE (key, id) < (last_key, last_id) ORDER BY key, id LIMIT n``
+so the cost of page 100 is the same as page 1, and no ``COUNT(*)`` is ever run.
+Cursors are opaque base64 tokens carrying the last row's key values.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Allowed orderings -> (sort field, tie-breaker). Mirrors ProductViewSet.ordering_fields
+ORDERINGS = {
+    '-created_at': ('-created_at', '-id'),
+    'created_at': ('created_at', 'id'),
+    '-price': ('-price', '-id'),
+    'price': ('price', 'id'),
+    # Relevance order from marketplace.search (0 = best match)
+    'search_rank': ('search_rank', 'id'),
+}
+DEFAULT_ORDERING = '-created_at'
+
+# Type of each key column a cursor may carry
+KEY_TYPES = {'created_at': datetime, 'price': Decimal, 'search_rank': int, 'id': int}
+MAX_INT = 2 ** 63 - 1  # BIGINT
+
+CATALOG_PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'dec': str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'dec' in value:
+            return Decimal(value['dec'])
+    return value
+
+
+def encode_cursor(ordering, key, reverse=False):
+    payload = {'o': ordering, 'k': [_encode_value(v) for v in key], 'r': reverse}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _valid_key_value(field, value):
+    expected = KEY_TYPES[_field_name(field)]
+    if type(value) is not expected:  # bool is an int, but not a key value
+        return False
+    if expected is int:
+        return -MAX_INT <= value <= MAX_INT
+    if expected is Decimal:
+        return value.is_finite()
+    return True
+
+
+def decode_cursor(token):
+    """``(ordering, key, reverse)`` of a cursor token. Raises InvalidCursor if it wasn't made by encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, dict) or not isinstance(payload.get('k'), list):
+            raise InvalidCursor(token)
+        ordering, key, reverse = payload.get('o'), [_decode_value(v) for v in payload['k']], payload.get('r', False)
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        # ArithmeticError: decimal.InvalidOperation from a bad {'dec': ...}
+        raise InvalidCursor(token)
+    if (ordering not in ORDERINGS or not isinstance(reverse, bool) or len(key) != 2
+            or not all(_valid_key_value(field, value) for field, value in zip(ORDERINGS[ordering], key))):
+        raise InvalidCursor(token)
+    return ordering, key, reverse
+
+
+def _field_name(field):
+    return field.lstrip('-')
+
+
+def _after(fields, key, reverse):
+    """Q object selecting rows strictly after ``key`` in the ``fields`` order."""
+    (first, tie), (first_value, tie_value) = fields, key
+    first_desc = first.startswith('-') != reverse
+    tie_desc = tie.startswith('-') != reverse
+    first_lookup = f"{_field_name(first)}__{'lt' if first_desc else 'gt'}"
+    tie_lookup = f"{_field_name(tie)}__{'lt' if tie_desc else 'gt'}"
+    return Q(**{first_lookup: first_value}) | Q(**{_field_name(first): first_value, tie_lookup: tie_value})
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    ordering: str
+    next_cursor: str = None
+    previous_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def resolve_ordering(requested, default=DEFAULT_ORDERING):
+    return requested if requested in ORDERINGS else default
+
+
+def keyset_page(queryset, ordering=DEFAULT_ORDERING, cursor=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    Return one ``KeysetPage`` of ``queryset``.
+
+    ``cursor`` is a token from a previous page's ``next_cursor``/``previous_cursor``.
+    Raises ``InvalidCursor`` for tampered tokens or a cursor from another ordering.
+    """
+    reverse = False
+    if cursor:
+        cursor_ordering, key, reverse = decode_cursor(cursor)
+        if cursor_ordering != ordering:
+            raise InvalidCursor(cursor)
+    fields = ORDERINGS[ordering]
+    order_by = [_flip(f) for f in fields] if reverse else list(fields)
+
+    qs = queryset.order_by(*order_by)
+    if cursor:
+        qs = qs.filter(_after(fields, key, reverse))
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    def key_of(obj):
+        # Model instances, or dicts from a .values() queryset
+        if isinstance(obj, dict):
+            return [obj[_field_name(f)] for f in fields]
+        return [getattr(obj, _field_name(f)) for f in fields]
+
+    page = KeysetPage(items=rows, ordering=ordering)
+    if not rows:
+        return page
+    # Walking forwards, the extra row means there is a next page and having a
+    # cursor means there is a previous one. Walking backwards it is mirrored.
+    more_after = (has_more and not reverse) or reverse
+    more_before = (has_more and reverse) or (bool(cursor) and not reverse)
+    if more_after:
+        page.next_cursor = encode_cursor(ordering, key_of(rows[-1]))
+    if more_before:
+        page.previous_cursor = encode_cursor(ordering, key_of(rows[0]), reverse=True)
+    return page
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination over ``ORDERINGS``. Honours ``?ordering=`` (as used by
+    OrderingFilter) and falls back to relevance when ``?search=`` is given.
+    """
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    default_ordering = DEFAULT_ORDERING
+
+    def get_ordering(self, request, view):
+        requested = request.query_params.get('ordering')
+        allowed = set(getattr(view, 'ordering_fields', None) or [])
+        if requested and requested.lstrip('-') in allowed:
+            return resolve_ordering(requested, self.default_ordering)
+        if request.query_params.get('search', '').strip():
+            return 'search_rank'
+        return self.default_ordering
+
+    def get_key_fields(self, request, view):
+        """Columns the cursors are built from, for views paginating ``.values()`` rows."""
+        return [_field_name(f) for f in ORDERINGS[self.get_ordering(request, view)]]
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_ordering(request, view)
+        try:
+            self.page = keyset_page(
+                queryset, ordering,
+                cursor=request.query_params.get(self.cursor_query_param),
+                page_size=self.get_page_size(request),
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.items
+
+    def _link(self, token):
+        if token is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def page_url(request, token):
+    """Current URL with ``cursor`` swapped for ``token`` (None when there is no page)."""
+    if token is None:
+        return None
+    url = remove_query_param(request.get_full_path(), 'partial')
+    return replace_query_param(url, 'cursor', token)
@@ -0,0 +1,147 @@
+"""
+Stock reservations.
+
+Putting something in the cart holds those units on the product for
+``CART_HOLD_MINUTES``. Holds are counted in ``Product.reserved_quantity``, so the
+stock other buyers can take is ``quantity - reserved_quantity``. Every change
+to ``reserved_quantity`` is a single conditional UPDATE, so two buyers racing
+for the last units can never both win.
+
+Expired holds are handed back by ``release_expired`` (run from Celery beat,
+see ``marketplace.tasks``). A cart line whose hold has lapsed is still
+checked out if the stock is there.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import CartItem, Product
+
+HOLD_MINUTES = getattr(settings, 'CART_HOLD_MINUTES', 15)
+SWEEP_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        self.product = product
+        self.available = available
+        super().__init__(f'Stock insufficient. Only {available} {product.unit} available.')
+
+
+def hold_expiry(now=None):
+    return (now or timezone.now()) + timedelta(minutes=HOLD_MINUTES)
+
+
+def held_quantity(item):
+    """Units this cart line currently counts in ``reserved_quantity``."""
+    return item.quantity if item.reserved_until is not None else 0
+
+
+def _adjust_reserved(product_id, delta):
+    """Change ``reserved_quantity`` by ``delta``; growing only succeeds if the stock is free."""
+    qs = Product.objects.filter(pk=product_id)
+    if delta > 0:
+        return qs.filter(available=True, quantity__gte=F('reserved_quantity') + delta).update(
+            reserved_quantity=F('reserved_quantity') + delta,
+        )
+    if delta < 0:
+        return qs.update(reserved_quantity=Greatest(F('reserved_quantity') + delta, Value(0)))
+    return 1
+
+
+def hold(buyer, product, quantity, add=False):
+    """
+    Put ``quantity`` units of ``product`` in ``buyer``'s cart (on top of what
+    is there when ``add`` is True) and hold them. Returns the CartItem.
+
+    Raises ``InsufficientStock`` if the units are not free.
+    """
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update().filter(buyer=buyer, product=product).first()
+        held = held_quantity(item) if item else 0
+        target = quantity + (item.quantity if item and add else 0)
+
+        if not _adjust_reserved(product.pk, target - held):
+            product = Product.objects.get(pk=product.pk)
+            raise InsufficientStock(product, product.available_quantity + held)
+
+        if item is None:
+            item = CartItem(buyer=buyer, product=product)
+        item.quantity = target
+        item.reserved_until = hold_expiry()
+        item.save()
+    return item
+
+
+def release(item):
+    """Remove a cart line and hand its held units back."""
+    with transaction.atomic():
+        item = CartItem.objects.select_for_update().filter(pk=item.pk).first()
+        if item is None:
+            return
+        _adjust_reserved(item.product_id, -held_quantity(item))
+        item.delete()
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Hand back every hold that expired before ``now``. Cart lines stay in the
+    cart, just unheld. Returns the number of lines released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                CartItem.objects.select_for_update()
+                .filter(reserved_until__lt=now)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return released
+            per_product = (
+                CartItem.objects.filter(id__in=ids)
+                .values('product_id').annotate(units=Sum('quantity'))
+            )
+            totals = {row['product_id']: row['units'] for row in per_product}
+            CartItem.objects.filter(id__in=ids).update(reserved_until=None)
+            Product.objects.filter(pk__in=totals).update(
+                reserved_quantity=Greatest(
+                    Case(
+                        *[When(pk=pk, then=F('reserved_quantity') - units) for pk, units in totals.items()],
+                        default=F('reserved_quantity'),
+                        output_field=PositiveIntegerField(),
+                    ),
+                    Value(0),
+                ),
+            )
+            released += len(ids)
+
+
+def consume(lines):
+    """
+    Turn cart holds into sold stock for ``[(cart_item, product), ...]``.
+
+    Must run inside the checkout transaction with the products locked. One
+    UPDATE covers every line, and its WHERE clause re-checks the stock, so a
+    short row count means someone else got there first.
+    Returns True if every line was applied.
+    """
+    guard = Q(pk__in=[])
+    quantity_cases, reserved_cases = [], []
+    for item, product in lines:
+        held = held_quantity(item)
+        guard |= Q(pk=product.pk, quantity__gte=F('reserved_quantity') - held + item.quantity)
+        quantity_cases.append(When(pk=product.pk, then=F('quantity') - item.quantity))
+        reserved_cases.append(When(pk=product.pk, then=Greatest(F('reserved_quantity') - held, Value(0))))
+
+    updated = Product.objects.filter(guard).update(
+        quantity=Case(*quantity_cases, default=F('quantity'), output_field=PositiveIntegerField()),
+        reserved_quantity=Case(*reserved_cases, default=F('reserved_quantity'), output_field=PositiveIntegerField()),
+        last_updated=timezone.now(),
+    )
+    return updated == len(lines)
@@ -0,0 +1,310 @@
+"""
+Full-text product search.
+
+Products are indexed into a side table that lives next to ``marketplace_product``:
+
+* SQLite  -> an FTS5 virtual table (porter stemmer, bm25 ranking)
+* Postgres -> a tsvector column with a GIN index (ts_rank_cd ranking)
+
+Anything else falls back to the old ``icontains`` scan so the site keeps working.
+Both the HTML catalog and the DRF viewset go through ``search_products``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Product
+
+FTS_TABLE = 'marketplace_product_fts'
+PG_TABLE = 'marketplace_product_search'
+
+# Upper bound on ranked ids pulled from the index for a single query. Matches
+# past it are still returned, after the ranked ones, in id order.
+SEARCH_RESULT_LIMIT = 500
+
+# Column weights for FTS5 bm25(): name, description, category, location, sw_terms
+FTS_WEIGHTS = (10.0, 2.0, 4.0, 4.0, 6.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Kiswahili noun-class prefixes (singular/plural pairs like kiazi/viazi, mhindi/mahindi)
+SW_PREFIXES = ('wa', 'vi', 'ki', 'mi', 'ma', 'ji', 'u', 'm')
+# Verb extensions + final vowel (e.g. kulima, limwa, limisha -> lim)
+SW_SUFFIXES = ('ishwa', 'eshwa', 'ishia', 'eshea', 'isha', 'esha', 'iwa', 'ewa',
+               'ika', 'eka', 'ana', 'wa', 'a', 'i', 'e')
+SW_MIN_STEM = 3
+
+
+def tokenize(text):
+    return [t.lower() for t in TOKEN_RE.findall(text or '')]
+
+
+def swahili_stem(word):
+    """
+    Light Kiswahili stemmer: drops one noun-class prefix and one verbal
+    suffix, as long as at least SW_MIN_STEM letters remain.
+    """
+    word = word.lower()
+    if word.startswith('ku') and len(word) - 2 >= SW_MIN_STEM + 1:
+        # Infinitive marker: kulima -> lima
+        word = word[2:]
+    for prefix in SW_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= SW_MIN_STEM:
+            word = word[len(prefix):]
+            break
+    for suffix in SW_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= SW_MIN_STEM:
+            word = word[:-len(suffix)]
+            break
+    return word
+
+
+def build_document(product):
+    """Return the text columns indexed for a product."""
+    category = product.get_category_display() if hasattr(product, 'get_category_display') else product.category
+    text = ' '.join([product.name or '', product.description or '', category or '', product.location or ''])
+    sw_terms = ' '.join(sorted({swahili_stem(t) for t in tokenize(text)}))
+    return {
+        'name': product.name or '',
+        'description': product.description or '',
+        'category': f"{product.category} {category}",
+        'location': product.location or '',
+        'sw_terms': sw_terms,
+    }
+
+
+class FallbackBackend:
+    """No index available: plain ``icontains`` scan, newest first."""
+    vendor = None
+    table = None
+    _table_exists = False
+
+    def available(self):
+        # Only a positive answer is remembered: the table appears once migrated
+        if self.table is None or self._table_exists:
+            return True
+        self._table_exists = self.table in connection.introspection.table_names()
+        return self._table_exists
+
+    def index(self, cursor, product):
+        pass
+
+    def remove(self, cursor, product_id):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def condition(self, query):
+        condition = Q()
+        for token in tokenize(query):
+            condition &= (
+                Q(name__icontains=token) | Q(description__icontains=token) |
+                Q(category__icontains=token) | Q(location__icontains=token)
+            )
+        return condition
+
+    def matching(self, query, queryset):
+        """Narrow ``queryset`` to every product matching ``query``, unranked."""
+        return queryset.filter(self.condition(query))
+
+    def ranked_ids(self, query, limit):
+        qs = Product.objects.filter(self.condition(query)).order_by('-created_at')
+        return list(qs.values_list('id', flat=True)[:limit])
+
+
+class SQLiteFTSBackend(FallbackBackend):
+    vendor = 'sqlite'
+    table = FTS_TABLE
+
+    def index(self, cursor, product):
+        doc = build_document(product)
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, category, location, sw_terms) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [product.pk, doc['name'], doc['description'], doc['category'], doc['location'], doc['sw_terms']],
+        )
+
+    def remove(self, cursor, product_id):
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def match_expression(self, tokens):
+        # Every token must match, either as an English (porter) term in the
+        # text columns or as a Kiswahili stem. The last token is a prefix so
+        # partial words typed into the search box still hit.
+        clauses = []
+        for i, token in enumerate(tokens):
+            star = '*' if i == len(tokens) - 1 else ''
+            clauses.append(
+                f'({{name description category location}} : "{token}"{star} '
+                f'OR sw_terms : "{swahili_stem(token)}"{star})'
+            )
+        return ' AND '.join(clauses)
+
+    def matching(self, query, queryset):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [self.match_expression(tokens)],
+        ))
+
+    def ranked_ids(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC LIMIT %s",
+                [self.match_expression(tokens), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend(FallbackBackend):
+    vendor = 'postgresql'
+    table = PG_TABLE
+
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector('english', %s), 'A') || "
+        "setweight(to_tsvector('english', %s), 'C') || "
+        "setweight(to_tsvector('english', %s || ' ' || %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'B')"
+    )
+
+    def index(self, cursor, product):
+        doc = build_document(product)
+        cursor.execute(
+            f"INSERT INTO {PG_TABLE} (product_id, document) VALUES (%s, {self.DOCUMENT_SQL}) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            [product.pk, doc['name'], doc['description'], doc['category'], doc['location'], doc['sw_terms']],
+        )
+
+    def remove(self, cursor, product_id):
+        cursor.execute(f"DELETE FROM {PG_TABLE} WHERE product_id = %s", [product_id])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {PG_TABLE}")
+
+    def tsquery(self, tokens):
+        parts, params = [], []
+        for token in tokens:
+            parts.append("(to_tsquery('english', %s) || to_tsquery('simple', %s))")
+            params.extend([f"{token}:*", f"{swahili_stem(token)}:*"])
+        return ' && '.join(parts), params
+
+    def matching(self, query, queryset):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        tsquery, params = self.tsquery(tokens)
+        return queryset.filter(pk__in=RawSQL(
+            f"SELECT product_id FROM {PG_TABLE} WHERE document @@ ({tsquery})", params,
+        ))
+
+    def ranked_ids(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        tsquery, params = self.tsquery(tokens)
+        with connection.cursor() as cursor:
+            # ts_rank_cd normalisation 1 divides by 1 + log(length), which gives
+            # the same long-document damping bm25 applies.
+            cursor.execute(
+                f"SELECT product_id FROM {PG_TABLE}, ({'SELECT ' + tsquery}) AS q(query) "
+                "WHERE document @@ q.query "
+                "ORDER BY ts_rank_cd(document, q.query, 1) DESC, product_id DESC LIMIT %s",
+                params + [limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+
+def get_backend():
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None or not backend.available():
+        return FallbackBackend()
+    return backend
+
+
+def index_product(product):
+    """Add or refresh a single product in the search index."""
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        backend.index(cursor, product)
+
+
+def index_products(products):
+    """index_product for many products, on one cursor."""
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        for product in products:
+            backend.index(cursor, product)
+
+
+def remove_product(product_id):
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        backend.remove(cursor, product_id)
+
+
+def rebuild_index(products=None, chunk_size=1000):
+    """Re-index every product (or the given iterable). Returns the count indexed."""
+    backend = get_backend()
+    if products is None:
+        products = Product.objects.all().iterator(chunk_size=chunk_size)
+    count = 0
+    with connection.cursor() as cursor:
+        backend.clear(cursor)
+        for product in products:
+            backend.index(cursor, product)
+            count += 1
+    return count
+
+
+def search_products(query, queryset=None, limit=SEARCH_RESULT_LIMIT):
+    """
+    Narrow ``queryset`` to products matching ``query``, best match first.
+
+    The result is annotated with ``search_rank`` (0 = best) so callers can
+    keep relevance order or re-sort as they like. Only the best ``limit``
+    matches are ranked; the rest share ``search_rank == limit`` and follow
+    in id order, so a keyset walk still reaches every match.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    backend = get_backend()
+    ids = backend.ranked_ids(query, limit)
+    if not ids:
+        # Still annotated: callers order by search_rank whatever the hits
+        return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+    rank = Case(
+        *[When(pk=pk, then=Value(pos)) for pos, pk in enumerate(ids)],
+        default=Value(limit),
+        output_field=IntegerField(),
+    )
+    return backend.matching(query, queryset).annotate(search_rank=rank).order_by('search_rank', 'id')
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """DRF filter backend that routes ``?search=`` through the product index."""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_products(query, queryset)
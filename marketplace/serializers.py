@@ -1,19 +1,21 @@
 from rest_framework import serializers
+from core.serializers import ImageVariantsField, SparseFieldsMixin
 from .models import Product, Order
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     seller_name = serializers.ReadOnlyField(source='seller.username')
+    image_variants = ImageVariantsField(field='image')
 
     class Meta:
         model = Product
-        fields = ['id', 'seller', 'seller_name', 'name', 'description', 'price', 'category', 'image', 'location', 'available', 'created_at']
+        fields = ['id', 'seller', 'seller_name', 'name', 'description', 'price', 'category', 'image', 'image_variants', 'location', 'available', 'created_at']
         read_only_fields = ['seller']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source='product.name')
     buyer_name = serializers.ReadOnlyField(source='buyer.username')
 
     class Meta:
         model = Order
-        fields = ['id', 'buyer', 'buyer_name', 'product', 'product_name', 'quantity', 'total_price', 'status', 'created_at']
-        read_only_fields = ['buyer', 'total_price']
+        fields = ['id', 'buyer', 'buyer_name', 'seller', 'product', 'product_name', 'quantity', 'unit_price', 'total_price', 'status', 'created_at']
+        read_only_fields = ['buyer', 'seller', 'unit_price', 'total_price']
@@ -0,0 +1,201 @@
+"""
+Checkout pipeline.
+
+``checkout_cart`` turns a buyer's cart into orders inside one transaction with
+a fixed number of queries, however many items are in the cart:
+
+    lock cart + products -> one conditional UPDATE consuming the cart holds
+    (see marketplace.reservations) -> bulk_create orders, stock history and
+    notifications -> delete the ordered cart rows
+"""
+from dataclasses import dataclass, field
+
+from django.db import transaction
+
+from users.models import DeliveryAddress
+from .models import CartItem, Notification, Order, Product, StockHistory
+from . import cache as catalog_cache
+from . import reservations, signals, stats
+from .notifications import notify_many
+
+
+class CheckoutError(Exception):
+    """Raised when the checkout request itself is invalid (nothing is ordered)."""
+
+
+ORDERED = 'ORDERED'
+INSUFFICIENT_STOCK = 'INSUFFICIENT_STOCK'
+UNAVAILABLE = 'UNAVAILABLE'
+
+
+@dataclass
+class CheckoutLine:
+    product_id: int
+    product_name: str
+    quantity: int
+    status: str
+    order: Order = None
+    message: str = ''
+
+    @property
+    def ok(self):
+        return self.status == ORDERED
+
+
+@dataclass
+class CheckoutReport:
+    lines: list = field(default_factory=list)
+
+    @property
+    def orders(self):
+        return [line.order for line in self.lines if line.ok]
+
+    @property
+    def failed(self):
+        return [line for line in self.lines if not line.ok]
+
+
+@dataclass
+class DeliveryChoice:
+    method: str = 'PICKUP'
+    address_id: int = None
+
+
+def delivery_choices_from_post(data):
+    """
+    Read ``delivery_method_<farmer_id>`` / ``address_<farmer_id>`` form fields
+    into ``{farmer_id: DeliveryChoice}``.
+    """
+    choices = {}
+    for key, value in data.items():
+        if key.startswith('delivery_method_'):
+            farmer_id = key[len('delivery_method_'):]
+            if farmer_id.isdigit():
+                choice = choices.setdefault(int(farmer_id), DeliveryChoice())
+                choice.method = value
+        elif key.startswith('address_'):
+            farmer_id = key[len('address_'):]
+            if farmer_id.isdigit() and value:
+                choice = choices.setdefault(int(farmer_id), DeliveryChoice())
+                choice.address_id = value
+    return choices
+
+
+def _resolve_addresses(buyer, items, choices):
+    """Validate delivery choices for every farmer in the cart (one query)."""
+    needed = {}
+    for item in items:
+        choice = choices.get(item.product.seller_id, DeliveryChoice())
+        if choice.method == 'DELIVERY':
+            if not choice.address_id:
+                raise CheckoutError("Please select a delivery address for every farmer offering delivery.")
+            needed[item.product.seller_id] = choice.address_id
+
+    addresses = DeliveryAddress.objects.filter(user=buyer, id__in=set(needed.values())).in_bulk() if needed else {}
+    resolved = {}
+    for farmer_id, address_id in needed.items():
+        try:
+            resolved[farmer_id] = addresses[int(address_id)]
+        except (KeyError, ValueError):
+            raise CheckoutError("Invalid delivery address selected.")
+    return resolved
+
+
+def checkout_cart(buyer, choices=None):
+    """
+    Place one order per cart item and return a ``CheckoutReport``.
+
+    Items that cannot be fulfilled (out of stock / unlisted) are reported and
+    left in the cart; the rest are ordered atomically.
+    """
+    choices = choices or {}
+    report = CheckoutReport()
+
+    with transaction.atomic():
+        items = list(CartItem.objects.select_for_update().filter(buyer=buyer).select_related('product'))
+        if not items:
+            return report
+        addresses = _resolve_addresses(buyer, items, choices)
+
+        # Lock the rows we are about to decrement so concurrent checkouts queue up
+        products = Product.objects.select_for_update().in_bulk([item.product_id for item in items])
+
+        accepted = []
+        for item in items:
+            product = products.get(item.product_id)
+            # Free stock plus whatever this line already holds; the same sum
+            # reservations.consume guards on, unclamped
+            available = product.quantity - product.reserved_quantity + reservations.held_quantity(item) if product else 0
+            if product is None or not product.available:
+                report.lines.append(CheckoutLine(
+                    item.product_id, item.product.name, item.quantity, UNAVAILABLE,
+                    message=f"{item.product.name} is no longer available.",
+                ))
+            elif available < item.quantity:
+                report.lines.append(CheckoutLine(
+                    product.id, product.name, item.quantity, INSUFFICIENT_STOCK,
+                    message=f"Stock insufficient for {product.name}. Only {max(available, 0)} {product.unit} available.",
+                ))
+            else:
+                accepted.append((item, product))
+
+        if not accepted:
+            return report
+
+        # One guarded UPDATE for every product. The row locks above make a
+        # mismatch impossible in practice; if it happens, undo everything.
+        if not reservations.consume(accepted):
+            raise CheckoutError("Stock changed while you were checking out. Please try again.")
+
+        orders = Order.objects.bulk_create([
+            Order(
+                buyer=buyer,
+                product=product,
+                seller_id=product.seller_id,
+                quantity=item.quantity,
+                unit_price=product.price,
+                total_price=product.price * item.quantity,
+                status='PENDING',
+                delivery_method=choices.get(product.seller_id, DeliveryChoice()).method,
+                delivery_address=addresses.get(product.seller_id),
+            )
+            for item, product in accepted
+        ])
+
+        history, notifications = [], []
+        for order, (item, product) in zip(orders, accepted):
+            old_quantity = product.quantity
+            product.quantity -= item.quantity
+            history.append(StockHistory(
+                product=product, old_quantity=old_quantity,
+                new_quantity=product.quantity, reason=f"Order #{order.id}",
+            ))
+            notifications.append(Notification(
+                user=buyer, notification_type='ORDER_PLACED', order=order,
+                message=f'Your order for {product.name} (x{item.quantity}) has been placed successfully!',
+            ))
+            notifications.append(Notification(
+                user_id=product.seller_id, notification_type='ORDER_PLACED', order=order,
+                message=f'New order received: {product.name} (x{item.quantity}) from {buyer.username}',
+            ))
+            if product.quantity == 0:
+                notifications.append(Notification(
+                    user_id=product.seller_id, notification_type='ORDER_PLACED',
+                    message=f"Your product '{product.name}' is now OUT OF STOCK. Update quantity when available.",
+                ))
+            report.lines.append(CheckoutLine(product.id, product.name, item.quantity, ORDERED, order=order))
+
+        StockHistory.objects.bulk_create(history)
+        # bulk_create skips post_save, so count the orders for the dashboards here
+        stats.orders_placed([(order, product.seller_id) for order, (_, product) in zip(orders, accepted)])
+        signals.orders_placed.send(sender=Order, orders=orders)
+        notify_many(notifications)
+        CartItem.objects.filter(pk__in=[item.pk for item, _ in accepted]).delete()
+
+        # update() skips post_save, so drop cached catalog pages ourselves
+        scopes = []
+        for _, product in accepted:
+            scopes.extend(catalog_cache.product_scopes(product))
+        transaction.on_commit(lambda: catalog_cache.bump_version(*scopes))
+
+    return report
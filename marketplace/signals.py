@@ -0,0 +1,65 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+from .models import Order, Product
+from . import search
+from . import stats
+from . import cache as catalog_cache
+
+# Sent by checkout for the orders it bulk-creates (bulk_create sends no
+# post_save), with ``orders``: the saved Order instances
+orders_placed = Signal()
+# Sent by the bulk import (marketplace.bulk) for the products it creates, with ``products``
+products_added = Signal()
+
+# Fields that feed the search document; saves touching none of them skip re-indexing
+SEARCH_FIELDS = {'name', 'description', 'category', 'location'}
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, update_fields=None, **kwargs):
+    """Keep the search index in step with product edits"""
+    if update_fields and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_product(instance)
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, instance, **kwargs):
+    """Bump catalog versions so cached pages showing this product are dropped"""
+    loaded = getattr(instance, '_loaded_values', None)
+    old_category = loaded.get('category') if loaded else None
+    catalog_cache.bump_version(*catalog_cache.product_scopes(instance, old_category))
+
+
+@receiver(post_save, sender=Product)
+def count_listing_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Active listings on the farmer dashboard"""
+    if update_fields and 'available' not in update_fields:
+        return
+    known, was_available = instance.previous_value('available', created)
+    if not known:
+        stats.rebuild([instance.seller_id])
+        return
+    stats.product_changed(instance.seller_id, int(bool(instance.available)) - int(bool(was_available)))
+
+@receiver(post_delete, sender=Product)
+def count_listing_on_delete(sender, instance, **kwargs):
+    if instance.available:
+        stats.product_changed(instance.seller_id, -1)
+
+@receiver(post_save, sender=Order)
+def count_order_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """Order counts and revenue on the farmer dashboard"""
+    if update_fields and not {'status', 'total_price'}.intersection(update_fields):
+        return
+    seller_id = stats.seller_id_of(instance)
+    if not stats.order_changed(instance, seller_id, created=created):
+        # Built by hand, so what changed is unknown: recount this seller
+        stats.rebuild([seller_id])
+
+@receiver(post_delete, sender=Order)
+def count_order_on_delete(sender, instance, **kwargs):
+    stats.order_changed(instance, stats.seller_id_of(instance), deleted=True)
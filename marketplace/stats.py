@@ -0,0 +1,247 @@
+"""
+Farmer dashboard rollups.
+
+``FarmerStats`` holds one row per seller: order counts by status, active
+listings, gross revenue (orders accepted or later) and paid-out revenue.
+``FarmerDailyStats`` splits orders by the day they were placed. Both are
+moved by deltas: the signal handlers in marketplace.signals call
+``order_changed`` / ``product_changed``, and checkout calls ``orders_placed``
+for the orders it bulk-creates, so a status change costs a couple of small
+UPDATEs and the dashboard reads a single row.
+
+``rebuild`` recounts from the orders table (``manage.py rebuild_farmer_stats``)
+and ``check`` reports rows that disagree with it (``manage.py
+check_farmer_stats``).
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import FarmerDailyStats, FarmerStats, Order, Product
+
+# Accepted or later: counted in gross revenue and the dashboard's active list
+GROSS_STATUSES = ('ACCEPTED', 'ESCROW', 'IN_DELIVERY', 'DELIVERED', 'PAID_OUT', 'COMPLETED')
+PAID_OUT_STATUSES = ('PAID_OUT',)
+
+STATS_FIELDS = [f'{status.lower()}_count' for status, _ in Order.STATUS_CHOICES] + [
+    'active_products', 'gross_revenue', 'paid_out_revenue',
+]
+DAILY_FIELDS = ['orders', 'gross_revenue', 'paid_out_revenue']
+
+ZERO = Decimal('0.00')
+
+
+def status_field(status):
+    return f'{status.lower()}_count'
+
+
+def contribution(status, total_price):
+    """What one order in ``status`` adds to its seller's FarmerStats."""
+    if status is None:
+        return {}
+    price = Decimal(total_price or 0)
+    values = {status_field(status): 1}
+    if status in GROSS_STATUSES:
+        values['gross_revenue'] = price
+    if status in PAID_OUT_STATUSES:
+        values['paid_out_revenue'] = price
+    return values
+
+
+def difference(new, old):
+    keys = new.keys() | old.keys()
+    return {key: new.get(key, 0) - old.get(key, 0) for key in keys if new.get(key, 0) != old.get(key, 0)}
+
+
+def seller_id_of(order):
+    if order.seller_id is None:
+        # Not saved through Order.save() yet
+        return Product.objects.filter(pk=order.product_id).values_list('seller_id', flat=True).first()
+    return order.seller_id
+
+
+def order_day(order):
+    return timezone.localdate(order.created_at) if order.created_at else timezone.localdate()
+
+
+def stats_for(farmer):
+    """``farmer``'s stats row, built on first use."""
+    row = FarmerStats.objects.filter(farmer=farmer).first()
+    if row is None:
+        rebuild([farmer.pk])
+        row = FarmerStats.objects.get(farmer=farmer)
+    return row
+
+
+def apply(farmer_id, deltas, day=None, orders=0):
+    """
+    Add ``deltas`` to ``farmer_id``'s stats and, with ``day``, to that day's
+    bucket (plus ``orders`` placed). A seller without stats yet is counted
+    from scratch instead.
+    """
+    if not farmer_id or not (deltas or orders):
+        return
+    with transaction.atomic():
+        if deltas:
+            updated = FarmerStats.objects.filter(farmer_id=farmer_id).update(
+                **{field: F(field) + delta for field, delta in deltas.items()}
+            )
+            if not updated:
+                rebuild([farmer_id])
+                return
+        if day is None:
+            return
+        daily = {field: delta for field, delta in deltas.items() if field in DAILY_FIELDS}
+        if orders:
+            daily['orders'] = orders
+        if not daily:
+            return
+        bucket = FarmerDailyStats.objects.filter(farmer_id=farmer_id, day=day)
+        changes = {field: F(field) + delta for field, delta in daily.items()}
+        if not bucket.update(**changes):
+            FarmerDailyStats.objects.bulk_create([FarmerDailyStats(farmer_id=farmer_id, day=day)],
+                                                 ignore_conflicts=True)
+            bucket.update(**changes)
+
+
+def order_changed(order, seller_id, created=False, deleted=False):
+    """
+    Move the counters for a saved or deleted order. Returns False if the
+    order's previous state isn't known (the caller should recount).
+    """
+    new = {} if deleted else contribution(order.status, order.total_price)
+    if created:
+        old = {}
+    elif deleted:
+        old = contribution(order.status, order.total_price)
+    else:
+        known_status, old_status = order.previous_value('status')
+        known_price, old_price = order.previous_value('total_price')
+        if not (known_status and known_price):
+            return False
+        old = contribution(old_status, old_price)
+    apply(seller_id, difference(new, old), day=order_day(order), orders=int(created) - int(deleted))
+    return True
+
+
+def orders_placed(placed):
+    """Count freshly bulk-created orders, given as ``[(order, seller_id), ...]``."""
+    buckets = defaultdict(Counter)
+    counts = Counter()
+    for order, seller_id in placed:
+        key = (seller_id, order_day(order))
+        buckets[key].update(contribution(order.status, order.total_price))
+        counts[key] += 1
+    for (seller_id, day), deltas in buckets.items():
+        apply(seller_id, dict(deltas), day=day, orders=counts[(seller_id, day)])
+
+
+def product_changed(seller_id, delta):
+    if delta:
+        apply(seller_id, {'active_products': delta})
+
+
+def _expected(farmer_ids):
+    """What the rollups of ``farmer_ids`` should hold: ({id: {field: value}}, {(id, day): {field: value}})."""
+    stats = {farmer_id: dict.fromkeys(STATS_FIELDS, 0) for farmer_id in farmer_ids}
+    for farmer_id in farmer_ids:
+        stats[farmer_id].update(gross_revenue=ZERO, paid_out_revenue=ZERO)
+    money = DecimalField(max_digits=14, decimal_places=2)
+    total = Coalesce(Sum('total_price'), Value(ZERO), output_field=money)
+
+    orders = Order.objects.filter(seller_id__in=farmer_ids)
+    for farmer_id, status, n, value in (
+        orders.values('seller_id', 'status').annotate(n=Count('id'), value=total)
+        .values_list('seller_id', 'status', 'n', 'value')
+    ):
+        row = stats[farmer_id]
+        row[status_field(status)] = n
+        if status in GROSS_STATUSES:
+            row['gross_revenue'] += value
+        if status in PAID_OUT_STATUSES:
+            row['paid_out_revenue'] += value
+
+    for farmer_id, n in (
+        Product.objects.filter(seller_id__in=farmer_ids, available=True)
+        .values('seller_id').annotate(n=Count('id')).values_list('seller_id', 'n')
+    ):
+        stats[farmer_id]['active_products'] = n
+
+    daily = {}
+    for farmer_id, day, status, n, value in (
+        orders.annotate(day=TruncDate('created_at'))
+        .values('seller_id', 'day', 'status').annotate(n=Count('id'), value=total)
+        .values_list('seller_id', 'day', 'status', 'n', 'value')
+    ):
+        bucket = daily.setdefault((farmer_id, day), {'orders': 0, 'gross_revenue': ZERO, 'paid_out_revenue': ZERO})
+        bucket['orders'] += n
+        if status in GROSS_STATUSES:
+            bucket['gross_revenue'] += value
+        if status in PAID_OUT_STATUSES:
+            bucket['paid_out_revenue'] += value
+    return stats, daily
+
+
+def _farmer_ids(farmer_ids):
+    if farmer_ids is not None:
+        return list(farmer_ids)
+    return list(Product.objects.order_by().values_list('seller_id', flat=True).distinct())
+
+
+def rebuild(farmer_ids=None):
+    """
+    Recount the rollups of ``farmer_ids`` (every seller by default) from
+    scratch. Returns the number of FarmerStats rows written.
+    """
+    farmer_ids = _farmer_ids(farmer_ids)
+    if not farmer_ids:
+        return 0
+    stats, daily = _expected(farmer_ids)
+    with transaction.atomic():
+        FarmerStats.objects.bulk_create(
+            [FarmerStats(farmer_id=farmer_id, **values) for farmer_id, values in stats.items()],
+            batch_size=500, update_conflicts=True, unique_fields=['farmer'], update_fields=STATS_FIELDS,
+        )
+        FarmerDailyStats.objects.filter(farmer_id__in=farmer_ids).delete()
+        FarmerDailyStats.objects.bulk_create(
+            [FarmerDailyStats(farmer_id=farmer_id, day=day, **values) for (farmer_id, day), values in daily.items()],
+            batch_size=500,
+        )
+    return len(stats)
+
+
+def check(farmer_ids=None):
+    """
+    Compare stored rollups with a fresh count. Returns ``(farmer_id, day,
+    field, stored, expected)`` for each mismatch; ``day`` is None for the
+    FarmerStats row, and a missing row reads as all zeros.
+    """
+    farmer_ids = _farmer_ids(farmer_ids)
+    if not farmer_ids:
+        return []
+    expected_stats, expected_daily = _expected(farmer_ids)
+    stored_stats = {
+        row['farmer_id']: row
+        for row in FarmerStats.objects.filter(farmer_id__in=farmer_ids).values('farmer_id', *STATS_FIELDS)
+    }
+    stored_daily = {
+        (row['farmer_id'], row['day']): row
+        for row in FarmerDailyStats.objects.filter(farmer_id__in=farmer_ids).values('farmer_id', 'day', *DAILY_FIELDS)
+    }
+
+    problems = []
+    for farmer_id, expected in expected_stats.items():
+        stored = stored_stats.get(farmer_id, {})
+        for field in STATS_FIELDS:
+            if stored.get(field, 0) != expected[field]:
+                problems.append((farmer_id, None, field, stored.get(field, 0), expected[field]))
+    for key in sorted(expected_daily.keys() | stored_daily.keys()):
+        expected, stored = expected_daily.get(key, {}), stored_daily.get(key, {})
+        for field in DAILY_FIELDS:
+            if stored.get(field, 0) != expected.get(field, 0):
+                problems.append((key[0], key[1], field, stored.get(field, 0), expected.get(field, 0)))
+    return problems
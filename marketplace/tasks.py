@@ -0,0 +1,27 @@
+from celery import shared_task
+
+from . import dispatch, notifications, qr, reservations
+
+
+@shared_task
+def release_expired_holds():
+    """Hand expired cart holds back to stock. Scheduled every minute."""
+    return reservations.release_expired()
+
+
+@shared_task
+def propose_dispatch():
+    """Refresh rider proposals for ready orders. Scheduled every two minutes."""
+    return len(dispatch.propose())
+
+
+@shared_task
+def pregenerate_order_qr(order_id):
+    """Encode an accepted order's QR codes ahead of the first view."""
+    return qr.pregenerate(order_id)
+
+
+@shared_task
+def reconcile_notification_counters():
+    """Repair unread counters that drifted from the Notification table. Scheduled hourly."""
+    return notifications.reconcile()
@@ -0,0 +1,1113 @@
+import base64
+import itertools
+import json
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management import call_command
+
+from django.db import connection
+from django.db.models.signals import post_save
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from users import badges
+from .models import Product, Order, CartItem, Notification, StockHistory, DispatchProposal, FarmerStats
+from . import search
+from . import cache as catalog_cache
+from . import services as checkout_service
+from . import bulk, dispatch, qr, reservations, stats, transitions
+from .views import OrderViewSet, ProductViewSet
+from . import notifications as notification_service
+from .notifications import notify, notify_many
+from .tasks import pregenerate_order_qr, propose_dispatch, release_expired_holds
+from .utils import get_nearby_riders
+from .pagination import CATALOG_PAGE_SIZE, ORDERINGS, InvalidCursor, keyset_page
+
+User = get_user_model()
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user(username='farmer', password='password123', role='FARMER')
+        self.tomatoes = Product.objects.create(
+            seller=self.farmer, name='Fresh Tomatoes', description='Ripe red tomatoes from Kirinyaga',
+            price=50, category='VEGETABLES', location='Kirinyaga',
+        )
+        self.potatoes = Product.objects.create(
+            seller=self.farmer, name='Viazi', description='Irish potatoes, fresh tomatoes mention',
+            price=80, category='VEGETABLES', location='Nyandarua',
+        )
+        self.maize = Product.objects.create(
+            seller=self.farmer, name='Mahindi', description='Dry maize grain',
+            price=40, category='GRAINS', location='Trans Nzoia',
+        )
+
+    def test_english_stemming_and_ranking(self):
+        results = list(search.search_products('tomato'))
+        # Name matches outrank description matches
+        self.assertEqual(results, [self.tomatoes, self.potatoes])
+
+    def test_swahili_stemming(self):
+        # kiazi (singular) finds viazi (plural)
+        self.assertEqual(list(search.search_products('kiazi')), [self.potatoes])
+
+    def test_index_follows_save_and_delete(self):
+        self.maize.name = 'Yellow Maize'
+        self.maize.save()
+        self.assertIn(self.maize, search.search_products('yellow'))
+        self.maize.delete()
+        self.assertFalse(search.search_products('yellow').exists())
+
+    def test_matches_past_the_rank_limit_are_still_paged(self):
+        for i in range(5):
+            Product.objects.create(seller=self.farmer, name=f'Tomato crate {i}', price=60, category='VEGETABLES')
+        results = search.search_products('tomato', limit=3)
+        ranked = list(results[:3])
+        self.assertEqual([p.search_rank for p in ranked], [0, 1, 2])
+        self.assertEqual(results.count(), 7)
+
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(results, 'search_rank', cursor=cursor, page_size=2)
+            seen.extend(p.pk for p in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [p.pk for p in results])
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_product_list_and_api_share_search(self):
+        response = self.client.get(reverse('product_list'), {'q': 'maize'})
+        self.assertEqual(list(response.context['products']), [self.maize])
+
+        response = self.client.get('/marketplace/api/products/', {'search': 'maize'})
+        self.assertEqual([p['id'] for p in response.json()['results']], [self.maize.id])
+
+    def test_searches_without_hits(self):
+        for query in ['banana', '!!!']:
+            response = self.client.get(reverse('product_list'), {'q': query})
+            self.assertEqual((response.status_code, list(response.context['products'])), (200, []), query)
+            response = self.client.get('/marketplace/api/products/', {'search': query})
+            self.assertEqual((response.status_code, response.json()['results']), (200, []), query)
+
+    def test_blank_search_lists_everything(self):
+        newest_first = [self.maize.id, self.potatoes.id, self.tomatoes.id]
+        response = self.client.get(reverse('product_list'), {'q': '   '})
+        self.assertEqual([p.id for p in response.context['products']], newest_first)
+        response = self.client.get('/marketplace/api/products/', {'search': '   '})
+        self.assertEqual([p['id'] for p in response.json()['results']], newest_first)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user(username='farmer', password='password123', role='FARMER')
+        # Two products per price so the id tie-breaker is exercised
+        self.products = [
+            Product.objects.create(
+                seller=self.farmer, name=f'Product {i}', description='Produce',
+                price=10 + (i // 2), category='FRUITS', location='Meru',
+            )
+            for i in range(7)
+        ]
+
+    def walk(self, ordering, page_size):
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(Product.objects.all(), ordering, cursor=cursor, page_size=page_size)
+            seen.extend(page.items)
+            if not page.has_next:
+                return seen, page
+            cursor = page.next_cursor
+
+    def test_walks_every_ordering_without_gaps(self):
+        for ordering in ['-created_at', 'created_at', 'price', '-price']:
+            seen, _ = self.walk(ordering, page_size=3)
+            expected = list(Product.objects.order_by(*ORDERINGS[ordering]))
+            self.assertEqual(seen, expected, ordering)
+
+    def test_previous_cursor_returns_to_prior_page(self):
+        first = keyset_page(Product.objects.all(), 'price', page_size=3)
+        second = keyset_page(Product.objects.all(), 'price', cursor=first.next_cursor, page_size=3)
+        back = keyset_page(Product.objects.all(), 'price', cursor=second.previous_cursor, page_size=3)
+        self.assertEqual(back.items, first.items)
+        self.assertFalse(back.has_previous)
+
+    def test_cursor_is_bound_to_its_ordering(self):
+        first = keyset_page(Product.objects.all(), 'price', page_size=3)
+        with self.assertRaises(InvalidCursor):
+            keyset_page(Product.objects.all(), '-created_at', cursor=first.next_cursor)
+
+    def test_tampered_cursors_are_rejected(self):
+        def token(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        cursors = ['not-a-cursor', token([1, 2]), token({'o': 'price', 'k': [{'dec': '10'}]}),
+                   token({'o': 'price', 'k': [{'dec': '10'}, 1, 2]}), token({'o': 'price', 'k': ['10', 1]}),
+                   token({'o': 'price', 'k': [{'dec': 'abc'}, 1]}), token({'o': 'price', 'k': [{'dec': 'NaN'}, 1]}),
+                   token({'o': 'price', 'k': [{'dec': '10'}, True]}), token({'o': 'price', 'k': [{'dec': '10'}, 2 ** 70]}),
+                   token({'o': '-created_at', 'k': [{'dt': 'yesterday'}, 1]}), token({'o': 'name', 'k': ['a', 1]})]
+        for cursor in cursors:
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                keyset_page(Product.objects.all(), 'price', cursor=cursor)
+            response = self.client.get('/marketplace/api/products/', {'ordering': 'price', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_api_pages_without_count(self):
+        url = '/marketplace/api/products/?ordering=price&page_size=3'
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).json()
+            self.assertFalse(any('COUNT(' in q['sql'].upper() for q in ctx.captured_queries))
+            ids.extend(p['id'] for p in data['results'])
+            url = data['next']
+        self.assertEqual(ids, list(Product.objects.order_by('price', 'id').values_list('id', flat=True)))
+
+    def test_product_list_infinite_scroll_fragment(self):
+        Product.objects.bulk_create([
+            Product(seller=self.farmer, name=f'Bulk {i}', description='Produce', price=5,
+                    category='FRUITS', location='Meru')
+            for i in range(CATALOG_PAGE_SIZE)
+        ])
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(len(response.context['products']), CATALOG_PAGE_SIZE)
+        next_url = response.context['next_url']
+        self.assertIsNotNone(next_url)
+        data = self.client.get(next_url + '&partial=1').json()
+        self.assertIn('Product', data['html'])
+
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        caches['local'].clear()
+        self.farmer = User.objects.create_user(username='farmer', password='password123', role='FARMER')
+        self.product = Product.objects.create(
+            seller=self.farmer, name='Avocado', description='Hass avocado',
+            price=20, category='FRUITS', location='Muranga',
+        )
+
+    def test_repeat_anonymous_hits_are_served_from_cache(self):
+        self.client.get(reverse('product_list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('product_list'))
+        self.assertContains(response, 'Avocado')
+        self.assertGreaterEqual(catalog_cache.stats()['hits'], 2)
+
+    def test_product_save_invalidates_list_and_detail(self):
+        self.client.get(reverse('product_list'))
+        self.client.get(reverse('product_detail', args=[self.product.pk]))
+
+        self.product.name = 'Fuerte Avocado'
+        self.product.save()
+
+        self.assertContains(self.client.get(reverse('product_list')), 'Fuerte Avocado')
+        self.assertContains(self.client.get(reverse('product_detail', args=[self.product.pk])), 'Fuerte Avocado')
+
+    def test_category_change_invalidates_old_category(self):
+        fruits_url = reverse('product_list') + '?category=FRUITS'
+        self.assertContains(self.client.get(fruits_url), 'Avocado')
+
+        product = Product.objects.get(pk=self.product.pk)
+        product.category = 'VEGETABLES'
+        product.save()
+
+        self.assertNotContains(self.client.get(fruits_url), 'Avocado')
+
+    def test_versions_outlive_the_default_timeout(self):
+        version = catalog_cache.get_version('all')
+        catalog_cache.bump_version('category:FRUITS')
+        fruits = catalog_cache.get_version('category:FRUITS')
+        caches['local'].clear()
+        later = time.time() + catalog_cache.SHARED_TIMEOUT * 10
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(catalog_cache.get_version('all'), version)
+            self.assertEqual(catalog_cache.get_version('category:FRUITS'), fruits)
+
+
+class CheckoutPipelineTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='password123', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='password123', role='FARMER')
+        self.client.login(username='buyer', password='password123')
+
+    def fill_cart(self, count, quantity=10):
+        products = [
+            Product.objects.create(
+                seller=self.farmer, name=f'Item {i}', description='Produce',
+                price=10, category='FRUITS', location='Meru', quantity=quantity,
+            )
+            for i in range(count)
+        ]
+        for product in products:
+            CartItem.objects.create(buyer=self.buyer, product=product, quantity=2)
+        return products
+
+    def checkout_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            report = checkout_service.checkout_cart(self.buyer)
+        return report, len(ctx.captured_queries)
+
+    def test_query_count_is_constant_in_cart_size(self):
+        # The day's first order also creates the farmer's daily stats bucket
+        self.fill_cart(1)
+        self.checkout_queries()
+        self.fill_cart(1)
+        report_small, small = self.checkout_queries()
+        self.fill_cart(10)
+        report_large, large = self.checkout_queries()
+        self.assertEqual(len(report_small.orders), 1)
+        self.assertEqual(len(report_large.orders), 10)
+        self.assertEqual(small, large)
+
+    def test_checkout_decrements_stock_and_records_history(self):
+        product, = self.fill_cart(1, quantity=2)
+        response = self.client.post(reverse('checkout_cart'))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        order = Order.objects.get(product=product)
+        self.assertEqual(order.total_price, 20)
+        self.assertEqual(StockHistory.objects.get(product=product).reason, f"Order #{order.id}")
+        # Buyer, farmer and the out-of-stock alert
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertFalse(CartItem.objects.filter(buyer=self.buyer).exists())
+
+    def test_insufficient_items_are_reported_and_kept_in_cart(self):
+        enough, short = self.fill_cart(2)
+        Product.objects.filter(pk=short.pk).update(quantity=1)
+
+        report = checkout_service.checkout_cart(self.buyer)
+
+        statuses = {line.product_id: line.status for line in report.lines}
+        self.assertEqual(statuses, {enough.pk: checkout_service.ORDERED,
+                                    short.pk: checkout_service.INSUFFICIENT_STOCK})
+        self.assertEqual(list(CartItem.objects.filter(buyer=self.buyer).values_list('product_id', flat=True)), [short.pk])
+        short.refresh_from_db()
+        self.assertEqual(short.quantity, 1)
+
+    def test_delivery_requires_owned_address(self):
+        self.fill_cart(1)
+        response = self.client.post(reverse('checkout_cart'), {
+            f'delivery_method_{self.farmer.id}': 'DELIVERY',
+            f'address_{self.farmer.id}': '999',
+        })
+        self.assertRedirects(response, reverse('view_cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='password123', role='BUYER')
+        self.other = User.objects.create_user(username='other', password='password123', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='password123', role='FARMER')
+        self.product = Product.objects.create(
+            seller=self.farmer, name='Eggs', description='Tray of eggs',
+            price=400, category='LIVESTOCK', location='Kiambu', quantity=5, unit='tray',
+        )
+        self.client.login(username='buyer', password='password123')
+
+    def test_cart_hold_blocks_other_buyers(self):
+        reservations.hold(self.buyer, self.product, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_quantity, 1)
+        with self.assertRaises(reservations.InsufficientStock):
+            reservations.hold(self.other, self.product, 2)
+
+    def test_cart_views_hold_and_release(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 1})
+        item = CartItem.objects.get(buyer=self.buyer)
+        self.assertEqual(item.quantity, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_quantity, 3)
+
+        response = self.client.post(reverse('update_cart_item', args=[item.pk]), {'quantity': 6},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.client.post(reverse('update_cart_item', args=[item.pk]), {'quantity': 1})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_quantity, 1)
+
+        self.client.post(reverse('remove_from_cart', args=[item.pk]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_quantity, 0)
+
+    def test_sweeper_releases_expired_holds(self):
+        item = reservations.hold(self.buyer, self.product, 5)
+        later = item.reserved_until + timezone.timedelta(seconds=1)
+        self.assertEqual(release_expired_holds.apply(kwargs={}).get(), 0)
+        self.assertEqual(reservations.release_expired(now=later), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_quantity, 0)
+        # The line stays in the cart and can still be bought while stock lasts
+        report = checkout_service.checkout_cart(self.buyer)
+        self.assertEqual(len(report.orders), 1)
+
+    def test_checkout_consumes_hold(self):
+        reservations.hold(self.buyer, self.product, 5)
+        report = checkout_service.checkout_cart(self.buyer)
+        self.assertEqual(len(report.orders), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved_quantity), (0, 0))
+
+    def test_farmer_edit_keeps_reserved_quantity(self):
+        reservations.hold(self.buyer, self.product, 2)
+        self.client.login(username='farmer', password='password123')
+        self.client.post(reverse('edit_product', args=[self.product.pk]), {
+            'name': 'Kienyeji Eggs', 'description': 'Tray of eggs', 'price': 400, 'quantity': 6, 'unit': 'tray',
+            'category': 'LIVESTOCK', 'location': 'Kiambu',
+        })
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.quantity, self.product.reserved_quantity),
+                         ('Kienyeji Eggs', 6, 2))
+
+    def test_stock_cut_below_holds_fails_only_that_line(self):
+        milk = Product.objects.create(seller=self.farmer, name='Milk', description='Fresh', price=60,
+                                      category='LIVESTOCK', location='Kiambu', quantity=10, unit='litre')
+        reservations.hold(self.buyer, self.product, 3)
+        reservations.hold(self.buyer, milk, 2)
+        reservations.hold(self.other, self.product, 2)
+        # The farmer sells some eggs off the platform
+        Product.objects.filter(pk=self.product.pk).update(quantity=2)
+
+        report = checkout_service.checkout_cart(self.buyer)
+        self.assertEqual([order.product_id for order in report.orders], [milk.pk])
+        line, = report.failed
+        self.assertEqual((line.product_id, line.status), (self.product.pk, checkout_service.INSUFFICIENT_STOCK))
+        self.assertIn('Only 0 tray', line.message)
+
+    def test_plain_save_leaves_update_fields_to_receivers(self):
+        seen = []
+        receiver = lambda sender, update_fields=None, **kwargs: seen.append(update_fields)
+        post_save.connect(receiver, sender=Product)
+        try:
+            self.product.save()
+            self.product.save(update_fields=['quantity'])
+        finally:
+            post_save.disconnect(receiver, sender=Product)
+        self.assertEqual(seen, [None, frozenset({'quantity'})])
+
+    def test_save_after_row_deleted_inserts_again(self):
+        pk = self.product.pk
+        Product.objects.filter(pk=pk).delete()
+        self.product.save()
+        self.assertTrue(Product.objects.filter(pk=pk).exists())
+
+
+class HotProductStressTest(TransactionTestCase):
+    """Many buyers racing for one product must never oversell it."""
+    BUYERS = 12
+    STOCK = 5
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        product = Product.objects.create(
+            seller=farmer, name='Hot Mangoes', description='Everyone wants these',
+            price=100, category='FRUITS', location='Makueni', quantity=self.STOCK,
+        )
+        buyers = [User.objects.create_user(username=f'buyer{i}', password='x', role='BUYER')
+                  for i in range(self.BUYERS)]
+        # Half the buyers got their hold in early, the rest race without one
+        for buyer in buyers[:self.STOCK // 2]:
+            reservations.hold(buyer, product, 1)
+        for buyer in buyers[self.STOCK // 2:]:
+            CartItem.objects.create(buyer=buyer, product=product, quantity=1)
+        start = threading.Barrier(self.BUYERS)
+        errors = []
+
+        def shop(buyer):
+            try:
+                start.wait()
+                try:
+                    reservations.hold(buyer, product, 1)
+                except reservations.InsufficientStock:
+                    pass
+                checkout_service.checkout_cart(buyer)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shop, args=(b,)) for b in buyers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        sold = sum(Order.objects.filter(product=product).values_list('quantity', flat=True))
+        # Demand outstrips supply, so every unit goes, exactly once
+        self.assertEqual(sold, self.STOCK)
+        self.assertEqual((product.quantity, product.reserved_quantity), (0, 0))
+
+
+class NearbyRidersTest(TestCase):
+    def make_rider(self, name, lat, lon, **profile):
+        user = User.objects.create_user(username=name, password='x', role='RIDER')
+        rider = user.rider_profile
+        rider.current_latitude, rider.current_longitude = lat, lon
+        rider.is_available = profile.get('is_available', True)
+        rider.verification_status = profile.get('verification_status', 'VERIFIED')
+        rider.save()
+        return rider
+
+    def test_only_riders_in_radius_sorted_by_distance(self):
+        near = self.make_rider('westlands', '-1.2676', '36.8108')     # ~2 km
+        nearer = self.make_rider('cbd', '-1.2841', '36.8233')         # ~0.7 km
+        self.make_rider('thika', '-1.0333', '37.0693')                # ~40 km
+        self.make_rider('offline', '-1.2850', '36.8200', is_available=False)
+        self.make_rider('pending', '-1.2850', '36.8200', verification_status='PENDING')
+        self.make_rider('mombasa', '-4.0435', '39.6682')
+
+        riders = get_nearby_riders('-1.286389', '36.817223', radius_km=10)
+        self.assertEqual([user for user, _ in riders], [nearer.user, near.user])
+        self.assertLess(riders[0][1], 1)
+
+    def test_position_updates_move_rider_between_cells(self):
+        rider = self.make_rider('mover', '-4.0435', '39.6682')
+        self.assertEqual(get_nearby_riders('-1.2864', '36.8172', radius_km=5), [])
+        rider.current_latitude, rider.current_longitude = '-1.2860', '36.8170'
+        rider.save(update_fields=['current_latitude', 'current_longitude'])
+        self.assertEqual([u for u, _ in get_nearby_riders('-1.2864', '36.8172', radius_km=5)], [rider.user])
+
+
+class DispatchTest(TestCase):
+    def brute_force(self, benefit):
+        n, m = benefit.shape
+        best = 0
+        for cols in itertools.permutations(list(range(m)) + [-1] * n, n):
+            used = [c for c in cols if c >= 0]
+            if len(set(used)) == len(used):
+                value = sum(benefit[i, c] for i, c in enumerate(cols) if c >= 0)
+                if np.isfinite(value):
+                    best = max(best, value)
+        return best
+
+    def test_auction_is_near_optimal(self):
+        rng = np.random.default_rng(3)
+        for _ in range(40):
+            n, m = rng.integers(1, 5, size=2)
+            benefit = rng.uniform(0, 50, (n, m))
+            benefit[rng.random((n, m)) < 0.3] = -np.inf
+            picked = dispatch.auction(benefit, epsilon=0.001)
+            used = picked[picked >= 0]
+            self.assertEqual(len(set(used)), len(used))
+            value = sum(benefit[i, c] for i, c in enumerate(picked) if c >= 0)
+            self.assertAlmostEqual(value, self.brute_force(benefit), delta=(n + m) * 0.001 + 1e-9)
+
+    def test_plan_respects_vehicle_and_capacity(self):
+        orders = {
+            'id': np.array([1, 2, 3]),
+            'lat': np.array([-1.28, -1.28, -1.28]), 'lon': np.array([36.82, 36.82, 36.82]),
+            # a cow, and two small loads
+            'min_rank': np.array([dispatch.required_vehicle('LIVESTOCK', 1),
+                                  dispatch.required_vehicle('VEGETABLES', 5),
+                                  dispatch.required_vehicle('VEGETABLES', 5)]),
+        }
+        riders = {
+            'id': np.array([10, 20, 30]),
+            # Bicycle right there, pickup 10 km out, motorbike 40 km out (beyond its range)
+            'lat': np.array([-1.281, -1.19, -0.92]), 'lon': np.array([36.82, 36.82, 36.82]),
+            'rank': np.array([0, 3, 1]),
+            'max_km': np.array([5.0, 80.0, 30.0]),
+            'slots': np.array([1, 1, 2]),
+        }
+        matches = {m.order_id: m.rider_id for m in dispatch.plan(orders, riders)}
+        self.assertEqual(matches[1], 20)
+        self.assertNotIn(30, matches.values())
+        self.assertEqual(sorted(matches.values()), [10, 20])
+
+    def test_propose_stores_proposals_and_accept_closes_them(self):
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        farmer.profile.latitude, farmer.profile.longitude = -1.2864, 36.8172
+        farmer.profile.save()
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        rider = User.objects.create_user(username='rider', password='x', role='RIDER')
+        profile = rider.rider_profile
+        profile.current_latitude, profile.current_longitude = '-1.2900', '36.8200'
+        profile.is_available, profile.verification_status = True, 'VERIFIED'
+        profile.save()
+        product = Product.objects.create(seller=farmer, name='Kale', description='Sukuma',
+                                         price=50, category='VEGETABLES', location='Nairobi')
+        order = Order.objects.create(buyer=buyer, product=product, quantity=1, total_price=50,
+                                     status='ACCEPTED', is_ready_for_pickup=True)
+
+        call_command('dispatch_orders', stdout=StringIO())
+        propose_dispatch.apply()
+        proposal = DispatchProposal.objects.get()
+        self.assertEqual((proposal.order, proposal.rider, proposal.status), (order, rider, 'PROPOSED'))
+        # Re-running keeps the proposal and does not notify again
+        self.assertEqual(rider.notifications.filter(notification_type='DELIVERY_PROPOSED').count(), 1)
+
+        self.client.login(username='rider', password='x')
+        self.client.post(reverse('accept_delivery', args=[order.id]))
+        proposal.refresh_from_db()
+        self.assertEqual(proposal.status, 'ACCEPTED')
+        self.assertEqual(dispatch.propose(), [])
+
+
+class OrderQRTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                         price=50, category='VEGETABLES', location='Thika')
+        self.order = Order.objects.create(buyer=self.buyer, product=product, quantity=2, total_price=100,
+                                          status='ACCEPTED', delivery_method='DELIVERY')
+        self.client.login(username='farmer', password='x')
+
+    def test_svg_and_png_with_etag(self):
+        svg = self.client.get(reverse('order_qr', args=[self.order.id, 'svg']))
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', svg.content)
+        self.assertIn('private', svg['Cache-Control'])
+        self.assertIn('no-cache', svg['Cache-Control'])
+        self.assertNotIn('max-age', svg['Cache-Control'])
+        png = self.client.get(reverse('order_qr', args=[self.order.id, 'png']))
+        self.assertTrue(png.content.startswith(b'\x89PNG'))
+
+        again = self.client.get(reverse('order_qr', args=[self.order.id, 'svg']), HTTP_IF_NONE_MATCH=svg['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_changed_details_change_the_etag(self):
+        first = self.client.get(reverse('order_qr', args=[self.order.id, 'svg']))
+        self.buyer.profile.phone_number = '0712345678'
+        self.buyer.profile.save()
+        second = self.client.get(reverse('order_qr', args=[self.order.id, 'svg']), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_images_are_cached_and_pregenerated(self):
+        digest = pregenerate_order_qr.apply(args=[self.order.id]).get()
+        self.assertIsNotNone(caches['default'].get(f'qr:png:{digest}'))
+        with mock.patch.object(qr, 'render') as render:
+            self.client.get(reverse('order_qr', args=[self.order.id, 'svg']))
+        render.assert_not_called()
+
+    def test_only_parties_to_the_order_see_it(self):
+        User.objects.create_user(username='stranger', password='x', role='BUYER')
+        self.client.login(username='stranger', password='x')
+        self.assertEqual(self.client.get(reverse('order_qr', args=[self.order.id, 'svg'])).status_code, 404)
+        self.client.login(username='buyer', password='x')
+        self.assertEqual(self.client.get(reverse('order_qr', args=[self.order.id, 'gif'])).status_code, 404)
+
+    def test_find_rider_page_links_the_image(self):
+        response = self.client.get(reverse('find_rider', args=[self.order.id]))
+        self.assertContains(response, reverse('order_qr', args=[self.order.id, 'png']))
+        self.assertNotContains(response, 'base64')
+
+
+class NotificationPushTest(TestCase):
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+
+    def listen(self, user):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(f'user_{user.pk}', channel)
+        return channel
+
+    def receive(self, channel):
+        return async_to_sync(self.layer.receive)(channel)
+
+    def test_rows_are_written_in_bulk_and_pushed_after_commit(self):
+        buyer_channel, farmer_channel = self.listen(self.buyer), self.listen(self.farmer)
+        # Savepoint, the INSERT, the counter rows and one counter UPDATE
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(5):
+            saved = notify_many([
+                Notification(user=self.buyer, notification_type='ORDER_PLACED', message='Placed'),
+                Notification(user=self.farmer, notification_type='ORDER_PLACED', message='New order'),
+            ])
+        self.assertTrue(all(n.pk for n in saved))
+        # Nothing is sent before the transaction commits
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+
+        event = self.receive(buyer_channel)
+        self.assertEqual((event['type'], event['id'], event['message']), ('send_notification', saved[0].pk, 'Placed'))
+        self.assertEqual(event['unread_count'], 1)
+        self.assertEqual(self.receive(farmer_channel)['message'], 'New order')
+
+    def test_views_notify_through_the_service(self):
+        channel = self.listen(self.buyer)
+        product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                         price=50, category='VEGETABLES', location='Thika')
+        order = Order.objects.create(buyer=self.buyer, product=product, quantity=1, total_price=50)
+        self.client.login(username='farmer', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('accept_order', args=[order.id]))
+        self.assertEqual(self.receive(channel)['notification_type'], 'ORDER_ACCEPTED')
+
+    def test_status_endpoint_counts_unread(self):
+        notify(self.buyer, 'ORDER_PLACED', 'One')
+        notify(self.buyer, 'ORDER_PLACED', 'Two')
+        self.client.login(username='buyer', password='x')
+        with self.assertNumQueries(3):  # session, user, counter
+            self.assertEqual(self.client.get(reverse('notification_status')).json(), {'unread_count': 2})
+
+
+class NotificationCounterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.other = User.objects.create_user(username='farmer', password='x', role='FARMER')
+
+    def test_counter_follows_creates_and_reads(self):
+        first = notify(self.user, 'ORDER_PLACED', 'One')
+        notify_many([Notification(user=self.user, notification_type='ORDER_PLACED', message=m) for m in 'ab'])
+        notify(self.other, 'ORDER_PLACED', 'Other')
+        self.assertEqual(notification_service.unread_count(self.user), 3)
+
+        self.assertTrue(notification_service.mark_read(first))
+        # Reading it twice must not count twice
+        self.assertFalse(notification_service.mark_read(first))
+        self.assertEqual(notification_service.unread_count(self.user), 2)
+
+        self.assertEqual(notification_service.mark_all_read(self.user), 2)
+        self.assertEqual(notification_service.unread_count(self.user), 0)
+        self.assertEqual(notification_service.unread_count(self.other), 1)
+
+    def test_read_views_keep_the_counter(self):
+        one = notify(self.user, 'ORDER_PLACED', 'One')
+        notify(self.user, 'ORDER_PLACED', 'Two')
+        self.client.login(username='buyer', password='x')
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = self.client.post(reverse('mark_notification_read', args=[one.pk]), **ajax)
+        self.assertEqual(response.json(), {'success': True, 'unread_count': 1})
+        self.client.post(reverse('mark_all_notifications_read'), **ajax)
+        self.assertEqual(notification_service.unread_count(self.user), 0)
+
+    def test_reconcile_repairs_drift(self):
+        notify(self.user, 'ORDER_PLACED', 'One')
+        notify(self.user, 'ORDER_PLACED', 'Two')
+        # Writes that bypass the service
+        Notification.objects.filter(user=self.user).first().delete()
+        Notification.objects.create(user=self.other, notification_type='ORDER_PLACED', message='Raw')
+
+        self.assertEqual(notification_service.reconcile(), 2)
+        self.assertEqual(notification_service.unread_count(self.user), 1)
+        self.assertEqual(notification_service.unread_count(self.other), 1)
+        self.assertEqual(notification_service.reconcile(), 0)
+
+    def test_navbar_badge_comes_from_the_counter(self):
+        notify(self.user, 'ORDER_PLACED', 'One')
+        self.client.login(username='buyer', password='x')
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.context['unread_notifications'], 1)
+        self.assertContains(response, 'data-unread="1"')
+
+
+class FarmerStatsTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                           price=50, quantity=100, category='VEGETABLES', location='Thika')
+        self.eggs = Product.objects.create(seller=self.farmer, name='Eggs', description='Tray',
+                                           price=400, quantity=100, category='DAIRY', location='Thika')
+
+    def place_orders(self):
+        CartItem.objects.create(buyer=self.buyer, product=self.kale, quantity=2)
+        CartItem.objects.create(buyer=self.buyer, product=self.eggs, quantity=1)
+        return checkout_service.checkout_cart(self.buyer).orders
+
+    def row(self):
+        return FarmerStats.objects.get(farmer=self.farmer)
+
+    def test_checkout_and_status_changes_move_the_rollup(self):
+        kale_order, eggs_order = sorted(self.place_orders(), key=lambda o: o.total_price)
+        row = self.row()
+        self.assertEqual((row.pending_count, row.orders_count, row.active_products), (2, 2, 2))
+
+        self.client.login(username='farmer', password='x')
+        self.client.get(reverse('accept_order', args=[eggs_order.id]))
+        self.client.get(reverse('complete_pickup_order', args=[eggs_order.id]))
+        kale_order.refresh_from_db()
+        kale_order.status = 'PAID_OUT'
+        kale_order.save()
+
+        row = self.row()
+        self.assertEqual((row.pending_count, row.completed_count, row.paid_out_count), (0, 1, 1))
+        self.assertEqual((row.gross_revenue, row.paid_out_revenue), (500, 100))
+        daily = self.farmer.daily_stats.get()
+        self.assertEqual((daily.orders, daily.gross_revenue, daily.paid_out_revenue), (2, 500, 100))
+        self.assertEqual(stats.check([self.farmer.pk]), [])
+
+        kale_order.delete()
+        self.kale.available = False
+        self.kale.save()
+        self.assertEqual((self.row().orders_count, self.row().active_products), (1, 1))
+        self.assertEqual(stats.check([self.farmer.pk]), [])
+
+    def test_checker_finds_and_fixes_drift(self):
+        self.place_orders()
+        FarmerStats.objects.filter(farmer=self.farmer).update(pending_count=7)
+        self.farmer.daily_stats.update(orders=0)
+        problems = stats.check()
+        self.assertEqual({(field, stored) for _, _, field, stored, _ in problems},
+                         {('pending_count', 7), ('orders', 0)})
+
+        out = StringIO()
+        call_command('check_farmer_stats', '--fix', stdout=out)
+        self.assertIn('Rebuilt stats for 1 seller(s)', out.getvalue())
+        self.assertEqual(stats.check(), [])
+
+    def test_dashboard_reads_the_rollup(self):
+        self.place_orders()
+        self.client.login(username='farmer', password='x')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual((response.context['orders_count'], response.context['pending_count']), (2, 2))
+        self.assertEqual(len(response.context['pending_orders']), 2)
+        aggregates = [q['sql'] for q in ctx.captured_queries
+                      if 'marketplace_order' in q['sql'] and ('COUNT(' in q['sql'] or 'SUM(' in q['sql'])]
+        self.assertEqual(aggregates, [])
+
+
+class OrderTransitionTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                           price=50, quantity=100, category='VEGETABLES', location='Thika')
+        CartItem.objects.create(buyer=self.buyer, product=self.kale, quantity=3)
+        self.order, = checkout_service.checkout_cart(self.buyer).orders
+
+    def test_price_is_snapshotted_at_checkout(self):
+        self.assertEqual((self.order.unit_price, self.order.total_price), (50, 150))
+        Product.objects.filter(pk=self.kale.pk).update(price=80)
+        order = Order.objects.get(pk=self.order.pk)
+        order.quantity = 3
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual((order.unit_price, order.total_price), (50, 150))
+
+    def test_status_change_is_one_narrow_update(self):
+        order = Order.objects.get(pk=self.order.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            transitions.transition(order, 'ACCEPTED')
+        touching_orders = [q['sql'] for q in ctx.captured_queries if 'marketplace_order"' in q['sql']]
+        self.assertEqual(len(touching_orders), 1)
+        self.assertTrue(touching_orders[0].startswith('UPDATE'))
+        self.assertNotIn('total_price', touching_orders[0])
+        self.assertEqual(FarmerStats.objects.get(farmer=self.farmer).accepted_count, 1)
+
+    def test_only_the_winning_change_is_signalled(self):
+        sent = []
+
+        def record(sender, instance, update_fields, **kwargs):
+            sent.append((instance.previous_value('status'), instance.status, sorted(update_fields)))
+
+        order, stale = Order.objects.get(pk=self.order.pk), Order.objects.get(pk=self.order.pk)
+        post_save.connect(record, sender=Order)
+        try:
+            transitions.transition(order, 'ACCEPTED', checkout_request_id='ws_CO_1')
+            with self.assertRaises(transitions.InvalidTransition):
+                transitions.transition(stale, 'CANCELLED')
+        finally:
+            post_save.disconnect(record, sender=Order)
+        self.assertEqual(sent, [((True, 'PENDING'), 'ACCEPTED', ['checkout_request_id', 'status', 'updated_at'])])
+        self.assertEqual(order.previous_value('status'), (True, 'ACCEPTED'))
+        self.assertEqual(stale.status, 'ACCEPTED')
+
+    def test_illegal_transitions_are_rejected(self):
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(self.order, 'PAID_OUT')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'PENDING')
+
+        self.client.login(username='farmer', password='x')
+        self.client.get(reverse('reject_order', args=[self.order.id]))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'CANCELLED')
+        self.client.get(reverse('accept_order', args=[self.order.id]))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'CANCELLED')
+
+    def test_repeated_mpesa_callback_is_ignored(self):
+        transitions.transition(self.order, 'ACCEPTED', checkout_request_id='ws_CO_1')
+        body = {'Body': {'stkCallback': {
+            'ResultCode': 0, 'CheckoutRequestID': 'ws_CO_1',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'RCP1'}]},
+        }}}
+        for receipt in ('RCP1', 'RCP2'):
+            body['Body']['stkCallback']['CallbackMetadata']['Item'][0]['Value'] = receipt
+            # Applied after commit by mpesa.callbacks
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('mpesa_callback'), json.dumps(body), content_type='application/json')
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.status, order.mpesa_receipt_number), ('ESCROW', 'RCP1'))
+
+
+class OrderTransitionRaceTest(TransactionTestCase):
+    def test_racing_transitions_apply_once(self):
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        kale = Product.objects.create(seller=farmer, name='Kale', description='Sukuma',
+                                      price=50, quantity=100, category='VEGETABLES', location='Thika')
+        CartItem.objects.create(buyer=buyer, product=kale, quantity=3)
+        order, = checkout_service.checkout_cart(buyer).orders
+        # Accept racing reject (and a second accept), each from its own stale copy
+        targets = ['ACCEPTED', 'ACCEPTED', 'CANCELLED']
+        copies = [Order.objects.get(pk=order.pk) for _ in targets]
+        start = threading.Barrier(len(targets))
+        won, lost, errors = [], [], []
+
+        def move(copy, status):
+            try:
+                start.wait()
+                transitions.transition(copy, status)
+                won.append(status)
+            except transitions.InvalidTransition:
+                lost.append(status)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=move, args=pair) for pair in zip(copies, targets)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual((len(won), len(lost)), (1, 2))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, won[0])
+        stats = FarmerStats.objects.get(farmer=farmer)
+        self.assertEqual(stats.accepted_count, 1 if won[0] == 'ACCEPTED' else 0)
+
+    def test_stale_copy_is_rejected(self):
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        kale = Product.objects.create(seller=farmer, name='Kale', price=50, quantity=10, category='VEGETABLES')
+        CartItem.objects.create(buyer=buyer, product=kale, quantity=1)
+        order, = checkout_service.checkout_cart(buyer).orders
+        stale = Order.objects.get(pk=order.pk)
+        transitions.transition(order, 'ACCEPTED')
+        with self.assertRaises(transitions.InvalidTransition):
+            transitions.transition(stale, 'ACCEPTED', checkout_request_id='ws_CO_9')
+        self.assertEqual((stale.status, stale.checkout_request_id), ('ACCEPTED', None))
+        self.assertEqual(FarmerStats.objects.get(farmer=farmer).accepted_count, 1)
+        # The copy can carry on from where the row really is
+        transitions.transition(stale, 'ESCROW')
+        stats = FarmerStats.objects.get(farmer=farmer)
+        self.assertEqual((stats.pending_count, stats.accepted_count, stats.escrow_count), (0, 0, 1))
+
+
+class OrderIndexTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.rider = User.objects.create_user(username='rider', password='x', role='RIDER')
+        self.kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                           price=50, quantity=100, category='VEGETABLES', location='Thika')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+
+    def test_seller_is_copied_from_the_product(self):
+        order = Order.objects.create(buyer=self.buyer, product=self.kale, quantity=1)
+        self.assertEqual(order.seller_id, self.farmer.id)
+        CartItem.objects.create(buyer=self.buyer, product=self.kale, quantity=2)
+        placed, = checkout_service.checkout_cart(self.buyer).orders
+        self.assertEqual(Order.objects.get(pk=placed.pk).seller_id, self.farmer.id)
+
+    def test_farmer_queries_use_the_seller_index(self):
+        orders = Order.objects.filter(seller=self.farmer)
+        self.assertUsesIndex(orders.filter(status='PENDING').order_by('-created_at'), 'order_seller_status_idx')
+        self.assertUsesIndex(orders.filter(pk=1), 'PRIMARY KEY')
+        self.assertUsesIndex(orders.values('status').annotate(n=Count('id')), 'order_seller_status_idx')
+        self.assertNotIn('marketplace_product', str(orders.filter(status='PENDING').query))
+
+    def test_buyer_rider_and_callback_lookups_use_indexes(self):
+        self.assertUsesIndex(Order.objects.filter(buyer=self.buyer).order_by('-created_at'), 'order_buyer_created_idx')
+        self.assertUsesIndex(Order.objects.filter(assigned_rider=self.rider, status='DELIVERED'), 'order_rider_status_idx')
+        self.assertUsesIndex(Order.objects.filter(checkout_request_id='ws_CO_1'), 'order_checkout_request_idx')
+
+
+class APIReadTest(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        products = Product.objects.bulk_create([
+            Product(seller=self.farmer, name=f'Kale {i}', description='Sukuma', price=50 + i,
+                    category='VEGETABLES', location='Thika', quantity=10)
+            for i in range(5)
+        ])
+        for product in products:
+            Order.objects.create(buyer=self.buyer, product=product, quantity=2)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        return response, len(ctx.captured_queries)
+
+    def test_fast_path_matches_the_serializer(self):
+        self.client.login(username='farmer', password='x')
+        for viewset, url in [(ProductViewSet, '/marketplace/api/products/'), (OrderViewSet, '/marketplace/api/orders/')]:
+            fast, fast_queries = self.get(url, page_size=3)
+            with mock.patch.object(viewset, 'fast_reads', False):
+                slow, slow_queries = self.get(url, page_size=3)
+            self.assertEqual(fast.json(), slow.json())
+            # Both paths join what they need: no query per row
+            self.assertEqual(slow_queries, fast_queries)
+            # And the cursors work on either
+            self.assertEqual(len(self.client.get(fast.json()['next']).json()['results']), 2)
+
+    def test_sparse_fieldsets(self):
+        response, queries = self.get('/marketplace/api/products/', fields='id,seller_name', ordering='price')
+        self.assertEqual(response.json()['results'][0], {'id': Product.objects.order_by('price').first().id,
+                                                         'seller_name': 'farmer'})
+        self.assertEqual(queries, 1)
+
+        product = Product.objects.first()
+        response = self.client.get(f'/marketplace/api/products/{product.id}/', {'fields': 'name,price'})
+        self.assertEqual(response.json(), {'name': product.name, 'price': f'{product.price:.2f}'})
+
+        response = self.client.get('/marketplace/api/products/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_writes_ignore_fields(self):
+        self.client.login(username='farmer', password='x')
+        response = self.client.post('/marketplace/api/products/?fields=id', {
+            'name': 'Eggs', 'description': 'Tray', 'price': '400.00', 'category': 'LIVESTOCK', 'location': 'Thika',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'Eggs')
+
+
+class BulkProductImportTest(TestCase):
+    def setUp(self):
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.client.login(username='farmer', password='x')
+
+    def upload(self, text, name='products.csv'):
+        upload = SimpleUploadedFile(name, text.encode(), content_type='text/csv')
+        return self.client.post(reverse('import_products'), {'file': upload})
+
+    def test_import_creates_products_and_defers_signal_work(self):
+        rows = ['name,description,price,quantity,category,location']
+        rows += [f'Kale {i},Sukuma,{50 + i},{10 + i},VEGETABLES,Thika' for i in range(25)]
+        rows.append('Broken,No price,,5,VEGETABLES,Thika')
+        with mock.patch.object(bulk, 'CHUNK_SIZE', 10), \
+                mock.patch('users.badges.rebuild', wraps=badges.rebuild) as rebuild_badges:
+            report = self.upload('\n'.join(rows)).context['report']
+
+        self.assertEqual((report.created, report.failed), (25, 1))
+        self.assertEqual(report.errors[0][0], 27)
+        self.assertIn('price', report.errors[0][1])
+        rebuild_badges.assert_called_once_with([self.farmer.pk])
+        self.assertEqual(badges.badge_for(self.farmer).total_products, 25)
+        self.assertEqual(stats.stats_for(self.farmer).active_products, 25)
+        self.assertEqual(StockHistory.objects.filter(reason=bulk.IMPORT_REASON).count(), 25)
+        self.assertEqual(list(search.search_products('kale 7').values_list('name', flat=True)), ['Kale 7'])
+
+    def test_export_round_trip_updates_in_place(self):
+        kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                      quantity=10, category='VEGETABLES', location='Thika', freshness_notes='Picked today')
+        Product.objects.create(seller=self.farmer, name='Eggs', description='Tray', price=400,
+                               quantity=5, category='LIVESTOCK', location='Thika')
+        other = Product.objects.create(seller=User.objects.create_user(username='other', password='x', role='FARMER'),
+                                       name='Milk', description='Fresh', price=60, category='LIVESTOCK', location='Nyeri')
+
+        response = self.client.get(reverse('export_products'))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(bulk.COLUMNS))
+        self.assertEqual(len(lines), 3)
+
+        # Restock kale, leave eggs alone, and try to edit someone else's listing
+        lines[1] = lines[1].replace(',10,kg,', ',40,kg,')
+        lines.append(f'{other.id},Milk,Fresh,1,1,kg,LIVESTOCK,Nyeri,,True')
+        report = self.upload('\n'.join(lines)).context['report']
+
+        self.assertEqual((report.created, report.updated, report.unchanged, report.failed), (0, 1, 1, 1))
+        kale.refresh_from_db()
+        self.assertEqual((kale.quantity, kale.freshness_notes), (40, 'Picked today'))
+        history = StockHistory.objects.get(product=kale)
+        self.assertEqual((history.old_quantity, history.new_quantity), (10, 40))
+        other.refresh_from_db()
+        self.assertEqual(other.price, 60)
+
+    def test_unusable_files_and_roles(self):
+        response = self.upload('name,price\nKale,50')
+        self.assertIsNone(response.context['report'])
+        self.assertIn('Missing column(s)', str(list(response.context['messages'])[0]))
+        self.assertIsNone(self.upload('x', name='products.pdf').context['report'])
+
+        User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.client.login(username='buyer', password='x')
+        self.assertRedirects(self.client.get(reverse('import_products')), reverse('product_list'))
+
+    def test_malformed_uploads_are_rejected_without_a_crash(self):
+        header = 'id,name,description,price,quantity,category,location\n'
+        latin1 = SimpleUploadedFile('products.csv', (header + ',Café,Sukuma,50,1,VEGETABLES,Thika').encode('latin-1'))
+        response = self.client.post(reverse('import_products'), {'file': latin1})
+        self.assertIsNone(response.context['report'])
+        self.assertIn('UTF-8', str(list(response.context['messages'])[0]))
+
+        response = self.client.post(reverse('import_products'), {'file': SimpleUploadedFile('p.xlsx', b'not a zip')})
+        self.assertIsNone(response.context['report'])
+        self.assertIn('.xlsx', str(list(response.context['messages'])[0]))
+
+        report = self.upload(header + 'inf,Kale,Sukuma,50,1,VEGETABLES,Thika').context['report']
+        self.assertEqual((report.created, report.failed), (0, 1))
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_duplicate_ids_update_once(self):
+        kale = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                      quantity=10, category='VEGETABLES', location='Thika')
+        rows = ['id,name,description,price,quantity,category,location',
+                f'{kale.id},Kale,Sukuma,50,20,VEGETABLES,Thika',
+                f'{kale.id},Kale,Sukuma,50,30,VEGETABLES,Thika']
+        report = self.upload('\n'.join(rows)).context['report']
+        self.assertEqual((report.updated, report.failed), (1, 1))
+        self.assertIn('more than once', report.errors[0][1])
+        kale.refresh_from_db()
+        self.assertEqual(kale.quantity, 20)
+        history = StockHistory.objects.get(product=kale)
+        self.assertEqual((history.old_quantity, history.new_quantity), (10, 20))
+
+
+class NotificationConsumerTest(SimpleTestCase):
+    # No database here: the consumer closes the thread's connection when it exits
+    def test_consumer_forwards_pushed_notifications(self):
+        # asgiref's communicator: channels.testing needs daphne
+        from asgiref.testing import ApplicationCommunicator
+        from core.consumers import NotificationConsumer
+
+        layer = get_channel_layer()
+        user = SimpleNamespace(id=5, is_anonymous=False)
+
+        async def scenario():
+            scope = {'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': [],
+                     'user': user}
+            communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+            await layer.group_send('user_5', {
+                'type': 'send_notification', 'id': 7, 'notification_type': 'ORDER_ACCEPTED',
+                'message': 'Accepted', 'order_id': None, 'created_at': None,
+            })
+            frame = await communicator.receive_output()
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+            return json.loads(frame['text'])
+
+        payload = async_to_sync(scenario)()
+        self.assertEqual((payload['id'], payload['message']), (7, 'Accepted'))
@@ -0,0 +1,99 @@
+"""
+Order status changes.
+
+Every status change goes through ``transition``, which checks it against
+TRANSITIONS and writes only the status (plus any fields passed along) with
+one ``filter(pk=..., status=<checked status>).update(...)``: no repricing and
+no product load. The UPDATE only matches while the row is still in the
+status that was checked, so of two callers racing on one order (a duplicate
+callback, accept against reject) exactly one wins and the other gets
+InvalidTransition. update() sends no signals, so post_save is sent for the
+winning change only, and badges, dashboard stats and analytics count it once.
+
+Moving to PAID_OUT claims an order's payout (mpesa.payouts): a payout Daraja
+refuses is undone with ``undo_claim``.
+"""
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import Order
+
+TRANSITIONS = {
+    'PENDING': {'ACCEPTED', 'CANCELLED'},
+    # Pickup orders are paid in person and completed by the farmer
+    'ACCEPTED': {'ESCROW', 'IN_DELIVERY', 'COMPLETED', 'CANCELLED'},
+    'ESCROW': {'IN_DELIVERY', 'DELIVERED', 'PAID_OUT', 'DISPUTED', 'REFUNDED'},
+    'IN_DELIVERY': {'DELIVERED', 'PAID_OUT', 'DISPUTED'},
+    'DELIVERED': {'PAID_OUT', 'COMPLETED', 'DISPUTED'},
+    # Disputed when Safaricom reports the B2C payout failed (mpesa.callbacks)
+    'PAID_OUT': {'COMPLETED', 'DISPUTED'},
+    'DISPUTED': {'REFUNDED', 'PAID_OUT', 'COMPLETED'},
+    'COMPLETED': set(),
+    'CANCELLED': set(),
+    'REFUNDED': set(),
+}
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+
+
+class InvalidTransition(Exception):
+    def __init__(self, order, status):
+        self.order = order
+        self.status = status
+        super().__init__(
+            f"Order #{order.pk} can't go from {STATUS_LABELS.get(order.status, order.status)} "
+            f"to {STATUS_LABELS.get(status, status)}."
+        )
+
+
+def can_transition(order, status):
+    return status in TRANSITIONS.get(order.status, ())
+
+
+def transition(order, status, **changes):
+    """
+    Move ``order`` to ``status``, setting ``changes`` (other Order fields) in
+    the same UPDATE. Raises InvalidTransition if the move isn't allowed,
+    including when the row has left ``order.status`` since it was loaded.
+    """
+    if not can_transition(order, status):
+        raise InvalidTransition(order, status)
+    return _move(order, status, changes)
+
+
+def undo_claim(order, status):
+    """
+    Put ``order``, moved to PAID_OUT to claim its payout, back in ``status``
+    (where it was claimed from) because the payout was refused. The only way
+    back out of PAID_OUT; raises InvalidTransition like ``transition``.
+    """
+    if order.status != 'PAID_OUT' or 'PAID_OUT' not in TRANSITIONS.get(status, ()):
+        raise InvalidTransition(order, status)
+    return _move(order, status, {})
+
+
+def _move(order, status, changes):
+    old = order.status
+    now = timezone.now()
+    if not Order.objects.filter(pk=order.pk, status=old).update(status=status, updated_at=now, **changes):
+        # Someone else moved it first
+        current = Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+        if current is None:
+            raise Order.DoesNotExist(f"Order #{order.pk} no longer exists.")
+        order.status = current
+        if getattr(order, '_loaded_values', None) is not None:
+            order._loaded_values['status'] = current
+        raise InvalidTransition(order, status)
+
+    order.status = status
+    order.updated_at = now
+    for field, value in changes.items():
+        setattr(order, field, value)
+    update_fields = ['status', 'updated_at', *changes]
+    post_save.send(sender=Order, instance=order, created=False, update_fields=frozenset(update_fields),
+                   raw=False, using=order._state.db)
+    # What save() would have recorded, now the handlers have seen the old values
+    attnames = [Order._meta.get_field(name).attname for name in update_fields]
+    loaded = getattr(order, '_loaded_values', None) or {}
+    loaded.update((attname, getattr(order, attname)) for attname in attnames)
+    order._loaded_values = loaded
+    return order
@@ -14,6 +14,8 @@ urlpatterns = [
     path('create/', views.create_product, name='create_product'),
     path('product/<int:pk>/edit/', views.edit_product, name='edit_product'),
     path('product/<int:pk>/delete/', views.delete_product, name='delete_product'),
+    path('products/import/', views.import_products, name='import_products'),
+    path('products/export/', views.export_products, name='export_products'),
     
     # Cart URLs
     path('cart/', views.view_cart, name='view_cart'),
@@ -25,6 +27,7 @@ urlpatterns = [
     # Payment URLs
     path('payment/<int:order_id>/', views.payment_page, name='payment_page'),
     path('payment/<int:order_id>/initiate/', views.initiate_payment, name='initiate_payment'),
+    path('payment/<int:order_id>/status/', views.payment_status, name='payment_status'),
     
     # Favorites URLs
     path('favorites/', views.view_saved_products, name='view_saved_products'),
@@ -32,12 +35,14 @@ urlpatterns = [
     
     # Notifications URLs
     path('notifications/', views.view_notifications, name='view_notifications'),
+    path('notifications/status/', views.notification_status, name='notification_status'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
     path('notifications/read-all/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     path('confirm-delivery/<int:order_id>/', views.confirm_delivery, name='confirm_delivery'),
     path('order/<int:order_id>/accept/', views.accept_order, name='accept_order'),
     path('order/<int:order_id>/reject/', views.reject_order, name='reject_order'),
     path('order/<int:order_id>/find-rider/', views.find_rider, name='find_rider'),
+    path('order/<int:order_id>/qr.<str:fmt>', views.order_qr, name='order_qr'),
     path('order/<int:order_id>/assign-rider/<int:rider_id>/', views.assign_rider, name='assign_rider'),
     path('order/<int:order_id>/update-status/', views.update_order_status, name='update_order_status'),
     path('order/<int:order_id>/complete-pickup/', views.complete_pickup_order, name='complete_pickup_order'),
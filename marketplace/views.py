@@ -1,39 +1,58 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from datetime import datetime
+import tempfile
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.safestring import mark_safe
+from django.db import transaction
 from django.db.models import Sum, Count
 from rest_framework import viewsets, filters, permissions
+from core.api import FastReadMixin
 from users.models import User, DeliveryAddress
 from .models import Product, Order, CartItem, Favorite, Notification, StockHistory
 from .serializers import ProductSerializer, OrderSerializer
 from .forms import ProductForm
+from .search import ProductSearchFilter, search_products
+from . import cache as catalog_cache
+from . import services as checkout_service
+from . import bulk, dispatch, qr, reservations, transitions
+from . import notifications as notifications_service
+from .notifications import notify
+from .pagination import (
+    KeysetPagination, InvalidCursor, DEFAULT_ORDERING, keyset_page, resolve_ordering, page_url
+)
 from itertools import groupby
 from operator import attrgetter
-from mpesa.utils import release_escrow_to_farmer, stk_push
+from ledger import books
+from mpesa import payments, payouts
+from mpesa.models import PayoutJob
 
 # API ViewSets
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [ProductSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'category', 'location']
     ordering_fields = ['price', 'created_at']
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         serializer.save(seller=self.request.user)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(FastReadMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.role == 'FARMER': # Seller sees orders for their products
-            return Order.objects.filter(product__seller=user)
+            return Order.objects.filter(seller=user)
         return Order.objects.filter(buyer=user) # Buyer sees their orders
 
     def perform_create(self, serializer):
@@ -41,15 +60,65 @@ class OrderViewSet(viewsets.ModelViewSet):
 
 # Template Views
 def product_list(request):
-    products = Product.objects.filter(available=True)
-    # Simple search
-    query = request.GET.get('q')
-    if query:
-        products = products.filter(name__icontains=query)
-    return render(request, 'marketplace/product_list.html', {'products': products})
+    query = request.GET.get('q', '').strip()
+    category = request.GET.get('category', '').strip().upper()
+    if category not in dict(Product.CATEGORY_CHOICES):
+        category = ''
+
+    default_ordering = 'search_rank' if query else DEFAULT_ORDERING
+    ordering = resolve_ordering(request.GET.get('ordering'), default_ordering)
+    if ordering == 'search_rank' and not query:
+        ordering = DEFAULT_ORDERING
+    cursor = request.GET.get('cursor')
+
+    # Cached per category (or the whole catalog) and invalidated by version bumps
+    scope = f'category:{category}' if category else 'all'
+    cache_parts = (query, category, ordering, cursor)
+
+    def load_page():
+        products = Product.objects.filter(available=True).select_related('seller')
+        if category:
+            products = products.filter(category=category)
+        # Full-text search, best matches first
+        if query:
+            products = search_products(query, products)
+        # Keyset page: constant cost however deep the user scrolls
+        try:
+            return keyset_page(products, ordering, cursor=cursor)
+        except InvalidCursor:
+            return keyset_page(products, ordering)
+
+    page = catalog_cache.get_or_set('page', [scope], cache_parts, load_page)
+    next_url = page_url(request, page.next_cursor)
+
+    def render_cards():
+        return render_to_string('marketplace/product_cards.html', {'products': page.items}, request=request)
+
+    # Cards only differ per user once logged in (favourites, cart form)
+    if request.user.is_authenticated:
+        cards_html = render_cards()
+    else:
+        cards_html = catalog_cache.get_or_set('cards', [scope], cache_parts, render_cards)
+    cards_html = mark_safe(cards_html)
+
+    # Infinite scroll asks for just the next batch of cards
+    if request.GET.get('partial'):
+        return JsonResponse({'html': cards_html, 'next_url': next_url})
+
+    return render(request, 'marketplace/product_list.html', {
+        'products': page.items,
+        'cards_html': cards_html,
+        'page': page,
+        'next_url': next_url,
+    })
 
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
+    product = catalog_cache.get_or_set(
+        'product', [f'product:{pk}'], (pk,),
+        lambda: Product.objects.select_related('seller').filter(pk=pk).first(),
+    )
+    if product is None:
+        raise Http404("No Product matches the given query.")
     return render(request, 'marketplace/product_detail.html', {'product': product})
 
 @login_required
@@ -77,7 +146,9 @@ def edit_product(request, pk):
         old_quantity = product.quantity
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
-            updated_product = form.save()
+            updated_product = form.save(commit=False)
+            # Only what the form edits: reserved_quantity is the carts' (marketplace.reservations)
+            updated_product.save(update_fields=[*form.changed_data, 'last_updated'])
             
             # Track stock change
             if updated_product.quantity != old_quantity:
@@ -95,6 +166,41 @@ def edit_product(request, pk):
     
     return render(request, 'marketplace/product_form.html', {'form': form, 'title': 'Edit Product'})
 
+@login_required
+def import_products(request):
+    """Create or update many listings at once from a CSV/XLSX file"""
+    if request.user.role not in (User.Role.FARMER, User.Role.SUPPLIER):
+        messages.error(request, "Only farmers and suppliers can import products.")
+        return redirect('product_list')
+
+    report = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if not upload:
+            messages.error(request, "Choose a file to import.")
+        else:
+            try:
+                report = bulk.import_products(request.user, upload, bulk.file_format(upload.name))
+            except bulk.BulkImportError as e:
+                messages.error(request, str(e))
+            else:
+                if report.imported:
+                    messages.success(request, f"Imported {report.created} new and {report.updated} updated products.")
+    return render(request, 'marketplace/product_import.html', {'report': report, 'columns': bulk.COLUMNS})
+
+@login_required
+def export_products(request):
+    """The seller's listings as CSV (streamed) or XLSX, in the import layout"""
+    if request.GET.get('format') == bulk.XLSX:
+        target = tempfile.TemporaryFile()
+        bulk.export_xlsx(request.user, target)
+        target.seek(0)
+        return FileResponse(target, as_attachment=True, filename='products.xlsx',
+                            content_type=bulk.FORMATS[bulk.XLSX])
+    response = StreamingHttpResponse(bulk.export_csv(request.user), content_type=bulk.FORMATS[bulk.CSV])
+    response['Content-Disposition'] = 'attachment; filename="products.csv"'
+    return response
+
 @login_required
 def delete_product(request, pk):
     product = get_object_or_404(Product, pk=pk)
@@ -121,22 +227,15 @@ def add_to_cart(request, product_id):
     if quantity < 1:
         return JsonResponse({'success': False, 'error': 'Invalid quantity'}, status=400)
     
-    if quantity > product.quantity:
+    # Holds the units for this buyer (see marketplace.reservations)
+    try:
+        reservations.hold(request.user, product, quantity, add=True)
+    except reservations.InsufficientStock as e:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-             return JsonResponse({'success': False, 'error': f'Stock insufficient. Only {product.quantity} {product.unit} available.'}, status=400)
-        messages.error(request, f'Stock insufficient. Only {product.quantity} {product.unit} available.')
+             return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        messages.error(request, str(e))
         return redirect('product_detail', pk=product_id)
 
-    cart_item, created = CartItem.objects.get_or_create(
-        buyer=request.user,
-        product=product,
-        defaults={'quantity': quantity}
-    )
-    
-    if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
-    
     cart_count = request.user.cart_items.count()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -189,11 +288,10 @@ def update_cart_item(request, item_id):
     if quantity < 1:
         return JsonResponse({'success': False, 'error': 'Invalid quantity'}, status=400)
 
-    if quantity > cart_item.product.quantity:
-         return JsonResponse({'success': False, 'error': f'Stock insufficient. Only {cart_item.product.quantity} {cart_item.product.unit} available.'}, status=400)
-    
-    cart_item.quantity = quantity
-    cart_item.save()
+    try:
+        cart_item = reservations.hold(request.user, cart_item.product, quantity)
+    except reservations.InsufficientStock as e:
+         return JsonResponse({'success': False, 'error': str(e)}, status=400)
     
     cart_total = sum(item.total_price for item in request.user.cart_items.all())
     
@@ -208,7 +306,7 @@ def remove_from_cart(request, item_id):
     """Remove item from cart"""
     cart_item = get_object_or_404(CartItem, id=item_id, buyer=request.user)
     product_name = cart_item.product.name
-    cart_item.delete()
+    reservations.release(cart_item)
     
     cart_count = request.user.cart_items.count()
     
@@ -227,113 +325,26 @@ def checkout_cart(request):
     """Convert cart items to orders and clear cart"""
     if request.method != 'POST':
         return redirect('view_cart')
-    
-    cart_items = request.user.cart_items.select_related('product').all()
-    
-    if not cart_items:
-        messages.warning(request, 'Your cart is empty')
+
+    try:
+        report = checkout_service.checkout_cart(
+            request.user, checkout_service.delivery_choices_from_post(request.POST)
+        )
+    except checkout_service.CheckoutError as e:
+        messages.error(request, str(e))
         return redirect('view_cart')
-    
-    # Validate stock and delivery inputs for all items first
-    farmers_checked = set()
-    for item in cart_items:
-        # Stock Check
-        if item.quantity > item.product.quantity:
-            messages.error(request, f"Stock insufficient for {item.product.name}. Only {item.product.quantity} {item.product.unit} available.")
-            return redirect('view_cart')
-        
-        # Delivery Input Check
-        farmer_id = item.product.seller.id
-        if farmer_id not in farmers_checked:
-            delivery_key = f"delivery_method_{farmer_id}"
-            delivery_method = request.POST.get(delivery_key, 'PICKUP')
-            
-            if delivery_method == 'DELIVERY':
-                address_key = f"address_{farmer_id}"
-                address_id = request.POST.get(address_key)
-                if not address_id:
-                     messages.error(request, f"Please select a delivery address for items from {item.product.seller.username}")
-                     return redirect('view_cart')
-                # Validate address ownership
-                if not DeliveryAddress.objects.filter(id=address_id, user=request.user).exists():
-                     messages.error(request, "Invalid delivery address selected.")
-                     return redirect('view_cart')
-            farmers_checked.add(farmer_id)
-
-    # Create orders (one per cart item)
-    orders_created = 0
-    for item in cart_items:
-        if item.product.available and item.product.quantity >= item.quantity:
-            # Deduct Stock
-            product = item.product
-            old_qty = product.quantity
-            product.quantity -= item.quantity
-            
-            # Check for Out of Stock
-            if product.quantity == 0:
-                # Notify Farmer about Out of Stock
-                 Notification.objects.create(
-                    user=product.seller,
-                    notification_type='ORDER_PLACED', # Reusing type or could add STOCK_ALERT
-                    message=f"Your product '{product.name}' is now OUT OF STOCK. Update quantity when available."
-                )
-            
-            product.save()
 
-            # Get delivery method and address
-            delivery_key = f"delivery_method_{product.seller.id}"
-            delivery_method = request.POST.get(delivery_key, 'PICKUP')
-            
-            delivery_address = None
-            if delivery_method == 'DELIVERY':
-                address_key = f"address_{product.seller.id}"
-                address_id = request.POST.get(address_key)
-                if address_id:
-                    delivery_address = DeliveryAddress.objects.filter(id=address_id, user=request.user).first()
-
-            # Create Order
-            order = Order.objects.create(
-                buyer=request.user,
-                product=product,
-                quantity=item.quantity,
-                status='PENDING',
-                delivery_method=delivery_method,
-                delivery_address=delivery_address,
-                total_price=product.price * item.quantity # Explicitly set total_price as save() does it but good to be sure
-            )
+    if not report.lines:
+        messages.warning(request, 'Your cart is empty')
+        return redirect('view_cart')
 
-            # Record History
-            StockHistory.objects.create(
-                product=product,
-                old_quantity=old_qty,
-                new_quantity=product.quantity,
-                reason=f"Order #{order.id}"
-            )
-            
-            # Create notification for buyer
-            Notification.objects.create(
-                user=request.user,
-                notification_type='ORDER_PLACED',
-                order=order,
-                message=f'Your order for {item.product.name} (x{item.quantity}) has been placed successfully!'
-            )
+    # Items that could not be ordered stay in the cart
+    for line in report.failed:
+        messages.error(request, line.message)
 
-            # Create notification for farmer (seller)
-            Notification.objects.create(
-                user=item.product.seller,
-                notification_type='ORDER_PLACED',
-                order=order,
-                message=f'New order received: {item.product.name} (x{item.quantity}) from {request.user.username}'
-            )
-            
-            orders_created += 1
-    
-    # Clear cart
-    cart_items.delete()
-    
-    if orders_created == 1:
-        # If single order, check logic here if needed
-        pass
+    orders_created = len(report.orders)
+    if not orders_created:
+        return redirect('view_cart')
 
     messages.success(request, f'{orders_created} order(s) placed successfully! Waiting for farmer approval.')
     return redirect('dashboard')
@@ -341,7 +352,7 @@ def checkout_cart(request):
 @login_required
 def payment_page(request, order_id):
     order = get_object_or_404(Order, id=order_id, buyer=request.user)
-    return render(request, 'marketplace/payment.html', {'order': order})
+    return render(request, 'marketplace/payment.html', {'order': order, 'job': payments.latest_job(order)})
 
 @login_required
 def initiate_payment(request, order_id):
@@ -373,34 +384,44 @@ def initiate_payment(request, order_id):
     if is_sandbox and is_test_phone:
         print("DEBUG: Triggering Sandbox Simulation")
         # Simulate successful payment immediately
-        order.status = 'ESCROW'
-        order.checkout_request_id = f"TEST-{datetime.now().timestamp()}"
-        order.mpesa_receipt_number = "TEST_RECEIPT_AUTO"
-        order.save()
+        try:
+            with transaction.atomic():
+                transitions.transition(
+                    order, 'ESCROW',
+                    checkout_request_id=f"TEST-{datetime.now().timestamp()}",
+                    mpesa_receipt_number="TEST_RECEIPT_AUTO",
+                )
+                books.escrow_in(order)
+        except transitions.InvalidTransition as e:
+            messages.error(request, str(e))
+            return redirect('dashboard')
         messages.success(request, "Sandbox Test Payment Accepted! Funds in Escrow.")
         return redirect('dashboard') # Redirect to dashboard to see status update
     
-    # Call STK Push
-    try:
-        response = stk_push(phone, int(order.total_price), account_reference=f"Order-{order.id}")
-        
-        # Save CheckoutRequestID to order for tracking callback
-        checkout_request_id = response.get('CheckoutRequestID')
-        if checkout_request_id:
-            order.checkout_request_id = checkout_request_id
-            order.save()
-            messages.success(request, f"M-Pesa STK Push sent to {phone}! Please check your phone to complete payment.")
-        else:
-            # Capture specific error
-            error_desc = response.get('ResponseDescription') or response.get('errorMessage') or "Unknown Error"
-            error_code = response.get('ResponseCode') or response.get('errorCode')
-            messages.error(request, f"M-Pesa Failed: {error_desc} (Code: {error_code})")
-            
-    except Exception as e:
-        messages.error(request, f"Error initiating payment: {str(e)}")
-        
+    # Sent by the payments worker; the page polls payment_status
+    job = payments.queue_stk_push(order, phone)
+    if request.accepts('application/json') and not request.accepts('text/html'):
+        return JsonResponse(payment_job_data(order, job), status=202)
+    messages.info(request, f"Sending the M-Pesa prompt to {job.phone}. Please check your phone to complete payment.")
     return redirect('payment_page', order_id=order.id)
 
+def payment_job_data(order, job):
+    return {
+        'order_status': order.status,
+        'job': job and {
+            'id': job.id,
+            'status': job.status,
+            'status_display': job.get_status_display(),
+            'attempts': job.attempts,
+            'error': job.error,
+        },
+    }
+
+@login_required
+def payment_status(request, order_id):
+    order = get_object_or_404(Order, id=order_id, buyer=request.user)
+    return JsonResponse(payment_job_data(order, payments.latest_job(order)))
+
 @login_required
 def confirm_delivery(request, order_id):
     """Confirm delivery of an order"""
@@ -417,31 +438,37 @@ def confirm_delivery(request, order_id):
         if not farmer_phone:
              return JsonResponse({'success': False, 'message': 'Farmer phone number not found.'}, status=400)
              
-        # Format farmer phone
-        if farmer_phone.startswith('0'):
-            farmer_phone = '254' + farmer_phone[1:]
+        # Claim the order first, committed: a second confirmation racing this
+        # one fails here instead of sending a second payout (mpesa.payouts)
+        claimed_from = order.status
+        try:
+            transitions.transition(order, 'PAID_OUT')
+        except transitions.InvalidTransition:
+            messages.error(request, 'This delivery has already been confirmed.')
+            return redirect('dashboard')
 
-        # Call B2C
-        response = release_escrow_to_farmer(farmer_phone, int(order.total_price))
-        
-        # Check if B2C request was accepted (ConversationID/OriginatorConversationID present)
-        if response.get('ConversationID'):
-            order.status = 'PAID_OUT'
-            order.save()
-            
-            # Notify Farmer
-            Notification.objects.create(
-                user=order.product.seller,
-                notification_type='ORDER_COMPLETED', 
-                order=order,
-                message=f'Order #{order.id} delivered and funds released to your M-Pesa.'
-            )
-            
-            messages.success(request, 'Delivery confirmed! Funds successfully released to farmer.')
+        # Call B2C: the farmer gets the escrowed payment less the rider's fee
+        job = payouts.send(order, farmer_phone, claimed_from)
+        if job.status == PayoutJob.FAILED:
+            messages.error(request, 'Failed to release funds. Please contact support.')
+            return redirect('dashboard')
+        books.rider_fee(order)
+
+        if job.status == PayoutJob.UNCONFIRMED:
+            messages.warning(request, "Delivery confirmed! M-Pesa hasn't confirmed the payout to the farmer yet; "
+                                      "our team will follow it up.")
             return redirect('dashboard')
-        else:
-             messages.error(request, 'Failed to release funds. Please contact support.')
-             return redirect('dashboard')
+
+        # Notify Farmer
+        notify(
+            user=order.product.seller,
+            notification_type='ORDER_COMPLETED', 
+            order=order,
+            message=f'Order #{order.id} delivered and funds released to your M-Pesa.'
+        )
+
+        messages.success(request, 'Delivery confirmed! Funds successfully released to farmer.')
+        return redirect('dashboard')
 
     except Exception as e:
         messages.error(request, f"Error: {str(e)}")
@@ -475,24 +502,32 @@ def toggle_favorite(request, product_id):
 @login_required
 def view_notifications(request):
     notifications = request.user.notifications.all()
-    return render(request, 'marketplace/notifications.html', {'notifications': notifications})
+    return render(request, 'marketplace/notifications.html', {
+        'notifications': notifications,
+        'unread_count': notifications_service.unread_count(request.user),
+    })
+
+@login_required
+def notification_status(request):
+    """Unread count, polled by the browser only while its websocket is down"""
+    return JsonResponse({'unread_count': notifications_service.unread_count(request.user)})
 
 @login_required
 def mark_notification_read(request, notification_id):
     notification = get_object_or_404(Notification, id=notification_id, user=request.user)
-    notification.mark_as_read()
+    notifications_service.mark_read(notification)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': True, 'unread_count': notifications_service.unread_count(request.user)})
         
     return redirect('view_notifications')
 
 @login_required
 def mark_all_notifications_read(request):
-    request.user.notifications.filter(is_read=False).update(is_read=True)
+    notifications_service.mark_all_read(request.user)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'success': True})
+        return JsonResponse({'success': True, 'unread_count': 0})
         
     messages.success(request, 'All notifications marked as read')
     return redirect('view_notifications')
@@ -500,10 +535,17 @@ def mark_all_notifications_read(request):
 
 @login_required
 def accept_order(request, order_id):
-    order = get_object_or_404(Order, id=order_id, product__seller=request.user)
+    order = get_object_or_404(Order, id=order_id, seller=request.user)
     if order.status == 'PENDING':
-        order.status = 'ACCEPTED'
-        order.save()
+        try:
+            transitions.transition(order, 'ACCEPTED')
+        except transitions.InvalidTransition as e:
+            # Lost a race (double click, accept against reject)
+            messages.error(request, str(e))
+            return redirect('dashboard')
+        if qr.PREGENERATE:
+            from .tasks import pregenerate_order_qr
+            transaction.on_commit(lambda: pregenerate_order_qr.delay(order.id))
         
         # Notify buyer
         if order.delivery_method == 'PICKUP':
@@ -511,7 +553,7 @@ def accept_order(request, order_id):
         else:
              msg = f"Your order for {order.product.name} has been accepted! You can now proceed to payment."
 
-        Notification.objects.create(
+        notify(
             user=order.buyer,
             notification_type='ORDER_ACCEPTED',
             order=order,
@@ -522,13 +564,17 @@ def accept_order(request, order_id):
 
 @login_required
 def reject_order(request, order_id):
-    order = get_object_or_404(Order, id=order_id, product__seller=request.user)
+    order = get_object_or_404(Order, id=order_id, seller=request.user)
     if order.status == 'PENDING':
-        order.status = 'REJECTED'
-        order.save()
+        try:
+            transitions.transition(order, 'CANCELLED')
+        except transitions.InvalidTransition as e:
+            # Lost a race (double click, accept against reject)
+            messages.error(request, str(e))
+            return redirect('dashboard')
         
         # Notify buyer
-        Notification.objects.create(
+        notify(
             user=order.buyer,
             notification_type='ORDER_REJECTED',
             order=order,
@@ -589,10 +635,6 @@ def find_rider(request, order_id):
     if ward_id:
         riders = riders.filter(profile__ward_id=ward_id)
     
-    # Generate QR Code for this order
-    from .utils import generate_order_qr
-    qr_code_base64 = generate_order_qr(order)
-    
     # Get all counties for the dropdown
     from users.models import County
     counties = County.objects.all()
@@ -602,7 +644,6 @@ def find_rider(request, order_id):
         'riders': riders,
         'recommended_riders': recommended_riders,
         'search_query': location_query,
-        'qr_code': qr_code_base64,
         'counties': counties,
         'selected_county': int(county_id) if county_id else None,
         'selected_sub_county': int(sub_county_id) if sub_county_id else None,
@@ -610,6 +651,30 @@ def find_rider(request, order_id):
     }
     return render(request, 'marketplace/find_rider.html', context)
 
+@login_required
+def order_qr(request, order_id, fmt):
+    """QR code of an order's pickup/drop-off details, as SVG or PNG"""
+    if fmt not in qr.FORMATS:
+        raise Http404
+    try:
+        order = qr.load_order(order_id)
+    except Order.DoesNotExist:
+        raise Http404
+    if request.user.pk not in (order.product.seller_id, order.buyer_id, order.assigned_rider_id) and not request.user.is_staff:
+        raise Http404
+
+    payload = qr.order_payload(order)
+    digest = qr.payload_hash(payload)
+    etag = f'"{digest}-{fmt}"'
+    # Same details, same image: the browser revalidates every time and gets a
+    # 304 until the order details (and so the digest) change
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(qr.get_image(payload, fmt, digest), content_type=qr.FORMATS[fmt])
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True, must_revalidate=True)
+    return response
+
 @login_required
 def assign_rider(request, order_id, rider_id):
     """Assign a rider to an order"""
@@ -620,15 +685,16 @@ def assign_rider(request, order_id, rider_id):
         
     rider = get_object_or_404(User, id=rider_id, role=User.Role.RIDER)
     
-    order.assigned_rider = rider
     # Update status to ACCEPTED if it was PENDING -> This signifies the farmer has 'processed' it
     if order.status == 'PENDING':
-        order.status = 'ACCEPTED'
-        
-    order.save()
+        transitions.transition(order, 'ACCEPTED', assigned_rider=rider)
+    else:
+        order.assigned_rider = rider
+        order.save(update_fields=['assigned_rider', 'updated_at'])
+    dispatch.close_proposals(order, rider)
     
     # Notify Rider
-    Notification.objects.create(
+    notify(
         user=rider,
         notification_type='ORDER_ASSIGNED',
         order=order,
@@ -658,11 +724,10 @@ def update_order_status(request, order_id):
             # If we overwrite ESCROW, we might lose the 'paid' state visibility in some logic if not careful.
             # However, our models allow IN_DELIVERY. 
             # Ideally, IN_DELIVERY implies it's moving.
-            order.status = 'IN_DELIVERY'
-            order.save()
+            transitions.transition(order, 'IN_DELIVERY')
             
             # Notify Buyer
-            Notification.objects.create(
+            notify(
                 user=order.buyer,
                 notification_type='ORDER_UPDATE',
                 order=order,
@@ -672,11 +737,10 @@ def update_order_status(request, order_id):
             
     elif new_status == 'DELIVERED':
         if order.status == 'IN_DELIVERY' or order.status == 'ESCROW':
-            order.status = 'DELIVERED'
-            order.save()
+            transitions.transition(order, 'DELIVERED')
             
             # Notify Buyer to confirm
-            Notification.objects.create(
+            notify(
                 user=order.buyer,
                 notification_type='ORDER_DELIVERED',
                 order=order,
@@ -689,18 +753,22 @@ def update_order_status(request, order_id):
 @login_required
 def complete_pickup_order(request, order_id):
     """Farmer marks a pickup order as completed (handover done)"""
-    order = get_object_or_404(Order, id=order_id, product__seller=request.user)
+    order = get_object_or_404(Order, id=order_id, seller=request.user)
     
     if order.delivery_method != 'PICKUP':
         messages.error(request, "This action is only for pickup orders.")
         return redirect('dashboard')
         
     if order.status == 'ACCEPTED':
-        order.status = 'COMPLETED'
-        order.save()
+        try:
+            transitions.transition(order, 'COMPLETED')
+        except transitions.InvalidTransition as e:
+            # Lost a race (double click, accept against reject)
+            messages.error(request, str(e))
+            return redirect('dashboard')
         
         # Notify Buyer
-        Notification.objects.create(
+        notify(
             user=order.buyer,
             notification_type='ORDER_COMPLETED',
             order=order,
@@ -1,3 +1,28 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PaymentEvent, PaymentJob, PayoutJob
+
+
+@admin.register(PaymentJob)
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'phone', 'amount', 'status', 'attempts', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('order__id', 'phone', 'checkout_request_id')
+    readonly_fields = ('checkout_request_id', 'attempts', 'error')
+
+
+@admin.register(PayoutJob)
+class PayoutJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'order', 'phone', 'amount', 'status', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('order__id', 'phone', 'conversation_id')
+    readonly_fields = ('conversation_id', 'error')
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'callback_id', 'result_code', 'order', 'received_at', 'processed_at')
+    list_filter = ('kind', 'result_code', 'received_at')
+    search_fields = ('callback_id', 'order__id', 'error')
+    readonly_fields = ('kind', 'callback_id', 'result_code', 'payload', 'order', 'received_at', 'processed_at',
+                      'error')
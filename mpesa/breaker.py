@@ -0,0 +1,52 @@
+"""
+Circuit breaker for calls to Daraja, shared by every worker through the
+default cache (Redis in production).
+
+After ``threshold`` failures in a row the circuit *opens*: callers are told
+to back off for ``cooldown`` seconds instead of piling more requests onto a
+Safaricom that is already struggling. Once the cooldown is over one probe
+request is let through (*half-open*); its success closes the circuit, its
+failure opens it for another cooldown.
+"""
+import time
+
+from django.core.cache import cache
+
+
+class CircuitBreaker:
+    def __init__(self, name, threshold=5, cooldown=30):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def _key(self, part):
+        return f'breaker:{self.name}:{part}'
+
+    def retry_after(self):
+        """0 if a call may go ahead now, else seconds until the circuit may be tried again."""
+        opened_until = cache.get(self._key('open_until'))
+        if opened_until is None:
+            return 0
+        remaining = opened_until - time.time()
+        if remaining > 0:
+            return remaining
+        # Half-open: the first caller to get here is the probe, the rest keep waiting
+        if cache.add(self._key('probe'), 1, timeout=self.cooldown):
+            return 0
+        return self.cooldown
+
+    def allow(self):
+        return self.retry_after() == 0
+
+    def is_open(self):
+        return cache.get(self._key('open_until')) is not None
+
+    def record_success(self):
+        cache.delete_many([self._key('failures'), self._key('open_until'), self._key('probe')])
+
+    def record_failure(self):
+        key = self._key('failures')
+        cache.add(key, 0, timeout=None)
+        if cache.incr(key) >= self.threshold:
+            cache.set(self._key('open_until'), time.time() + self.cooldown, timeout=None)
+            cache.delete(self._key('probe'))
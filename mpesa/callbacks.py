@@ -0,0 +1,239 @@
+"""
+M-Pesa callback ingestion.
+
+Safaricom's callbacks (STK push results, B2C payout results and timeouts)
+are acknowledged as soon as they are stored: the view does one
+``INSERT ... ON CONFLICT DO NOTHING`` into PaymentEvent and answers.
+Repeats of a callback hit the unique key and are dropped there.
+
+A Celery task then applies the stored events to orders a batch at a time:
+one indexed lookup per batch for the orders (STK results through the
+PaymentJob holding their CheckoutRequestID, B2C ones through the PayoutJob
+holding their ConversationID), each order's change through
+``marketplace.transitions`` and the money's through ``ledger.books``, and
+one UPDATE stamping the batch processed. Each event is applied in its own
+savepoint: one that fails is rolled back, logged, and stamped processed
+with its ``error``, so it can't hold up the events queued behind it.
+A failed payout leaves its order DISPUTED, for mpesa.payouts to retry.
+However many callbacks arrive at once, only one processing run is queued
+at a time, and a beat job sweeps up anything left behind.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from ledger import books
+from marketplace import transitions
+from marketplace.models import Notification, Order
+from marketplace.notifications import notify_many
+from . import payouts
+from .models import PaymentEvent, PaymentJob, PayoutJob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+SCHEDULED_KEY = 'mpesa:events:scheduled'
+SCHEDULED_TIMEOUT = 60  # a lost run stops blocking new ones after this
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+def _result(payload):
+    # B2C results and timeouts come as {"Result": {...}}
+    return payload.get('Result', payload)
+
+
+def parse(kind, payload):
+    """``(callback_id, result_code)`` of a callback body. Raises InvalidCallback."""
+    try:
+        if kind == PaymentEvent.STK:
+            body = payload['Body']['stkCallback']
+            callback_id = body.get('CheckoutRequestID')
+        else:
+            body = _result(payload)
+            callback_id = body.get('ConversationID') or body.get('OriginatorConversationID')
+    except (KeyError, TypeError, AttributeError):
+        raise InvalidCallback("Unexpected callback body.")
+    if not callback_id:
+        raise InvalidCallback("Callback has no request id.")
+    result_code = body.get('ResultCode')
+    try:
+        result_code = None if result_code is None else int(result_code)
+    except (TypeError, ValueError):
+        raise InvalidCallback(f"Invalid ResultCode {result_code!r}")
+    return str(callback_id)[:100], result_code
+
+
+def record(kind, payload):
+    """Store a callback (once, however often Safaricom sends it) and queue its processing."""
+    callback_id, result_code = parse(kind, payload)
+    PaymentEvent.objects.bulk_create(
+        [PaymentEvent(kind=kind, callback_id=callback_id, result_code=result_code, payload=payload)],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(schedule)
+
+
+def schedule():
+    from .tasks import process_payment_events
+
+    # One queued run at a time; a burst of callbacks shares it
+    if cache.add(SCHEDULED_KEY, 1, timeout=SCHEDULED_TIMEOUT):
+        process_payment_events.delay()
+
+
+def process_pending(batch_size=BATCH_SIZE):
+    """Apply every unprocessed event, a batch at a time. Returns how many were processed."""
+    # Anything recorded from here on queues another run
+    cache.delete(SCHEDULED_KEY)
+    count = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True).order_by('id')[:batch_size]
+            )
+            if not events:
+                return count
+            apply_batch(events)
+        count += len(events)
+
+
+def apply_batch(events):
+    notifications = []
+    _apply_stk([event for event in events if event.kind == PaymentEvent.STK])
+    _apply_payouts([event for event in events if event.kind != PaymentEvent.STK], notifications)
+    now = timezone.now()
+    for event in events:
+        event.processed_at = now
+    PaymentEvent.objects.bulk_update(events, ['processed_at', 'order', 'error'])
+    if notifications:
+        notify_many(notifications)
+
+
+def _apply_each(events, apply):
+    """Run ``apply(event, order)`` for each event with an order, each in its own savepoint."""
+    for event in events:
+        order = event.order
+        if order is None:
+            continue
+        try:
+            with transaction.atomic():
+                apply(event, order)
+        except Exception as e:
+            logger.exception("Could not apply M-Pesa %s callback %s to order %s", event.kind, event.callback_id, order.pk)
+            event.error = f"{type(e).__name__}: {e}"[:255]
+            # Rolled back: later events for the order must see it as it is
+            order.refresh_from_db()
+
+
+def stk_receipt(payload):
+    items = payload['Body']['stkCallback'].get('CallbackMetadata', {}).get('Item', [])
+    for item in items:
+        if item.get('Name') == 'MpesaReceiptNumber':
+            return item.get('Value')
+    return ''
+
+
+def _apply_stk(events):
+    if not events:
+        return
+    ids = [event.callback_id for event in events]
+    jobs = {job.checkout_request_id: job
+            for job in PaymentJob.objects.filter(checkout_request_id__in=ids).select_related('order')}
+    # Every prompt's job, not just the order's latest push: a payment made on
+    # an earlier prompt still finds its order
+    orders = {checkout_request_id: job.order for checkout_request_id, job in jobs.items()}
+    unmatched = [callback_id for callback_id in ids if callback_id not in orders]
+    if unmatched:
+        # Pushes recorded only on the order (the sandbox shortcut, pushes sent before jobs kept their ids)
+        orders.update((order.checkout_request_id, order) for order in Order.objects.filter(checkout_request_id__in=unmatched))
+    # One instance per order, so two prompts for it see each other's changes
+    by_pk = {}
+    orders = {callback_id: by_pk.setdefault(order.pk, order) for callback_id, order in orders.items()}
+    failed_jobs = []
+
+    def apply(event, order):
+        if event.succeeded:
+            if transitions.can_transition(order, 'ESCROW'):
+                transitions.transition(order, 'ESCROW', mpesa_receipt_number=stk_receipt(event.payload))
+                books.escrow_in(order)
+            return
+        # Cancelled on the phone, wrong PIN, ...: let the buyer try again
+        job = jobs.get(event.callback_id)
+        if job and job.status == PaymentJob.SENT:
+            job.status = PaymentJob.FAILED
+            job.error = event.payload['Body']['stkCallback'].get('ResultDesc', '')[:255]
+            job.updated_at = timezone.now()
+            failed_jobs.append(job)
+
+    for event in events:
+        event.order = orders.get(event.callback_id)
+    _apply_each(events, apply)
+    PaymentJob.objects.bulk_update(failed_jobs, ['status', 'error', 'updated_at'])
+
+
+def b2c_transaction_id(payload):
+    return _result(payload).get('TransactionID') or ''
+
+
+def _apply_payouts(events, notifications):
+    if not events:
+        return
+    ids = [event.callback_id for event in events]
+    jobs = {job.conversation_id: job
+            for job in PayoutJob.objects.filter(conversation_id__in=ids).select_related('order')}
+    # Every payout's job, not just the order's latest: a retried payout's
+    # earlier result still finds its order
+    orders = {conversation_id: job.order for conversation_id, job in jobs.items()}
+    unmatched = [callback_id for callback_id in ids if callback_id not in orders]
+    if unmatched:
+        # Payouts sent before they had jobs
+        orders.update((order.payout_conversation_id, order)
+                      for order in Order.objects.filter(payout_conversation_id__in=unmatched))
+    by_pk = {}
+    orders = {callback_id: by_pk.setdefault(order.pk, order) for callback_id, order in orders.items()}
+    settled_jobs = []
+
+    def settle(event, status, error=''):
+        # Last in apply(), so a rolled-back event leaves its job as it was
+        job = jobs.get(event.callback_id)
+        if job and job.status != status:
+            job.status = status
+            job.error = error[:255]
+            job.updated_at = timezone.now()
+            settled_jobs.append(job)
+
+    def apply(event, order):
+        if event.kind == PaymentEvent.B2C_RESULT and event.succeeded:
+            receipt = b2c_transaction_id(event.payload)
+            books.farmer_payout(order, receipt)
+            if order.status == 'DISPUTED' and not order.payout_receipt_number:
+                # A timeout was reported first, then the payout went through after all
+                transitions.transition(order, 'PAID_OUT', payout_receipt_number=receipt)
+            else:
+                order.payout_receipt_number = receipt
+                order.save(update_fields=['payout_receipt_number', 'updated_at'])
+            settle(event, PayoutJob.PAID)
+            return
+        reason = _result(event.payload).get('ResultDesc') or 'timed out'
+        if order.status == 'PAID_OUT' and not order.payout_receipt_number:
+            transitions.transition(order, 'DISPUTED')
+            if payouts.will_retry(order):
+                then = "We'll retry it."
+            else:
+                then = "Our team will be in touch to sort it out."
+            notifications.append(Notification(
+                user_id=order.seller_id, notification_type='PAYOUT_FAILED', order=order,
+                message=f"The M-Pesa payout for order #{order.id} didn't go through ({reason}). {then}",
+            ))
+        settle(event, PayoutJob.FAILED, reason)
+
+    for event in events:
+        event.order = orders.get(event.callback_id)
+    _apply_each(events, apply)
+    PayoutJob.objects.bulk_update(settled_jobs, ['status', 'error', 'updated_at'])
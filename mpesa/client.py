@@ -0,0 +1,147 @@
+"""
+Daraja (M-Pesa API) client shared by the whole process.
+
+- The OAuth token is cached until shortly before Safaricom's ``expires_in``
+  runs out, so a payment is one HTTP call instead of a token call plus the
+  payment call. A lock makes concurrent requests wait for the one refresh
+  in flight instead of each fetching their own token.
+- Calls go through one pooled ``requests.Session``, which keeps the TLS
+  connection to Safaricom alive between payments. Every call has a timeout.
+- A call that never reached Safaricom (no connection, or no token) raises
+  MpesaNotSent, so callers know it is safe to send again. Any other failure
+  (a read timeout, a dropped connection) raises MpesaError: the request may
+  have been acted on.
+
+    client = get_client()
+    client.post('/mpesa/stkpush/v1/processrequest', payload)
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+PRODUCTION_URL = "https://api.safaricom.co.ke"
+SANDBOX_URL = "https://sandbox.safaricom.co.ke"
+TOKEN_PATH = "/oauth/v1/generate?grant_type=client_credentials"
+
+TIMEOUT = (3.05, 30)      # (connect, read) seconds
+REFRESH_MARGIN = 60       # refresh the token this many seconds before it expires
+DEFAULT_EXPIRES_IN = 3599 # what Daraja issues, if a response leaves it out
+POOL_SIZE = 10            # kept-alive connections; more than the web workers' threads
+
+
+class MpesaError(Exception):
+    """Daraja couldn't be reached or refused the credentials."""
+
+
+class MpesaNotSent(MpesaError):
+    """The request never reached Daraja, so sending it again can't repeat it."""
+
+
+def _never_sent(exc):
+    """True if ``exc`` failed while connecting, before any of the request went out."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.ConnectionError):
+        reason = exc.args[0] if exc.args else None
+        # requests wraps urllib3's MaxRetryError, whose reason is the real error
+        return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+    return False
+
+
+def base_url():
+    if settings.MPESA_BASE_URL:
+        return settings.MPESA_BASE_URL.rstrip('/')
+    return PRODUCTION_URL if settings.MPESA_ENV == 'production' else SANDBOX_URL
+
+
+class MpesaClient:
+    def __init__(self, base_url, consumer_key, consumer_secret, timeout=TIMEOUT):
+        self.base_url = base_url
+        self.auth = (consumer_key or '', consumer_secret or '')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    def access_token(self):
+        """The cached token, fetching a new one if it's missing or about to expire."""
+        if self._fresh():
+            return self._token
+        with self._lock:
+            # Another thread may have refreshed it while we waited
+            if not self._fresh():
+                self._refresh()
+            return self._token
+
+    def _refresh(self):
+        try:
+            response = self.session.get(self.base_url + TOKEN_PATH, auth=self.auth, timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            # The call the token was for hasn't been made
+            raise MpesaNotSent(f"Token request failed: {e}") from e
+        token = data.get('access_token')
+        if not token:
+            raise MpesaNotSent(f"No access token in response: {response.text}")
+        expires_in = int(data.get('expires_in') or DEFAULT_EXPIRES_IN)
+        self._token = token
+        self._expires_at = time.monotonic() + max(expires_in - REFRESH_MARGIN, 0)
+
+    def invalidate(self, token):
+        """Forget ``token`` (if it's still the cached one) so the next call fetches another."""
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def post(self, path, payload):
+        """
+        POST ``payload`` to Daraja; returns the ``requests`` response. Raises
+        MpesaNotSent if it never got there, MpesaError if the answer was lost.
+        """
+        token = self.access_token()
+        response = self._post(path, payload, token)
+        if response.status_code == 401:
+            # Revoked early or cached across a credentials change: one retry with a new token
+            self.invalidate(token)
+            response = self._post(path, payload, self.access_token())
+        return response
+
+    def _post(self, path, payload, token):
+        try:
+            return self.session.post(self.base_url + path, json=payload, timeout=self.timeout,
+                                     headers={"Authorization": f"Bearer {token}"})
+        except requests.RequestException as e:
+            if _never_sent(e):
+                raise MpesaNotSent(str(e)) from e
+            raise MpesaError(str(e)) from e
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client, built from settings on first use."""
+    global _client
+    config = (base_url(), settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET)
+    with _client_lock:
+        # Rebuilt if the settings change (override_settings in tests)
+        if _client is None or (_client.base_url, *_client.auth) != tuple(value or '' for value in config):
+            if _client is not None:
+                _client.close()
+            _client = MpesaClient(*config)
+        return _client
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from mpesa.stub import StubDaraja
+
+class Command(BaseCommand):
+    help = 'Runs a local stub of the Daraja API (point MPESA_BASE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--expires-in', type=int, default=3599, help='Token lifetime in seconds')
+
+    def handle(self, *args, **options):
+        daraja = StubDaraja(port=options['port'], expires_in=options['expires_in'])
+        self.stdout.write(self.style.SUCCESS(f"Stub Daraja on {daraja.url} (MPESA_BASE_URL={daraja.url})"))
+        try:
+            daraja.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daraja.server.server_close()
+            self.stdout.write(f"Requests served: {dict(daraja.counts)}")
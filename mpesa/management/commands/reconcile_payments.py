@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from mpesa import reconcile
+
+class Command(BaseCommand):
+    help = 'Queries Daraja for STK pushes whose callback never arrived and applies the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=reconcile.RUN_LIMIT, help='Most orders to check this run')
+
+    def handle(self, *args, **options):
+        report = reconcile.reconcile(limit=options['limit'])
+        self.stdout.write(f"Checked:  {report.checked}")
+        self.stdout.write(f"Paid:     {report.paid}")
+        self.stdout.write(f"Failed:   {report.failed}")
+        self.stdout.write(f"Pending:  {report.pending}")
+        self.stdout.write(f"Errors:   {report.errors}")
+        if report.stopped:
+            self.stdout.write(self.style.WARNING(f"Stopped early: {report.stopped}"))
+        self.stdout.write(self.style.SUCCESS(f"Applied {report.applied} result(s) in {report.seconds:.1f} s"))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0033_order_payout'),
+        ('mpesa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('STK', 'STK push result'), ('B2C_RESULT', 'B2C payout result'), ('B2C_TIMEOUT', 'B2C payout timeout')], max_length=12)),
+                ('callback_id', models.CharField(help_text='CheckoutRequestID (STK) or ConversationID (B2C)', max_length=100)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentjob',
+            index=models.Index(fields=['checkout_request_id'], name='payment_job_checkout_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='marketplace.order'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='payment_event_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentevent',
+            constraint=models.UniqueConstraint(fields=('kind', 'callback_id'), name='payment_event_callback_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0002_payment_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentevent',
+            name='error',
+            field=models.CharField(blank=True, help_text='Why applying it failed, if it did', max_length=255),
+        ),
+    ]
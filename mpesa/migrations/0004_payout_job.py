@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0034_order_awaiting_payment_idx'),
+        ('mpesa', '0003_payment_event_error'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone', models.CharField(max_length=15)),
+                ('amount', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('SENDING', 'Sending'), ('SENT', 'Sent to M-Pesa'), ('UNCONFIRMED', 'Unconfirmed'), ('FAILED', 'Failed')], default='SENDING', max_length=12)),
+                ('conversation_id', models.CharField(blank=True, max_length=100)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payout_jobs', to='marketplace.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order', '-created_at'], name='payout_job_order_idx')],
+            },
+        ),
+    ]
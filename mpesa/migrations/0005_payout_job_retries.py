@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0034_order_awaiting_payment_idx'),
+        ('mpesa', '0004_payout_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payoutjob',
+            name='status',
+            field=models.CharField(choices=[('SENDING', 'Sending'), ('SENT', 'Sent to M-Pesa'), ('UNCONFIRMED', 'Unconfirmed'), ('PAID', 'Paid'), ('FAILED', 'Failed')], default='SENDING', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='payoutjob',
+            index=models.Index(fields=['conversation_id'], name='payout_job_conversation_idx'),
+        ),
+    ]
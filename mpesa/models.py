@@ -1,3 +1,124 @@
 from django.db import models
 
-# Create your models here.
+
+class PaymentJob(models.Model):
+    """
+    One STK push for an order, sent to Daraja by a Celery worker instead of
+    inside the web request (see mpesa.payments). The payment page polls it.
+    """
+    QUEUED = 'QUEUED'
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent to phone'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE = [QUEUED, SENDING]
+
+    order = models.ForeignKey('marketplace.Order', on_delete=models.CASCADE, related_name='payment_jobs')
+    phone = models.CharField(max_length=15)
+    amount = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    checkout_request_id = models.CharField(max_length=100, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', '-created_at'], name='payment_job_order_idx'),
+            # STK callbacks report back by CheckoutRequestID
+            models.Index(fields=['checkout_request_id'], name='payment_job_checkout_idx'),
+        ]
+
+    def __str__(self):
+        return f"STK push for order #{self.order_id}: {self.status}"
+
+
+class PayoutJob(models.Model):
+    """
+    One B2C payout of an order's escrow to its farmer (see mpesa.payouts).
+    UNCONFIRMED ones never got an answer from Daraja: the money may or may
+    not have gone out, so staff settle them. A retry after a FAILED one is a
+    new job, with its own ConversationID.
+    """
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    UNCONFIRMED = 'UNCONFIRMED'
+    PAID = 'PAID'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (SENDING, 'Sending'),
+        (SENT, 'Sent to M-Pesa'),
+        (UNCONFIRMED, 'Unconfirmed'),
+        (PAID, 'Paid'),
+        (FAILED, 'Failed'),
+    ]
+    # The payout may still go through: never retried while one of these is there
+    OPEN = [SENDING, SENT, UNCONFIRMED]
+
+    order = models.ForeignKey('marketplace.Order', on_delete=models.CASCADE, related_name='payout_jobs')
+    phone = models.CharField(max_length=15)
+    amount = models.PositiveIntegerField()
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=SENDING)
+    conversation_id = models.CharField(max_length=100, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', '-created_at'], name='payout_job_order_idx'),
+            # B2C results and timeouts report back by ConversationID
+            models.Index(fields=['conversation_id'], name='payout_job_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"B2C payout for order #{self.order_id}: {self.status}"
+
+
+class PaymentEvent(models.Model):
+    """
+    A callback from Safaricom, stored as received before anything acts on it
+    (see mpesa.callbacks). Rows are only ever added, and stamped once
+    processed, with ``error`` set if applying it failed. Safaricom repeats
+    callbacks; the unique key keeps one of each.
+    """
+    STK = 'STK'
+    B2C_RESULT = 'B2C_RESULT'
+    B2C_TIMEOUT = 'B2C_TIMEOUT'
+    KIND_CHOICES = [
+        (STK, 'STK push result'),
+        (B2C_RESULT, 'B2C payout result'),
+        (B2C_TIMEOUT, 'B2C payout timeout'),
+    ]
+
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    callback_id = models.CharField(max_length=100, help_text="CheckoutRequestID (STK) or ConversationID (B2C)")
+    result_code = models.IntegerField(null=True, blank=True)
+    payload = models.JSONField()
+    order = models.ForeignKey('marketplace.Order', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='payment_events')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True, help_text="Why applying it failed, if it did")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'callback_id'], name='payment_event_callback_uniq'),
+        ]
+        indexes = [
+            # The worker's queue: events not yet applied
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='payment_event_pending_idx'),
+        ]
+
+    @property
+    def succeeded(self):
+        return self.result_code == 0
+
+    def __str__(self):
+        return f"{self.kind} {self.callback_id} ({self.result_code})"
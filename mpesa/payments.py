@@ -0,0 +1,189 @@
+"""
+STK pushes, sent off the web request.
+
+``initiate_payment`` only records a PaymentJob and queues
+``mpesa.tasks.send_stk_push``, then answers the browser straight away; the
+payment page polls the job. The task runs on the ``payments`` Celery queue,
+whose worker pool size bounds how many calls to Safaricom are in flight
+however many buyers press Pay at once.
+
+An STK push is not idempotent: if Safaricom took the request and only the
+answer was lost, pushing again puts a second prompt on the buyer's phone.
+So only attempts that certainly never reached Daraja (no connection, no
+token, or a 429) are retried, with exponential backoff. A read timeout, a
+5xx or an unreadable answer ends the job FAILED, as the prompt may be on
+its way; the buyer can press Pay again.
+
+Before any push, the order's earlier prompts that Safaricom hasn't reported
+on are asked about through the STK push query: one the buyer paid ends the
+job (the answer is stored as a PaymentEvent and applied like a callback),
+one still open on the phone makes the job wait and ask again.
+
+Every CheckoutRequestID stays on its PaymentJob, and callbacks are matched
+to orders through the jobs (mpesa.callbacks), so a payment made on an
+earlier prompt still finds its order.
+
+Failures also feed a circuit breaker shared by all workers: while it is
+open, jobs wait out the cooldown without calling Daraja at all. A definite
+answer from Daraja (accepted, or rejected, e.g. a bad phone number) ends
+the job.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .breaker import CircuitBreaker
+from .client import MpesaError, MpesaNotSent, get_client
+from .models import PaymentEvent, PaymentJob
+from .utils import STK_PUSH_PATH, format_phone, stk_push_payload
+
+MAX_ATTEMPTS = getattr(settings, 'MPESA_MAX_ATTEMPTS', 5)
+RETRY_BASE_DELAY = getattr(settings, 'MPESA_RETRY_BASE_DELAY', 2)  # seconds; doubles per attempt
+RETRY_MAX_DELAY = 60
+STALE_AFTER = timedelta(minutes=5)  # an active job this old has lost its worker
+
+breaker = CircuitBreaker(
+    'daraja',
+    threshold=getattr(settings, 'MPESA_BREAKER_THRESHOLD', 5),
+    cooldown=getattr(settings, 'MPESA_BREAKER_COOLDOWN', 30),
+)
+
+
+class RetryLater(Exception):
+    def __init__(self, countdown, reason):
+        self.countdown = countdown
+        self.reason = reason
+        super().__init__(reason)
+
+
+def backoff(attempt):
+    """Seconds to wait after ``attempt`` failed, with jitter so retries don't arrive together."""
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+
+def queue_stk_push(order, phone):
+    """
+    A PaymentJob sending ``order``'s STK push to ``phone``. Pressing Pay again
+    while one is still on its way returns that job instead of a second push.
+    """
+    from .tasks import send_stk_push
+
+    with transaction.atomic():
+        recent = timezone.now() - STALE_AFTER
+        job = order.payment_jobs.filter(status__in=PaymentJob.ACTIVE, updated_at__gte=recent).first()
+        if job:
+            return job
+        job = PaymentJob.objects.create(order=order, phone=format_phone(phone), amount=int(order.total_price))
+        transaction.on_commit(lambda: send_stk_push.delay(job.pk))
+    return job
+
+
+def latest_job(order):
+    return order.payment_jobs.order_by('-created_at').first()
+
+
+def _update(job, **changes):
+    for name, value in changes.items():
+        setattr(job, name, value)
+    job.save(update_fields=[*changes, 'updated_at'])
+
+
+def unanswered_pushes(order_id, exclude=None):
+    """CheckoutRequestIDs of ``order_id``'s prompts that Safaricom hasn't reported on yet, newest first."""
+    answered = PaymentEvent.objects.filter(kind=PaymentEvent.STK, callback_id=OuterRef('checkout_request_id'))
+    jobs = PaymentJob.objects.filter(order_id=order_id, status=PaymentJob.SENT).exclude(checkout_request_id='')
+    if exclude is not None:
+        jobs = jobs.exclude(pk=exclude.pk)
+    return list(jobs.exclude(Exists(answered)).order_by('-created_at').values_list('checkout_request_id', flat=True))
+
+
+def _check_earlier_pushes(job):
+    """
+    Ask Daraja about the order's unanswered prompts. Returns True if one was
+    paid (the job is then over); raises RetryLater while one is still open.
+    """
+    from . import callbacks, reconcile
+
+    for checkout_request_id in unanswered_pushes(job.order_id, exclude=job):
+        outcome, result = reconcile.query(checkout_request_id)
+        if outcome in (reconcile.PAID, reconcile.FAILED):
+            PaymentEvent.objects.bulk_create([reconcile.as_event(checkout_request_id, result)], ignore_conflicts=True)
+            transaction.on_commit(callbacks.schedule)
+        if outcome == reconcile.PAID:
+            _update(job, status=PaymentJob.FAILED, error="An earlier M-Pesa prompt for this order was already paid.")
+            return True
+        if outcome in (reconcile.PENDING, reconcile.ERROR):
+            reason = ("An earlier M-Pesa prompt for this order is still open."
+                      if outcome == reconcile.PENDING else "Couldn't check the earlier M-Pesa prompt.")
+            _update(job, status=PaymentJob.QUEUED, error=reason)
+            raise RetryLater(backoff(job.attempts), reason)
+    return False
+
+
+def send(job):
+    """
+    Make one attempt at ``job``. Raises RetryLater if it should be tried
+    again; otherwise the job ends up SENT or FAILED.
+    """
+    if job.status not in PaymentJob.ACTIVE:
+        return
+    wait = breaker.retry_after()
+    if wait:
+        _update(job, error="M-Pesa is not responding; waiting to retry.")
+        raise RetryLater(wait, job.error)
+
+    _update(job, status=PaymentJob.SENDING, attempts=job.attempts + 1)
+    if _check_earlier_pushes(job):
+        return
+    try:
+        response = get_client().post(STK_PUSH_PATH, stk_push_payload(job.phone, job.amount, f"Order-{job.order_id}"))
+    except MpesaNotSent as e:
+        breaker.record_failure()
+        _update(job, status=PaymentJob.QUEUED, error=str(e)[:255])
+        raise RetryLater(backoff(job.attempts), job.error)
+    except MpesaError as e:
+        return _unconfirmed(job, str(e))
+    if response.status_code == 429:
+        # Throttled: turned away before Safaricom acted on it
+        breaker.record_failure()
+        _update(job, status=PaymentJob.QUEUED, error="M-Pesa is busy; waiting to retry.")
+        raise RetryLater(backoff(job.attempts), job.error)
+    if response.status_code >= 500:
+        return _unconfirmed(job, f"Daraja answered {response.status_code}")
+    try:
+        data = response.json()
+    except ValueError as e:
+        return _unconfirmed(job, str(e))
+    breaker.record_success()
+
+    checkout_request_id = data.get('CheckoutRequestID')
+    if not checkout_request_id:
+        error_desc = data.get('ResponseDescription') or data.get('errorMessage') or "Unknown Error"
+        error_code = data.get('ResponseCode') or data.get('errorCode')
+        _update(job, status=PaymentJob.FAILED, error=f"{error_desc} (Code: {error_code})"[:255])
+        return
+
+    with transaction.atomic():
+        _update(job, status=PaymentJob.SENT, checkout_request_id=checkout_request_id, error='')
+        # The latest push, for display and reconciliation; callbacks match through the job
+        order = job.order
+        order.checkout_request_id = checkout_request_id
+        order.save(update_fields=['checkout_request_id', 'updated_at'])
+
+
+def _unconfirmed(job, reason):
+    """Safaricom may have taken the push but we didn't hear back: don't send another one blind."""
+    breaker.record_failure()
+    _update(job, status=PaymentJob.FAILED, error=(
+        f"M-Pesa didn't confirm the request ({reason}). If a prompt arrives on your phone, complete it; "
+        "otherwise press Pay again."
+    )[:255])
+
+
+def give_up(job, reason):
+    _update(job, status=PaymentJob.FAILED, error=f"Gave up after {job.attempts} attempt(s): {reason}"[:255])
@@ -0,0 +1,126 @@
+"""
+B2C payouts: an order's escrow, less the rider's fee, to its farmer.
+
+The caller claims the order first, moving it to PAID_OUT through
+marketplace.transitions and committing that, so of two confirmations racing
+on one order only one gets to send. ``send`` then makes the B2C request
+outside any transaction: nothing is locked while Daraja answers, which can
+take up to the client's read timeout.
+
+Like an STK push, a B2C request is not idempotent, so each one is a
+PayoutJob and how it ended decides what happens to the claim:
+
+* Daraja accepted it (a ConversationID): SENT. The result callback books
+  the payout or reports its failure (mpesa.callbacks).
+* Daraja refused it, or it never left (MpesaNotSent): FAILED, and the order
+  goes back to the status it was claimed from.
+* No answer (a read timeout, a dropped connection, a 5xx, an unreadable
+  body): UNCONFIRMED. The money may have gone out, so the order stays
+  claimed and nothing sends it again; staff settle it with Safaricom.
+
+A payout Safaricom reports as failed or timed out leaves the order
+DISPUTED (mpesa.callbacks). ``retry_failed``, run from Celery beat
+(mpesa.tasks.retry_payouts), claims such orders back to PAID_OUT and sends
+a new payout, with a new ConversationID, once RETRY_AFTER has passed and
+while the order has had fewer than MAX_ATTEMPTS payouts. Never while a
+payout of the order may still go through (PayoutJob.OPEN).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from ledger import books
+from marketplace import transitions
+from marketplace.models import Order
+from .client import MpesaError, MpesaNotSent
+from .models import PayoutJob
+from .utils import format_phone, release_escrow_to_farmer
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'MPESA_PAYOUT_MAX_ATTEMPTS', 3)
+RETRY_AFTER = timedelta(minutes=getattr(settings, 'MPESA_PAYOUT_RETRY_MINUTES', 15))
+
+
+def _update(job, **changes):
+    for name, value in changes.items():
+        setattr(job, name, value)
+    job.save(update_fields=[*changes, 'updated_at'])
+
+
+def send(order, phone, claimed_from):
+    """
+    Send the payout for ``order``, already claimed (PAID_OUT) from
+    ``claimed_from``. Returns the PayoutJob; its status says how it went.
+    """
+    job = PayoutJob.objects.create(order=order, phone=format_phone(phone), amount=int(books.payout_for(order)))
+    try:
+        response = release_escrow_to_farmer(job.phone, job.amount)
+    except MpesaNotSent as e:
+        return _refused(job, order, claimed_from, str(e))
+    except (MpesaError, ValueError) as e:
+        return _unconfirmed(job, str(e))
+
+    conversation_id = response.get('ConversationID') if isinstance(response, dict) else None
+    if not conversation_id:
+        response = response if isinstance(response, dict) else {}
+        error_desc = response.get('ResponseDescription') or response.get('errorMessage') or "Unknown Error"
+        error_code = response.get('ResponseCode') or response.get('errorCode')
+        return _refused(job, order, claimed_from, f"{error_desc} (Code: {error_code})")
+
+    with transaction.atomic():
+        _update(job, status=PayoutJob.SENT, conversation_id=conversation_id)
+        order.payout_conversation_id = conversation_id
+        order.save(update_fields=['payout_conversation_id', 'updated_at'])
+    return job
+
+
+def _refused(job, order, claimed_from, reason):
+    """Nothing was paid: undo the claim, so the payout can be claimed again."""
+    with transaction.atomic():
+        _update(job, status=PayoutJob.FAILED, error=reason[:255])
+        transitions.undo_claim(order, claimed_from)
+    return job
+
+
+def _unconfirmed(job, reason):
+    logger.warning("B2C payout for order %s unconfirmed: %s", job.order_id, reason)
+    _update(job, status=PayoutJob.UNCONFIRMED, error=f"M-Pesa didn't confirm the payout ({reason})"[:255])
+    return job
+
+
+def will_retry(order):
+    """True if ``order``'s failed payout is retried (it hasn't had MAX_ATTEMPTS yet)."""
+    return order.payout_jobs.count() < MAX_ATTEMPTS
+
+
+def retryable(now=None):
+    """DISPUTED orders whose payout failed, due another try."""
+    now = now or timezone.now()
+    open_payouts = PayoutJob.objects.filter(order=OuterRef('pk'), status__in=PayoutJob.OPEN)
+    return (
+        Order.objects.filter(status='DISPUTED', payout_conversation_id__isnull=False,
+                             payout_receipt_number__isnull=True, updated_at__lt=now - RETRY_AFTER)
+        .exclude(Exists(open_payouts))
+        .annotate(attempts=Count('payout_jobs')).filter(attempts__lt=MAX_ATTEMPTS)
+    )
+
+
+def retry_failed(now=None):
+    """Send a new payout for every retryable order. Returns the PayoutJobs sent."""
+    jobs = []
+    for order in retryable(now).select_related('seller__profile').order_by('pk'):
+        phone = getattr(getattr(order.seller, 'profile', None), 'phone_number', '')
+        if not phone:
+            logger.warning("Can't retry the payout for order %s: the farmer has no phone number", order.pk)
+            continue
+        try:
+            transitions.transition(order, 'PAID_OUT')
+        except transitions.InvalidTransition:
+            continue  # settled some other way meanwhile
+        jobs.append(send(order, phone, 'DISPUTED'))
+    return jobs
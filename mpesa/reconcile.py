@@ -0,0 +1,184 @@
+"""
+Payment reconciliation: STK pushes whose callback never arrived.
+
+An order that got an STK push (``checkout_request_id`` set) but is still
+ACCEPTED after ``STALE_AFTER`` is asked about through Daraja's STK push
+query, once for each of its prompts (the order's latest push and every SENT
+PaymentJob's) that has no stored callback. The answers are stored as if they were
+the missing callbacks (PaymentEvents), and mpesa.callbacks applies them
+the usual batched way. A late real callback then finds its event already
+there and is dropped.
+
+Orders are read BATCH_SIZE at a time, by primary key. Each batch is
+queried at most CONCURRENCY at a time through the shared pooled client
+(mpesa.client). A run stops early at RUN_LIMIT orders, or if the
+breaker (mpesa.payments) opens. Results are counted in a ReconcileReport.
+
+Run every few minutes from Celery beat (mpesa.tasks.reconcile_payments),
+or with ``manage.py reconcile_payments``.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from marketplace.models import Order
+from . import callbacks
+from .client import MpesaError, get_client
+from .models import PaymentEvent, PaymentJob
+from .payments import breaker
+from .utils import STK_QUERY_PATH, stk_query_payload
+
+logger = logging.getLogger(__name__)
+
+STALE_AFTER = timedelta(minutes=getattr(settings, 'MPESA_RECONCILE_AFTER_MINUTES', 10))
+MAX_AGE = timedelta(days=1)  # older pushes are past asking about
+BATCH_SIZE = 200
+CONCURRENCY = getattr(settings, 'MPESA_RECONCILE_CONCURRENCY', 4)
+RUN_LIMIT = 5000
+STILL_PROCESSING = '500.001.1001'  # Daraja's errorCode while the buyer hasn't answered yet
+
+PAID = 'paid'
+FAILED = 'failed'
+PENDING = 'pending'
+ERROR = 'error'
+
+
+@dataclass
+class ReconcileReport:
+    checked: int = 0
+    paid: int = 0
+    failed: int = 0
+    pending: int = 0  # Safaricom is still waiting on the buyer; asked again next run
+    errors: int = 0   # couldn't ask; asked again next run
+    applied: int = 0  # stored events applied to their orders
+    stopped: str = ''
+    seconds: float = 0.0
+    apply_seconds: float = 0.0
+
+    def as_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        text = (f"checked {self.checked}: {self.paid} paid, {self.failed} failed, {self.pending} pending, "
+                f"{self.errors} errors; {self.applied} applied; {self.seconds:.1f} s "
+                f"({self.apply_seconds:.1f} s applying)")
+        return f"{text} (stopped: {self.stopped})" if self.stopped else text
+
+
+def stale_orders(now=None):
+    """Orders whose STK push went out a while ago with a prompt no callback is stored for."""
+    now = now or timezone.now()
+    answered = PaymentEvent.objects.filter(kind=PaymentEvent.STK, callback_id=OuterRef('checkout_request_id'))
+    unanswered_jobs = PaymentJob.objects.filter(order=OuterRef('pk'), status=PaymentJob.SENT).exclude(
+        checkout_request_id='').exclude(Exists(answered))
+    return (
+        Order.objects.filter(status='ACCEPTED', checkout_request_id__isnull=False,
+                             updated_at__range=(now - MAX_AGE, now - STALE_AFTER))
+        .filter((~Q(checkout_request_id__startswith='TEST-') & ~Exists(answered)) | Exists(unanswered_jobs))
+    )
+
+
+def unanswered_pushes(batch):
+    """``[(order pk, checkout_request_id)]`` of every unanswered prompt of the ``(pk, latest id)`` batch."""
+    pushes = {(pk, checkout_request_id) for pk, checkout_request_id in batch
+              if not checkout_request_id.startswith('TEST-')}  # sandbox shortcut, never sent
+    pushes.update(
+        PaymentJob.objects.filter(order_id__in=[pk for pk, _ in batch], status=PaymentJob.SENT)
+        .exclude(checkout_request_id='').values_list('order_id', 'checkout_request_id')
+    )
+    answered = set(PaymentEvent.objects.filter(
+        kind=PaymentEvent.STK, callback_id__in=[checkout_request_id for _, checkout_request_id in pushes],
+    ).values_list('callback_id', flat=True))
+    return sorted(push for push in pushes if push[1] not in answered)
+
+
+def query(checkout_request_id):
+    """``(outcome, result)`` of one STK push query. Runs on the pool's threads: HTTP only, no database."""
+    try:
+        response = get_client().post(STK_QUERY_PATH, stk_query_payload(checkout_request_id))
+        data = response.json()
+    except (MpesaError, ValueError) as e:
+        breaker.record_failure()
+        return ERROR, str(e)
+    if not isinstance(data, dict):
+        return ERROR, data
+    if data.get('errorCode') == STILL_PROCESSING:
+        breaker.record_success()
+        return PENDING, data
+    if response.status_code != 200 or 'ResultCode' not in data:
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure()
+        return ERROR, data
+    breaker.record_success()
+    try:
+        result_code = int(data['ResultCode'])
+    except (TypeError, ValueError):
+        # Not an answer we can store; asked again next run
+        return ERROR, data
+    return (PAID if result_code == 0 else FAILED), data
+
+
+def as_event(checkout_request_id, result):
+    # Stored in the STK callback's shape, so callbacks.apply_batch treats it as
+    # one. ``result`` is a PAID or FAILED answer from query(): ResultCode is numeric
+    return PaymentEvent(
+        kind=PaymentEvent.STK,
+        callback_id=checkout_request_id,
+        result_code=int(result['ResultCode']),
+        payload={'Body': {'stkCallback': {
+            'MerchantRequestID': result.get('MerchantRequestID', ''),
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': int(result['ResultCode']),
+            'ResultDesc': result.get('ResultDesc', ''),
+        }}, 'Reconciled': True},
+    )
+
+
+def reconcile(limit=RUN_LIMIT, now=None):
+    """Ask Daraja about up to ``limit`` stale STK pushes and apply the answers. Returns a ReconcileReport."""
+    report = ReconcileReport()
+    started = time.perf_counter()
+    orders = stale_orders(now).order_by('pk').values_list('pk', 'checkout_request_id')
+    last_pk = 0
+    # The pool is the concurrency bound: at most CONCURRENCY queries are in flight
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        while report.checked < limit:
+            if not breaker.allow():
+                report.stopped = "M-Pesa is not responding"
+                break
+            batch = list(orders.filter(pk__gt=last_pk)[:min(BATCH_SIZE, limit - report.checked)])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            pushes = unanswered_pushes(batch)
+            events = []
+            for (pk, checkout_request_id), (outcome, result) in zip(
+                    pushes, pool.map(query, [checkout_request_id for pk, checkout_request_id in pushes])):
+                if outcome == PAID:
+                    report.paid += 1
+                elif outcome == FAILED:
+                    report.failed += 1
+                elif outcome == PENDING:
+                    report.pending += 1
+                else:
+                    report.errors += 1
+                    logger.warning("STK query for order %s (%s) failed: %s", pk, checkout_request_id, result)
+                if outcome in (PAID, FAILED):
+                    events.append(as_event(checkout_request_id, result))
+            PaymentEvent.objects.bulk_create(events, ignore_conflicts=True)
+            report.checked += len(batch)
+        else:
+            report.stopped = f"run limit of {limit} reached"
+
+    applying = time.perf_counter()
+    report.applied = callbacks.process_pending()
+    report.apply_seconds = time.perf_counter() - applying
+    report.seconds = time.perf_counter() - started
+    logger.info("Payment reconciliation: %s", report)
+    return report
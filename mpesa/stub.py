@@ -0,0 +1,186 @@
+"""
+A local stand-in for Safaricom's Daraja API, for tests and benchmarks.
+
+Serves the token, STK push and B2C endpoints with canned responses and
+counts what it sees (requests per endpoint and TCP connections), so callers
+can check how many round trips a payment took. ``handshake_delay`` is slept
+once per new connection, roughly what a TLS handshake to Safaricom costs;
+``response_delay`` before each payment response (a slow Safaricom). While
+``outage`` is set, payment calls get a 503.
+
+STK push queries answer from ``query_results`` ({CheckoutRequestID:
+ResultCode}, or ``None`` for "still being processed"), defaulting to
+``default_query_result``. ``max_in_flight`` is the most payment calls seen
+being handled at once.
+
+    with StubDaraja() as daraja:
+        with override_settings(MPESA_BASE_URL=daraja.url):
+            ...
+        daraja.counts['token']
+
+or standalone: ``python manage.py daraja_stub --port 8765`` and set
+MPESA_BASE_URL=http://127.0.0.1:8765.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN_PATH = '/oauth/v1/generate'
+PATHS = {
+    '/mpesa/stkpush/v1/processrequest': 'stk_push',
+    '/mpesa/b2c/v1/paymentrequest': 'b2c',
+    '/mpesa/stkpushquery/v1/query': 'stk_query',
+}
+RESULT_DESCRIPTIONS = {
+    0: 'The service request is processed successfully.',
+    1032: 'Request cancelled by user',
+    1037: 'DS timeout user cannot be reached',
+}
+
+
+class StubDaraja:
+    def __init__(self, host='127.0.0.1', port=0, expires_in=3599, handshake_delay=0.0, response_delay=0.0):
+        self.expires_in = expires_in
+        self.handshake_delay = handshake_delay
+        self.response_delay = response_delay
+        self.outage = False
+        self.query_results = {}
+        self.default_query_result = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counts = Counter()
+        self.tokens = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def revoke_tokens(self):
+        """Make every token issued so far invalid, as Safaricom does on expiry."""
+        with self._lock:
+            self.tokens.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _handler(daraja):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def setup(self):
+            super().setup()
+            daraja.count('connections')
+            time.sleep(daraja.handshake_delay)
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.split('?')[0] != TOKEN_PATH:
+                return self.reply(404, {'errorMessage': 'Not found'})
+            daraja.count('token')
+            if not self.headers.get('Authorization', '').startswith('Basic '):
+                return self.reply(400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'})
+            # Daraja sends expires_in as a string
+            self.reply(200, {'access_token': daraja.issue_token(), 'expires_in': str(daraja.expires_in)})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            name = PATHS.get(self.path)
+            if name is None:
+                return self.reply(404, {'errorMessage': 'Not found'})
+            daraja.count(name)
+            daraja.enter()
+            try:
+                time.sleep(daraja.response_delay)
+                self.answer(name, payload)
+            finally:
+                daraja.leave()
+
+        def answer(self, name, payload):
+            if daraja.outage:
+                return self.reply(503, {'errorMessage': 'Service Unavailable'})
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            if token not in daraja.tokens:
+                return self.reply(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+            request_id = uuid.uuid4().hex[:20]
+            if name == 'stk_query':
+                checkout_request_id = payload.get('CheckoutRequestID')
+                result_code = daraja.query_results.get(checkout_request_id, daraja.default_query_result)
+                if result_code is None:
+                    return self.reply(500, {'requestId': request_id, 'errorCode': '500.001.1001',
+                                            'errorMessage': 'The transaction is being processed'})
+                self.reply(200, {
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'The service request has been accepted successsfully',
+                    'MerchantRequestID': f'stub-{request_id}',
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResultCode': str(result_code),
+                    'ResultDesc': RESULT_DESCRIPTIONS.get(result_code, 'The transaction failed'),
+                })
+            elif name == 'stk_push':
+                self.reply(200, {
+                    'MerchantRequestID': f'stub-{request_id}',
+                    'CheckoutRequestID': f'ws_CO_{request_id}',
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Success. Request accepted for processing',
+                    'CustomerMessage': f"Success. Request accepted for processing (KES {payload.get('Amount')})",
+                })
+            else:
+                self.reply(200, {
+                    'ConversationID': f'AG_{request_id}',
+                    'OriginatorConversationID': f'stub-{request_id}',
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Accept the service request successfully.',
+                })
+
+    return Handler
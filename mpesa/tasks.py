@@ -0,0 +1,48 @@
+from celery import shared_task
+from django.core.cache import cache
+
+from . import callbacks, payments, payouts, reconcile
+from .models import PaymentJob
+
+
+@shared_task(bind=True, max_retries=payments.MAX_ATTEMPTS - 1)
+def send_stk_push(self, job_id):
+    """Send a queued STK push, retrying with backoff while Daraja is failing."""
+    job = PaymentJob.objects.select_related('order').get(pk=job_id)
+    try:
+        payments.send(job)
+    except payments.RetryLater as e:
+        if self.request.retries >= self.max_retries:
+            payments.give_up(job, e.reason)
+            return job.status
+        raise self.retry(countdown=e.countdown)
+    return job.status
+
+
+@shared_task
+def process_payment_events():
+    """Apply stored M-Pesa callbacks to their orders. Queued by each callback; also scheduled every minute."""
+    return callbacks.process_pending()
+
+
+@shared_task
+def reconcile_payments():
+    """Ask Daraja about STK pushes whose callback never came. Scheduled every five minutes."""
+    # A slow run mustn't overlap the next one
+    if not cache.add('mpesa:reconcile:running', 1, timeout=15 * 60):
+        return None
+    try:
+        return reconcile.reconcile().as_dict()
+    finally:
+        cache.delete('mpesa:reconcile:running')
+
+
+@shared_task
+def retry_payouts():
+    """Send failed B2C payouts again. Scheduled every five minutes."""
+    if not cache.add('mpesa:payouts:running', 1, timeout=15 * 60):
+        return None
+    try:
+        return [job.pk for job in payouts.retry_failed()]
+    finally:
+        cache.delete('mpesa:payouts:running')
@@ -1,3 +1,448 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ledger import books
+from marketplace import transitions
+from marketplace.models import Notification, Order, Product
+from users.models import User
+from . import callbacks
+from . import client as mpesa_client
+from . import payments, payouts, reconcile, tasks
+from .client import MpesaClient
+from .models import PaymentEvent, PaymentJob, PayoutJob
+from .stub import StubDaraja
+
+STK_PATH = '/mpesa/stkpush/v1/processrequest'
+UNREACHABLE = 'http://127.0.0.1:1'  # connection refused: calls never reach Daraja
+
+
+class MpesaClientTest(SimpleTestCase):
+    def setUp(self):
+        self.daraja = StubDaraja().start()
+        self.addCleanup(self.daraja.stop)
+        self.client_ = MpesaClient(self.daraja.url, 'key', 'secret')
+        self.addCleanup(self.client_.close)
+
+    def test_token_is_reused_over_one_connection(self):
+        for _ in range(5):
+            response = self.client_.post(STK_PATH, {'Amount': 100})
+            self.assertEqual(response.json()['ResponseCode'], '0')
+        self.assertEqual(self.daraja.counts['token'], 1)
+        self.assertEqual(self.daraja.counts['stk_push'], 5)
+        self.assertEqual(self.daraja.counts['connections'], 1)
+
+    def test_token_refreshed_before_expiry_and_after_revocation(self):
+        token = self.client_.access_token()
+        # Still inside REFRESH_MARGIN of the 3599 s lifetime: cached
+        with mock.patch('mpesa.client.time.monotonic', return_value=self.client_._expires_at - 1):
+            self.assertEqual(self.client_.access_token(), token)
+        with mock.patch('mpesa.client.time.monotonic', return_value=self.client_._expires_at + 1):
+            self.assertNotEqual(self.client_.access_token(), token)
+
+        # A 401 drops the token and retries once
+        self.daraja.revoke_tokens()
+        self.assertEqual(self.client_.post(STK_PATH, {}).status_code, 200)
+        self.assertEqual(self.daraja.counts['token'], 3)
+        self.assertEqual(self.daraja.counts['stk_push'], 2)
+
+    def test_concurrent_callers_share_one_token_request(self):
+        self.daraja.handshake_delay = 0.05  # keep the first refresh in flight
+        start = threading.Barrier(8)
+        tokens = []
+
+        def pay():
+            start.wait()
+            tokens.append(self.client_.access_token())
+
+        threads = [threading.Thread(target=pay) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(tokens)), 1)
+        self.assertEqual(self.daraja.counts['token'], 1)
+
+    def test_shared_client_follows_settings(self):
+        with override_settings(MPESA_BASE_URL=self.daraja.url, MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret'):
+            shared = mpesa_client.get_client()
+            self.assertIs(mpesa_client.get_client(), shared)
+            self.assertEqual(shared.base_url, self.daraja.url)
+        with override_settings(MPESA_BASE_URL=None, MPESA_ENV='production'):
+            self.assertEqual(mpesa_client.get_client().base_url, mpesa_client.PRODUCTION_URL)
+
+
+class PaymentPipelineTest(TestCase):
+    def setUp(self):
+        cache.clear()  # breaker state
+        self.daraja = StubDaraja().start()
+        self.addCleanup(self.daraja.stop)
+        settings = override_settings(MPESA_BASE_URL=self.daraja.url, MPESA_CONSUMER_KEY='key',
+                                     MPESA_CONSUMER_SECRET='secret', MPESA_SHORTCODE='174379', MPESA_PASSKEY='pass')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        product = Product.objects.create(seller=farmer, name='Kale', description='Sukuma', price=50,
+                                         quantity=100, category='VEGETABLES', location='Thika')
+        self.order = Order.objects.create(buyer=self.buyer, product=product, quantity=3, status='ACCEPTED')
+        self.client.login(username='buyer', password='x')
+
+    def test_pay_queues_a_job_and_returns_at_once(self):
+        url = reverse('initiate_payment', args=[self.order.id])
+        with mock.patch.object(tasks.send_stk_push, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(url, {'phone': '0712345678'}, HTTP_ACCEPT='application/json')
+            # Pressing Pay again while it's on its way doesn't push twice
+            again = self.client.post(url, {'phone': '0712345678'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job']['status'], PaymentJob.QUEUED)
+        self.assertEqual(again.json()['job']['id'], response.json()['job']['id'])
+        job = PaymentJob.objects.get()
+        self.assertEqual((job.phone, job.amount), ('254712345678', 150))
+        self.assertEqual(len(callbacks), 1)
+        delay.assert_called_once_with(job.pk)
+        self.assertEqual(self.daraja.counts['stk_push'], 0)
+
+        payments.send(job)
+        status = self.client.get(reverse('payment_status', args=[self.order.id])).json()
+        self.assertEqual(status['job']['status'], PaymentJob.SENT)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.checkout_request_id, job.checkout_request_id)
+
+    def test_failures_back_off_then_open_the_breaker(self):
+        job = PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150)
+        countdowns = []
+        with override_settings(MPESA_BASE_URL=UNREACHABLE):
+            for _ in range(payments.breaker.threshold):
+                with self.assertRaises(payments.RetryLater) as raised:
+                    payments.send(job)
+                countdowns.append(raised.exception.countdown)
+            self.assertEqual(job.status, PaymentJob.QUEUED)
+            self.assertTrue(all(later > earlier for earlier, later in zip(countdowns, countdowns[1:])))
+
+            # Open: jobs wait without calling Daraja
+            attempts = job.attempts
+            with self.assertRaises(payments.RetryLater):
+                payments.send(job)
+            self.assertEqual(job.attempts, attempts)
+
+        # After the cooldown one probe goes through and closes it
+        later = mock.patch('mpesa.breaker.time.time', return_value=payments.breaker.cooldown + 10 ** 10)
+        with later:
+            payments.send(job)
+        self.assertEqual(job.status, PaymentJob.SENT)
+        self.assertEqual(self.daraja.counts['stk_push'], 1)
+        self.assertFalse(payments.breaker.is_open())
+
+    def test_task_gives_up_after_max_attempts(self):
+        job = PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150)
+        # Eager mode: retries run at once, ignoring the countdown
+        with override_settings(MPESA_BASE_URL=UNREACHABLE):
+            tasks.send_stk_push.delay(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PaymentJob.FAILED)
+        self.assertIn('Gave up', job.error)
+        self.assertEqual(job.attempts, min(payments.MAX_ATTEMPTS, payments.breaker.threshold))
+
+    def test_push_that_may_have_arrived_is_not_repeated(self):
+        job = PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150)
+        self.daraja.outage = True  # 503: Safaricom may still have acted on it
+        tasks.send_stk_push.delay(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PaymentJob.FAILED, 1))
+        self.assertIn("didn't confirm", job.error)
+        self.assertEqual(self.daraja.counts['stk_push'], 1)
+
+        read_timeout = mock.patch('requests.Session.post', side_effect=requests.ReadTimeout('read timed out'))
+        job = PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150)
+        with read_timeout:
+            payments.send(job)
+        self.assertEqual(job.status, PaymentJob.FAILED)
+
+    def test_earlier_prompt_is_queried_before_pushing_again(self):
+        PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150,
+                                  status=PaymentJob.SENT, checkout_request_id='ws_CO_first')
+        job = PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150)
+
+        # Still open on the phone: wait, don't prompt again
+        self.daraja.query_results = {'ws_CO_first': None}
+        with self.assertRaises(payments.RetryLater):
+            payments.send(job)
+        self.assertEqual((job.status, self.daraja.counts['stk_push']), (PaymentJob.QUEUED, 0))
+
+        # Paid after all: the answer is applied and no second prompt goes out
+        self.daraja.query_results = {'ws_CO_first': 0}
+        with self.captureOnCommitCallbacks(execute=True):
+            payments.send(job)
+        self.assertEqual(job.status, PaymentJob.FAILED)
+        self.assertEqual(self.daraja.counts['stk_push'], 0)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'ESCROW')
+
+        # Cancelled: the next job pushes
+        other = Order.objects.create(buyer=self.buyer, product=self.order.product, quantity=1, status='ACCEPTED')
+        PaymentJob.objects.create(order=other, phone='254712345678', amount=50,
+                                  status=PaymentJob.SENT, checkout_request_id='ws_CO_cancelled')
+        self.daraja.query_results = {'ws_CO_cancelled': 1032}
+        job = PaymentJob.objects.create(order=other, phone='254712345678', amount=50)
+        payments.send(job)
+        self.assertEqual((job.status, self.daraja.counts['stk_push']), (PaymentJob.SENT, 1))
+
+    def test_payment_on_an_earlier_prompt_finds_its_order(self):
+        PaymentJob.objects.create(order=self.order, phone='254712345678', amount=150,
+                                  status=PaymentJob.SENT, checkout_request_id='ws_CO_first')
+        Order.objects.filter(pk=self.order.pk).update(checkout_request_id='ws_CO_second')
+        callbacks.record(PaymentEvent.STK, stk_callback('ws_CO_first'))
+        callbacks.process_pending()
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.mpesa_receipt_number), ('ESCROW', 'QK12345'))
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='QK12345'):
+    callback = {'MerchantRequestID': 'm-1', 'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code,
+                'ResultDesc': 'Processed' if result_code == 0 else 'Request cancelled by user'}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [{'Name': 'Amount', 'Value': 150},
+                                                 {'Name': 'MpesaReceiptNumber', 'Value': receipt}]}
+    return {'Body': {'stkCallback': callback}}
+
+
+def b2c_result(conversation_id, result_code=0):
+    return {'Result': {'ResultType': 0, 'ResultCode': result_code, 'ResultDesc': 'Insufficient funds' if result_code else 'OK',
+                       'OriginatorConversationID': 'o-1', 'ConversationID': conversation_id, 'TransactionID': 'RB99'}}
+
+
+class PaymentCallbackTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma', price=50,
+                                         quantity=100, category='VEGETABLES', location='Thika')
+        self.orders = [
+            Order.objects.create(buyer=buyer, product=product, status='ACCEPTED', checkout_request_id=f'ws_CO_{i}')
+            for i in range(3)
+        ]
+
+    def post(self, name, payload):
+        # Processed on commit (inline: Celery is eager in tests)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(name), json.dumps(payload), content_type='application/json')
+
+    def test_callbacks_are_stored_once_and_applied_in_a_batch(self):
+        job = PaymentJob.objects.create(order=self.orders[2], phone='254712345678', amount=50,
+                                        status=PaymentJob.SENT, checkout_request_id='ws_CO_2')
+        burst = [stk_callback('ws_CO_0'), stk_callback('ws_CO_0'), stk_callback('ws_CO_1', receipt='QK2'),
+                 stk_callback('ws_CO_2', result_code=1032), stk_callback('ws_CO_unknown')]
+        with mock.patch.object(tasks.process_payment_events, 'delay') as delay:
+            for payload in burst:
+                with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+                    response = self.client.post(reverse('mpesa_callback'), json.dumps(payload),
+                                                content_type='application/json')
+                self.assertEqual(response.json()['ResultCode'], 0)
+                # Acknowledged after one INSERT, nothing touches the orders
+                self.assertEqual([q['sql'].split()[0] for q in ctx.captured_queries], ['INSERT'])
+        self.assertEqual(PaymentEvent.objects.count(), 4)  # the repeat was dropped
+        delay.assert_called_once_with()  # one run for the whole burst
+        self.assertEqual(Order.objects.get(pk=self.orders[0].pk).status, 'ACCEPTED')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(callbacks.process_pending(), 4)
+        order_lookups = [q for q in ctx.captured_queries
+                         if q['sql'].startswith('SELECT') and 'FROM "marketplace_order"' in q['sql']]
+        self.assertEqual(len(order_lookups), 1)
+
+        statuses = dict(Order.objects.values_list('checkout_request_id', 'status'))
+        self.assertEqual(statuses, {'ws_CO_0': 'ESCROW', 'ws_CO_1': 'ESCROW', 'ws_CO_2': 'ACCEPTED'})
+        self.assertEqual(Order.objects.get(pk=self.orders[1].pk).mpesa_receipt_number, 'QK2')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (PaymentJob.FAILED, 'Request cancelled by user'))
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(callbacks.process_pending(), 0)
+
+    def test_event_that_fails_does_not_hold_up_the_queue(self):
+        bad, good, other = self.orders
+        escrow_in = books.escrow_in
+
+        def refuse_bad_order(order):
+            if order.pk == bad.pk:
+                raise ValueError("Transfer amount must be positive")
+            return escrow_in(order)
+
+        for order in self.orders:
+            callbacks.record(PaymentEvent.STK, stk_callback(order.checkout_request_id, receipt=f'QK{order.pk}'))
+        with mock.patch.object(callbacks.books, 'escrow_in', side_effect=refuse_bad_order), \
+                self.assertLogs('mpesa.callbacks', 'ERROR'):
+            self.assertEqual(callbacks.process_pending(), 3)
+
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        # The bad event was rolled back on its own; those behind it went through
+        self.assertEqual(statuses, {bad.pk: 'ACCEPTED', good.pk: 'ESCROW', other.pk: 'ESCROW'})
+        failed = PaymentEvent.objects.get(callback_id=bad.checkout_request_id)
+        self.assertIsNotNone(failed.processed_at)
+        self.assertIn('Transfer amount must be positive', failed.error)
+        self.assertEqual(PaymentEvent.objects.exclude(error='').count(), 1)
+        self.assertEqual(callbacks.process_pending(), 0)
+
+    def test_b2c_result_and_timeout(self):
+        paid, timed_out = self.orders[:2]
+        for order, conversation_id in [(paid, 'AG_1'), (timed_out, 'AG_2')]:
+            Order.objects.filter(pk=order.pk).update(status='PAID_OUT', payout_conversation_id=conversation_id)
+
+        self.assertEqual(self.post('b2c_result', b2c_result('AG_1')).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            # At the path release_escrow_to_farmer hands Safaricom
+            response = self.client.post('/mpesa/b2c/timeout/', json.dumps({'Result': {'ConversationID': 'AG_2'}}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post('b2c_result', {'Result': {}}).status_code, 400)
+
+        paid.refresh_from_db()
+        timed_out.refresh_from_db()
+        self.assertEqual((paid.status, paid.payout_receipt_number), ('PAID_OUT', 'RB99'))
+        self.assertEqual(timed_out.status, 'DISPUTED')
+        self.assertTrue(Notification.objects.filter(user=self.farmer, notification_type='PAYOUT_FAILED').exists())
+
+        # The payout went through after all
+        self.post('b2c_result', b2c_result('AG_2'))
+        timed_out.refresh_from_db()
+        self.assertEqual((timed_out.status, timed_out.payout_receipt_number), ('PAID_OUT', 'RB99'))
+
+
+    def test_failed_payout_is_retried_with_a_new_conversation(self):
+        self.farmer.profile.phone_number = '0712345678'
+        self.farmer.profile.save()
+        order = self.orders[0]
+        Order.objects.filter(pk=order.pk).update(status='DELIVERED')
+        order.refresh_from_db()
+        transitions.transition(order, 'PAID_OUT')
+        with mock.patch('mpesa.payouts.release_escrow_to_farmer', return_value={'ConversationID': 'AG_1'}):
+            payouts.send(order, '0712345678', 'DELIVERED')
+
+        def fail(conversation_id, name='b2c_result'):
+            self.post(name, b2c_result(conversation_id, result_code=2001))
+            return Notification.objects.filter(notification_type='PAYOUT_FAILED').latest('id').message
+
+        self.assertIn("We'll retry it.", fail('AG_1', name='b2c_timeout'))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'DISPUTED')
+        self.assertEqual(payouts.retry_failed(), [])  # not before RETRY_AFTER
+
+        for attempt in [2, 3]:
+            later = timezone.now() + payouts.RETRY_AFTER + timedelta(minutes=1)
+            with mock.patch('mpesa.payouts.release_escrow_to_farmer',
+                            return_value={'ConversationID': f'AG_{attempt}'}) as b2c:
+                job, = payouts.retry_failed(now=later)
+            b2c.assert_called_once_with('254712345678', 50)
+            order.refresh_from_db()
+            self.assertEqual((order.status, order.payout_conversation_id), ('PAID_OUT', f'AG_{attempt}'))
+            self.assertEqual(job.status, PayoutJob.SENT)
+            message = fail(f'AG_{attempt}')
+        # Out of attempts: left to staff
+        self.assertIn('Our team will be in touch', message)
+        self.assertEqual(payouts.retry_failed(now=timezone.now() + timedelta(days=1)), [])
+        self.assertEqual(list(order.payout_jobs.values_list('status', flat=True).order_by('pk')),
+                         [PayoutJob.FAILED] * 3)
+
+        # The first payout, reported timed out, went through after all: found through its job
+        self.post('b2c_result', b2c_result('AG_1'))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payout_receipt_number), ('PAID_OUT', 'RB99'))
+        self.assertEqual(order.payout_jobs.get(conversation_id='AG_1').status, PayoutJob.PAID)
+
+class ReconcileTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.daraja = StubDaraja(response_delay=0.02).start()
+        self.addCleanup(self.daraja.stop)
+        settings = override_settings(MPESA_BASE_URL=self.daraja.url, MPESA_CONSUMER_KEY='key',
+                                     MPESA_CONSUMER_SECRET='secret', MPESA_SHORTCODE='174379', MPESA_PASSKEY='pass')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.product = Product.objects.create(seller=farmer, name='Kale', description='Sukuma', price=50,
+                                              quantity=100, category='VEGETABLES', location='Thika')
+        self.buyer = buyer
+
+    def order(self, checkout_request_id, minutes_ago=30):
+        order = Order.objects.create(buyer=self.buyer, product=self.product, status='ACCEPTED',
+                                     checkout_request_id=checkout_request_id)
+        Order.objects.filter(pk=order.pk).update(updated_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return order
+
+    def test_stale_pushes_are_queried_in_batches_and_applied(self):
+        paid = [self.order(f'ws_CO_paid_{i}') for i in range(6)]
+        cancelled = self.order('ws_CO_cancelled')
+        waiting = self.order('ws_CO_waiting')
+        answered = self.order('ws_CO_answered')
+        PaymentEvent.objects.create(kind=PaymentEvent.STK, callback_id='ws_CO_answered', result_code=1032, payload={},
+                                    processed_at=timezone.now())
+        self.order('ws_CO_fresh', minutes_ago=1)
+        self.order('TEST-123')
+        self.daraja.query_results = {'ws_CO_cancelled': 1032, 'ws_CO_waiting': None}
+
+        with mock.patch.object(reconcile, 'BATCH_SIZE', 3):
+            report = reconcile.reconcile()
+
+        self.assertEqual((report.checked, report.paid, report.failed, report.pending, report.errors), (8, 6, 1, 1, 0))
+        self.assertEqual(report.applied, 7)
+        self.assertEqual(self.daraja.counts['stk_query'], 8)
+        self.assertLessEqual(self.daraja.max_in_flight, reconcile.CONCURRENCY)
+        self.assertGreater(self.daraja.max_in_flight, 1)
+        self.assertEqual(Order.objects.filter(pk__in=[o.pk for o in paid], status='ESCROW').count(), 6)
+        for order in (cancelled, waiting, answered):
+            order.refresh_from_db()
+            self.assertEqual(order.status, 'ACCEPTED')
+
+        # Only the one Safaricom was still waiting on is asked about again
+        self.daraja.query_results = {}
+        report = reconcile.reconcile()
+        self.assertEqual((report.checked, report.paid), (1, 1))
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, 'ESCROW')
+
+    def test_unreadable_answer_counts_as_an_error(self):
+        garbled = self.order('ws_CO_garbled')
+        self.order('ws_CO_paid')
+        self.daraja.query_results = {'ws_CO_garbled': 'n/a'}
+        with self.assertLogs('mpesa.reconcile', 'WARNING'):
+            report = reconcile.reconcile()
+        self.assertEqual((report.checked, report.paid, report.errors), (2, 1, 1))
+        self.assertFalse(PaymentEvent.objects.filter(callback_id='ws_CO_garbled').exists())
+        garbled.refresh_from_db()
+        self.assertEqual(garbled.status, 'ACCEPTED')
+
+    def test_every_unanswered_prompt_of_an_order_is_queried(self):
+        order = self.order('ws_CO_second')
+        PaymentJob.objects.create(order=order, phone='254712345678', amount=50,
+                                  status=PaymentJob.SENT, checkout_request_id='ws_CO_first')
+        # The latest prompt was cancelled; the first one was paid but its callback never came
+        PaymentEvent.objects.create(kind=PaymentEvent.STK, callback_id='ws_CO_second', result_code=1032, payload={},
+                                    processed_at=timezone.now())
+        report = reconcile.reconcile()
+        self.assertEqual((report.checked, report.paid), (1, 1))
+        self.assertEqual(self.daraja.counts['stk_query'], 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'ESCROW')
+
+    def test_run_stops_when_the_breaker_opens(self):
+        for i in range(payments.breaker.threshold + 5):
+            self.order(f'ws_CO_{i}')
+        self.daraja.outage = True
+        with mock.patch.object(reconcile, 'BATCH_SIZE', payments.breaker.threshold):
+            report = reconcile.reconcile()
+        self.assertEqual((report.checked, report.errors), (payments.breaker.threshold,) * 2)
+        self.assertEqual(report.stopped, "M-Pesa is not responding")
+        self.assertFalse(Order.objects.filter(status='ESCROW').exists())
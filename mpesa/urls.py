@@ -6,4 +6,7 @@ urlpatterns = [
     path('callback/', mpesa_callback, name='mpesa_callback'),
     path('b2c_result/', b2c_result, name='b2c_result'),
     path('b2c_timeout/', b2c_timeout, name='b2c_timeout'),
+    # The URLs release_escrow_to_farmer gives Safaricom
+    path('b2c/result/', b2c_result),
+    path('b2c/timeout/', b2c_timeout),
 ]
\ No newline at end of file
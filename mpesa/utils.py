@@ -1,22 +1,16 @@
 
-import requests
 from django.conf import settings
-from requests.auth import HTTPBasicAuth
 import base64
 from datetime import datetime
 
+from .client import MpesaError, get_client
+
 def get_access_token():
-    base_url = "https://api.safaricom.co.ke" if settings.MPESA_ENV == 'production' else "https://sandbox.safaricom.co.ke"
-    url = f"{base_url}/oauth/v1/generate?grant_type=client_credentials"
-    
-    response = requests.get(url, auth=HTTPBasicAuth(
-        settings.MPESA_CONSUMER_KEY,
-        settings.MPESA_CONSUMER_SECRET
-    ))
+    # Cached by the client: only the first payment (and one an hour after) asks Safaricom
     try:
-        return response.json().get("access_token")
-    except Exception as e:
-        print("M-Pesa Access Token Error:", response.text)
+        return get_client().access_token()
+    except MpesaError as e:
+        print("M-Pesa Access Token Error:", e)
         return None
 
 # IMPORTANT: UPDATE THIS URL TO YOUR CURRENT RUNNING NGROK URL
@@ -24,28 +18,30 @@ def get_access_token():
 # Make sure to include "https://" and NO trailing slash
 NGROK_URL = "https://britt-unlacerated-alpinely.ngrok-free.dev"
 
-def stk_push(phone, amount, account_reference="AgriStar Order"):
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+STK_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
+B2C_PATH = "/mpesa/b2c/v1/paymentrequest"
+
+def format_phone(phone):
     # Robust Phone Formatting
     phone = str(phone).strip().replace(" ", "").replace("+", "")
     if phone.startswith("0"):
         phone = "254" + phone[1:]
     elif phone.startswith("7") or phone.startswith("1"):
         phone = "254" + phone
-        
-    access_token = get_access_token()
-    if not access_token:
-        print("M-Pesa Logic Error: Could not generate Access Token. Check Credentials.")
-        return {"ResponseCode": "1", "ResponseDescription": "Failed to authenticate with M-Pesa."}
-        
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return phone
 
+def _password():
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     password = base64.b64encode(
         (settings.MPESA_SHORTCODE + settings.MPESA_PASSKEY + timestamp).encode()
     ).decode()
+    return password, timestamp
 
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    payload = {
+def stk_push_payload(phone, amount, account_reference="AgriStar Order"):
+    """The STK push request body for ``phone`` (formatted with format_phone)."""
+    password, timestamp = _password()
+    return {
         "BusinessShortCode": settings.MPESA_SHORTCODE,
         "Password": password,
         "Timestamp": timestamp,
@@ -59,13 +55,28 @@ def stk_push(phone, amount, account_reference="AgriStar Order"):
         "TransactionDesc": "Payment for AgriStar order",
     }
 
-    base_url = "https://api.safaricom.co.ke" if settings.MPESA_ENV == 'production' else "https://sandbox.safaricom.co.ke"
+def stk_query_payload(checkout_request_id):
+    """The STK push query request body: what became of ``checkout_request_id``."""
+    password, timestamp = _password()
+    return {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+
+def stk_push(phone, amount, account_reference="AgriStar Order"):
+    phone = format_phone(phone)
+
+    access_token = get_access_token()
+    if not access_token:
+        print("M-Pesa Logic Error: Could not generate Access Token. Check Credentials.")
+        return {"ResponseCode": "1", "ResponseDescription": "Failed to authenticate with M-Pesa."}
+
+    payload = stk_push_payload(phone, amount, account_reference)
     try:
         print(f"Sending STK Push to {phone} for KES {amount} (Env: {settings.MPESA_ENV})...")
-        response = requests.post(
-            f"{base_url}/mpesa/stkpush/v1/processrequest",
-            json=payload, headers=headers
-        )
+        response = get_client().post(STK_PUSH_PATH, payload)
         
         # Log to file
         with open("mpesa_debug.log", "a") as f:
@@ -81,11 +92,10 @@ def stk_push(phone, amount, account_reference="AgriStar Order"):
 
 def release_escrow_to_farmer(farmer_phone, amount):
     """
-    Releases escrowed funds to the farmer using B2C payment.
+    Releases escrowed funds to the farmer using B2C payment. Returns Daraja's
+    answer; raises MpesaError if it may have been acted on without one (see
+    mpesa.client), including a 5xx.
     """
-    access_token = get_access_token()
-    headers = {"Authorization": f"Bearer {access_token}"}
-
     payload = {
         "InitiatorName": "testapi",  # Sandbox initiator name
         "SecurityCredential": "YOUR_ENCODED_PASSWORD",  # Sandbox security credential
@@ -108,9 +118,7 @@ def release_escrow_to_farmer(farmer_phone, amount):
             "ResponseDescription": "Accept the service request successfully."
         }
 
-    response = requests.post(
-        "https://sandbox.safaricom.co.ke/mpesa/b2c/v1/paymentrequest",
-        json=payload, headers=headers
-    )
-
-    return response.json()
\ No newline at end of file
+    response = get_client().post(B2C_PATH, payload)
+    if response.status_code >= 500:
+        raise MpesaError(f"Daraja answered {response.status_code}")
+    return response.json()
@@ -1,52 +1,25 @@
-
 import json
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from marketplace.models import Order
+from . import callbacks
+from .models import PaymentEvent
+
+def _ingest(request, kind):
+    # Stored and acknowledged here; mpesa.callbacks applies it in the background
+    try:
+        callbacks.record(kind, json.loads(request.body.decode('utf-8')))
+    except ValueError as e:  # bad JSON or callbacks.InvalidCallback
+        return JsonResponse({"ResultCode": 1, "ResultDesc": str(e)}, status=400)
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
 
 @csrf_exempt
 def mpesa_callback(request):
-    try:
-        data = json.loads(request.body.decode('utf-8'))
-        callback_data = data.get("Body", {}).get("stkCallback", {})
-        result_code = callback_data.get("ResultCode")
-        
-        checkout_request_id = callback_data.get("CheckoutRequestID")
-        mpesa_receipt_number = callback_data.get("CallbackMetadata", {}).get("Item", [])
-        
-        # Extract receipt number if successful
-        receipt_number = ""
-        if result_code == 0:
-            for item in mpesa_receipt_number:
-                if item.get("Name") == "MpesaReceiptNumber":
-                    receipt_number = item.get("Value")
-                    break
-        
-        if checkout_request_id:
-            try:
-                order = Order.objects.get(checkout_request_id=checkout_request_id)
-                if result_code == 0:
-                    order.status = "ESCROW"
-                    order.mpesa_receipt_number = receipt_number
-                    order.save(update_fields=['status', 'mpesa_receipt_number']) # Force update fields
-                    print(f"DEBUG: Updated order {order.id} to ESCROW")
-            except Order.DoesNotExist:
-                pass
-                
-        return JsonResponse({"status": "ok"})
-    except Exception as e:
-        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+    return _ingest(request, PaymentEvent.STK)
 
 @csrf_exempt
 def b2c_result(request):
-    data = json.loads(request.body.decode('utf-8'))
-    # Handle B2C result
-    print("B2C result:", data)
-    return JsonResponse({"status": "ok"})
+    return _ingest(request, PaymentEvent.B2C_RESULT)
 
 @csrf_exempt
 def b2c_timeout(request):
-    data = json.loads(request.body.decode('utf-8'))
-    # Handle timeout scenario
-    print("B2C timeout:", data)
-    return JsonResponse({"status": "ok"})
+    return _ingest(request, PaymentEvent.B2C_TIMEOUT)
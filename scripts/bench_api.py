@@ -0,0 +1,72 @@
+"""
+API list benchmark: 1,000-row product and order responses through the
+serializer + json path ("before") and the .values() + orjson path ("after").
+
+    python scripts/bench_api.py
+"""
+import json
+
+from bench_utils import measure, scratch_database
+
+from django.test.utils import setup_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.renderers import ORJSONRenderer
+from users.models import User
+from marketplace.models import Order, Product
+from marketplace.pagination import KeysetPagination
+from marketplace.views import OrderViewSet, ProductViewSet
+
+ROWS = 1000
+REPEAT = 5
+
+
+def seed():
+    farmer = User.objects.create_user(username='bench_farmer', password='x', role='FARMER')
+    buyer = User.objects.create_user(username='bench_buyer', password='x', role='BUYER')
+    products = Product.objects.bulk_create([
+        Product(seller=farmer, name=f'Bench {i}', description='Bench produce', price=10 + i % 50,
+                category='FRUITS', location='Nairobi', quantity=100)
+        for i in range(ROWS)
+    ])
+    Order.objects.bulk_create([
+        Order(buyer=buyer, seller=farmer, product=p, quantity=2, unit_price=p.price, total_price=p.price * 2)
+        for p in products
+    ])
+    return farmer
+
+
+def fetch(viewset, user, fast, query=''):
+    viewset.fast_reads = fast
+    viewset.renderer_classes = [ORJSONRenderer if fast else JSONRenderer]
+    request = APIRequestFactory().get(f'/api/?page_size={ROWS}{query}')
+    force_authenticate(request, user=user)
+    response = viewset.as_view({'get': 'list'})(request)
+    response.render()
+    assert len(response.data['results']) == ROWS
+    return response.content
+
+
+def run():
+    setup_test_environment()
+    KeysetPagination.max_page_size = ROWS
+    farmer = seed()
+    for label, viewset, query in [
+        ('products', ProductViewSet, ''),
+        ('orders', OrderViewSet, ''),
+        ('products ?fields=id,name,price', ProductViewSet, '&fields=id,name,price'),
+    ]:
+        outputs = []
+        for fast in (False, True):
+            with measure(f"{label} {'after' if fast else 'before'} x{REPEAT}"):
+                for _ in range(REPEAT):
+                    content = fetch(viewset, farmer, fast, query)
+            outputs.append(content)
+        # Byte layout differs (orjson is compact), the data must not
+        print("same data:", json.loads(outputs[0]) == json.loads(outputs[1]))
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
@@ -0,0 +1,117 @@
+"""
+M-Pesa callback burst benchmark: BURST STK callbacks (a quarter of them
+repeats, as Safaricom retries) against as many orders.
+
+    python scripts/bench_callbacks.py
+
+"before" is the old inline view: look the order up and move it to escrow
+inside the callback request. "after" is the acknowledge-then-process path
+(mpesa.callbacks): the request only stores the event; the batch worker
+applies them afterwards. Queries per callback and per batch should not
+grow with the burst or the orders table.
+"""
+import json
+import os
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+# Queue the processing task instead of running it inline, so the ack is timed alone
+os.environ['CELERY_BROKER_URL'] = 'memory://'
+os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+
+from bench_utils import scratch_database
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+from marketplace import transitions
+from marketplace.models import Order, Product
+from mpesa import callbacks
+from users.models import User
+
+BURSTS = [250, 1000]
+
+
+def seed(size, tag):
+    buyer = User.objects.create_user(username=f'bench_buyer_{tag}', password='x', role='BUYER')
+    farmer = User.objects.create_user(username=f'bench_farmer_{tag}', password='x', role='FARMER')
+    product = Product.objects.create(seller=farmer, name='Bench', description='Bench', price=10,
+                                     quantity=10 ** 6, category='FRUITS', location='Nairobi')
+    Order.objects.bulk_create([
+        Order(buyer=buyer, seller=farmer, product=product, quantity=1, unit_price=10, total_price=10,
+              status='ACCEPTED', checkout_request_id=f'ws_CO_{tag}_{i}')
+        for i in range(size)
+    ])
+    ids = [f'ws_CO_{tag}_{i}' for i in range(size)]
+    burst = ids + random.sample(ids, size // 4)
+    random.shuffle(burst)
+    return [json.dumps({'Body': {'stkCallback': {
+        'CheckoutRequestID': checkout_id, 'ResultCode': 0, 'ResultDesc': 'Processed',
+        'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': f'QK{checkout_id[-6:]}'}]},
+    }}}) for checkout_id in burst]
+
+
+def before(body):
+    # The old mpesa_callback body
+    data = json.loads(body)['Body']['stkCallback']
+    order = Order.objects.get(checkout_request_id=data['CheckoutRequestID'])
+    if transitions.can_transition(order, 'ESCROW'):
+        transitions.transition(order, 'ESCROW', mpesa_receipt_number=data['CallbackMetadata']['Item'][0]['Value'])
+
+
+def after(web, body):
+    response = web.post(reverse('mpesa_callback'), body, content_type='application/json')
+    assert response.status_code == 200
+
+
+@contextmanager
+def count_queries():
+    # Counted rather than captured: a burst runs past Django's 9000-query log
+    counter = [0]
+
+    def count(execute, sql, params, many, context):
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        yield counter
+
+
+def burst(label, bodies, send):
+    latencies = []
+    with count_queries() as queries:
+        for body in bodies:
+            start = time.perf_counter()
+            send(body)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{label:<24} p50 {statistics.median(latencies):>6.2f} ms  p99 {latencies[int(len(latencies) * 0.99)]:>6.2f} ms"
+          f"  {queries[0] / len(bodies):>5.2f} queries/callback")
+
+
+def run():
+    setup_test_environment()
+    settings.DEBUG = False
+    web = Client()
+    for size in BURSTS:
+        burst(f"before, {size} orders", seed(size, f'b{size}'), before)
+        burst(f"after, {size} orders", seed(size, f'a{size}'), lambda body: after(web, body))
+        start = time.perf_counter()
+        with count_queries() as queries:
+            processed = callbacks.process_pending()
+        elapsed = time.perf_counter() - start
+        assert not Order.objects.filter(checkout_request_id__startswith=f'ws_CO_a{size}_', status='ACCEPTED').exists()
+        print(f"  worker: {processed} events in {-(-processed // callbacks.BATCH_SIZE)} batches, {elapsed:.2f} s, "
+              f"{queries[0] / processed:.2f} queries/event")
+    plan = str(Order.objects.filter(checkout_request_id__in=['ws_CO_x']).explain())
+    print("order lookup uses order_checkout_request_idx:", 'order_checkout_request_idx' in plan)
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
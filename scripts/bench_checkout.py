@@ -0,0 +1,66 @@
+"""
+Checkout benchmark: query count and time for carts of different sizes.
+
+    python scripts/bench_checkout.py
+
+The query count must stay flat as the cart grows; the script exits non-zero
+if it doesn't. Very large carts on SQLite get a few extra INSERTs because
+bulk_create splits batches at the variable limit, so the counts compared
+treat the batches of one bulk_create as one statement.
+"""
+import re
+import sys
+
+from bench_utils import measure, scratch_database
+
+from users.models import User
+from marketplace.models import CartItem, Product
+from marketplace import services as checkout_service
+
+CART_SIZES = [1, 10, 50]
+INSERT_RE = re.compile(r'INSERT INTO "(\w+)"')
+
+
+def fill_cart(buyer, farmer, size):
+    products = Product.objects.bulk_create([
+        Product(seller=farmer, name=f'Bench {size}-{i}', description='Bench', price=10,
+                category='FRUITS', location='Nairobi', quantity=100)
+        for i in range(size)
+    ])
+    CartItem.objects.bulk_create([CartItem(buyer=buyer, product=p, quantity=1) for p in products])
+
+
+def statements(queries):
+    """Query count, with back-to-back INSERT batches into one table counted once."""
+    count, previous = 0, None
+    for query in queries:
+        match = INSERT_RE.match(query['sql'])
+        table = match.group(1) if match else None
+        if table is None or table != previous:
+            count += 1
+        previous = table
+    return count
+
+
+def run():
+    buyer = User.objects.create_user(username='bench_buyer', password='x', role='BUYER')
+    farmer = User.objects.create_user(username='bench_farmer', password='x', role='FARMER')
+    # The day's first order also creates the farmer's daily stats bucket
+    fill_cart(buyer, farmer, 1)
+    checkout_service.checkout_cart(buyer)
+    counts = []
+    for size in CART_SIZES:
+        fill_cart(buyer, farmer, size)
+        with measure(f"checkout {size} items") as ctx:
+            report = checkout_service.checkout_cart(buyer)
+        assert len(report.orders) == size
+        counts.append(statements(ctx.captured_queries))
+    constant = len(set(counts)) == 1
+    print("constant query count:", constant, counts)
+    return constant
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        ok = run()
+    sys.exit(0 if ok else 1)
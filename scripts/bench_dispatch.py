@@ -0,0 +1,73 @@
+"""
+Dispatch benchmark: auction matching vs first-come greedy on synthetic fleets.
+
+    python scripts/bench_dispatch.py
+
+Orders and riders are spread over greater Nairobi with a realistic mix of
+loads and vehicles. Greedy gives each order, in turn, the nearest free rider,
+which is roughly what people clicking through find_rider achieve.
+"""
+import time
+
+import numpy as np
+
+import bench_utils  # noqa: F401  (sets up Django)
+
+from core import geo
+from marketplace import dispatch
+
+SIZES = [1_000, 3_000, 5_000]
+AREA = {'lat': (-1.6, -0.9), 'lon': (36.5, 37.2)}
+
+
+def fleet(rng, size):
+    vehicles = rng.choice(len(dispatch.VEHICLE_RANK), size, p=[0.1, 0.6, 0.15, 0.1, 0.05])
+    names = [dispatch.VEHICLE_RANK[v] for v in vehicles]
+    orders = {
+        'id': np.arange(size),
+        'lat': rng.uniform(*AREA['lat'], size), 'lon': rng.uniform(*AREA['lon'], size),
+        'min_rank': rng.choice([0, 1, 2, 3], size, p=[0.5, 0.3, 0.1, 0.1]),
+    }
+    riders = {
+        'id': np.arange(size),
+        'lat': rng.uniform(*AREA['lat'], size), 'lon': rng.uniform(*AREA['lon'], size),
+        'rank': vehicles,
+        'max_km': np.array([dispatch.VEHICLE_LIMITS[n]['max_km'] for n in names], dtype=float),
+        'slots': np.ones(size, dtype=np.int64),
+    }
+    return orders, riders
+
+
+def greedy(orders, riders):
+    distance = geo.pairwise_km(orders['lat'], orders['lon'], riders['lat'], riders['lon'])
+    allowed = (distance <= riders['max_km'][None, :]) & (riders['rank'][None, :] >= orders['min_rank'][:, None])
+    distance = np.where(allowed, distance, np.inf)
+    free = np.ones(len(riders['id']), dtype=bool)
+    total, matched = 0.0, 0
+    for row in distance:
+        row = np.where(free, row, np.inf)
+        j = row.argmin()
+        if np.isfinite(row[j]):
+            free[j] = False
+            total += row[j]
+            matched += 1
+    return matched, total
+
+
+def run():
+    rng = np.random.default_rng(11)
+    for size in SIZES:
+        orders, riders = fleet(rng, size)
+        print(f"--- {size} orders x {size} riders")
+        start = time.perf_counter()
+        matches = dispatch.plan(orders, riders)
+        elapsed = time.perf_counter() - start
+        km = sum(m.distance_km for m in matches)
+        print(f"auction: {len(matches)} matched, {km:,.0f} km, {elapsed:.2f}s")
+        start = time.perf_counter()
+        matched, km = greedy(orders, riders)
+        print(f"greedy:  {matched} matched, {km:,.0f} km, {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    run()
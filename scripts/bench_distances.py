@@ -0,0 +1,39 @@
+"""
+Distance benchmark: per-point Python haversine vs core.geo's array functions.
+
+    python scripts/bench_distances.py
+"""
+import random
+import time
+from decimal import Decimal
+
+import bench_utils  # noqa: F401  (sets up Django)
+
+from core import geo
+
+SIZES = [100, 500, 5_000]
+RIDER = (Decimal('-1.286389'), Decimal('36.817223'))
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<40} {(time.perf_counter() - start) * 1000:>10.2f} ms")
+    return result
+
+
+def run():
+    rng = random.Random(7)
+    for size in SIZES:
+        # Decimals, as they come out of the DecimalField columns
+        lats = [Decimal(f'{rng.uniform(-4.6, 4.6):.6f}') for _ in range(size)]
+        lons = [Decimal(f'{rng.uniform(34.0, 41.8):.6f}') for _ in range(size)]
+        print(f"--- {size} orders")
+        loop = timed("scalar loop", lambda: [geo.haversine_km(*RIDER, lat, lon) for lat, lon in zip(lats, lons)])
+        vec = timed("distances_km", lambda: geo.distances_km(*RIDER, lats, lons))
+        timed("nearest k=10", lambda: geo.nearest(*RIDER, lats, lons, k=10))
+        assert max(abs(a - b) for a, b in zip(loop, vec)) < 1e-6
+
+
+if __name__ == '__main__':
+    run()
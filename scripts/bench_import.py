@@ -0,0 +1,61 @@
+"""
+Bulk import benchmark: time and peak Python memory for importing CSVs of
+growing size, then for re-importing the largest as updates.
+
+    python scripts/bench_import.py
+
+Peak memory should stay roughly flat as the file grows (rows are handled a chunk
+at a time).
+"""
+import io
+import time
+import tracemalloc
+
+from bench_utils import scratch_database
+
+from django.conf import settings
+
+from users.models import User
+from marketplace import bulk
+
+SIZES = [1000, 10000]
+
+
+def make_csv(rows, ids=None):
+    # Re-imports (with ids) restock every row
+    lines = [','.join(bulk.COLUMNS)]
+    for i in range(rows):
+        pk, quantity = (ids[i], 200) if ids else ('', 100)
+        lines.append(f'{pk},Bench {i},Fresh produce lot {i},{10 + i % 90}.00,{quantity},kg,VEGETABLES,Nairobi,,True')
+    return io.BytesIO('\n'.join(lines).encode())
+
+
+def timed_import(label, seller, upload, traced=False):
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    report = bulk.import_products(seller, upload, bulk.CSV)
+    elapsed = time.perf_counter() - start
+    if not traced:
+        print(f"{label:<28} {report.created:>6} created {report.updated:>6} updated {elapsed:>7.2f} s")
+        return
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label + ', traced':<28} peak {peak / 2 ** 20:>6.1f} MiB")
+
+
+def run():
+    # DEBUG keeps a log of every query, which would show up as import memory
+    settings.DEBUG = False
+    for size in SIZES:
+        # Timed and memory-traced runs on separate sellers (tracing slows everything down)
+        for traced in (False, True):
+            seller = User.objects.create_user(username=f'bench_seller_{size}_{traced}', password='x', role='SUPPLIER')
+            timed_import(f"import {size} rows", seller, make_csv(size), traced)
+            ids = list(seller.products.order_by('pk').values_list('pk', flat=True))
+            timed_import(f"re-import {size} as updates", seller, make_csv(size, ids), traced)
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
@@ -0,0 +1,112 @@
+"""
+Ledger benchmark: RIDERS wallets earning fees and withdrawing from
+THREADS threads at once, then the cost of reading and checking balances
+as the postings pile up.
+
+    python scripts/bench_ledger.py
+
+Nothing may be lost or overdrawn, however the threads interleave: the
+books are checked at the end. A balance read is one row whatever the
+history; check() with snapshots only sums the postings since them.
+"""
+import random
+import threading
+import time
+
+from bench_utils import scratch_database
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+from ledger import audit, books
+from ledger.models import Account, Entry, Posting
+from marketplace.models import Order, Product
+from users.models import User
+
+RIDERS = 20
+THREADS = 8
+TRANSFERS = 4000  # per round
+FEE = 15
+
+
+def seed():
+    buyer = User.objects.create_user(username='bench_buyer', password='x', role='BUYER')
+    farmer = User.objects.create_user(username='bench_farmer', password='x', role='FARMER')
+    riders = [User.objects.create_user(username=f'bench_rider_{i}', password='x', role='RIDER') for i in range(RIDERS)]
+    product = Product.objects.create(seller=farmer, name='Bench', description='Bench', price=100,
+                                     quantity=10 ** 6, category='FRUITS', location='Nairobi')
+    return buyer, product, riders
+
+
+def orders_for(buyer, product, riders, count):
+    orders = Order.objects.bulk_create([
+        Order(buyer=buyer, seller=product.seller, product=product, quantity=1, unit_price=100, total_price=100,
+              status='ESCROW', assigned_rider=random.choice(riders), delivery_fee=FEE)
+        for _ in range(count)
+    ])
+    for order in orders:
+        books.escrow_in(order)
+    return orders
+
+
+def hammer(orders, riders):
+    """Post a fee per order and as many withdrawals, spread over THREADS threads."""
+    work = [(books.rider_fee, (order,)) for order in orders]
+    work += [(books.withdraw, (random.choice(riders), random.choice([10, 20, 40]))) for _ in orders]
+    random.shuffle(work)
+    refused = [0]
+
+    def run(chunk):
+        try:
+            for call, args in chunk:
+                try:
+                    call(*args)
+                except books.InsufficientFunds:
+                    refused[0] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(work[i::THREADS],)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"{len(work)} transfers on {THREADS} threads in {elapsed:.2f} s ({len(work) / elapsed:.0f}/s), "
+          f"{refused[0]} withdrawals refused")
+
+
+def timed(label, call, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    print(f"  {label:<44} {(time.perf_counter() - start) / repeat * 1000:>8.2f} ms")
+    return result
+
+
+def run():
+    settings.DEBUG = False
+    buyer, product, riders = seed()
+    escrow = books.account(Account.ESCROW)
+    for round_ in range(1, 4):
+        hammer(orders_for(buyer, product, riders, TRANSFERS // 2), riders)
+        print(f"after round {round_}: {Posting.objects.count()} postings")
+        timed("escrow balance, from the account row", lambda: Account.objects.get(pk=escrow.pk).balance)
+        timed("escrow balance, summing its postings", lambda: escrow.postings.aggregate(Sum('amount')))
+        timed("check(full=True)", lambda: audit.check(full=True), repeat=1)
+        timed("take_snapshots()", audit.take_snapshots, repeat=1)
+        timed("check(), since the snapshots", audit.check, repeat=1)
+
+    problems = audit.check(full=True)
+    withdrawn = Entry.objects.filter(kind=Entry.WITHDRAWAL).aggregate(total=Sum('amount'))['total']
+    earned = Entry.objects.filter(kind=Entry.RIDER_FEE).count() * FEE
+    wallets = Account.objects.filter(kind=Account.RIDER).aggregate(total=Sum('balance'))['total']
+    print(f"riders earned {earned}, withdrew {withdrawn}, hold {wallets}; problems: {problems or 'none'}")
+    assert not problems and earned - withdrawn == wallets
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
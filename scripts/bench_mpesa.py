@@ -0,0 +1,51 @@
+"""
+M-Pesa payment call benchmark against the local stub Daraja (mpesa/stub.py):
+a fresh token and a fresh connection per payment ("before", what
+mpesa.utils did) against the shared MpesaClient ("after").
+
+    python scripts/bench_mpesa.py
+
+The stub sleeps HANDSHAKE_DELAY per new connection to stand in for a TLS
+handshake to Safaricom. "after" should make one HTTP call per payment.
+"""
+import time
+
+import bench_utils  # noqa: F401  (sets up Django)
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+from mpesa.client import TOKEN_PATH, MpesaClient
+from mpesa.stub import StubDaraja
+
+PAYMENTS = 50
+HANDSHAKE_DELAY = 0.02
+STK_PATH = '/mpesa/stkpush/v1/processrequest'
+PAYLOAD = {'BusinessShortCode': '174379', 'Amount': 100, 'PhoneNumber': '254700000000'}
+
+
+def before(url):
+    # The old get_access_token() + requests.post(), new connections each time
+    token = requests.get(url + TOKEN_PATH, auth=HTTPBasicAuth('key', 'secret')).json()['access_token']
+    requests.post(url + STK_PATH, json=PAYLOAD, headers={'Authorization': f'Bearer {token}'}).json()
+
+
+def run():
+    for label in ('before', 'after'):
+        with StubDaraja(handshake_delay=HANDSHAKE_DELAY) as daraja:
+            client = MpesaClient(daraja.url, 'key', 'secret')
+            start = time.perf_counter()
+            for _ in range(PAYMENTS):
+                if label == 'before':
+                    before(daraja.url)
+                else:
+                    client.post(STK_PATH, PAYLOAD).json()
+            elapsed = (time.perf_counter() - start) * 1000
+            client.close()
+            calls = daraja.counts['token'] + daraja.counts['stk_push']
+            print(f"{label:<7} {PAYMENTS} payments {elapsed:>8.1f} ms  {elapsed / PAYMENTS:>6.1f} ms each  "
+                  f"{calls / PAYMENTS:.2f} HTTP calls each  {daraja.counts['connections']:>3} connections")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,78 @@
+"""
+Rider lookup benchmark: full scan vs geohash cells.
+
+    python scripts/bench_nearby_riders.py
+
+A fixed pool of riders works around Nairobi and the rest of the table is
+spread over East Africa. The lookup is find_rider's 50 km search from
+Nairobi: the full scan grows with the whole table, the cell lookup only with
+the riders near Nairobi.
+"""
+import random
+
+from bench_utils import measure, scratch_database
+
+from core import geo
+from users.models import RiderProfile, User
+from marketplace.utils import get_nearby_riders, haversine_distance, nearby_rider_candidates
+
+SIZES = [5_000, 20_000, 50_000]
+NAIROBI = (-1.286389, 36.817223)
+RADIUS_KM = 50
+LOCAL_RIDERS = 1_000
+LOCAL_SPREAD = 0.4  # degrees around Nairobi
+# Rough bounding box of East Africa
+LAT_RANGE = (-11.0, 5.0)
+LON_RANGE = (29.0, 42.0)
+
+
+def full_scan(latitude, longitude, radius_km):
+    """The old get_nearby_riders: every rider through Python haversine."""
+    riders = RiderProfile.objects.filter(is_available=True, verification_status='VERIFIED').select_related('user')
+    found = [
+        (r.user, haversine_distance(latitude, longitude, r.current_latitude, r.current_longitude))
+        for r in riders if r.current_latitude and r.current_longitude
+    ]
+    return sorted((f for f in found if f[1] <= radius_km), key=lambda x: x[1])
+
+
+def add_riders(start, count, rng, around=None):
+    users = User.objects.bulk_create([
+        User(username=f'rider{i}', role=User.Role.RIDER) for i in range(start, start + count)
+    ], batch_size=2000)
+    profiles = []
+    for user in users:
+        if around:
+            lat = around[0] + rng.uniform(-LOCAL_SPREAD, LOCAL_SPREAD)
+            lon = around[1] + rng.uniform(-LOCAL_SPREAD, LOCAL_SPREAD)
+        else:
+            lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+        profiles.append(RiderProfile(
+            user=user, is_available=True, verification_status='VERIFIED',
+            current_latitude=round(lat, 6), current_longitude=round(lon, 6),
+            current_geohash=geo.encode(lat, lon),
+        ))
+    RiderProfile.objects.bulk_create(profiles, batch_size=2000)
+
+
+def run():
+    rng = random.Random(42)
+    add_riders(0, LOCAL_RIDERS, rng, around=NAIROBI)
+    total = LOCAL_RIDERS
+    for size in SIZES:
+        add_riders(total, size - total, rng)
+        total = size
+        print(f"--- {size} riders")
+        with measure("full scan"):
+            expected = full_scan(*NAIROBI, RADIUS_KM)
+        with measure("geohash cells"):
+            found = get_nearby_riders(*NAIROBI, radius_km=RADIUS_KM)
+        candidates = nearby_rider_candidates(*NAIROBI, RADIUS_KM).count()
+        # Same riders (order can differ on ties once distances are rounded)
+        assert {u.pk for u, _ in found} == {u.pk for u, _ in expected}
+        print(f"{len(found)} riders in range, {candidates} candidates fetched")
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
@@ -0,0 +1,102 @@
+"""
+Payment load test: web latency of "Pay via M-Pesa" while Safaricom is fast
+and while it is slow, against the local stub Daraja (mpesa/stub.py).
+
+    python scripts/bench_payments.py
+
+"before" is what initiate_payment used to do, the STK push inside the
+request. "after" is the view as it is now, with a real Celery worker
+(in-process, a pool of WORKERS threads on an in-memory broker) sending the
+queued pushes. The web latency should stay flat however slow the stub is;
+only the time for the queue to drain grows.
+"""
+import os
+import statistics
+import time
+
+# In-memory broker for the in-process worker; must be set before Django loads the settings
+os.environ['CELERY_BROKER_URL'] = 'memory://'
+os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+
+from bench_utils import scratch_database
+
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from AgriStar.celery import app
+from marketplace.models import Order, Product
+from mpesa.client import get_client
+from mpesa.models import PaymentJob
+from mpesa.stub import StubDaraja
+from mpesa.utils import STK_PUSH_PATH, stk_push_payload
+from users.models import User
+
+PAYMENTS = 40
+WORKERS = 4
+DELAYS = [0.0, 1.0]  # seconds the stub takes to answer an STK push
+
+
+def seed():
+    buyer = User.objects.create_user(username='bench_buyer', password='x', role='BUYER')
+    farmer = User.objects.create_user(username='bench_farmer', password='x', role='FARMER')
+    product = Product.objects.create(seller=farmer, name='Bench', description='Bench', price=10,
+                                     quantity=10 ** 6, category='FRUITS', location='Nairobi')
+    return buyer, product
+
+
+def report(label, latencies, extra=''):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<24} p50 {statistics.median(latencies):>8.1f} ms  p95 {p95:>8.1f} ms{extra}")
+
+
+def before():
+    payload = stk_push_payload('254712345678', 100, 'Order-bench')
+    latencies = []
+    for _ in range(PAYMENTS):
+        start = time.perf_counter()
+        get_client().post(STK_PUSH_PATH, payload).json()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def after(buyer, product):
+    web = Client()
+    web.force_login(buyer)
+    orders = [Order.objects.create(buyer=buyer, product=product, quantity=1, status='ACCEPTED')
+              for _ in range(PAYMENTS)]
+    latencies = []
+    start_all = time.perf_counter()
+    for order in orders:
+        start = time.perf_counter()
+        response = web.post(reverse('initiate_payment', args=[order.id]), {'phone': '0712345678'},
+                            HTTP_ACCEPT='application/json')
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 202
+    jobs = PaymentJob.objects.filter(order__in=orders)
+    while jobs.exclude(status=PaymentJob.SENT).exists():
+        time.sleep(0.05)
+    return latencies, time.perf_counter() - start_all
+
+
+def run():
+    setup_test_environment()
+    settings.DEBUG = False
+    buyer, product = seed()
+    for delay in DELAYS:
+        with StubDaraja(response_delay=delay) as daraja, override_settings(
+                MPESA_BASE_URL=daraja.url, MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret',
+                MPESA_SHORTCODE='174379', MPESA_PASSKEY='pass'):
+            report(f"before, upstream {delay:.1f} s", before())
+            with start_worker(app, pool='threads', concurrency=WORKERS, queues=['payments'],
+                              perform_ping_check=False, shutdown_timeout=30):
+                latencies, drained = after(buyer, product)
+            report(f"after, upstream {delay:.1f} s", latencies, f"  ({PAYMENTS} pushes sent in {drained:.1f} s)")
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
@@ -0,0 +1,72 @@
+"""
+Payment reconciliation benchmark: STALE orders whose STK callback never
+came, against the local stub Daraja answering each query in QUERY_DELAY.
+
+    python scripts/bench_reconcile.py
+
+Run once one query at a time and once with the configured pool, on fresh
+orders each time. The pool should cut the querying time about
+CONCURRENCY-fold while the stub never sees more than CONCURRENCY queries at
+once. Applying the answers (mpesa.callbacks) is the same work either way,
+and so are the database queries per order.
+"""
+from datetime import timedelta
+from unittest import mock
+
+from bench_utils import scratch_database
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from marketplace.models import Order, Product
+from mpesa import reconcile
+from mpesa.stub import StubDaraja
+from users.models import User
+
+STALE = 2000
+QUERY_DELAY = 0.01
+
+
+def seed(tag):
+    # Out of the way: what an earlier run left pending
+    Order.objects.filter(status='ACCEPTED').update(status='CANCELLED')
+    buyer = User.objects.create_user(username=f'bench_buyer_{tag}', password='x', role='BUYER')
+    farmer = User.objects.create_user(username=f'bench_farmer_{tag}', password='x', role='FARMER')
+    product = Product.objects.create(seller=farmer, name='Bench', description='Bench', price=10,
+                                     quantity=10 ** 6, category='FRUITS', location='Nairobi')
+    orders = Order.objects.bulk_create([
+        Order(buyer=buyer, seller=farmer, product=product, quantity=1, unit_price=10, total_price=10,
+              status='ACCEPTED', checkout_request_id=f'ws_CO_{tag}_{i}')
+        for i in range(STALE)
+    ])
+    Order.objects.filter(pk__in=[o.pk for o in orders]).update(updated_at=timezone.now() - timedelta(hours=1))
+    # 5% cancelled on the phone, 5% still waiting on the buyer, the rest paid
+    return {o.checkout_request_id: (1032 if i % 20 == 0 else None if i % 20 == 1 else 0) for i, o in enumerate(orders)}
+
+
+def run():
+    settings.DEBUG = False
+    for concurrency in (1, reconcile.CONCURRENCY):
+        with StubDaraja(response_delay=QUERY_DELAY) as daraja, override_settings(
+                MPESA_BASE_URL=daraja.url, MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret',
+                MPESA_SHORTCODE='174379', MPESA_PASSKEY='pass'):
+            daraja.query_results = seed(f'c{concurrency}')
+            queries = [0]
+
+            def count(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            with mock.patch.object(reconcile, 'CONCURRENCY', concurrency), connection.execute_wrapper(count):
+                report = reconcile.reconcile()
+            print(f"concurrency {concurrency}: {report}")
+            querying = report.seconds - report.apply_seconds
+            print(f"  querying {report.checked / querying:>5.0f} orders/s, at most {daraja.max_in_flight} queries in flight, "
+                  f"{queries[0] / report.checked:.2f} db queries/order")
+
+
+if __name__ == '__main__':
+    with scratch_database():
+        run()
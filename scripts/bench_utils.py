@@ -0,0 +1,40 @@
+"""
+Helpers shared by the scripts/bench_*.py benchmarks.
+
+Benchmarks run against a throwaway copy of the configured database so they
+never touch real data.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import django
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "AgriStar.settings")
+django.setup()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def scratch_database():
+    """Create a fresh test database, yield, then drop it."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def measure(label):
+    """Print wall time and query count for the wrapped block."""
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as ctx:
+        yield ctx
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{label:<40} {len(ctx.captured_queries):>6} queries {elapsed:>10.1f} ms")
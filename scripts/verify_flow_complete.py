@@ -122,7 +122,7 @@ def run_test():
     request.user = buyer
     
     # Mock release_escrow_to_farmer to return success
-    with patch('marketplace.views.release_escrow_to_farmer') as mock_release:
+    with patch('mpesa.payouts.release_escrow_to_farmer') as mock_release:
         mock_release.return_value = {
             'ConversationID': 'AG_2023_TEST',
             'OriginatorConversationID': '1234-5678',
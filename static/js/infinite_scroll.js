@@ -0,0 +1,46 @@
+// Infinite scroll for the marketplace catalog (keyset pages)
+
+document.addEventListener('DOMContentLoaded', function () {
+    const grid = document.querySelector('#product-grid');
+    const sentinel = document.querySelector('#catalog-sentinel');
+    if (!grid || !sentinel || !('IntersectionObserver' in window)) {
+        return;
+    }
+
+    let nextUrl = sentinel.dataset.nextUrl;
+    let loading = false;
+
+    const observer = new IntersectionObserver(function (entries) {
+        if (entries[0].isIntersecting) {
+            loadNextPage();
+        }
+    }, { rootMargin: '400px' });
+    observer.observe(sentinel);
+
+    function loadNextPage() {
+        if (loading || !nextUrl) {
+            return;
+        }
+        loading = true;
+
+        const url = new URL(nextUrl, window.location.origin);
+        url.searchParams.set('partial', '1');
+
+        fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.json())
+            .then(data => {
+                grid.insertAdjacentHTML('beforeend', data.html);
+                nextUrl = data.next_url;
+                if (!nextUrl) {
+                    observer.disconnect();
+                    sentinel.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading products:', error);
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }
+});
@@ -0,0 +1,93 @@
+// Live notifications over the websocket (core.consumers.NotificationConsumer).
+// Polls the unread count only while the socket is down.
+
+(function () {
+    const script = document.currentScript;
+    const statusUrl = script.dataset.statusUrl;
+    const POLL_MS = 30000;
+    const MAX_RETRY_MS = 30000;
+
+    let unread = parseInt(script.dataset.unread, 10) || 0;
+    let retryMs = 1000;
+    let pollTimer = null;
+    let reconnecting = false;
+
+    function badge() {
+        return document.querySelector('.notification-badge .badge');
+    }
+
+    function setUnread(count) {
+        unread = count;
+        const el = badge();
+        if (el) {
+            el.textContent = count > 99 ? '99+' : count;
+            el.style.display = count > 0 ? 'inline-block' : 'none';
+        }
+    }
+
+    function refreshCount() {
+        fetch(statusUrl, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.json())
+            .then(data => setUnread(data.unread_count))
+            .catch(error => console.error('Error fetching notifications:', error));
+    }
+
+    function startPolling() {
+        if (!pollTimer) {
+            refreshCount();
+            pollTimer = setInterval(refreshCount, POLL_MS);
+        }
+    }
+
+    function stopPolling() {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+
+    function toast(message) {
+        const el = document.createElement('div');
+        el.className = 'toast-notification alert alert-info';
+        const text = document.createElement('span');
+        text.textContent = message;
+        el.innerHTML = '<i class="bi bi-bell me-2"></i>';
+        el.appendChild(text);
+        document.body.appendChild(el);
+        setTimeout(() => el.remove(), 5000);
+    }
+
+    function connect() {
+        if (!('WebSocket' in window)) {
+            startPolling();
+            return;
+        }
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${scheme}://${window.location.host}/ws/notifications/`);
+
+        socket.onopen = function () {
+            retryMs = 1000;
+            stopPolling();
+            // The page rendered the count; after a drop, catch up on what we missed
+            if (reconnecting) {
+                refreshCount();
+            }
+        };
+
+        socket.onmessage = function (e) {
+            const data = JSON.parse(e.data);
+            // The server sends the counter; older payloads only imply +1
+            setUnread(Number.isInteger(data.unread_count) ? data.unread_count : unread + 1);
+            toast(data.message);
+            // Pages can react too (e.g. refresh an order card)
+            document.dispatchEvent(new CustomEvent('agristar:notification', { detail: data }));
+        };
+
+        socket.onclose = function () {
+            reconnecting = true;
+            startPolling();
+            setTimeout(connect, retryMs);
+            retryMs = Math.min(retryMs * 2, MAX_RETRY_MS);
+        };
+    }
+
+    document.addEventListener('DOMContentLoaded', connect);
+})();
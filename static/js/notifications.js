@@ -25,8 +25,7 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
-    // Auto-refresh notification count every 30 seconds
-    setInterval(updateNotificationCount, 30000);
+    // Live updates come over the websocket (notification_socket.js)
 });
 
 // Mark single notification as read
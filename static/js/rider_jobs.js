@@ -0,0 +1,29 @@
+// Polls the rider jobs feed and flags new nearby requests without reloading the page
+
+document.addEventListener('DOMContentLoaded', function () {
+    const feed = document.querySelector('#jobs-feed');
+    const alertBox = document.querySelector('#new-jobs-alert');
+    if (!feed || !alertBox) {
+        return;
+    }
+
+    const POLL_MS = 30000;
+    const shown = new Set(feed.dataset.jobIds ? feed.dataset.jobIds.split(',') : []);
+
+    function poll() {
+        if (document.hidden) {
+            return;
+        }
+        fetch(feed.dataset.jobsUrl, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.json())
+            .then(data => {
+                const fresh = (data.results || []).some(job => !shown.has(String(job.id)));
+                alertBox.classList.toggle('d-none', !fresh);
+            })
+            .catch(error => {
+                console.error('Error polling jobs:', error);
+            });
+    }
+
+    setInterval(poll, POLL_MS);
+});
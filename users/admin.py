@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import User, Profile, DeliveryAddress, RiderProfile, VehicleChangeRequest
 from .review_models import FarmerReview, FarmerBadge
+from . import badges
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'role', 'is_staff')
@@ -26,9 +27,9 @@ class FarmerBadgeAdmin(admin.ModelAdmin):
     actions = ['update_badges']
     
     def update_badges(self, request, queryset):
-        for badge in queryset:
-            badge.update_badge_level()
-        self.message_user(request, f"{queryset.count()} badges updated successfully!")
+        # Recounts everything; manually overridden levels are kept
+        updated = badges.rebuild(list(queryset.values_list('farmer_id', flat=True)))
+        self.message_user(request, f"{updated} badges updated successfully!")
     update_badges.short_description = "Update badge levels"
 
 @admin.register(RiderProfile)
@@ -0,0 +1,190 @@
+"""
+Farmer badge upkeep.
+
+The counters on ``FarmerBadge`` are moved by the signal handlers in
+``users.signals`` only when something that counts actually changes:
+- an order entering or leaving a sale status,
+- a product becoming available or unavailable,
+- a review being added, re-rated or removed.
+
+Each change is a single UPDATE that applies the deltas and re-derives the
+average and the level from the new values in SQL. When a handler cannot
+tell what changed (an instance built by hand rather than loaded), it queues
+a debounced recompute of that farmer instead. ``rebuild`` recounts from
+scratch in a handful of grouped queries; ``manage.py rebuild_farmer_badges``
+runs it for everyone.
+"""
+import logging
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+
+from .models import User
+from .review_models import FarmerBadge, FarmerReview
+
+logger = logging.getLogger(__name__)
+
+SALE_STATUSES = frozenset({'DELIVERED', 'PAID_OUT', 'COMPLETED'})
+
+# (level, min sales, min average rating, min reviews), best first
+TIERS = [
+    ('DIAMOND', 1000, Decimal('4.8'), 200),
+    ('PLATINUM', 500, Decimal('4.5'), 100),
+    ('GOLD', 250, Decimal('4.0'), 50),
+    ('SILVER', 100, Decimal('3.5'), 15),
+    ('BRONZE', 25, Decimal('3.0'), 5),
+]
+DEFAULT_LEVEL = 'BEGINNER'
+
+RECOMPUTE_DELAY = 60  # seconds; requests within it share one run
+
+
+def average_of(rating_sum, reviews):
+    if not reviews:
+        return Decimal('0.00')
+    return round(Decimal(rating_sum) / reviews, 2)
+
+
+def level_for(sales, average_rating, reviews):
+    for level, min_sales, min_rating, min_reviews in TIERS:
+        if sales >= min_sales and average_rating >= min_rating and reviews >= min_reviews:
+            return level
+    return DEFAULT_LEVEL
+
+
+def _average_expression(rating_sum, reviews):
+    # * 1.0 so SQLite doesn't do integer division
+    return Case(
+        When(GreaterThan(reviews, 0), then=Round(rating_sum * Value(1.0) / reviews, 2)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def _level_expression(sales, average, reviews):
+    # SQL twin of level_for
+    return Case(
+        When(is_manual_override=True, then=F('badge_level')),
+        *[
+            When(
+                GreaterThanOrEqual(sales, min_sales)
+                & GreaterThanOrEqual(average, float(min_rating))
+                & GreaterThanOrEqual(reviews, min_reviews),
+                then=Value(level),
+            )
+            for level, min_sales, min_rating, min_reviews in TIERS
+        ],
+        default=Value(DEFAULT_LEVEL),
+        output_field=CharField(),
+    )
+
+
+def adjust(farmer_id, sales=0, products=0, reviews=0, rating=0):
+    """
+    Apply counter deltas to ``farmer_id``'s badge in one UPDATE. A farmer
+    without a badge yet gets one built from scratch.
+    """
+    if not (sales or products or reviews or rating):
+        return
+    # Right-hand sides all see the old row, so the average and level are
+    # derived from the new values rather than from the columns being set
+    new_sales = F('total_sales') + sales
+    new_reviews = F('total_reviews') + reviews
+    average = _average_expression(F('rating_sum') + rating, new_reviews)
+    updated = FarmerBadge.objects.filter(farmer_id=farmer_id).update(
+        total_sales=new_sales,
+        total_products=F('total_products') + products,
+        total_reviews=new_reviews,
+        rating_sum=F('rating_sum') + rating,
+        average_rating=average,
+        badge_level=_level_expression(new_sales, average, new_reviews),
+    )
+    if not updated and User.objects.filter(pk=farmer_id, role=User.Role.FARMER).exists():
+        rebuild([farmer_id])
+
+
+def rebuild(farmer_ids=None):
+    """
+    Recount the badges of ``farmer_ids`` (every farmer by default) from the
+    orders, products and reviews tables, creating missing badges. Manual
+    overrides keep their level. Returns the number of badges written.
+    """
+    from marketplace.models import Order, Product
+
+    farmers = User.objects.filter(role=User.Role.FARMER)
+    if farmer_ids is not None:
+        farmers = farmers.filter(pk__in=farmer_ids)
+    ids = list(farmers.values_list('pk', flat=True))
+    if not ids:
+        return 0
+
+    sales = dict(
+        Order.objects.filter(seller_id__in=ids, status__in=SALE_STATUSES)
+        .values('seller_id').annotate(n=Count('id')).values_list('seller_id', 'n')
+    )
+    products = dict(
+        Product.objects.filter(seller_id__in=ids, available=True)
+        .values('seller_id').annotate(n=Count('id')).values_list('seller_id', 'n')
+    )
+    reviews = {
+        farmer_id: (n, total)
+        for farmer_id, n, total in FarmerReview.objects.filter(farmer_id__in=ids)
+        .values('farmer_id').annotate(n=Count('id'), total=Sum('rating')).values_list('farmer_id', 'n', 'total')
+    }
+    existing = dict(
+        FarmerBadge.objects.filter(farmer_id__in=ids, is_manual_override=True).values_list('farmer_id', 'badge_level')
+    )
+
+    badges = []
+    for farmer_id in ids:
+        review_count, rating_sum = reviews.get(farmer_id, (0, 0))
+        average = average_of(rating_sum, review_count)
+        sale_count = sales.get(farmer_id, 0)
+        badges.append(FarmerBadge(
+            farmer_id=farmer_id,
+            total_sales=sale_count,
+            total_products=products.get(farmer_id, 0),
+            total_reviews=review_count,
+            rating_sum=rating_sum,
+            average_rating=average,
+            badge_level=existing.get(farmer_id) or level_for(sale_count, average, review_count),
+        ))
+    FarmerBadge.objects.bulk_create(
+        badges, batch_size=500, update_conflicts=True, unique_fields=['farmer'],
+        update_fields=['total_sales', 'total_products', 'total_reviews', 'rating_sum', 'average_rating',
+                       'badge_level'],
+    )
+    return len(badges)
+
+
+def badge_for(farmer):
+    """``farmer``'s badge, built on first use."""
+    badge = FarmerBadge.objects.filter(farmer=farmer).first()
+    if badge is None:
+        rebuild([farmer.pk])
+        badge = FarmerBadge.objects.get(farmer=farmer)
+    return badge
+
+
+def recompute_key(farmer_id):
+    return f'badge-recompute:{farmer_id}'
+
+
+def schedule_recompute(farmer_id):
+    """Queue a rebuild of one farmer's badge, at most once per RECOMPUTE_DELAY."""
+    if not cache.add(recompute_key(farmer_id), 1, RECOMPUTE_DELAY * 2):
+        return
+
+    def enqueue():
+        from .tasks import recompute_farmer_badge
+        try:
+            recompute_farmer_badge.apply_async((farmer_id,), countdown=RECOMPUTE_DELAY)
+        except Exception:
+            # Counters stay as they were; `manage.py rebuild_farmer_badges` catches up
+            logger.exception("Could not queue a badge recompute for farmer %s", farmer_id)
+
+    transaction.on_commit(enqueue)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users import badges
+
+
+class Command(BaseCommand):
+    help = 'Recounts farmer badges from orders, products and reviews (creates missing ones)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('farmer_ids', nargs='*', type=int, help='Only these farmers (default: all)')
+
+    def handle(self, *args, **options):
+        written = badges.rebuild(options['farmer_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} farmer badge(s)."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+def fill_geohash(apps, schema_editor):
+    from core import geo
+    RiderProfile = apps.get_model('users', 'RiderProfile')
+    riders = RiderProfile.objects.exclude(current_latitude=None).exclude(current_longitude=None)
+    for rider in riders.iterator():
+        rider.current_geohash = geo.encode(rider.current_latitude, rider.current_longitude)
+        rider.save(update_fields=['current_geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0030_farmerbadge_is_manual_override'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riderprofile',
+            name='current_geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='riderprofile',
+            index=models.Index(fields=['is_available', 'verification_status', 'current_geohash'], name='rider_dispatch_geo_idx'),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+def sum_ratings(apps, schema_editor):
+    FarmerBadge = apps.get_model('users', 'FarmerBadge')
+    FarmerReview = apps.get_model('users', 'FarmerReview')
+    sums = FarmerReview.objects.values('farmer_id').annotate(total=models.Sum('rating')).values_list('farmer_id', 'total')
+    for farmer_id, total in sums:
+        FarmerBadge.objects.filter(farmer_id=farmer_id).update(rating_sum=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0032_profile_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='farmerbadge',
+            name='rating_sum',
+            field=models.IntegerField(default=0, help_text='Sum of all review ratings, for the running average'),
+        ),
+        migrations.RunPython(sum_ratings, migrations.RunPython.noop),
+    ]
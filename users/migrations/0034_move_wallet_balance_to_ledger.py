@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0033_farmerbadge_rating_sum'),
+        # Carries the balances over first
+        ('ledger', '0002_opening_balances'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='riderprofile',
+            name='wallet_balance',
+        ),
+    ]
@@ -5,6 +5,8 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
+from core import geo
+
 class User(AbstractUser):
     class Role(models.TextChoices):
         FARMER = 'FARMER', _('Farmer')
@@ -38,6 +40,7 @@ class Profile(models.Model):
     phone_number = models.CharField(max_length=20, blank=True)
     whatsapp_number = models.CharField(max_length=20, blank=True)
     avatar = models.ImageField(upload_to='avatars/', default='avatars/default.png')
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_verified = models.BooleanField(default=False)
     
     # Location Coordinates & Hierarchy
@@ -109,9 +112,10 @@ class RiderProfile(models.Model):
     completed_deliveries = models.IntegerField(default=0)
     cancelled_deliveries = models.IntegerField(default=0)
     failed_deliveries = models.IntegerField(default=0)
-    wallet_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Geohash of the current position, kept in sync by save() (see core.geo)
+    current_geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     
     # Vehicle Info
     vehicle_type = models.CharField(max_length=20, choices=VehicleType.choices, default=VehicleType.MOTORBIKE)
@@ -129,9 +133,31 @@ class RiderProfile(models.Model):
     verification_license = models.ImageField(upload_to='rider_verification/', blank=True, null=True)
     verification_good_conduct = models.ImageField(upload_to='rider_verification/', blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            # get_nearby_riders: available + verified riders, by geohash cell range
+            models.Index(fields=['is_available', 'verification_status', 'current_geohash'], name='rider_dispatch_geo_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.current_latitude is not None and self.current_longitude is not None:
+            self.current_geohash = geo.encode(self.current_latitude, self.current_longitude)
+        else:
+            self.current_geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'current_latitude', 'current_longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'current_geohash'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Rider: {self.user.username}"
         
+    @property
+    def wallet_balance(self):
+        # Kept by the ledger (ledger.books), not on the profile
+        from ledger.books import balance
+        return balance(self.user_id)
+
     @property
     def delivery_success_rate(self):
         if self.total_deliveries == 0:
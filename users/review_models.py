@@ -1,11 +1,11 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Avg
+from core.models import LoadedValuesMixin
 
 User = get_user_model()
 
-class FarmerReview(models.Model):
+class FarmerReview(LoadedValuesMixin, models.Model):
     """Reviews for farmers by buyers"""
     farmer = models.ForeignKey(
         User, 
@@ -64,6 +64,7 @@ class FarmerBadge(models.Model):
     total_products = models.IntegerField(default=0)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
     total_reviews = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0, help_text="Sum of all review ratings, for the running average")
     earned_date = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_manual_override = models.BooleanField(default=False, help_text="If checked, automatic badge updates will be disabled.")
@@ -76,46 +77,13 @@ class FarmerBadge(models.Model):
         return f"{self.farmer.username} - {self.get_badge_level_display()}"
     
     def update_badge_level(self):
-        """Update badge level based on real-time criteria"""
+        """Recount this badge from scratch (signals keep it current incrementally; see users.badges)"""
         if self.is_manual_override:
             return
+        from .badges import rebuild
+        rebuild([self.farmer_id])
+        self.refresh_from_db()
 
-        # Import here to avoid circular dependencies
-        from marketplace.models import Product, Order
-        
-        # 1. Update Counts
-        # Update Total Products (Available ones)
-        self.total_products = Product.objects.filter(seller=self.farmer, available=True).count()
-        
-        # Update Total Sales (Completed/Delivered/Paid Out Orders)
-        # Using status__in to capture all "successful" states
-        completed_statuses = ['DELIVERED', 'PAID_OUT', 'COMPLETED']
-        self.total_sales = Order.objects.filter(
-            product__seller=self.farmer, 
-            status__in=completed_statuses
-        ).count()
-
-        # Update Average Rating & Review Count
-        avg_rating = self.farmer.farmer_reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-        self.average_rating = round(avg_rating, 2)
-        self.total_reviews = self.farmer.farmer_reviews.count()
-        
-        # 2. Determine Badge Level
-        if self.total_sales >= 1000 and self.average_rating >= 4.8 and self.total_reviews >= 200:
-            self.badge_level = 'DIAMOND'
-        elif self.total_sales >= 500 and self.average_rating >= 4.5 and self.total_reviews >= 100:
-            self.badge_level = 'PLATINUM'
-        elif self.total_sales >= 250 and self.average_rating >= 4.0 and self.total_reviews >= 50:
-            self.badge_level = 'GOLD'
-        elif self.total_sales >= 100 and self.average_rating >= 3.5 and self.total_reviews >= 15:
-            self.badge_level = 'SILVER'
-        elif self.total_sales >= 25 and self.average_rating >= 3.0 and self.total_reviews >= 5:
-            self.badge_level = 'BRONZE'
-        else:
-            self.badge_level = 'BEGINNER'
-        
-        self.save()
-    
     def get_badge_color(self):
         """Return badge color for display"""
         colors = {
@@ -1,10 +1,13 @@
 from rest_framework import serializers
+from core.serializers import ImageVariantsField
 from .models import User, Profile
 
 class ProfileSerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField(field='avatar')
+
     class Meta:
         model = Profile
-        fields = ['bio', 'location', 'avatar', 'farm_size', 'main_crops', 'company_name']
+        fields = ['bio', 'location', 'avatar', 'avatar_variants', 'farm_size', 'main_crops', 'company_name']
 
 class UserSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
@@ -1,29 +1,68 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from marketplace.models import Product, Order
-from users.review_models import FarmerReview, FarmerBadge
+from marketplace.stats import seller_id_of
+from users.review_models import FarmerReview
+from users import badges
+
+# Badge counters move by deltas (users.badges); when the previous state of
+# an instance is unknown, the farmer's badge is recounted in the background.
+
 
 @receiver(post_save, sender=Product)
+def update_badge_on_product_change(sender, instance, created, update_fields=None, **kwargs):
+    """Count products going on or off sale"""
+    if update_fields and 'available' not in update_fields:
+        return
+    known, was_available = instance.previous_value('available', created)
+    if not known:
+        badges.schedule_recompute(instance.seller_id)
+        return
+    delta = int(bool(instance.available)) - int(bool(was_available))
+    badges.adjust(instance.seller_id, products=delta)
+
+
 @receiver(post_delete, sender=Product)
-def update_badge_on_product_change(sender, instance, **kwargs):
-    """Update farmer badge when products are added/removed"""
-    if instance.seller and instance.seller.role == 'FARMER':
-        # Get or create badge to be safe
-        badge, _ = FarmerBadge.objects.get_or_create(farmer=instance.seller)
-        badge.update_badge_level()
+def update_badge_on_product_delete(sender, instance, **kwargs):
+    if instance.available:
+        badges.adjust(instance.seller_id, products=-1)
+
 
 @receiver(post_save, sender=Order)
-def update_badge_on_order_change(sender, instance, **kwargs):
-    """Update farmer badge when order status changes (sales count)"""
-    if instance.product.seller and instance.product.seller.role == 'FARMER':
-        # Only certain statuses affect the count, but calling update is cheap enough
-        # and safer than duplicating logic here.
-        badge, _ = FarmerBadge.objects.get_or_create(farmer=instance.product.seller)
-        badge.update_badge_level()
+def update_badge_on_order_change(sender, instance, created, update_fields=None, **kwargs):
+    """Count orders moving into or out of a sale status"""
+    if update_fields and 'status' not in update_fields:
+        return
+    known, old_status = instance.previous_value('status', created)
+    if not known:
+        badges.schedule_recompute(seller_id_of(instance))
+        return
+    delta = int(instance.status in badges.SALE_STATUSES) - int(old_status in badges.SALE_STATUSES)
+    if delta:
+        badges.adjust(seller_id_of(instance), sales=delta)
+
+
+@receiver(post_delete, sender=Order)
+def update_badge_on_order_delete(sender, instance, **kwargs):
+    if instance.status in badges.SALE_STATUSES:
+        seller_id = seller_id_of(instance)
+        if seller_id:
+            badges.adjust(seller_id, sales=-1)
+
 
 @receiver(post_save, sender=FarmerReview)
-def update_badge_on_review(sender, instance, **kwargs):
-    """Update farmer badge when a review is added"""
-    # instance.farmer is the User (farmer)
-    badge, _ = FarmerBadge.objects.get_or_create(farmer=instance.farmer)
-    badge.update_badge_level()
+def update_badge_on_review(sender, instance, created, **kwargs):
+    """Keep the running rating sum and review count"""
+    if created:
+        badges.adjust(instance.farmer_id, reviews=1, rating=instance.rating)
+        return
+    known, old_rating = instance.previous_value('rating', created)
+    if not known:
+        badges.schedule_recompute(instance.farmer_id)
+        return
+    badges.adjust(instance.farmer_id, rating=instance.rating - old_rating)
+
+
+@receiver(post_delete, sender=FarmerReview)
+def update_badge_on_review_delete(sender, instance, **kwargs):
+    badges.adjust(instance.farmer_id, reviews=-1, rating=-instance.rating)
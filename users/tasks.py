@@ -0,0 +1,12 @@
+from celery import shared_task
+from django.core.cache import cache
+
+from . import badges
+
+
+@shared_task
+def recompute_farmer_badge(farmer_id):
+    """Recount one farmer's badge (queued by badges.schedule_recompute)."""
+    # Clear the debounce first so changes made during the rebuild queue another
+    cache.delete(badges.recompute_key(farmer_id))
+    return badges.rebuild([farmer_id])
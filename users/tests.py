@@ -1,7 +1,17 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
+from marketplace import jobs
+from marketplace.models import Order, Product
+from . import badges
+from .review_models import FarmerBadge, FarmerReview
+
 User = get_user_model()
 
 class UserModelTest(TestCase):
@@ -23,6 +33,174 @@ class UserViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'users/dashboard_base.html')
 
+class RiderDashboardTest(TestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(username='rider', password='password123', role='RIDER')
+        profile = self.rider.rider_profile
+        profile.current_latitude, profile.current_longitude = Decimal('-1.2864'), Decimal('36.8172')
+        profile.save()
+        self.buyer = User.objects.create_user(username='buyer', password='password123', role='BUYER')
+        self.client.login(username='rider', password='password123')
+
+    def open_orders(self, count, latitude=Decimal('-1.0333'), longitude=Decimal('37.0693')):
+        for i in range(count):
+            farmer = User.objects.create_user(username=f'farmer{Order.objects.count()}', password='x', role='FARMER')
+            farmer.profile.latitude, farmer.profile.longitude = latitude, longitude
+            farmer.profile.save()
+            product = Product.objects.create(seller=farmer, name='Kale', description='Sukuma',
+                                             price=50, category='VEGETABLES', location='Thika')
+            Order.objects.create(buyer=self.buyer, product=product, quantity=1, total_price=50,
+                                 status='ACCEPTED', is_ready_for_pickup=True)
+
+    def test_distances_for_open_orders(self):
+        self.open_orders(1)
+        response = self.client.get(reverse('dashboard'))
+        order = response.context['available_orders'][0]
+        self.assertAlmostEqual(order.distance_km, 39.6, delta=0.5)
+        self.assertEqual(order.estimated_fee, 7)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.open_orders(1)
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('dashboard'))
+        self.open_orders(5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(len(response.context['available_orders']), 6)
+        self.assertEqual(len(one.captured_queries), len(many.captured_queries))
+
+    def test_jobs_outside_radius_are_skipped_and_nearest_come_first(self):
+        self.open_orders(1)  # Thika, ~40 km
+        self.open_orders(1, Decimal('-1.2921'), Decimal('36.8219'))  # Nairobi CBD, <1 km
+        self.open_orders(1, Decimal('-0.0917'), Decimal('34.7680'))  # Kisumu, ~265 km
+        response = self.client.get(reverse('dashboard'))
+        distances = [order.distance_km for order in response.context['available_orders']]
+        self.assertEqual(len(distances), 2)
+        self.assertLess(distances[0], 1)
+        response = self.client.get(reverse('dashboard'), {'radius': 10})
+        self.assertEqual(len(response.context['available_orders']), 1)
+
+    def test_jobs_without_seller_coordinates_follow_nearby_ones(self):
+        self.open_orders(1, None, None)
+        self.open_orders(1, Decimal('-1.2921'), Decimal('36.8219'))  # Nairobi CBD, <1 km
+        response = self.client.get(reverse('dashboard'))
+        distances = [order.distance_km for order in response.context['available_orders']]
+        self.assertEqual(len(distances), 2)
+        self.assertLess(distances[0], 1)
+        self.assertEqual(distances[1], 'N/A')
+
+    def test_jobs_are_paginated(self):
+        self.open_orders(jobs.JOBS_PAGE_SIZE + 3)
+        first = self.client.get(reverse('dashboard'))
+        self.assertEqual(len(first.context['available_orders']), jobs.JOBS_PAGE_SIZE)
+        self.assertTrue(first.context['jobs_has_next'])
+        second = self.client.get(reverse('dashboard'), {'page': 2})
+        self.assertEqual(len(second.context['available_orders']), 3)
+        self.assertFalse(second.context['jobs_has_next'])
+
+    def test_jobs_json_feed(self):
+        self.open_orders(2)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('rider_jobs')).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNone(data['next_page'])
+        self.assertAlmostEqual(data['results'][0]['distance_km'], 39.6, delta=0.5)
+        self.assertEqual(data['results'][0]['estimated_fee'], 7)
+        self.open_orders(10)
+        with CaptureQueriesContext(connection) as more:
+            self.client.get(reverse('rider_jobs'))
+        self.assertEqual(len(queries.captured_queries), len(more.captured_queries))
+
+    def test_jobs_json_feed_is_for_riders(self):
+        self.client.login(username='buyer', password='password123')
+        self.assertEqual(self.client.get(reverse('rider_jobs')).status_code, 403)
+
+class FarmerBadgeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.farmer = User.objects.create_user(username='farmer', password='x', role='FARMER')
+        self.buyer = User.objects.create_user(username='buyer', password='x', role='BUYER')
+        self.product = Product.objects.create(seller=self.farmer, name='Kale', description='Sukuma',
+                                              price=50, quantity=100, category='VEGETABLES', location='Thika')
+
+    def badge(self):
+        return FarmerBadge.objects.get(farmer=self.farmer)
+
+    def assertMatchesRebuild(self):
+        counted = self.badge()
+        badges.rebuild([self.farmer.pk])
+        rebuilt = self.badge()
+        fields = ['total_sales', 'total_products', 'total_reviews', 'rating_sum', 'average_rating', 'badge_level']
+        self.assertEqual([getattr(counted, f) for f in fields], [getattr(rebuilt, f) for f in fields])
+
+    def test_counters_follow_orders_products_and_reviews(self):
+        order = Order.objects.create(buyer=self.buyer, product=self.product, quantity=1, total_price=50)
+        self.assertEqual(self.badge().total_sales, 0)
+        for status in ['ACCEPTED', 'DELIVERED', 'COMPLETED']:
+            order.status = status
+            order.save()
+        self.assertEqual(self.badge().total_sales, 1)
+
+        review = FarmerReview.objects.create(farmer=self.farmer, buyer=self.buyer, rating=4)
+        review.rating = 5
+        review.save()
+        self.assertEqual((self.badge().total_reviews, self.badge().average_rating), (1, Decimal('5.00')))
+
+        self.product.available = False
+        self.product.save()
+        self.assertEqual(self.badge().total_products, 0)
+        self.assertMatchesRebuild()
+
+        order.delete()
+        review.delete()
+        self.assertEqual((self.badge().total_sales, self.badge().total_reviews, self.badge().rating_sum), (0, 0, 0))
+        self.assertMatchesRebuild()
+
+    def test_unrelated_saves_cost_no_badge_queries(self):
+        order = Order.objects.create(buyer=self.buyer, product=self.product, quantity=1, total_price=50)
+        order = Order.objects.select_related('product').get(pk=order.pk)
+        order.status = 'ACCEPTED'
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+            order.is_ready_for_pickup = True
+            order.save(update_fields=['is_ready_for_pickup'])
+        self.assertFalse([q for q in queries if 'farmerbadge' in q['sql']])
+
+    def test_level_is_worked_out_in_the_update(self):
+        badge = self.badge()
+        badge.total_sales, badge.total_reviews, badge.rating_sum = 24, 5, 20
+        badge.average_rating = badges.average_of(20, 5)
+        badge.save()
+        order = Order.objects.create(buyer=self.buyer, product=self.product, quantity=1, total_price=50)
+        order.status = 'DELIVERED'
+        order.save()
+        self.assertEqual((self.badge().total_sales, self.badge().badge_level), (25, 'BRONZE'))
+
+        badge = self.badge()
+        badge.is_manual_override = True
+        badge.badge_level = 'GOLD'
+        badge.save()
+        order.status = 'CANCELLED'
+        order.save()
+        self.assertEqual((self.badge().total_sales, self.badge().badge_level), (24, 'GOLD'))
+
+    def test_unknown_previous_state_queues_a_recompute(self):
+        order = Order.objects.create(buyer=self.buyer, product=self.product, quantity=1, total_price=50,
+                                     status='DELIVERED')
+        FarmerBadge.objects.filter(farmer=self.farmer).update(total_sales=7)
+        # Built by hand, so the handler can't know what it was before
+        detached = Order(**dict(Order.objects.filter(pk=order.pk).values().get(), status='COMPLETED'))
+        with self.captureOnCommitCallbacks(execute=True):
+            detached.save()
+        self.assertEqual(self.badge().total_sales, 1)
+
+    def test_profile_view_does_not_recount(self):
+        self.badge()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('farmer_profile_public', args=[self.farmer.pk]))
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] and 'marketplace_order' in q['sql']])
+
+
 class UserAPITest(TestCase):
     def test_user_serializer(self):
         # Basic test for serializer logic if needed, or integration test with APIClient
@@ -29,6 +29,7 @@ urlpatterns = [
     path('dashboard/toggle-availability/', views.toggle_rider_availability, name='toggle_rider_availability'),
     path('dashboard/withdraw/', views.rider_withdraw, name='rider_withdraw'),
     path('dashboard/update-location/', views.update_location, name='update_location'),
+    path('dashboard/jobs/', views.rider_jobs, name='rider_jobs'),
     
     # Rider functionality
     path('rider/order/<int:order_id>/accept/', views.accept_delivery, name='accept_delivery'),
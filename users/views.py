@@ -1,17 +1,19 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.db.models import Sum
-from decimal import Decimal
 from .forms import (
     RegisterForm, LoginForm, UserUpdateForm, ProfileUpdateForm,
     FarmerRegistrationProfileForm, SupplierRegistrationProfileForm,
     BuyerRegistrationProfileForm, RiderRegistrationProfileForm, RiderVerificationForm
 )
 from .models import User, VehicleChangeRequest, RiderProfile
+from ledger import books
+from decimal import Decimal, InvalidOperation
 import json
 
 def select_role(request):
@@ -107,32 +109,42 @@ def register(request):
         'role': role
     })
 
+DASHBOARD_ORDERS_PAGE_SIZE = 20
+
 @login_required
 def dashboard(request):
     user = request.user
     if user.role == User.Role.FARMER:
-        # Get orders for products owned by this farmer
-        from marketplace.models import Order, Product
-        from django.db.models import Sum
-        
-        # Stats
-        orders_count = Order.objects.filter(product__seller=user).count()
-        active_products_count = Product.objects.filter(seller=user, available=True).count()
-        
-        # Order Lists
-        pending_orders = Order.objects.filter(product__seller=user, status='PENDING').order_by('-created_at')
-        accepted_statuses = ['ACCEPTED', 'ESCROW', 'IN_DELIVERY', 'DELIVERED', 'PAID_OUT', 'COMPLETED']
-        accepted_orders = Order.objects.filter(product__seller=user, status__in=accepted_statuses).order_by('-created_at')
-        
-        # Calculate earnings
-        total_earnings = Order.objects.filter(product__seller=user, status='PAID_OUT').aggregate(Sum('total_price'))['total_price__sum'] or 0
+        # Counts and revenue come from the FarmerStats rollup; only the order lists hit Order
+        from marketplace.models import Order
+        from marketplace import jobs, stats
+
+        farmer_stats = stats.stats_for(user)
+        orders = Order.objects.filter(seller=user).select_related(
+            'product', 'buyer', 'delivery_address', 'assigned_rider',
+        ).order_by('-created_at', '-id')
+        pending_page = jobs.parse_page(request.GET.get('pending_page'))
+        accepted_page = jobs.parse_page(request.GET.get('accepted_page'))
+        pending_orders, pending_has_next = jobs.page_of(
+            orders.filter(status='PENDING'), pending_page, DASHBOARD_ORDERS_PAGE_SIZE,
+        )
+        accepted_orders, accepted_has_next = jobs.page_of(
+            orders.filter(status__in=stats.GROSS_STATUSES), accepted_page, DASHBOARD_ORDERS_PAGE_SIZE,
+        )
         
         context = {
-            'orders_count': orders_count,
-            'active_products_count': active_products_count,
+            'farmer_stats': farmer_stats,
+            'orders_count': farmer_stats.orders_count,
+            'active_products_count': farmer_stats.active_products,
+            'total_earnings': farmer_stats.paid_out_revenue,
             'pending_orders': pending_orders,
+            'pending_count': farmer_stats.pending_count,
+            'pending_page': pending_page,
+            'pending_has_next': pending_has_next,
             'accepted_orders': accepted_orders,
-            'total_earnings': total_earnings,
+            'accepted_count': farmer_stats.in_progress_count,
+            'accepted_page': accepted_page,
+            'accepted_has_next': accepted_has_next,
         }
         return render(request, 'users/dashboard_farmer.html', context)
     elif user.role == User.Role.BUYER:
@@ -156,50 +168,21 @@ def dashboard(request):
         return render(request, 'users/dashboard_supplier.html')
     elif user.role == User.Role.RIDER:
         from marketplace.models import Order
+        from marketplace import jobs
         from django.db.models import Sum
-        from math import radians, cos, sin, asin, sqrt
-
-        def haversine(lon1, lat1, lon2, lat2):
-            """
-            Calculate the great circle distance between two points 
-            on the earth (specified in decimal degrees)
-            """
-            if not all([lon1, lat1, lon2, lat2]):
-                return None
-            # convert decimal degrees to radians 
-            lon1, lat1, lon2, lat2 = map(radians, [float(lon1), float(lat1), float(lon2), float(lat2)])
-            # haversine formula 
-            dlon = lon2 - lon1 
-            dlat = lat2 - lat1 
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * asin(sqrt(a)) 
-            r = 6371 # Radius of earth in kilometers
-            return c * r
 
         # Get rider profile and stats
         rider_profile = user.rider_profile
-        rider_lat = rider_profile.current_latitude or user.profile.latitude
-        rider_lon = rider_profile.current_longitude or user.profile.longitude
-        
-        # 1. Available Deliveries (Ready for pickup + Unassigned)
-        available_orders_qs = Order.objects.filter(
-            is_ready_for_pickup=True,
-            assigned_rider__isnull=True,
-            status__in=['ACCEPTED', 'ESCROW'] 
-        ).order_by('-updated_at')
-        
-        # Annotate with distance
-        available_orders = []
-        for order in available_orders_qs:
-            seller_profile = order.product.seller.profile
-            dist = None
-            if rider_lat and rider_lon and seller_profile.latitude and seller_profile.longitude:
-                dist = haversine(rider_lon, rider_lat, seller_profile.longitude, seller_profile.latitude)
-            
-            # Add attributes dynamically for template
-            order.distance_km = round(dist, 1) if dist is not None else "N/A"
-            order.estimated_fee = int(order.total_price * 0.15) # Mock 15% delivery fee
-            available_orders.append(order)
+        rider_lat, rider_lon = _rider_position(user)
+        radius_km = jobs.parse_radius(request.GET.get('radius'))
+        page = jobs.parse_page(request.GET.get('page'))
+
+        # 1. Available Deliveries (Ready for pickup + Unassigned), nearest first
+        available_orders, has_next = jobs.page_of(
+            jobs.nearby_jobs(rider_lat, rider_lon, radius_km).select_related('product__seller__profile', 'buyer__profile'),
+            page,
+        )
+        jobs.add_distances(rider_lat, rider_lon, available_orders)
 
         # 2. Accepted Deliveries (Active Jobs)
         active_deliveries = Order.objects.filter(
@@ -210,7 +193,7 @@ def dashboard(request):
         # 3. Earnings & History
         completed_orders = Order.objects.filter(assigned_rider=user, status='DELIVERED')
         total_delivered_value = completed_orders.aggregate(Sum('total_price'))['total_price__sum'] or 0
-        total_earnings = int(total_delivered_value * Decimal('0.15')) # Estimated earnings
+        total_earnings = int(total_delivered_value * jobs.DELIVERY_FEE_RATE) # Estimated earnings
         
         delivery_history = completed_orders.order_by('-updated_at')[:10]
         
@@ -220,6 +203,9 @@ def dashboard(request):
         context = {
             'rider_profile': rider_profile,
             'available_orders': available_orders,
+            'jobs_page': page,
+            'jobs_has_next': has_next,
+            'jobs_radius_km': radius_km,
             'active_deliveries': active_deliveries,
             'total_earnings': total_earnings, 
             'delivery_history': delivery_history,
@@ -229,10 +215,55 @@ def dashboard(request):
     else:
         return render(request, 'users/dashboard_base.html') # Fallback
 
+def _rider_position(user):
+    """Last GPS fix, else the rider's home location (or None, None)."""
+    rider_profile = user.rider_profile
+    if rider_profile.current_latitude is not None and rider_profile.current_longitude is not None:
+        return rider_profile.current_latitude, rider_profile.current_longitude
+    return user.profile.latitude, user.profile.longitude
+
+@login_required
+def rider_jobs(request):
+    """JSON page of available jobs near the rider, for the dashboard to poll"""
+    from marketplace import jobs
+
+    if request.user.role != User.Role.RIDER:
+        return JsonResponse({'error': 'Riders only'}, status=403)
+
+    rider_lat, rider_lon = _rider_position(request.user)
+    radius_km = jobs.parse_radius(request.GET.get('radius'))
+    page = jobs.parse_page(request.GET.get('page'))
+    orders, has_next = jobs.page_of(
+        jobs.nearby_jobs(rider_lat, rider_lon, radius_km).select_related('product__seller__profile'),
+        page,
+    )
+    jobs.add_distances(rider_lat, rider_lon, orders)
+    return JsonResponse({
+        'page': page,
+        'next_page': page + 1 if has_next else None,
+        'radius_km': radius_km,
+        'results': [
+            {
+                'id': order.id,
+                'product': order.product.name,
+                'quantity': order.quantity,
+                'unit': order.product.unit,
+                'pickup_location': order.product.location,
+                'total_price': str(order.total_price),
+                'estimated_fee': order.estimated_fee,
+                'distance_km': None if order.distance_km == "N/A" else order.distance_km,
+                'accept_url': reverse('accept_delivery', args=[order.id]),
+            }
+            for order in orders
+        ],
+    })
+
 @login_required
 def accept_delivery(request, order_id):
     """Rider accepts a delivery"""
     from marketplace.models import Order, Notification
+    from marketplace.notifications import notify_many
+    from marketplace import dispatch
     
     if request.method == 'POST' and request.user.role == User.Role.RIDER:
         # Check Verification Status
@@ -253,25 +284,26 @@ def accept_delivery(request, order_id):
             # Let's keep status field as main tracker. 
             # If it was 'ESCROW', it implies paid. 
             
-            order.save()
+            order.save(update_fields=['assigned_rider', 'updated_at'])
+            dispatch.close_proposals(order, request.user)
             
             messages.success(request, f"You have accepted order #{order.id}")
             
-            # Notify Farmer
-            Notification.objects.create(
-                user=order.product.seller,
-                notification_type='ORDER_ASSIGNED',
-                order=order,
-                message=f"Rider {request.user.username} has accepted your delivery request for {order.product.name}."
-            )
-            
-            # Notify Buyer
-            Notification.objects.create(
-                user=order.buyer,
-                notification_type='ORDER_ASSIGNED',
-                order=order,
-                message=f"Rider {request.user.username} is on the way to pick up your order."
-            )
+            # Notify Farmer and Buyer
+            notify_many([
+                Notification(
+                    user=order.product.seller,
+                    notification_type='ORDER_ASSIGNED',
+                    order=order,
+                    message=f"Rider {request.user.username} has accepted your delivery request for {order.product.name}."
+                ),
+                Notification(
+                    user=order.buyer,
+                    notification_type='ORDER_ASSIGNED',
+                    order=order,
+                    message=f"Rider {request.user.username} is on the way to pick up your order."
+                ),
+            ])
             
         else:
             messages.error(request, "This order has already been taken.")
@@ -281,7 +313,9 @@ def accept_delivery(request, order_id):
 @login_required
 def update_delivery_status(request, order_id):
     """Rider updates status (Picked Up, Delivered)"""
-    from marketplace.models import Order, Notification
+    from marketplace.models import Order
+    from marketplace.notifications import notify
+    from marketplace import transitions
     
     if request.method == 'POST' and request.user.role == User.Role.RIDER:
         order = Order.objects.get(id=order_id)
@@ -291,12 +325,18 @@ def update_delivery_status(request, order_id):
             messages.error(request, "Not authorized")
             return redirect('dashboard')
             
+        next_status = {'picked_up': 'IN_DELIVERY', 'delivered': 'DELIVERED'}.get(action)
+        if next_status:
+            try:
+                transitions.transition(order, next_status)
+            except transitions.InvalidTransition as e:
+                messages.error(request, str(e))
+                return redirect('dashboard')
+
         if action == 'picked_up':
-            order.status = 'IN_DELIVERY'
-            order.save()
             messages.success(request, "Order marked as Picked Up")
             # Notify Buyer
-            Notification.objects.create(
+            notify(
                 user=order.buyer,
                 notification_type='ORDER_UPDATED', # Add this type if strict or use accepted
                 order=order,
@@ -304,14 +344,12 @@ def update_delivery_status(request, order_id):
             )
             
         elif action == 'delivered':
-            order.status = 'DELIVERED'
             request.user.rider_profile.completed_deliveries += 1
             request.user.rider_profile.total_deliveries += 1
             request.user.rider_profile.save()
-            order.save()
             messages.success(request, "Order marked as Delivered")
              # Notify Farmer to confirm/get paid
-            Notification.objects.create(
+            notify(
                 user=order.product.seller,
                 notification_type='ORDER_UPDATED',
                 order=order,
@@ -323,7 +361,8 @@ def update_delivery_status(request, order_id):
 @login_required
 def reject_delivery(request, order_id):
     """Rider rejects a delivery request"""
-    from marketplace.models import Order, Notification
+    from marketplace.models import Order
+    from marketplace.notifications import notify
     
     if request.method == 'POST' and request.user.role == User.Role.RIDER:
         order = get_object_or_404(Order, id=order_id)
@@ -331,7 +370,7 @@ def reject_delivery(request, order_id):
         # Only allow rejection if order is not yet assigned
         if order.assigned_rider is None and order.is_ready_for_pickup:
             # Notify Farmer
-            Notification.objects.create(
+            notify(
                 user=order.product.seller,
                 notification_type='ORDER_UPDATED',
                 order=order,
@@ -605,10 +644,8 @@ def public_profile(request, user_id):
     
     # Add farmer badge data if user is a farmer
     if profile_user.role == 'FARMER':
-        from .review_models import FarmerBadge
-        farmer_badge, created = FarmerBadge.objects.get_or_create(farmer=profile_user)
-        if not created:
-            farmer_badge.update_badge_level()
+        from .badges import badge_for
+        farmer_badge = badge_for(profile_user)
         
         # Define badge requirements for progress tracking
         badge_tiers = {
@@ -725,16 +762,15 @@ def farmer_profile_public(request, farmer_id):
     from django.shortcuts import get_object_or_404
     from django.db.models import Avg
     from django.db import models
-    from .review_models import FarmerReview, FarmerBadge
+    from .review_models import FarmerReview
     from .review_forms import FarmerReviewForm
+    from .badges import badge_for
     from marketplace.models import Product
     
     farmer = get_object_or_404(User, id=farmer_id, role=User.Role.FARMER)
     
-    # Get or create farmer badge
-    farmer_badge, created = FarmerBadge.objects.get_or_create(farmer=farmer)
-    if not created:
-        farmer_badge.update_badge_level()
+    # Kept current by signals; only built here for a farmer who has none yet
+    farmer_badge = badge_for(farmer)
     
     # Get farmer's products
     products = Product.objects.filter(seller=farmer, available=True)[:6]
@@ -782,7 +818,7 @@ def submit_review(request, farmer_id):
     """Submit or update a review for a farmer"""
     from django.shortcuts import get_object_or_404
     from django.http import JsonResponse
-    from .review_models import FarmerReview, FarmerBadge
+    from .review_models import FarmerReview
     from .review_forms import FarmerReviewForm
     
     if request.user.role != User.Role.BUYER:
@@ -804,12 +840,9 @@ def submit_review(request, farmer_id):
             review = form.save(commit=False)
             review.farmer = farmer
             review.buyer = request.user
+            # Saving moves the farmer's badge counters (users.signals)
             review.save()
             
-            # Update farmer badge
-            farmer_badge = FarmerBadge.objects.get(farmer=farmer)
-            farmer_badge.update_badge_level()
-            
             messages.success(request, 'Review submitted successfully!')
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -915,24 +948,24 @@ def rider_withdraw(request):
     """Handle rider withdrawal requests"""
     if request.method == 'POST' and request.user.role == User.Role.RIDER:
         try:
-            amount = float(request.POST.get('amount', 0))
-            rider_profile = request.user.rider_profile
-            
-            if amount <= 0:
-                 messages.error(request, "Invalid amount")
-            elif amount > rider_profile.wallet_balance:
-                 messages.error(request, "Insufficient funds")
-            else:
-                 # TODO: Integrate M-Pesa B2C
-                 rider_profile.wallet_balance -= amount
-                 rider_profile.save()
-                 messages.success(request, f"Withdrawal request of KES {amount} received. Processing...")
-                 
-        except ValueError:
-             messages.error(request, "Invalid amount format")
-        except Exception as e:
-             messages.error(request, f"Error processing withdrawal: {str(e)}")
-             
+            amount = Decimal(request.POST.get('amount', 0))
+            valid = amount.is_finite() and 0 < amount <= books.MAX_AMOUNT and amount == amount.quantize(books.CENT)
+        except InvalidOperation:
+            messages.error(request, "Invalid amount format")
+            return redirect('dashboard')
+
+        if not valid:
+            messages.error(request, "Invalid amount")
+            return redirect('dashboard')
+        try:
+            # A single conditional UPDATE, so two withdrawals at once can't overdraw the wallet
+            books.withdraw(request.user, amount)
+        except books.InsufficientFunds:
+            messages.error(request, "Insufficient funds")
+        else:
+            # TODO: Integrate M-Pesa B2C
+            messages.success(request, f"Withdrawal request of KES {amount} received. Processing...")
+
     return redirect('dashboard')
 
 @login_required